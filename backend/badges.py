@@ -0,0 +1,105 @@
+"""
+徽章帳本 (migrations/0007_badge_ledger.sql)
+
+  - 拿到徽章 (結束專注) 和花掉徽章 (送訊息、nudge) 都是 INSERT 一筆 badge_ledger，不再 UPDATE users
+  - 餘額 = badge_balances 的快照 + badge_ledger 裡還沒壓縮的紀錄，查詢一律讀 user_badges view
+  - 扣徽章先呼叫 badge_balance_for_update(user_id)：同一個人的扣款用 advisory lock 排隊，不會扣成負的
+  - BadgeCompactor 每 BADGE_COMPACT_SECONDS 秒把 badge_ledger 的紀錄加進 badge_balances 再刪掉，
+    讓每個人的未壓縮紀錄保持很少筆 (多個 worker 用 advisory lock，只有一個會做)
+
+  BADGE_COMPACT_SECONDS     壓縮的間隔，預設 60
+  BADGE_COMPACT_BATCH       一個 transaction 最多壓縮幾筆，預設 10000
+也可以手動執行一次：
+    docker compose exec backend python badges.py
+"""
+import asyncio
+import os
+from typing import Optional
+
+import asyncpg
+
+from db import named_query
+
+DATABASE_URL = os.environ.get("DATABASE_URL", "postgresql://postgres:password@db:5432/focusmate")
+BADGE_COMPACT_SECONDS = float(os.environ.get("BADGE_COMPACT_SECONDS", "60"))
+BADGE_COMPACT_BATCH = int(os.environ.get("BADGE_COMPACT_BATCH", "10000"))
+# pg_advisory_lock 的 key (migrate.py 用 7_310_001、partitions.py 用 7_310_002)
+BADGE_COMPACT_LOCK_KEY = 7_310_003
+
+BADGE_BALANCE_SQL = named_query("badges.balance", """
+    SELECT badge FROM user_badges WHERE user_id = $1
+""")
+
+# 刪掉的紀錄和加進快照在同一個 statement：別的 transaction 讀到的餘額不是壓縮前就是壓縮後。
+# 還沒 commit 的紀錄看不到、不會被刪，下次再壓縮。
+COMPACT_SQL = named_query("badges.compact", """
+    WITH moved AS (
+        DELETE FROM badge_ledger
+        WHERE id IN (SELECT id FROM badge_ledger ORDER BY id LIMIT $1)
+        RETURNING user_id, amount
+    ), totals AS (
+        SELECT user_id, SUM(amount)::int AS amount FROM moved GROUP BY user_id
+    ), merged AS (
+        INSERT INTO badge_balances (user_id, balance, compacted_at)
+        SELECT user_id, amount, now() FROM totals
+        ORDER BY user_id
+        ON CONFLICT (user_id)
+        DO UPDATE SET balance = badge_balances.balance + EXCLUDED.balance, compacted_at = EXCLUDED.compacted_at
+    )
+    SELECT count(*) FROM moved
+""")
+
+
+async def compact(conn: asyncpg.Connection, batch: int = BADGE_COMPACT_BATCH) -> Optional[int]:
+    """把 badge_ledger 全部壓縮進 badge_balances，回傳壓縮了幾筆。別的 process 正在做時回傳 None。"""
+    if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", BADGE_COMPACT_LOCK_KEY):
+        return None
+    try:
+        total = 0
+        while True:
+            moved = await conn.fetchval(COMPACT_SQL, batch)
+            total += moved
+            if moved < batch:
+                return total
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", BADGE_COMPACT_LOCK_KEY)
+
+
+class BadgeCompactor:
+    def __init__(self, pool: asyncpg.Pool, interval: float = BADGE_COMPACT_SECONDS):
+        self.pool = pool
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                async with self.pool.acquire() as conn:
+                    await compact(conn)
+            except Exception as e:
+                print(f"徽章帳本壓縮失敗: {e}")
+
+
+async def main():
+    conn = await asyncpg.connect(DATABASE_URL)
+    try:
+        moved = await compact(conn)
+        print(f"壓縮了 {moved} 筆" if moved is not None else "其他 process 正在壓縮")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+"""
+benchmarks 共用的小工具：建立/清除測試用 user、統計 DB 交易數、印出 latency 分佈。
+
+預設連到 docker compose 起來的服務：
+    docker compose exec backend python -m benchmarks.<name>
+"""
+import os
+import statistics
+from typing import List
+
+import asyncpg
+
+from migrate import discover
+
+DATABASE_URL = os.environ.get("DATABASE_URL", "postgresql://postgres:password@db:5432/focusmate")
+API_URL = os.environ.get("API_URL", "http://localhost:8000")
+
+BENCH_USER_PREFIX = "bench-"
+
+
+def migration_module(version: int):
+    """migrations/ 裡某個 .py migration 的 module，要建跟正式環境一樣的表時拿它的 SQL 常數。"""
+    migration, = [m for m in discover() if m.version == version]
+    return migration.load_module()
+
+
+# 直接寫進 focus_time 的測試資料要補算 focus_daily (平常由 /focus/save 增量維護)
+FOCUS_DAILY_BACKFILL_SQL = migration_module(1).FOCUS_DAILY_BACKFILL_SQL
+
+
+async def create_bench_users(conn: asyncpg.Connection, count: int, badge: int = 0) -> List[int]:
+    rows = await conn.fetch("""
+        INSERT INTO users (name, is_studying, title)
+        SELECT $1 || g, FALSE, 'Beginner'
+        FROM generate_series(1, $2) AS g
+        RETURNING user_id
+    """, BENCH_USER_PREFIX, count)
+    user_ids = [r["user_id"] for r in rows]
+    if badge:
+        await set_bench_badges(conn, user_ids, badge)
+    return user_ids
+
+
+async def set_bench_badges(conn: asyncpg.Connection, user_ids: List[int], badge: int):
+    """把徽章數直接設成 badge (清掉帳本、改快照)。"""
+    async with conn.transaction():
+        await conn.execute("DELETE FROM badge_ledger WHERE user_id = ANY($1::int[])", user_ids)
+        await conn.execute("""
+            INSERT INTO badge_balances (user_id, balance)
+            SELECT unnest($1::int[]), $2
+            ON CONFLICT (user_id) DO UPDATE SET balance = EXCLUDED.balance, compacted_at = now()
+        """, user_ids, badge)
+
+
+async def drop_bench_users(conn: asyncpg.Connection):
+    # ON DELETE CASCADE 會一起清掉 messages / deadlines / focus_time / pictures
+    await conn.execute("DELETE FROM users WHERE name LIKE $1", BENCH_USER_PREFIX + "%")
+
+
+async def xact_count(conn: asyncpg.Connection) -> int:
+    """目前 database 累積的 commit 數 (每個 autocommit 查詢算一次)。"""
+    await conn.execute("SELECT pg_stat_force_next_flush()")
+    return await conn.fetchval("""
+        SELECT xact_commit + xact_rollback FROM pg_stat_database
+        WHERE datname = current_database()
+    """)
+
+
+def summarize(label: str, samples_ms: List[float]):
+    if not samples_ms:
+        print(f"{label}: no samples")
+        return
+    samples = sorted(samples_ms)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"{label}: n={len(samples)} mean={statistics.mean(samples):.2f}ms "
+          f"p50={statistics.median(samples):.2f}ms p95={p95:.2f}ms p99={p99:.2f}ms max={samples[-1]:.2f}ms")
@@ -0,0 +1,110 @@
+"""
+同一個 user 的徽章加減和狀態更新同時進來時的排隊情形：
+  - legacy   徽章是 users 那一列的計數 (UPDATE badge = badge ± 1)，狀態更新也 UPDATE 同一列
+             (users.badge 已經拿掉，用一張同樣欄位的 bench_legacy_users 模擬)
+  - ledger   加徽章 INSERT badge_ledger、扣徽章先 badge_balance_for_update 再 INSERT，
+             狀態更新 UPDATE users；期間每秒壓縮一次帳本 (badges.compact)
+每種操作各 --tasks 個 task 連續執行 --seconds 秒，結束後檢查餘額 = 初始 + 加 - 扣，而且沒有扣成負的。
+
+    docker compose exec backend python -m benchmarks.bench_badges --tasks 20 --seconds 10
+"""
+import argparse
+import asyncio
+import time
+
+import asyncpg
+
+from badges import compact
+from benchmarks._common import DATABASE_URL, create_bench_users, drop_bench_users, set_bench_badges, summarize
+
+INITIAL_BADGES = 50
+
+LEGACY_OPS = {
+    "credit": "UPDATE bench_legacy_users SET badge = badge + 1 WHERE user_id = $1 RETURNING 1",
+    "debit": "UPDATE bench_legacy_users SET badge = badge - 1 WHERE user_id = $1 AND badge >= 1 RETURNING 1",
+    "status": "UPDATE bench_legacy_users SET is_studying = NOT is_studying WHERE user_id = $1 RETURNING 1",
+}
+
+LEDGER_OPS = {
+    "credit": "INSERT INTO badge_ledger (user_id, amount, reason) VALUES ($1, 1, 'focus') RETURNING 1",
+    "debit": """
+        INSERT INTO badge_ledger (user_id, amount, reason)
+        SELECT $1, -1, 'message' WHERE badge_balance_for_update($1) >= 1
+        RETURNING 1
+    """,
+    "status": "UPDATE users SET is_studying = NOT COALESCE(is_studying, FALSE) WHERE user_id = $1 RETURNING 1",
+}
+
+
+async def hammer(pool: asyncpg.Pool, label: str, ops: dict, user_id: int, args, balance_sql: str):
+    samples = {op: [] for op in ops}
+    applied = {op: 0 for op in ops}
+    stop_at = time.perf_counter() + args.seconds
+
+    async def worker(op: str):
+        while time.perf_counter() < stop_at:
+            async with pool.acquire() as conn:
+                t0 = time.perf_counter()
+                done = await conn.fetchval(ops[op], user_id)
+                samples[op].append((time.perf_counter() - t0) * 1000)
+            if done:
+                applied[op] += 1
+
+    async def compactor():
+        while time.perf_counter() < stop_at:
+            await asyncio.sleep(1)
+            async with pool.acquire() as conn:
+                await compact(conn)
+
+    tasks = [worker(op) for op in ops for _ in range(args.tasks)]
+    if label == "ledger":
+        tasks.append(compactor())
+    await asyncio.gather(*tasks)
+
+    for op in ops:
+        summarize(f"[{label}] {op}", samples[op])
+        print(f"  {applied[op] / args.seconds:,.0f} ops/s")
+    async with pool.acquire() as conn:
+        balance = await conn.fetchval(balance_sql, user_id)
+    expected = INITIAL_BADGES + applied["credit"] - applied["debit"]
+    print(f"[{label}] badge={balance} expected={expected}")
+    assert balance == expected and balance >= 0, f"{label} balance mismatch"
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    parser.add_argument("--tasks", type=int, default=20, help="每種操作幾個 task")
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    pool = await asyncpg.create_pool(args.dsn, min_size=3 * args.tasks + 2, max_size=3 * args.tasks + 2)
+    try:
+        async with pool.acquire() as conn:
+            await drop_bench_users(conn)
+            user_id, = await create_bench_users(conn, 1, badge=INITIAL_BADGES)
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS bench_legacy_users (
+                    user_id INTEGER PRIMARY KEY, badge INTEGER NOT NULL, is_studying BOOLEAN NOT NULL
+                )
+            """)
+            await conn.execute("""
+                INSERT INTO bench_legacy_users VALUES ($1, $2, FALSE)
+                ON CONFLICT (user_id) DO UPDATE SET badge = EXCLUDED.badge
+            """, user_id, INITIAL_BADGES)
+
+        await hammer(pool, "legacy", LEGACY_OPS, user_id, args,
+                     "SELECT badge FROM bench_legacy_users WHERE user_id = $1")
+        async with pool.acquire() as conn:
+            await set_bench_badges(conn, [user_id], INITIAL_BADGES)
+        await hammer(pool, "ledger", LEDGER_OPS, user_id, args,
+                     "SELECT badge FROM user_badges WHERE user_id = $1")
+    finally:
+        async with pool.acquire() as conn:
+            await conn.execute("DROP TABLE IF EXISTS bench_legacy_users")
+            await drop_bench_users(conn)
+        await pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
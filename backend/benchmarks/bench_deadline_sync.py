@@ -0,0 +1,95 @@
+"""
+deadline 清單的同步：每次修改後重抓整份清單 (改版前的 app) 對上增量同步 (/deadlines/sync 回傳的變動)。
+
+一個 user 有 --deadlines 個項目，每一輪隨機修改一項 (edit / done / doing 輪流)，量：
+  1. 修改 + 取得最新清單的延遲
+  2. 回應的大小 (orjson 序列化後的 bytes)：整份清單是 O(清單長度)，增量同步是 O(這次改的項目)
+    docker compose exec backend python -m benchmarks.bench_deadline_sync --deadlines 500 --edits 200
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import date, timedelta
+
+import asyncpg
+
+from benchmarks._common import DATABASE_URL, create_bench_users, drop_bench_users, summarize
+from main import DeadlineMutation, DeadlineSyncBatch, fetch_deadline_changes, fetch_deadlines, lock_deadline_order
+from ordering import key_between
+from responses import dumps
+
+
+async def seed(conn: asyncpg.Connection, user_id: int, count: int):
+    keys = []
+    key = None
+    for _ in range(count):
+        key = key_between(key, None)
+        keys.append(key)
+    await conn.execute("""
+        INSERT INTO deadlines (user_id, deadline_date, task, is_done, sort_key)
+        SELECT $1, current_date + (g % 30)::int, 'task ' || g, FALSE, k
+        FROM unnest($2::text[]) WITH ORDINALITY AS t(k, g)
+    """, user_id, keys)
+    return [row["id"] for row in await conn.fetch("SELECT id FROM deadlines WHERE user_id = $1", user_id)]
+
+
+def mutation_for(i: int, deadline_id: int) -> DeadlineMutation:
+    op = ("edit", "done", "doing")[i % 3]
+    if op == "edit":
+        return DeadlineMutation(op=op, id=deadline_id, task=f"edited {i}",
+                                deadline_date=date.today() + timedelta(days=i % 30))
+    if op == "done":
+        return DeadlineMutation(op=op, id=deadline_id, is_done=bool(i % 2))
+    return DeadlineMutation(op=op, id=deadline_id, current_doing=bool(i % 2))
+
+
+async def apply(conn: asyncpg.Connection, user_id: int, mutation: DeadlineMutation):
+    batch = DeadlineSyncBatch(conn, user_id)
+    async with conn.transaction():
+        await lock_deadline_order(conn, user_id)
+        return [await batch.apply(mutation)]
+
+
+async def run(conn: asyncpg.Connection, user_id: int, ids, edits: int, full: bool):
+    latencies, sizes = [], []
+    version = (await fetch_deadline_changes(conn, user_id, 0))["version"]
+    for i in range(edits):
+        mutation = mutation_for(i, random.choice(ids))
+        t0 = time.perf_counter()
+        results = await apply(conn, user_id, mutation)
+        if full:
+            payload = dumps(await fetch_deadlines(conn, user_id))
+        else:
+            changes = await fetch_deadline_changes(conn, user_id, version)
+            version = changes["version"]
+            payload = dumps({"results": results, **changes})
+        latencies.append((time.perf_counter() - t0) * 1000)
+        sizes.append(len(payload))
+    return latencies, sizes
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    parser.add_argument("--deadlines", type=int, default=500)
+    parser.add_argument("--edits", type=int, default=200)
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(args.dsn)
+    try:
+        await drop_bench_users(conn)
+        user_id, = await create_bench_users(conn, 1)
+        ids = await seed(conn, user_id, args.deadlines)
+
+        for label, full in (("修改後重抓整份清單", True), ("增量同步", False)):
+            latencies, sizes = await run(conn, user_id, ids, args.edits, full)
+            summarize(f"[{label}] 修改 + 取得最新狀態", latencies)
+            print(f"[{label}] 回應大小: 平均 {sum(sizes) / len(sizes):.0f} bytes, 最大 {max(sizes)} bytes")
+    finally:
+        await drop_bench_users(conn)
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
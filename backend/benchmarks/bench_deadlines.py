@@ -0,0 +1,138 @@
+"""
+deadline 清單：舊版 (每次讀取重算 display_order 並逐列 UPDATE、reorder 逐列 UPDATE)
+對上新版 (sort_key，讀取唯讀、拖曳只寫一列)。
+
+每個 user 有 --deadlines 個項目，每一輪隨機拖曳一個項目再讀一次清單：
+    docker compose exec backend python -m benchmarks.bench_deadlines --deadlines 1000 --moves 50
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import asyncpg
+
+from benchmarks._common import DATABASE_URL, create_bench_users, drop_bench_users, summarize
+from main import DeadlineMove, fetch_deadlines, move_deadline, reorder_deadline_ids
+from ordering import key_between
+
+
+async def seed(conn: asyncpg.Connection, user_id: int, count: int):
+    keys = []
+    key = None
+    for _ in range(count):
+        key = key_between(key, None)
+        keys.append(key)
+    await conn.execute("""
+        INSERT INTO deadlines (user_id, deadline_date, task, is_done, display_order, sort_key)
+        SELECT $1, current_date + (g % 30)::int, 'task ' || g, FALSE, g, k
+        FROM unnest($2::text[]) WITH ORDINALITY AS t(k, g)
+    """, user_id, keys)
+
+
+async def legacy_get(conn: asyncpg.Connection, user_id: int):
+    """改版前 get_deadlines_with_reorder 的寫法。"""
+    rows = await conn.fetch("""
+        SELECT id, display_order, is_done FROM deadlines WHERE user_id = $1 ORDER BY display_order ASC
+    """, user_id)
+    updates = []
+    undone = [row for row in rows if not row["is_done"]]
+    for i, row in enumerate(undone):
+        if row["display_order"] != i + 1:
+            updates.append((i + 1, row["id"]))
+    for row in rows:
+        if row["is_done"] and row["display_order"] != -1:
+            updates.append((-1, row["id"]))
+    if updates:
+        async with conn.transaction():
+            for new_order, id_ in updates:
+                await conn.execute("""
+                    UPDATE deadlines SET display_order = $1 WHERE id = $2 AND user_id = $3
+                """, new_order, id_, user_id)
+    rows = await conn.fetch("""
+        SELECT id, user_id, deadline_date, task as thing, is_done, display_order, current_doing
+        FROM deadlines WHERE user_id = $1 ORDER BY is_done ASC, display_order ASC
+    """, user_id)
+    return len(updates)
+
+
+async def legacy_reorder(conn: asyncpg.Connection, user_id: int, ordered_ids):
+    """改版前 reorder_deadlines：client 送整份清單，每個項目一個 UPDATE。"""
+    async with conn.transaction():
+        for i, id_ in enumerate(ordered_ids):
+            await conn.execute("""
+                UPDATE deadlines SET display_order = $1 WHERE id = $2 AND user_id = $3
+            """, i + 1, id_, user_id)
+    return len(ordered_ids)
+
+
+def random_move(ids):
+    ids = list(ids)
+    item = ids.pop(random.randrange(len(ids)))
+    pos = random.randint(0, len(ids))
+    ids.insert(pos, item)
+    return ids, pos
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    parser.add_argument("--deadlines", type=int, default=1000)
+    parser.add_argument("--moves", type=int, default=50)
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(args.dsn)
+    try:
+        await drop_bench_users(conn)
+        legacy_user, new_user = await create_bench_users(conn, 2)
+        await seed(conn, legacy_user, args.deadlines)
+        await seed(conn, new_user, args.deadlines)
+
+        # 舊版：reorder (整份清單逐列 UPDATE) + 讀取 (可能再寫)
+        ids = [row["id"] for row in await conn.fetch(
+            "SELECT id FROM deadlines WHERE user_id = $1 ORDER BY display_order", legacy_user)]
+        reorder_ms, get_ms, written = [], [], 0
+        for _ in range(args.moves):
+            ids, _ = random_move(ids)
+            t0 = time.perf_counter()
+            written += await legacy_reorder(conn, legacy_user, ids)
+            reorder_ms.append((time.perf_counter() - t0) * 1000)
+            t0 = time.perf_counter()
+            written += await legacy_get(conn, legacy_user)
+            get_ms.append((time.perf_counter() - t0) * 1000)
+        summarize("[legacy] reorder", reorder_ms)
+        summarize("[legacy] get-deadlines", get_ms)
+        print(f"[legacy] rows written per move: {written / args.moves:.1f}")
+
+        # 新版：/deadlines/move 與 /deadlines/reorder (整份清單，但只寫有變的列) + 唯讀讀取
+        for label in ("move", "reorder"):
+            ids = [row["id"] for row in await fetch_deadlines(conn, new_user)]
+            write_ms, get_ms, written = [], [], 0
+            for _ in range(args.moves):
+                ids, pos = random_move(ids)
+                t0 = time.perf_counter()
+                async with conn.transaction():
+                    if label == "move":
+                        move = DeadlineMove(
+                            user_id=new_user, id=ids[pos],
+                            prev_id=ids[pos - 1] if pos > 0 else None,
+                            next_id=ids[pos + 1] if pos + 1 < len(ids) else None,
+                        )
+                        written += await move_deadline(conn, move)
+                    else:
+                        written += await reorder_deadline_ids(conn, new_user, ids)
+                write_ms.append((time.perf_counter() - t0) * 1000)
+                t0 = time.perf_counter()
+                rows = await fetch_deadlines(conn, new_user)
+                get_ms.append((time.perf_counter() - t0) * 1000)
+            assert [row["id"] for row in rows] == ids
+            summarize(f"[sort_key] {label}", write_ms)
+            summarize("[sort_key] get-deadlines", get_ms)
+            print(f"[sort_key] rows written per {label}: {written / args.moves:.1f}")
+    finally:
+        await drop_bench_users(conn)
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,168 @@
+"""
+條件式 GET (ETag / If-None-Match) 的效果：模擬一個 user 一般的使用過程
+(反覆切換我的紀錄 / 好友 / deadline / 專注畫面，中間偶爾新增 deadline)，
+比較每次都重新下載，和像 mobile/api/api.js 一樣帶 If-None-Match 的差別：
+傳輸的 bytes、server 的 CPU 時間、延遲。
+
+server 的 CPU 從 /proc 讀 uvicorn process 的 utime + stime，所以要在 backend container 裡執行：
+    docker compose exec backend python -m benchmarks.bench_etag --rounds 200
+"""
+import argparse
+import asyncio
+import io
+import os
+import time
+
+import asyncpg
+import httpx
+from PIL import Image
+
+from benchmarks._common import (
+    API_URL,
+    DATABASE_URL,
+    FOCUS_DAILY_BACKFILL_SQL,
+    create_bench_users,
+    drop_bench_users,
+    summarize,
+)
+from ordering import key_between
+
+
+def screens(user_id: int, friend_ids: str):
+    """每個畫面打開時會呼叫的 GET (對應 mobile/app/(tabs) 的各個畫面)。"""
+    return {
+        "myRecord": [
+            ("/api/v1/user/record_status", {"user_id": user_id}),
+            ("/pictures/list", {"user_id": user_id, "limit": 100}),
+            ("/api/v1/focus/stats/daily", {"user_id": user_id}),
+            ("/api/v1/focus/stats/best-hour", {"user_id": user_id}),
+        ],
+        "friendList": [
+            ("/api/v1/user/record_status", {"user_id": user_id}),
+            ("/api/v1/friends/status", {"ids": friend_ids}),
+        ],
+        "deadlineList": [
+            ("/deadlines/get-deadlines", {"user_id": user_id}),
+        ],
+        "focusMode": [
+            ("/deadlines", {"user_id": user_id}),
+            ("/api/v1/messages/unread/latest", {"user_id": user_id}),
+        ],
+        "legacyPictures": [
+            ("/pictures", {"user_id": user_id, "size": "thumb"}),
+        ],
+    }
+
+
+def server_cpu_seconds() -> float:
+    """所有 uvicorn process 累積的 CPU 時間 (同一個 container 裡才讀得到)。"""
+    ticks = os.sysconf("SC_CLK_TCK")
+    total = 0
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                if b"uvicorn" not in f.read():
+                    continue
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            total += int(fields[11]) + int(fields[12])  # utime, stime
+        except (FileNotFoundError, ProcessLookupError, IndexError):
+            continue
+    return total / ticks
+
+
+async def seed(conn: asyncpg.Connection, user_id: int, friend_ids, args):
+    key = None
+    keys = []
+    for _ in range(args.deadlines):
+        key = key_between(key, None)
+        keys.append(key)
+    await conn.execute("""
+        INSERT INTO deadlines (user_id, deadline_date, task, is_done, sort_key, current_doing)
+        SELECT $1, current_date + (g % 30)::int, 'task ' || g, g % 4 = 0, k, g % 10 = 0
+        FROM unnest($2::text[]) WITH ORDINALITY AS t(k, g)
+    """, user_id, keys)
+
+    buf = io.BytesIO()
+    Image.new("RGB", (1280, 960), (120, 160, 200)).save(buf, "JPEG", quality=85)
+    await conn.executemany("""
+        INSERT INTO pictures (user_id, img, description, size_bytes, content_type)
+        VALUES ($1, $2, $3, $4, 'image/jpeg')
+    """, [(user_id, buf.getvalue(), f"photo {i}", len(buf.getvalue())) for i in range(args.pictures)])
+
+    await conn.execute("""
+        INSERT INTO focus_time (user_id, record_date, record_hour, focus_minutes)
+        SELECT $1, d::date, h, 1 + (random() * 59)::int
+        FROM generate_series(current_date - 59, current_date, interval '1 day') AS d,
+             generate_series(9, 12) AS h
+    """, user_id)
+    await conn.execute(FOCUS_DAILY_BACKFILL_SQL)
+
+    await conn.executemany("""
+        INSERT INTO messages (sender_id, receiver_id, content) VALUES ($1, $2, '加油')
+    """, [(friend_id, user_id) for friend_id in friend_ids])
+
+
+async def run_session(client: httpx.AsyncClient, label: str, user_id: int, friend_ids: str, args, conditional: bool):
+    cache = {}  # url -> etag
+    screen_map = screens(user_id, friend_ids)
+    order = list(screen_map)
+    transferred = 0
+    statuses = {200: 0, 304: 0}
+    latencies = []
+
+    cpu_before = server_cpu_seconds()
+    for i in range(args.rounds):
+        if i and i % args.write_every == 0:
+            # 偶爾新增一筆 deadline，下一次 deadline 相關的 GET 就會拿到新資料
+            await client.post("/deadlines/add-item", json={
+                "user_id": user_id, "deadline_date": "2030-01-01", "task": f"new {i}",
+            })
+        for path, params in screen_map[order[i % len(order)]]:
+            key = str(client.build_request("GET", path, params=params).url)
+            headers = {"If-None-Match": cache[key]} if conditional and key in cache else {}
+            t0 = time.perf_counter()
+            resp = await client.get(path, params=params, headers=headers)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            resp.raise_for_status()
+            statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+            transferred += len(resp.content) + sum(len(k) + len(v) + 4 for k, v in resp.headers.items())
+            if "etag" in resp.headers:
+                cache[key] = resp.headers["etag"]
+    cpu = server_cpu_seconds() - cpu_before
+
+    requests = sum(statuses.values())
+    print(f"[{label}] {requests} GETs: {transferred / 1024:,.1f} KiB transferred "
+          f"({transferred / requests / 1024:,.2f} KiB/request), server CPU {cpu:.2f}s, "
+          f"200={statuses.get(200, 0)} 304={statuses.get(304, 0)}")
+    summarize(f"[{label}] latency", latencies)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api-url", default=API_URL)
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    parser.add_argument("--rounds", type=int, default=200, help="切換畫面的次數")
+    parser.add_argument("--write-every", type=int, default=20, help="每幾次切換新增一筆 deadline")
+    parser.add_argument("--deadlines", type=int, default=100)
+    parser.add_argument("--pictures", type=int, default=20)
+    parser.add_argument("--friends", type=int, default=20)
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(args.dsn)
+    try:
+        await drop_bench_users(conn)
+        user_id, *friends = await create_bench_users(conn, 1 + args.friends)
+        await seed(conn, user_id, friends, args)
+        friend_ids = ",".join(map(str, friends))
+
+        async with httpx.AsyncClient(base_url=args.api_url, timeout=60) as client:
+            await run_session(client, "always 200", user_id, friend_ids, args, conditional=False)
+            await run_session(client, "If-None-Match", user_id, friend_ids, args, conditional=True)
+    finally:
+        await drop_bench_users(conn)
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+"""
+/focus/save 寫入延遲：舊版 (每小時一個 INSERT round-trip + 另外的徽章 INSERT)
+對上新版 (一個 unnest upsert + 一個徽章帳本 INSERT，同一個 transaction)。
+
+    docker compose exec backend python -m benchmarks.bench_focus_save --repeat 50
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import asyncpg
+
+from benchmarks._common import DATABASE_URL, create_bench_users, drop_bench_users, summarize
+from main import FocusSession, save_focus_sessions, split_focus_buckets
+
+SESSION_HOURS = (1, 8, 24)
+
+
+async def legacy_save(conn: asyncpg.Connection, session: FocusSession):
+    """改版前 save_focus_session 的寫法 (不含 transaction)。"""
+    if session.duration_seconds // 60 >= 5:
+        await conn.execute("""
+            INSERT INTO badge_ledger (user_id, amount, reason) VALUES ($1, 1, 'focus')
+        """, session.user_id)
+    for r_date, r_hour, minutes in split_focus_buckets(session.ended_at, session.duration_seconds):
+        await conn.execute("""
+            INSERT INTO focus_time (user_id, record_date, record_hour, focus_minutes)
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT (user_id, record_date, record_hour)
+            DO UPDATE SET focus_minutes = focus_time.focus_minutes + EXCLUDED.focus_minutes
+        """, session.user_id, r_date, r_hour, minutes)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(args.dsn)
+    try:
+        await drop_bench_users(conn)
+        legacy_user, batched_user = await create_bench_users(conn, 2)
+        # 每次往前挪兩天，避免同一小時累加超過 60 分鐘的 CHECK
+        base = datetime.now().replace(minute=30, second=0, microsecond=0)
+
+        for hours in SESSION_HOURS:
+            for label, user_id in (("legacy", legacy_user), ("batched", batched_user)):
+                samples = []
+                for i in range(args.repeat):
+                    session = FocusSession(
+                        duration_seconds=hours * 3600, user_id=user_id,
+                        ended_at=base - timedelta(days=2 * i),
+                    )
+                    start = time.perf_counter()
+                    if label == "legacy":
+                        await legacy_save(conn, session)
+                    else:
+                        await save_focus_sessions(conn, [session])
+                    samples.append((time.perf_counter() - start) * 1000)
+                summarize(f"{hours:>2}h session [{label}]", samples)
+            await conn.execute("DELETE FROM focus_time WHERE user_id = ANY($1::int[])", [legacy_user, batched_user])
+    finally:
+        await drop_bench_users(conn)
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+"""
+專注統計 API 壓力測試：先產生 N 個 user 一整年的 focus_time / focus_daily 假資料，
+再對 /api/v1/focus/stats/* 隨機打 request，列出每個 API 的延遲分佈 (p95)。
+
+    docker compose exec backend python -m benchmarks.bench_focus_stats --users 10000 --requests 5000
+資料量大 (預設 10k users x 365 天 x 4 小時 ≈ 1460 萬列)，產生資料需要幾分鐘。
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import date, timedelta
+
+import asyncpg
+import httpx
+
+from benchmarks._common import (
+    API_URL,
+    DATABASE_URL,
+    FOCUS_DAILY_BACKFILL_SQL,
+    create_bench_users,
+    drop_bench_users,
+    summarize,
+)
+
+ENDPOINTS = {
+    "daily(7d)": ("/api/v1/focus/stats/daily", 7, {}),
+    "rollup-week(90d)": ("/api/v1/focus/stats/rollup", 90, {"period": "week"}),
+    "rollup-month(365d)": ("/api/v1/focus/stats/rollup", 365, {"period": "month"}),
+    "hourly(30d)": ("/api/v1/focus/stats/hourly", 30, {}),
+    "best-hour(365d)": ("/api/v1/focus/stats/best-hour", 365, {}),
+}
+
+
+async def generate(conn: asyncpg.Connection, user_ids, hours_per_day: int):
+    start = time.perf_counter()
+    batch = 500
+    for i in range(0, len(user_ids), batch):
+        await conn.execute("""
+            INSERT INTO focus_time (user_id, record_date, record_hour, focus_minutes)
+            SELECT u, d::date, h, 1 + (random() * 59)::int
+            FROM unnest($1::int[]) AS u,
+                 generate_series(current_date - 364, current_date, interval '1 day') AS d,
+                 generate_series(9, 8 + $2) AS h
+        """, user_ids[i:i + batch], hours_per_day)
+    await conn.execute(FOCUS_DAILY_BACKFILL_SQL)
+    await conn.execute("ANALYZE focus_time; ANALYZE focus_daily;")
+    print(f"產生資料完成 ({time.perf_counter() - start:.0f}s)")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api-url", default=API_URL)
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--hours-per-day", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--keep", action="store_true", help="結束後保留假資料")
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(args.dsn)
+    try:
+        await drop_bench_users(conn)
+        user_ids = await create_bench_users(conn, args.users)
+        await generate(conn, user_ids, args.hours_per_day)
+
+        samples = {name: [] for name in ENDPOINTS}
+        sem = asyncio.Semaphore(args.concurrency)
+        today = date.today()
+
+        async def hit(client: httpx.AsyncClient, name: str):
+            path, days, extra = ENDPOINTS[name]
+            params = {
+                "user_id": random.choice(user_ids),
+                "start": (today - timedelta(days=days - 1)).isoformat(),
+                "end": today.isoformat(),
+                **extra,
+            }
+            async with sem:
+                t0 = time.perf_counter()
+                resp = await client.get(path, params=params)
+                samples[name].append((time.perf_counter() - t0) * 1000)
+            resp.raise_for_status()
+
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=args.api_url, limits=limits, timeout=60) as client:
+            names = list(ENDPOINTS)
+            t0 = time.perf_counter()
+            await asyncio.gather(*(hit(client, random.choice(names)) for _ in range(args.requests)))
+            elapsed = time.perf_counter() - t0
+
+        print(f"{args.requests} requests in {elapsed:.1f}s ({args.requests / elapsed:.0f} req/s)")
+        for name in ENDPOINTS:
+            summarize(name, samples[name])
+    finally:
+        if not args.keep:
+            await drop_bench_users(conn)
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
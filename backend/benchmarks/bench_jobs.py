@@ -0,0 +1,110 @@
+"""
+結束專注時的 request 延遲 (重的工作已經改成背景 job) 與 job 佇列的消化速度。
+
+模擬很多 user 同時結束專注：/user/status + /focus/save + /camera/upload-file 三個 request
+(加 --combined 改成一個 /focus/sessions)，列出每個 API 的延遲，
+再等佇列清空，列出 /api/v1/jobs/metrics 的 job 延遲。
+    docker compose exec backend python -m benchmarks.bench_jobs --users 200
+    docker compose exec backend python -m benchmarks.bench_jobs --users 200 --combined
+"""
+import argparse
+import asyncio
+import io
+import time
+import uuid
+
+import asyncpg
+import httpx
+from PIL import Image
+
+from benchmarks._common import API_URL, DATABASE_URL, create_bench_users, drop_bench_users, summarize
+
+
+def make_jpeg(seed: int) -> bytes:
+    # 每個 user 不同的圖，避免 content-addressed blob store 把它們合併成同一張
+    buf = io.BytesIO()
+    Image.new("RGB", (2048, 1536), (seed % 256, (seed * 7) % 256, (seed * 13) % 256)).save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api-url", default=API_URL)
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--drain-timeout", type=float, default=300)
+    parser.add_argument("--combined", action="store_true", help="用 /focus/sessions 一個 request 結束專注")
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(args.dsn)
+    try:
+        await drop_bench_users(conn)
+        user_ids = await create_bench_users(conn, args.users, badge=9)  # 9 個徽章：這次結束會升級稱號
+        if args.combined:
+            samples = {"/focus/sessions": []}
+        else:
+            samples = {"/user/status": [], "/focus/save": [], "/camera/upload-file": []}
+        session_samples = []  # 一個 user 從第一個 request 送出到最後一個回應
+        sem = asyncio.Semaphore(args.concurrency)
+
+        def requests_for(user_id: int, photo: bytes):
+            if args.combined:
+                return [("/focus/sessions", {
+                    "data": {"session_id": uuid.uuid4().hex, "user_id": str(user_id),
+                             "duration_seconds": str(3 * 3600), "is_studying": "false", "description": "bench"},
+                    "files": {"file": ("photo.jpg", photo, "image/jpeg")},
+                })]
+            return [
+                ("/user/status", {"json": {"user_id": user_id, "is_studying": False}}),
+                ("/focus/save", {"json": {"user_id": user_id, "duration_seconds": 3 * 3600}}),
+                ("/camera/upload-file", {
+                    "data": {"user_id": str(user_id), "description": "bench"},
+                    "files": {"file": ("photo.jpg", photo, "image/jpeg")},
+                }),
+            ]
+
+        async def end_session(client: httpx.AsyncClient, user_id: int):
+            photo = make_jpeg(user_id)
+            async with sem:
+                t_session = time.perf_counter()
+                for path, kwargs in requests_for(user_id, photo):
+                    t0 = time.perf_counter()
+                    resp = await client.post(path, **kwargs)
+                    samples[path].append((time.perf_counter() - t0) * 1000)
+                    resp.raise_for_status()
+                session_samples.append((time.perf_counter() - t_session) * 1000)
+
+        async with httpx.AsyncClient(base_url=args.api_url, timeout=60) as client:
+            t0 = time.perf_counter()
+            await asyncio.gather(*(end_session(client, u) for u in user_ids))
+            print(f"{args.users} 個 user 結束專注，request 全部回應: {time.perf_counter() - t0:.2f}s")
+            for path, values in samples.items():
+                summarize(path, values)
+            summarize("結束專注 (全部 request)", session_samples)
+
+            # 等背景 job 做完
+            deadline = time.perf_counter() + args.drain_timeout
+            while time.perf_counter() < deadline:
+                pending = await conn.fetchval("""
+                    SELECT count(*) FROM jobs WHERE status IN ('queued', 'running')
+                """)
+                if pending == 0:
+                    break
+                await asyncio.sleep(0.2)
+            print(f"佇列清空: {time.perf_counter() - t0:.2f}s (從第一個 request 開始算)")
+
+            failed = await conn.fetchval("SELECT count(*) FROM jobs WHERE status = 'failed'")
+            titles = await conn.fetchval("""
+                SELECT count(*) FROM users WHERE user_id = ANY($1::int[]) AND title <> 'Beginner'
+            """, user_ids)
+            print(f"failed jobs={failed}, 升級稱號的 user={titles}/{args.users}")
+            # metrics 只有處理那個 request 的 worker process 的延遲
+            print((await client.get("/api/v1/jobs/metrics")).json())
+    finally:
+        await drop_bench_users(conn)
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,129 @@
+"""
+好友排行榜 (這週) 的讀取延遲，每個 viewer 有 --friends 個好友：
+  1. on-demand   每次把好友這週的 focus_time (每小時一列) 加總再排序
+  2. totals      每次查 friends + focus_totals (Leaderboard 不快取，ttl = 0)
+  3. cached      Leaderboard 快取；同時有寫入者不斷存專注時間並 invalidate，量快取被清掉時的延遲
+
+    docker compose exec backend python -m benchmarks.bench_leaderboard --friends 500 --reads 500
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import date, datetime, timedelta
+
+import asyncpg
+
+from benchmarks._common import DATABASE_URL, create_bench_users, drop_bench_users, summarize
+from leaderboard import Leaderboard, period_start
+from main import FocusSession, save_focus_sessions
+
+TARGET_P95_MS = 10
+
+# 改版前的算法：每次都從 focus_time 加總
+ON_DEMAND_SQL = """
+    SELECT m.user_id, COALESCE(SUM(ft.focus_minutes), 0) AS focus_minutes
+    FROM (SELECT $1::int AS user_id UNION ALL SELECT friend_id FROM friends WHERE user_id = $1) AS m
+    LEFT JOIN focus_time ft
+        ON ft.user_id = m.user_id AND ft.record_date >= $2 AND ft.record_date < $2 + 7
+    GROUP BY m.user_id
+    ORDER BY focus_minutes DESC, m.user_id
+    LIMIT $3
+"""
+
+
+async def seed(pool: asyncpg.Pool, viewers, friends):
+    async with pool.acquire() as conn:
+        await conn.execute("""
+            INSERT INTO friends (user_id, friend_id)
+            SELECT v, f FROM unnest($1::int[]) AS v, unnest($2::int[]) AS f
+        """, viewers, friends)
+        # 每個人過去 7 天每天一段 (不同小時，不會碰到每小時 60 分鐘的上限)
+        now = datetime.now().replace(minute=55, second=0, microsecond=0)
+        sessions = [
+            FocusSession(user_id=user_id, duration_seconds=random.randint(10, 50) * 60,
+                         ended_at=now - timedelta(days=day, hours=random.randint(0, 12)))
+            for user_id in [*viewers, *friends] for day in range(7)
+        ]
+        for i in range(0, len(sessions), 1000):
+            await save_focus_sessions(conn, sessions[i:i + 1000])
+
+
+async def writer(pool: asyncpg.Pool, board: Leaderboard, friends, stop: asyncio.Event, interval: float):
+    """模擬好友們陸續結束專注：存進 DB 後 invalidate，跟 /focus/save 一樣。"""
+    writes = 0
+    while not stop.is_set():
+        user_id = random.choice(friends)
+        session = FocusSession(user_id=user_id, duration_seconds=60, ended_at=datetime.now())
+        async with pool.acquire() as conn:
+            await save_focus_sessions(conn, [session])
+        await board.invalidate(user_ids=[user_id])
+        writes += 1
+        await asyncio.sleep(interval)
+    return writes
+
+
+async def run(label: str, read, viewers, reads: int):
+    samples = []
+    for _ in range(reads):
+        viewer = random.choice(viewers)
+        t0 = time.perf_counter()
+        await read(viewer)
+        samples.append((time.perf_counter() - t0) * 1000)
+    summarize(label, samples)
+    p95 = sorted(samples)[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"  p95 {'<' if p95 < TARGET_P95_MS else '>='} {TARGET_P95_MS}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    parser.add_argument("--friends", type=int, default=500)
+    parser.add_argument("--viewers", type=int, default=20)
+    parser.add_argument("--reads", type=int, default=500)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--write-interval", type=float, default=0.01, help="寫入者每次存專注之間的秒數")
+    args = parser.parse_args()
+
+    pool = await asyncpg.create_pool(args.dsn, min_size=4, max_size=8)
+    try:
+        async with pool.acquire() as conn:
+            await drop_bench_users(conn)
+            user_ids = await create_bench_users(conn, args.viewers + args.friends)
+        viewers, friends = user_ids[:args.viewers], user_ids[args.viewers:]
+        await seed(pool, viewers, friends)
+        week = period_start("week", date.today())
+
+        async def on_demand(viewer):
+            async with pool.acquire() as conn:
+                return await conn.fetch(ON_DEMAND_SQL, viewer, week, args.limit)
+
+        uncached = Leaderboard(pool, ttl=0)
+        cached = Leaderboard(pool)
+
+        await run("[on-demand] 加總 focus_time", on_demand, viewers, args.reads)
+        await run("[totals] friends + focus_totals", lambda v: uncached.top(v, "week", args.limit), viewers, args.reads)
+
+        stop = asyncio.Event()
+        writes = asyncio.create_task(writer(pool, cached, friends, stop, args.write_interval))
+        try:
+            await run("[cached] Leaderboard 快取 + 併發寫入", lambda v: cached.top(v, "week", args.limit),
+                      viewers, args.reads)
+        finally:
+            stop.set()
+        print(f"  讀取期間寫入 {await writes} 次")
+
+        # 快取的結果要跟 DB 一致 (寫入後都有 invalidate)
+        for viewer in viewers:
+            expected = [(r["user_id"], r["focus_minutes"]) for r in await on_demand(viewer)]
+            got = [(e["user_id"], e["focus_minutes"]) for e in (await cached.top(viewer, "week", args.limit))["items"]]
+            if got != expected:
+                print(f"  viewer {viewer} 不一致: {got} != {expected}")
+    finally:
+        async with pool.acquire() as conn:
+            await drop_bench_users(conn)
+        await pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
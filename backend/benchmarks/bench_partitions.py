@@ -0,0 +1,258 @@
+"""
+messages / focus_time：單一大表 (改版前) 對上每月一個 partition (partitions.py)。
+
+在兩個暫時的 schema 裡各建一份同樣的多年份假資料 (預設 1000 users x 3 年，每人每天 2 則訊息、4 小時專注)：
+  bench_flat   舊的 table 結構 (一張表 + 原本的 index)
+  bench_part   partitioned table
+用 search_path 切換，兩邊跑的都是 main.py 裡 route 用的同一段 SQL，列出：
+  1. 每個查詢的延遲，以及 partitioned 那邊實際掃到幾個 partition (EXPLAIN ANALYZE)
+  2. 保留期限：flat 用 DELETE 刪舊資料 vs. 彙總後 DROP partition，花的時間和刪完之後的表大小
+全部做完會刪掉兩個 schema 和測試用 user。
+    docker compose exec backend python -m benchmarks.bench_partitions --users 1000 --years 3
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import date, datetime, timedelta
+
+import asyncpg
+
+from benchmarks._common import DATABASE_URL, create_bench_users, drop_bench_users, migration_module, summarize
+from main import (
+    FOCUS_BEST_HOUR_SQL,
+    FOCUS_HOURLY_SQL,
+    INBOX_SQL_BY_FILTER,
+    LATEST_UNREAD_SQL,
+    MARK_READ_SQL,
+    UNREAD_COUNT_SQL,
+    message_cutoff,
+)
+from partitions import (
+    MESSAGE_RETENTION_MONTHS,
+    add_months,
+    apply_retention,
+    ensure_partitions,
+    month_start,
+    record_id_bounds,
+)
+
+SCHEMAS = ("bench_flat", "bench_part")
+
+# partitioned table 跟正式環境一樣由 migration 0004 的 SQL 建立
+PARTITIONING = migration_module(4)
+
+FLAT_TABLES_SQL = """
+    CREATE TABLE messages (
+        id           INTEGER PRIMARY KEY DEFAULT nextval('messages_id_seq'),
+        sender_id    INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+        receiver_id  INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+        content      TEXT NOT NULL,
+        is_read      BOOLEAN DEFAULT FALSE,
+        created_at   TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE focus_time (
+        user_id       INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+        record_date   DATE NOT NULL,
+        record_hour   INT NOT NULL,
+        focus_minutes INT DEFAULT 0,
+        PRIMARY KEY (user_id, record_date, record_hour)
+    );
+"""
+
+
+async def connect(dsn: str, schema: str) -> asyncpg.Connection:
+    return await asyncpg.connect(dsn, server_settings={"search_path": f"{schema}, public"})
+
+
+async def build(dsn: str, user_ids, args):
+    today = date.today()
+    first_day = today - timedelta(days=365 * args.years)
+    for schema in SCHEMAS:
+        conn = await connect(dsn, schema)
+        try:
+            t0 = time.perf_counter()
+            await conn.execute(f"CREATE SCHEMA {schema}")
+            # focus_daily 也放在 schema 裡，保留期限的彙總不會寫到正式的表
+            await conn.execute("CREATE TABLE focus_daily (LIKE public.focus_daily INCLUDING ALL)")
+            await conn.execute(PARTITIONING.ARCHIVE_SQL)
+            if schema == "bench_flat":
+                await conn.execute(FLAT_TABLES_SQL)
+            else:
+                await conn.execute(PARTITIONING.MESSAGES_SQL)
+                await conn.execute(PARTITIONING.FOCUS_TIME_SQL)
+                await ensure_partitions(conn, since=first_day)
+
+            if schema == "bench_flat":
+                # 訊息時間平均分散，id 跟著時間遞增 (跟正式環境一樣)
+                await conn.execute("""
+                    INSERT INTO messages (id, sender_id, receiver_id, content, is_read, created_at)
+                    SELECT row_number() OVER (ORDER BY ts, r) + 1000000000, r, r, '加油', ts < now() - interval '3 days', ts
+                    FROM unnest($1::int[]) AS r,
+                         generate_series($2::timestamp, now()::timestamp, $3::interval) AS ts
+                """, user_ids, datetime(first_day.year, first_day.month, first_day.day),
+                    timedelta(days=1) / args.messages_per_day)
+                await conn.execute("""
+                    INSERT INTO focus_time (user_id, record_date, record_hour, focus_minutes)
+                    SELECT u, d::date, h, 30
+                    FROM unnest($1::int[]) AS u,
+                         generate_series($2::date, $3::date, interval '1 day') AS d,
+                         generate_series(9, 8 + $4) AS h
+                """, user_ids, first_day, today, args.hours_per_day)
+                await conn.execute("""
+                    CREATE INDEX idx_messages_receiver_created ON messages (receiver_id, created_at DESC, id DESC);
+                    CREATE INDEX idx_messages_receiver_unread ON messages (receiver_id, created_at DESC, id DESC)
+                    WHERE is_read = FALSE;
+                """)
+            else:
+                await conn.execute("INSERT INTO messages SELECT * FROM bench_flat.messages")
+                await conn.execute("INSERT INTO focus_time SELECT * FROM bench_flat.focus_time")
+                await conn.execute(PARTITIONING.MESSAGES_INDEXES_SQL)
+                await record_id_bounds(conn)
+            await conn.execute("INSERT INTO focus_daily SELECT user_id, record_date, SUM(focus_minutes) "
+                               "FROM focus_time GROUP BY 1, 2")
+            await conn.execute("ANALYZE messages; ANALYZE focus_time;")
+            count = await conn.fetchval("SELECT count(*) FROM messages")
+            print(f"[{schema}] {count} 則訊息，建立 {time.perf_counter() - t0:.0f}s")
+        finally:
+            await conn.close()
+
+
+def queries(conn_user: int, message: asyncpg.Record, today: date):
+    cursor_at, cursor_id = message["created_at"], message["id"]
+    cutoff = message_cutoff()
+    return {
+        "inbox 第一頁": (INBOX_SQL_BY_FILTER[False, False], (conn_user, cutoff, 31)),
+        "inbox 翻頁 (cursor)": (INBOX_SQL_BY_FILTER[False, True], (conn_user, cursor_at, cursor_id, cutoff, 31)),
+        "unread-count": (UNREAD_COUNT_SQL, (conn_user, cutoff)),
+        "unread/latest": (LATEST_UNREAD_SQL, (conn_user, cutoff)),
+        "標記單則已讀": (MARK_READ_SQL, (cursor_id,)),
+        "hourly (30 天)": (FOCUS_HOURLY_SQL, (conn_user, today - timedelta(days=29), today)),
+        "best-hour (365 天)": (FOCUS_BEST_HOUR_SQL, (conn_user, today - timedelta(days=364), today)),
+    }
+
+
+def scanned_relations(plan) -> set:
+    """EXPLAIN ANALYZE 裡實際執行過的 table / index scan 所屬的 relation。"""
+    found = set()
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        if node.get("Actual Loops", 0) > 0 and "Relation Name" in node:
+            found.add(node["Relation Name"])
+        stack.extend(node.get("Plans", []))
+    return found
+
+
+async def run_queries(dsn: str, user_ids, args):
+    today = date.today()
+    samples = {}
+    for schema in SCHEMAS:
+        conn = await connect(dsn, schema)
+        try:
+            for _ in range(args.rounds):
+                user_id = random.choice(user_ids)
+                # 第 3 頁左右的訊息當 cursor
+                message = await conn.fetchrow("""
+                    SELECT id, created_at FROM messages WHERE receiver_id = $1
+                    ORDER BY created_at DESC, id DESC OFFSET 60 LIMIT 1
+                """, user_id)
+                for label, (sql, params) in queries(user_id, message, today).items():
+                    t0 = time.perf_counter()
+                    await conn.fetch(sql, *params)
+                    samples.setdefault(label, {}).setdefault(schema, []).append((time.perf_counter() - t0) * 1000)
+
+            if schema == "bench_part":
+                user_id = user_ids[0]
+                message = await conn.fetchrow("""
+                    SELECT id, created_at FROM messages WHERE receiver_id = $1
+                    ORDER BY created_at DESC, id DESC OFFSET 60 LIMIT 1
+                """, user_id)
+                total = await conn.fetchval("SELECT count(*) FROM pg_inherits WHERE inhparent = 'messages'::regclass")
+                print(f"\n=== bench_part 每個查詢實際掃到的 partition (messages 共 {total} 個) ===")
+                for label, (sql, params) in queries(user_id, message, today).items():
+                    tr = conn.transaction()
+                    await tr.start()
+                    try:
+                        plan = json.loads(await conn.fetchval("EXPLAIN (ANALYZE, FORMAT JSON) " + sql, *params))
+                    finally:
+                        await tr.rollback()
+                    relations = sorted(scanned_relations(plan[0]["Plan"]))
+                    print(f"  {label}: {len(relations)} 個 — {', '.join(relations)}")
+        finally:
+            await conn.close()
+
+    print()
+    for label, by_schema in samples.items():
+        for schema in SCHEMAS:
+            summarize(f"[{schema}] {label}", by_schema[schema])
+
+
+async def table_size(conn: asyncpg.Connection, schema: str) -> int:
+    return await conn.fetchval("""
+        SELECT COALESCE(sum(pg_total_relation_size(c.oid)), 0)::bigint
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = $1 AND c.relkind = 'r'
+          AND (c.relname LIKE 'messages%' OR c.relname LIKE 'focus_time%')
+    """, schema)
+
+
+async def run_retention(dsn: str):
+    cutoff = add_months(month_start(date.today()), -MESSAGE_RETENTION_MONTHS)
+    print(f"\n=== 保留期限：刪除 {cutoff} 以前的訊息 ===")
+    conn = await connect(dsn, "bench_flat")
+    try:
+        before = await table_size(conn, "bench_flat")
+        t0 = time.perf_counter()
+        deleted = await conn.execute("DELETE FROM messages WHERE created_at < $1",
+                                     datetime(cutoff.year, cutoff.month, 1))
+        elapsed = time.perf_counter() - t0
+        after = await table_size(conn, "bench_flat")
+        print(f"[bench_flat] {deleted}: {elapsed:.1f}s, 大小 {before >> 20}MB -> {after >> 20}MB (DELETE 不會縮小)")
+    finally:
+        await conn.close()
+
+    conn = await connect(dsn, "bench_part")
+    try:
+        before = await table_size(conn, "bench_part")
+        t0 = time.perf_counter()
+        dropped = await apply_retention(conn)
+        elapsed = time.perf_counter() - t0
+        after = await table_size(conn, "bench_part")
+        archived = await conn.fetchval("SELECT count(*) FROM messages_monthly")
+        print(f"[bench_part] 彙總成 {archived} 列 messages_monthly 後刪除 {len(dropped)} 個 partition: "
+              f"{elapsed:.1f}s, 大小 {before >> 20}MB -> {after >> 20}MB")
+    finally:
+        await conn.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--messages-per-day", type=int, default=2)
+    parser.add_argument("--hours-per-day", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(args.dsn)
+    try:
+        for schema in SCHEMAS:
+            await conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        await drop_bench_users(conn)
+        user_ids = await create_bench_users(conn, args.users)
+
+        await build(args.dsn, user_ids, args)
+        await run_queries(args.dsn, user_ids, args)
+        await run_retention(args.dsn)
+    finally:
+        for schema in SCHEMAS:
+            await conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        await drop_bench_users(conn)
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
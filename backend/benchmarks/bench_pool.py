@@ -0,0 +1,99 @@
+"""
+連線池壓力測試：很多 client 同時打幾個常用的 GET，列出延遲，
+再從 /metrics 讀出 server 端等待連線的時間分佈與各查詢的延遲。
+
+用不同的 DB_POOL_MAX_SIZE 重啟 backend 再跑一次，就能比較 pool 大小的影響：
+    DB_POOL_MAX_SIZE=10 docker compose up -d backend
+    docker compose exec backend python -m benchmarks.bench_pool --clients 200
+"""
+import argparse
+import asyncio
+import re
+import time
+
+import asyncpg
+import httpx
+
+from benchmarks._common import API_URL, DATABASE_URL, create_bench_users, drop_bench_users, summarize
+
+
+def parse_metrics(text: str, name: str):
+    """回傳 {label 字串: 值}，只取指定的 metric。"""
+    values = {}
+    for line in text.splitlines():
+        match = re.match(rf"^{name}(\{{[^}}]*\}})? (\S+)$", line)
+        if match:
+            values[match.group(1) or ""] = float(match.group(2))
+    return values
+
+
+def histogram_summary(text: str, name: str, label: str):
+    """從 _bucket 算出每個 label 的 p50 / p99 (bucket 上界)。"""
+    buckets = {}
+    for labels, count in parse_metrics(text, f"{name}_bucket").items():
+        value = re.search(rf'{label}="([^"]*)"', labels).group(1)
+        le = float(re.search(r'le="([^"]*)"', labels).group(1).replace("+Inf", "inf"))
+        buckets.setdefault(value, []).append((le, count))
+    for value, points in sorted(buckets.items()):
+        points.sort()
+        total = points[-1][1]
+        if not total:
+            continue
+        p50 = next(le for le, c in points if c >= total * 0.5)
+        p99 = next(le for le, c in points if c >= total * 0.99)
+        print(f"  {value}: n={int(total)} p50<={p50 * 1000:g}ms p99<={p99 * 1000:g}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api-url", default=API_URL)
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=20, help="每個 client 送幾個 request")
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(args.dsn)
+    try:
+        await drop_bench_users(conn)
+        user_ids = await create_bench_users(conn, args.clients)
+        routes = [
+            ("/api/v1/messages/unread-count", "user_id"),
+            ("/deadlines/get-deadlines", "user_id"),
+            ("/api/v1/focus/stats/daily", "user_id"),
+            ("/pictures/list", "user_id"),
+        ]
+        latencies = []
+        errors = 0
+
+        async def client_loop(client: httpx.AsyncClient, user_id: int):
+            nonlocal errors
+            for i in range(args.requests):
+                path, param = routes[i % len(routes)]
+                t0 = time.perf_counter()
+                resp = await client.get(path, params={param: user_id})
+                latencies.append((time.perf_counter() - t0) * 1000)
+                if resp.status_code != 200:
+                    errors += 1
+
+        limits = httpx.Limits(max_connections=args.clients)
+        async with httpx.AsyncClient(base_url=args.api_url, timeout=60, limits=limits) as client:
+            t0 = time.perf_counter()
+            await asyncio.gather(*(client_loop(client, u) for u in user_ids))
+            elapsed = time.perf_counter() - t0
+            print(f"{len(latencies)} requests in {elapsed:.2f}s ({len(latencies) / elapsed:,.0f} req/s), "
+                  f"非 200 (含 503 pool timeout)={errors}")
+            summarize("GET latency", latencies)
+
+            text = (await client.get("/metrics")).text
+        print("pool 連線數:", parse_metrics(text, "db_pool_connections"))
+        print("等待連線 (server 端):")
+        histogram_summary(text, "db_pool_acquire_wait_seconds", "pool")
+        print("各查詢延遲 (server 端):")
+        histogram_summary(text, "db_query_duration_seconds", "query")
+    finally:
+        await drop_bench_users(conn)
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,79 @@
+"""
+好友狀態讀取量：每次都查 users (改版前 get_friends_status 的查詢)
+對上 PresenceCache (presence + profile 都在記憶體)。
+
+在同一個 process 裡直接呼叫，不經過 HTTP，只比較資料來源的差異：
+    docker compose exec backend python -m benchmarks.bench_presence --friends 20 --seconds 10
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import asyncpg
+
+from benchmarks._common import DATABASE_URL, create_bench_users, drop_bench_users
+from presence import PresenceCache
+
+
+async def read_from_db(pool: asyncpg.Pool, friend_ids):
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT u.user_id, u.name, u.is_studying, b.badge
+            FROM users u JOIN user_badges b ON b.user_id = u.user_id
+            WHERE u.user_id = ANY($1::int[])
+        """, friend_ids)
+    return [(r["user_id"], r["name"], bool(r["is_studying"])) for r in rows]
+
+
+async def read_from_cache(cache: PresenceCache, friend_ids):
+    profiles = await cache.get_profiles(friend_ids)
+    return [(uid, profiles[uid]["name"], cache.get(uid)[0]) for uid in friend_ids if uid in profiles]
+
+
+async def run(label: str, read, user_ids, args):
+    count = 0
+    stop_at = time.perf_counter() + args.seconds
+
+    async def worker():
+        nonlocal count
+        while time.perf_counter() < stop_at:
+            await read(random.sample(user_ids, args.friends))
+            count += 1
+
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    print(f"[{label}] {count / args.seconds:,.0f} status reads/s "
+          f"({args.friends} friends per read, concurrency={args.concurrency})")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--friends", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--pool-size", type=int, default=10)
+    args = parser.parse_args()
+
+    pool = await asyncpg.create_pool(args.dsn, min_size=args.pool_size, max_size=args.pool_size)
+    try:
+        async with pool.acquire() as conn:
+            await drop_bench_users(conn)
+            user_ids = await create_bench_users(conn, args.users)
+
+        cache = PresenceCache(pool)
+        for uid in user_ids[::3]:
+            cache._apply(uid, True, False, owned=False)
+        await cache.get_profiles(user_ids)  # 預熱
+
+        await run("db", lambda ids: read_from_db(pool, ids), user_ids, args)
+        await run("cache", lambda ids: read_from_cache(cache, ids), user_ids, args)
+    finally:
+        async with pool.acquire() as conn:
+            await drop_bench_users(conn)
+        await pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
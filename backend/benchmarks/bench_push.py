@@ -0,0 +1,127 @@
+"""
+比較 N 個閒置 client 在 polling 與 push (WebSocket) 兩種模式下：
+  1. 閒置期間每秒 DB 交易數
+  2. 新訊息從送出到 client 收到的延遲
+
+用法 (backend 與 db 需已啟動):
+    python -m benchmarks.bench_push --clients 200 --idle 30 --messages 50
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+import asyncpg
+import httpx
+import websockets
+
+from benchmarks._common import API_URL, DATABASE_URL, create_bench_users, drop_bench_users, summarize, xact_count
+
+POLL_INTERVAL = 3.0  # 和 FocusContext.tsx 的 setInterval 一樣
+
+
+class Receiver:
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.seen = {}  # content -> 收到的時間
+        self.last_id = None
+
+    def on_message(self, payload: dict):
+        data = payload.get("data") if payload else None
+        if payload and payload.get("has_unread") and data and data["id"] != self.last_id:
+            self.last_id = data["id"]
+            self.seen.setdefault(data["content"], time.perf_counter())
+
+
+async def run_polling(receiver: Receiver, client: httpx.AsyncClient, stop: asyncio.Event):
+    while not stop.is_set():
+        resp = await client.get("/api/v1/messages/unread/latest", params={"user_id": receiver.user_id})
+        receiver.on_message(resp.json())
+        try:
+            await asyncio.wait_for(stop.wait(), POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_push(receiver: Receiver, ready: asyncio.Event, stop: asyncio.Event, ws_url: str):
+    async with websockets.connect(f"{ws_url}/api/v1/messages/ws?user_id={receiver.user_id}") as ws:
+        receiver.on_message(json.loads(await ws.recv()))
+        ready.set()
+        while not stop.is_set():
+            try:
+                raw = await asyncio.wait_for(ws.recv(), 0.5)
+            except asyncio.TimeoutError:
+                continue
+            receiver.on_message(json.loads(raw))
+
+
+async def bench_mode(mode: str, args, conn: asyncpg.Connection, sender_id: int, receiver_ids):
+    receivers = [Receiver(uid) for uid in receiver_ids]
+    stop = asyncio.Event()
+    limits = httpx.Limits(max_connections=args.clients + 10)
+    async with httpx.AsyncClient(base_url=args.api_url, limits=limits, timeout=30) as client:
+        if mode == "polling":
+            tasks = [asyncio.create_task(run_polling(r, client, stop)) for r in receivers]
+        else:
+            ws_url = args.api_url.replace("http", "ws", 1)
+            readies = [asyncio.Event() for _ in receivers]
+            tasks = [asyncio.create_task(run_push(r, e, stop, ws_url)) for r, e in zip(receivers, readies)]
+            await asyncio.gather(*(e.wait() for e in readies))
+
+        # 1. 閒置期間的 DB 負載
+        await asyncio.sleep(1)
+        before = await xact_count(conn)
+        await asyncio.sleep(args.idle)
+        after = await xact_count(conn)
+        # 扣掉 xact_count 自己的兩次查詢
+        idle_qps = max(0, after - before - 2) / args.idle
+
+        # 2. 送訊息並量延遲
+        sent = {}
+        for i in range(args.messages):
+            receiver = receivers[i % len(receivers)]
+            content = f"bench {uuid.uuid4().hex}"
+            sent[content] = (receiver, time.perf_counter())
+            await client.post("/api/v1/messages", json={
+                "sender_id": sender_id, "receiver_id": receiver.user_id, "content": content,
+            })
+            await asyncio.sleep(args.gap)
+
+        deadline = time.perf_counter() + POLL_INTERVAL * 2
+        while time.perf_counter() < deadline and any(c not in r.seen for c, (r, _) in sent.items()):
+            await asyncio.sleep(0.05)
+
+        stop.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    latencies = [(r.seen[c] - t0) * 1000 for c, (r, t0) in sent.items() if c in r.seen]
+    print(f"[{mode}] clients={args.clients} idle DB xact/s={idle_qps:.1f} "
+          f"delivered={len(latencies)}/{len(sent)}")
+    summarize(f"[{mode}] delivery latency", latencies)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api-url", default=API_URL)
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--idle", type=float, default=15.0, help="量測閒置 DB 負載的秒數")
+    parser.add_argument("--messages", type=int, default=30)
+    parser.add_argument("--gap", type=float, default=0.2, help="每則訊息間隔秒數")
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(args.dsn)
+    try:
+        await drop_bench_users(conn)
+        sender_id, = await create_bench_users(conn, 1, badge=args.messages * 2 + 10)
+        receiver_ids = await create_bench_users(conn, args.clients)
+        for mode in ("polling", "push"):
+            await bench_mode(mode, args, conn, sender_id, receiver_ids)
+    finally:
+        await drop_bench_users(conn)
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
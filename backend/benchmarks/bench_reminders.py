@@ -0,0 +1,98 @@
+"""
+deadline 提醒：每個 user 各自查一次 deadlines (改版前 app 在休息畫面做的事)
+對上 ReminderScheduler (整份載入記憶體，一次 sweep 寄出全部到期的提醒)。
+
+產生 --users 個 user、每人 --per-user 筆未完成的 deadline (日期分散在接下來幾天)，然後量：
+  1. 逐一查每個 user 的 deadlines 要多久 (--concurrency 條連線)
+  2. scheduler 啟動時的載入時間與記憶體中的項目數
+  3. 沒有到期項目時一個 tick 的成本，以及把接下來幾天的提醒一次 sweep 寄出的時間
+    docker compose exec backend python -m benchmarks.bench_reminders --users 100000
+"""
+import argparse
+import asyncio
+import time
+
+import asyncpg
+
+from benchmarks._common import DATABASE_URL, create_bench_users, drop_bench_users, summarize
+from main import DEADLINE_DOING_SQL
+from reminders import ReminderScheduler, today
+
+
+async def per_user_queries(pool: asyncpg.Pool, user_ids, concurrency: int):
+    queue = list(user_ids)
+    samples = []
+
+    async def worker():
+        while queue:
+            user_id = queue.pop()
+            t0 = time.perf_counter()
+            async with pool.acquire() as conn:
+                await conn.fetch(DEADLINE_DOING_SQL, user_id)
+            samples.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - t0, samples
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--per-user", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    pool = await asyncpg.create_pool(args.dsn, min_size=args.concurrency, max_size=args.concurrency)
+    try:
+        async with pool.acquire() as conn:
+            await drop_bench_users(conn)
+            user_ids = await create_bench_users(conn, args.users)
+            await conn.execute("""
+                INSERT INTO deadlines (user_id, deadline_date, task, is_done, sort_key)
+                SELECT u, $2::date + ((u + g) % 5), 'bench task ' || g, FALSE, 'a' || lpad(g::text, 6, '0') || 'V'
+                FROM unnest($1::int[]) AS u, generate_series(1, $3) AS g
+            """, user_ids, today(), args.per_user)
+            await conn.execute("ANALYZE deadlines")
+
+        elapsed, samples = await per_user_queries(pool, user_ids, args.concurrency)
+        print(f"=== 每個 user 各查一次 ({len(user_ids)} 次查詢): {elapsed:.1f}s ===")
+        summarize("per-user deadline query", samples)
+
+        scheduler = ReminderScheduler(pool)
+        t0 = time.perf_counter()
+        await scheduler.load()
+        print(f"\n=== scheduler 載入: {(time.perf_counter() - t0) * 1000:.0f}ms, "
+              f"{len(scheduler._entries)} 筆 deadline, {scheduler.pending()} 個排定的提醒 ===")
+
+        # 第一次 sweep 會補寄已經過了時間點的提醒；之後的 tick 沒有到期項目
+        t0 = time.perf_counter()
+        sent = await scheduler.sweep()
+        print(f"補寄已過時間點的提醒: {sent} 則, {(time.perf_counter() - t0) * 1000:.0f}ms")
+        ticks = []
+        for _ in range(1000):
+            t0 = time.perf_counter()
+            await scheduler.sweep()
+            ticks.append((time.perf_counter() - t0) * 1000)
+        summarize("沒有到期項目的 tick", ticks)
+
+        # 把時間快轉 6 天：接下來所有的提醒在一次 sweep 裡寄出
+        pending = scheduler.pending()
+        t0 = time.perf_counter()
+        sent = await scheduler.sweep(now=time.time() + 6 * 86400)
+        print(f"一次 sweep 寄出 {sent} 則 (排定 {pending} 個): {(time.perf_counter() - t0) * 1000:.0f}ms")
+        # 再跑一次同樣的時間點：deadline_reminders 會擋掉全部，不會重複寄
+        for deadline_id, entry in list(scheduler._entries.items())[:10_000]:
+            scheduler._remove(deadline_id)
+            scheduler._add(deadline_id, entry.user_id, entry.deadline_date, entry.task)
+        resent = await scheduler.sweep(now=time.time() + 6 * 86400)
+        print(f"重新排入 10000 筆後再 sweep 一次: 重複寄出 {resent} 則 (應該是 0)")
+    finally:
+        async with pool.acquire() as conn:
+            await drop_bench_users(conn)
+        await pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+"""
+送訊息扣徽章的併發測試：很多 task 同時用同一個 sender 送訊息，
+檢查徽章不會被扣成負的 (舊版先 SELECT 再 UPDATE，會超扣)，並列出 throughput。
+
+    docker compose exec backend python -m benchmarks.bench_send --badges 500 --tasks 50
+舊版的超扣只會印出來；新版 (單一 statement) 和 nudge 有超扣就會 assert 失敗。
+"""
+import argparse
+import asyncio
+import time
+
+import asyncpg
+
+from benchmarks._common import DATABASE_URL, create_bench_users, drop_bench_users, set_bench_badges
+from main import MessageCreate, send_nudges, spend_badge_and_send
+
+
+async def legacy_send(conn: asyncpg.Connection, msg: MessageCreate) -> bool:
+    """改版前 send_message 的寫法 (SELECT → 檢查 → 扣款 → INSERT，扣款改成寫帳本)。"""
+    async with conn.transaction():
+        current_badge = await conn.fetchval("SELECT badge FROM user_badges WHERE user_id = $1", msg.sender_id)
+        if not current_badge or current_badge < 1:
+            return False
+        await conn.execute("""
+            INSERT INTO badge_ledger (user_id, amount, reason) VALUES ($1, -1, 'message')
+        """, msg.sender_id)
+        await conn.execute("""
+            INSERT INTO messages (sender_id, receiver_id, content) VALUES ($1, $2, $3)
+        """, msg.sender_id, msg.receiver_id, msg.content)
+    return True
+
+
+async def new_send(conn: asyncpg.Connection, msg: MessageCreate) -> bool:
+    return await spend_badge_and_send(conn, msg) is not None
+
+
+async def hammer(pool: asyncpg.Pool, label: str, send, sender: int, receiver: int, args):
+    await reset(pool, sender, args.badges)
+    attempts = args.badges * 2  # 一半的 request 應該因為徽章不足而失敗
+    per_task = attempts // args.tasks
+    sent = 0
+
+    async def worker():
+        nonlocal sent
+        for _ in range(per_task):
+            async with pool.acquire() as conn:
+                if await send(conn, MessageCreate(sender_id=sender, receiver_id=receiver, content="加油")):
+                    sent += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.tasks)))
+    elapsed = time.perf_counter() - start
+
+    badge, messages = await balance(pool, sender)
+    total = per_task * args.tasks
+    print(f"[{label}] {total} sends in {elapsed:.2f}s ({total / elapsed:,.0f}/s), "
+          f"sent={sent} messages={messages} badge_left={badge}")
+    return badge, messages
+
+
+async def reset(pool: asyncpg.Pool, sender: int, badges: int):
+    async with pool.acquire() as conn:
+        await conn.execute("DELETE FROM messages WHERE sender_id = $1", sender)
+        await set_bench_badges(conn, [sender], badges)
+
+
+async def balance(pool: asyncpg.Pool, sender: int):
+    async with pool.acquire() as conn:
+        badge = await conn.fetchval("SELECT badge FROM user_badges WHERE user_id = $1", sender)
+        messages = await conn.fetchval("SELECT count(*) FROM messages WHERE sender_id = $1", sender)
+    return badge, messages
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    parser.add_argument("--badges", type=int, default=500)
+    parser.add_argument("--tasks", type=int, default=50)
+    parser.add_argument("--friends", type=int, default=20)
+    parser.add_argument("--pool-size", type=int, default=20)
+    args = parser.parse_args()
+
+    pool = await asyncpg.create_pool(args.dsn, min_size=args.pool_size, max_size=args.pool_size)
+    try:
+        async with pool.acquire() as conn:
+            await drop_bench_users(conn)
+            sender, receiver, *friends = await create_bench_users(conn, 2 + args.friends)
+
+        badge, messages = await hammer(pool, "legacy", legacy_send, sender, receiver, args)
+        if badge < 0 or messages > args.badges:
+            print(f"[legacy] overdraft: {messages - args.badges} 則訊息沒有扣到徽章")
+
+        badge, messages = await hammer(pool, "atomic", new_send, sender, receiver, args)
+        assert badge == 0 and messages == args.badges, "atomic send overdraft"
+
+        # nudge：每個 task 一次寄給所有好友
+        await reset(pool, sender, args.badges)
+        start = time.perf_counter()
+        rounds = 0
+
+        async def nudger():
+            nonlocal rounds
+            while True:
+                async with pool.acquire() as conn:
+                    results = await send_nudges(conn, sender, friends, "休息夠了，回來讀書")
+                rounds += 1
+                if not any(r["status"] == "sent" for r in results):
+                    return
+
+        await asyncio.gather(*(nudger() for _ in range(args.tasks)))
+        elapsed = time.perf_counter() - start
+        badge, messages = await balance(pool, sender)
+        print(f"[nudge] {rounds} bulk sends ({args.friends} receivers each) in {elapsed:.2f}s "
+              f"({messages / elapsed:,.0f} messages/s), messages={messages} badge_left={badge}")
+        assert badge == 0 and messages == args.badges, "nudge overdraft"
+    finally:
+        async with pool.acquire() as conn:
+            await drop_bench_users(conn)
+        await pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+"""
+JSON 序列化：列表型 API 的回應本體怎麼產生。
+
+  - 改版前：[dict(row) for row in rows] → jsonable_encoder → json.dumps (FastAPI 預設的 JSONResponse)
+            好友列表還會每列先建一個 FriendStatusResponse
+  - 改版後：asyncpg Record 直接交給 orjson (responses.dumps)
+
+資料從資料庫真的查出來 (deadline 列表用 DEADLINE_LIST_SQL)，只量序列化的 CPU 時間，不含查詢。
+    docker compose exec backend python -m benchmarks.bench_serialization --rows 1000
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import asyncpg
+from fastapi.encoders import jsonable_encoder
+
+from benchmarks._common import DATABASE_URL, create_bench_users, drop_bench_users, summarize
+from main import DEADLINE_LIST_SQL, FriendStatusResponse
+from responses import dumps
+
+
+def legacy_render(content) -> bytes:
+    # starlette JSONResponse.render 的寫法
+    return json.dumps(
+        jsonable_encoder(content), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def measure(label: str, fn, rounds: int):
+    samples = []
+    size = 0
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        size = len(fn())
+        samples.append((time.perf_counter() - t0) * 1000)
+    summarize(f"{label} ({size / 1024:.0f} KiB)", samples)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(args.dsn)
+    try:
+        await drop_bench_users(conn)
+        user_ids = await create_bench_users(conn, args.rows)
+        owner = user_ids[0]
+        await conn.execute("""
+            INSERT INTO deadlines (user_id, deadline_date, task, is_done, sort_key)
+            SELECT $1, current_date + (g % 30)::int, '讀書計畫 第 ' || g || ' 章', g % 4 = 0, 'a' || lpad(g::text, 6, '0') || 'V'
+            FROM generate_series(1, $2) AS g
+        """, owner, args.rows)
+        deadlines = await conn.fetch(DEADLINE_LIST_SQL, owner)
+        friends = await conn.fetch(
+            "SELECT user_id, name, is_studying FROM users WHERE user_id = ANY($1::int[])", user_ids,
+        )
+
+        print(f"=== deadline 列表 ({len(deadlines)} 筆) ===")
+        measure("dict + jsonable_encoder + json", lambda: legacy_render([dict(row) for row in deadlines]), args.rounds)
+        measure("Record + orjson", lambda: dumps(deadlines), args.rounds)
+
+        print(f"\n=== 好友狀態 ({len(friends)} 筆) ===")
+        measure("Pydantic model + jsonable_encoder + json", lambda: legacy_render([
+            FriendStatusResponse(friend_id=r["user_id"], name=r["name"], is_studying=r["is_studying"], current_timer=None)
+            for r in friends
+        ]), args.rounds)
+        measure("dict + orjson", lambda: dumps([
+            {"friend_id": r["user_id"], "name": r["name"], "is_studying": r["is_studying"], "current_timer": None}
+            for r in friends
+        ]), args.rounds)
+    finally:
+        await drop_bench_users(conn)
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,121 @@
+"""
+啟動時間：改版前每個 worker 啟動都執行整份 DDL (現在的 migrations/0001_baseline.py)，
+改版後只執行 verify_schema (讀一次 schema_migrations)。
+
+先產生一份有資料的資料庫 (deadlines / pictures / focus_time / messages)，
+模擬 N 個 worker 同時啟動，各自用一條連線執行啟動時的 DB 工作，列出全部完成的時間，
+同時量測一般查詢 (讀 deadlines) 在這段期間的延遲，看 DDL 的 lock 對線上流量的影響。
+    docker compose exec backend python -m benchmarks.bench_startup --users 2000 --workers 4
+"""
+import argparse
+import asyncio
+import time
+
+import asyncpg
+
+from benchmarks._common import DATABASE_URL, FOCUS_DAILY_BACKFILL_SQL, create_bench_users, drop_bench_users, summarize
+from migrate import MIGRATIONS_DIR, Migration, verify_schema
+
+BASELINE = Migration(1, "baseline", MIGRATIONS_DIR / "0001_baseline.py")
+
+
+async def seed(conn: asyncpg.Connection, user_ids, args):
+    started = time.perf_counter()
+    await conn.execute("""
+        INSERT INTO deadlines (user_id, deadline_date, task, is_done, sort_key)
+        SELECT u, current_date + (g % 30)::int, 'task ' || g, g % 4 = 0, 'a' || lpad(g::text, 6, '0') || 'V'
+        FROM unnest($1::int[]) AS u, generate_series(1, $2) AS g
+    """, user_ids, args.deadlines)
+    await conn.execute("""
+        INSERT INTO pictures (user_id, description, size_bytes, content_type, blob_key)
+        SELECT u, 'photo ' || g, 100000, 'image/jpeg', md5(u::text || '-' || g)
+        FROM unnest($1::int[]) AS u, generate_series(1, $2) AS g
+    """, user_ids, args.pictures)
+    await conn.execute("""
+        INSERT INTO focus_time (user_id, record_date, record_hour, focus_minutes)
+        SELECT u, d::date, h, 30
+        FROM unnest($1::int[]) AS u,
+             generate_series(current_date - 89, current_date, interval '1 day') AS d,
+             generate_series(9, 12) AS h
+    """, user_ids)
+    await conn.execute(FOCUS_DAILY_BACKFILL_SQL)
+    await conn.execute("""
+        INSERT INTO messages (sender_id, receiver_id, content, is_read)
+        SELECT u, u, '加油', g % 3 > 0
+        FROM unnest($1::int[]) AS u, generate_series(1, $2) AS g
+    """, user_ids, args.messages)
+    await conn.execute("ANALYZE")
+    print(f"產生資料完成 ({time.perf_counter() - started:.0f}s)")
+
+
+async def boot(dsn: str, label: str, work, workers: int, probe_user: int):
+    """N 條連線同時做 work；期間另一條連線一直讀 deadlines，量延遲。"""
+    conns = [await asyncpg.connect(dsn) for _ in range(workers)]
+    probe = await asyncpg.connect(dsn)
+    stop = asyncio.Event()
+    probe_ms = []
+    errors = []
+
+    async def probe_loop():
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            await probe.fetch("SELECT id FROM deadlines WHERE user_id = $1 ORDER BY sort_key LIMIT 50", probe_user)
+            probe_ms.append((time.perf_counter() - t0) * 1000)
+            await asyncio.sleep(0.005)
+
+    async def one(conn):
+        t0 = time.perf_counter()
+        try:
+            await work(conn)
+        except asyncpg.PostgresError as e:
+            # 多個 process 同時 CREATE OR REPLACE 同一個 function / trigger 會互相衝突
+            errors.append(f"{type(e).__name__}: {e}")
+        return (time.perf_counter() - t0) * 1000
+
+    try:
+        prober = asyncio.create_task(probe_loop())
+        t0 = time.perf_counter()
+        per_worker = await asyncio.gather(*(one(c) for c in conns))
+        total = (time.perf_counter() - t0) * 1000
+        stop.set()
+        await prober
+    finally:
+        for c in conns + [probe]:
+            await c.close()
+
+    print(f"[{label}] {workers} workers 全部完成: {total:.1f}ms "
+          f"(每個 worker: {', '.join(f'{ms:.1f}' for ms in per_worker)} ms), 失敗={len(errors)}")
+    for error in errors[:3]:
+        print(f"  {error}")
+    summarize(f"[{label}] 同時間的 deadline 查詢", probe_ms)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--deadlines", type=int, default=50, help="每個 user 幾筆")
+    parser.add_argument("--pictures", type=int, default=50, help="每個 user 幾筆 (只有 metadata)")
+    parser.add_argument("--messages", type=int, default=100, help="每個 user 幾筆")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(args.dsn)
+    try:
+        await drop_bench_users(conn)
+        user_ids = await create_bench_users(conn, args.users)
+        await seed(conn, user_ids, args)
+
+        async def legacy(c):
+            # 改版前的 startup()：每個 worker 都跑一次整份 DDL
+            await BASELINE.apply(c)
+
+        await boot(args.dsn, "DDL on every boot", legacy, args.workers, user_ids[0])
+        await boot(args.dsn, "verify_schema", verify_schema, args.workers, user_ids[0])
+    finally:
+        await drop_bench_users(conn)
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,124 @@
+"""
+比較兩種上傳方式的吞吐量與後端記憶體 (RSS)：
+  - base64: POST /camera/upload (JSON, image_base64)
+  - multipart: POST /camera/upload-file (multipart/form-data，分段寫入 blob store)
+
+RSS 是直接讀同一台機器上 uvicorn process 的 /proc/<pid>/status，
+所以要在 backend container 裡執行：
+    docker compose exec backend python -m benchmarks.bench_upload --size-mb 4 --count 40
+"""
+import argparse
+import asyncio
+import base64
+import os
+import time
+
+import asyncpg
+import httpx
+
+from blob_store import get_blob_store
+from benchmarks._common import API_URL, DATABASE_URL, create_bench_users, drop_bench_users
+
+
+def uvicorn_pids():
+    pids = []
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                cmdline = f.read()
+        except OSError:
+            continue
+        if b"uvicorn" in cmdline or b"multiprocessing" in cmdline:
+            pids.append(int(pid))
+    return pids
+
+
+def total_rss_mb(pids) -> float:
+    total_kb = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+        except OSError:
+            pass
+    return total_kb / 1024
+
+
+async def sample_rss(pids, stop: asyncio.Event, samples: list):
+    while not stop.is_set():
+        samples.append(total_rss_mb(pids))
+        await asyncio.sleep(0.05)
+
+
+async def run(mode: str, client: httpx.AsyncClient, user_id: int, payloads, concurrency: int):
+    pids = uvicorn_pids()
+    baseline = total_rss_mb(pids)
+    samples = []
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_rss(pids, stop, samples))
+    sem = asyncio.Semaphore(concurrency)
+
+    async def upload(data: bytes):
+        async with sem:
+            if mode == "base64":
+                resp = await client.post("/camera/upload", json={
+                    "user_id": user_id,
+                    "image_base64": "data:image/jpeg;base64," + base64.b64encode(data).decode(),
+                    "description": "bench",
+                })
+            else:
+                resp = await client.post("/camera/upload-file",
+                                         data={"user_id": str(user_id), "description": "bench"},
+                                         files={"file": ("photo.jpg", data, "image/jpeg")})
+            resp.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(upload(p) for p in payloads))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await sampler
+
+    total_mb = sum(len(p) for p in payloads) / 1024 / 1024
+    peak = max(samples) if samples else baseline
+    print(f"[{mode}] {len(payloads)} uploads, {total_mb:.1f} MB in {elapsed:.2f}s "
+          f"-> {total_mb / elapsed:.1f} MB/s, {len(payloads) / elapsed:.1f} req/s; "
+          f"RSS baseline={baseline:.0f}MB peak={peak:.0f}MB (+{peak - baseline:.0f}MB)")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api-url", default=API_URL)
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    parser.add_argument("--size-mb", type=float, default=4.0)
+    parser.add_argument("--count", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    size = int(args.size_mb * 1024 * 1024)
+    conn = await asyncpg.connect(args.dsn)
+    try:
+        await drop_bench_users(conn)
+        user_id, = await create_bench_users(conn, 1)
+        async with httpx.AsyncClient(base_url=args.api_url, timeout=120) as client:
+            for mode in ("base64", "multipart"):
+                # 每張內容都不同，避免被 dedupe 掉
+                payloads = [b"\xff\xd8\xff\xe0" + os.urandom(size) for _ in range(args.count)]
+                await run(mode, client, user_id, payloads, args.concurrency)
+    finally:
+        # 清掉 benchmark 產生的檔案 (內容是亂數，不會和真的照片共用 blob)
+        store = get_blob_store()
+        for key in await conn.fetchval("""
+            SELECT array_agg(DISTINCT p.blob_key) FROM pictures p JOIN users u USING (user_id)
+            WHERE u.name LIKE 'bench-%' AND p.blob_key IS NOT NULL
+        """) or []:
+            await store.delete(key)
+        await drop_bench_users(conn)
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
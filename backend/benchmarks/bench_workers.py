@@ -0,0 +1,194 @@
+"""
+多 worker 的 throughput：用 serve.py 分別以 1 / 2 / 4 / 8 個 worker 啟動 server，
+對主要的 API 壓測固定秒數，列出每種 worker 數的 RPS 與 p50 / p99。
+最後測一次 graceful drain：上傳照片上傳到一半時送 SIGTERM，上傳仍要成功。
+
+壓測 client 本身也會吃 CPU，所以分成多個 process 送 request (--client-procs)。
+在 backend container 裡執行 (server 開在另一個 port，不影響 8000 的開發 server)：
+    docker compose exec backend python -m benchmarks.bench_workers --workers 1 2 4 8 --duration 20
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import asyncpg
+import httpx
+
+from benchmarks._common import DATABASE_URL, create_bench_users, drop_bench_users, summarize
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def routes(user_id: int, friend_ids: str):
+    return [
+        ("GET", "/api/v1/user/record_status", {"params": {"user_id": user_id}}),
+        ("GET", "/api/v1/friends/status", {"params": {"ids": friend_ids}}),
+        ("GET", "/deadlines/get-deadlines", {"params": {"user_id": user_id}}),
+        ("GET", "/api/v1/messages/unread-count", {"params": {"user_id": user_id}}),
+        ("GET", "/api/v1/focus/stats/daily", {"params": {"user_id": user_id}}),
+        ("GET", "/pictures/list", {"params": {"user_id": user_id}}),
+        ("POST", "/user/heartbeat", {"json": {"user_id": user_id}}),
+        ("POST", "/focus/save", {"json": {"user_id": user_id, "duration_seconds": 60}}),
+    ]
+
+
+async def _client_loop(base_url: str, user_ids, duration: float, concurrency: int):
+    friend_ids = ",".join(map(str, user_ids[:50]))
+    samples = {}
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            method, path, kwargs = random.choice(routes(random.choice(user_ids), friend_ids))
+            t0 = time.perf_counter()
+            try:
+                resp = await client.request(method, path, **kwargs)
+                ok = resp.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            samples.setdefault(path, []).append((time.perf_counter() - t0) * 1000)
+            errors += not ok
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=30, limits=limits) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    return samples, errors
+
+
+def _client_process(args):
+    return asyncio.run(_client_loop(*args))
+
+
+def start_server(workers: int, port: int) -> subprocess.Popen:
+    proc = subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", str(workers), "--port", str(port)],
+        cwd=BACKEND_DIR, env={**os.environ}, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/", timeout=1).status_code == 200:
+                time.sleep(1)  # 等其他 worker 也啟動完成
+                return proc
+        except httpx.HTTPError:
+            pass
+        if proc.poll() is not None:
+            raise RuntimeError(f"serve.py 結束了 (exit code {proc.returncode})")
+        time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("server 沒有在 60 秒內啟動")
+
+
+def stop_server(proc: subprocess.Popen):
+    proc.send_signal(signal.SIGTERM)
+    try:
+        proc.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def run_load(workers: int, user_ids, args):
+    proc = start_server(workers, args.port)
+    try:
+        per_proc = max(1, args.concurrency // args.client_procs)
+        jobs = [(f"http://127.0.0.1:{args.port}", user_ids, args.duration, per_proc)] * args.client_procs
+        t0 = time.perf_counter()
+        with multiprocessing.get_context("spawn").Pool(args.client_procs) as pool:
+            results = pool.map(_client_process, jobs)
+        elapsed = time.perf_counter() - t0
+    finally:
+        stop_server(proc)
+
+    merged = {}
+    errors = 0
+    for samples, errs in results:
+        errors += errs
+        for path, values in samples.items():
+            merged.setdefault(path, []).extend(values)
+    everything = [v for values in merged.values() for v in values]
+    print(f"\n=== {workers} worker(s): {len(everything) / elapsed:,.0f} req/s, errors={errors} ===")
+    summarize("all routes", everything)
+    if args.per_route:
+        for path, values in sorted(merged.items()):
+            summarize(f"  {path}", values)
+
+
+async def drain_test(user_id: int, args):
+    """上傳到一半時對 server 送 SIGTERM：進行中的上傳要成功，之後的新連線要被拒絕。"""
+    proc = start_server(2, args.port)
+    started = asyncio.Event()
+
+    async def slow_body():
+        # multipart 本體分成 20 段，每段隔 0.1 秒送出，總共約 2 秒
+        boundary = b"benchdrain"
+        yield b"--" + boundary + b'\r\nContent-Disposition: form-data; name="user_id"\r\n\r\n' + str(user_id).encode() + b"\r\n"
+        yield b"--" + boundary + b'\r\nContent-Disposition: form-data; name="file"; filename="a.jpg"\r\nContent-Type: image/jpeg\r\n\r\n'
+        started.set()
+        for _ in range(20):
+            yield os.urandom(64 * 1024)
+            await asyncio.sleep(0.1)
+        yield b"\r\n--" + boundary + b"--\r\n"
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=60) as client:
+        upload = asyncio.create_task(client.post(
+            "/camera/upload-file", content=slow_body(),
+            headers={"Content-Type": "multipart/form-data; boundary=benchdrain"},
+        ))
+        await started.wait()
+        await asyncio.sleep(0.3)
+        t0 = time.perf_counter()
+        proc.send_signal(signal.SIGTERM)
+        resp = await upload
+        print(f"\n=== graceful drain: SIGTERM 後進行中的上傳回應 {resp.status_code} "
+              f"({(time.perf_counter() - t0) * 1000:.0f}ms 後) ===")
+    await asyncio.get_running_loop().run_in_executor(None, proc.wait, 60)
+    print(f"server 結束 (exit code {proc.returncode})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--client-procs", type=int, default=4)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--per-route", action="store_true", help="列出每個 API 的延遲")
+    args = parser.parse_args()
+
+    async def setup():
+        conn = await asyncpg.connect(args.dsn)
+        try:
+            await drop_bench_users(conn)
+            return await create_bench_users(conn, args.users, badge=1000)
+        finally:
+            await conn.close()
+
+    async def teardown():
+        conn = await asyncpg.connect(args.dsn)
+        try:
+            await drop_bench_users(conn)
+        finally:
+            await conn.close()
+
+    user_ids = asyncio.run(setup())
+    try:
+        for workers in args.workers:
+            run_load(workers, user_ids, args)
+        asyncio.run(drain_test(user_ids[0], args))
+    finally:
+        asyncio.run(teardown())
+
+
+if __name__ == "__main__":
+    main()
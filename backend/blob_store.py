@@ -0,0 +1,167 @@
+"""
+圖片檔案存放 (content-addressed blob store)
+
+檔案以內容的 sha256 當 key，相同的圖片只會存一份。
+BlobStore 是介面，目前只有本機資料夾的實作 (docker compose 掛載的 ./uploads)，
+之後要換成 S3 相容的儲存，只要另外實作 BlobStore 並在 get_blob_store() 選用即可。
+"""
+import abc
+import hashlib
+import os
+import tempfile
+from typing import AsyncIterator, BinaryIO, Optional
+
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+BLOB_STORE_DIR = os.environ.get("BLOB_STORE_DIR", "uploads/pictures")
+CHUNK_SIZE = 256 * 1024
+
+
+class BlobStore(abc.ABC):
+    """存放不可變檔案的介面，key 一律是內容的 sha256 hex。"""
+
+    @abc.abstractmethod
+    async def put_stream(self, src: BinaryIO) -> tuple[str, int]:
+        """從檔案物件分段讀取並存入，回傳 (key, size)。"""
+
+    @abc.abstractmethod
+    async def put_bytes(self, data: bytes) -> tuple[str, int]:
+        ...
+
+    @abc.abstractmethod
+    async def exists(self, key: str) -> bool:
+        ...
+
+    @abc.abstractmethod
+    async def size(self, key: str) -> Optional[int]:
+        ...
+
+    @abc.abstractmethod
+    def iter_chunks(self, key: str, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+        ...
+
+    @abc.abstractmethod
+    async def read(self, key: str) -> bytes:
+        ...
+
+    @abc.abstractmethod
+    async def read_head(self, key: str, n: int = 16) -> bytes:
+        """讀前 n bytes，用來判斷檔案格式。"""
+
+    @abc.abstractmethod
+    async def delete(self, key: str):
+        """呼叫端要自己確認沒有其他 pictures 還指向這個 key。"""
+
+
+class LocalBlobStore(BlobStore):
+    """存在本機資料夾：<root>/ab/cd/abcd...，先寫暫存檔再 rename，寫到一半不會留下壞檔。"""
+
+    def __init__(self, root: str = BLOB_STORE_DIR):
+        self.root = root
+        self._tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self._tmp_dir, exist_ok=True)
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    async def put_stream(self, src: BinaryIO) -> tuple[str, int]:
+        return await run_in_threadpool(self._put_stream_sync, src)
+
+    async def put_bytes(self, data: bytes) -> tuple[str, int]:
+        return await run_in_threadpool(self._put_bytes_sync, data)
+
+    async def exists(self, key: str) -> bool:
+        return await run_in_threadpool(os.path.exists, self.path_for(key))
+
+    async def size(self, key: str) -> Optional[int]:
+        try:
+            return (await run_in_threadpool(os.stat, self.path_for(key))).st_size
+        except FileNotFoundError:
+            return None
+
+    def iter_chunks(self, key: str, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+        return iterate_in_threadpool(self._iter_chunks_sync(key, chunk_size))
+
+    async def read(self, key: str) -> bytes:
+        return await run_in_threadpool(self._read_sync, key)
+
+    async def read_head(self, key: str, n: int = 16) -> bytes:
+        return await run_in_threadpool(self._read_sync, key, n)
+
+    async def delete(self, key: str):
+        try:
+            await run_in_threadpool(os.remove, self.path_for(key))
+        except FileNotFoundError:
+            pass
+
+    def _put_stream_sync(self, src: BinaryIO) -> tuple[str, int]:
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as dst:
+                while True:
+                    chunk = src.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    dst.write(chunk)
+                    size += len(chunk)
+            key = digest.hexdigest()
+            self._commit(tmp_path, key)
+            return key, size
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _put_bytes_sync(self, data: bytes) -> tuple[str, int]:
+        key = hashlib.sha256(data).hexdigest()
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            fd, tmp_path = tempfile.mkstemp(dir=self._tmp_dir)
+            try:
+                with os.fdopen(fd, "wb") as dst:
+                    dst.write(data)
+                self._commit(tmp_path, key)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return key, len(data)
+
+    def _commit(self, tmp_path: str, key: str):
+        path = self.path_for(key)
+        if os.path.exists(path):
+            # 已經有一樣內容的檔案 (dedupe)，暫存檔交給呼叫端刪掉
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+
+    def _iter_chunks_sync(self, key: str, chunk_size: int):
+        with open(self.path_for(key), "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def _read_sync(self, key: str, n: int = -1) -> bytes:
+        with open(self.path_for(key), "rb") as f:
+            return f.read(n)
+
+
+def sniff_image_type(head: bytes) -> str:
+    """用檔頭判斷圖片格式 (相機預設是 JPEG)。"""
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return "image/jpeg"
+
+
+def get_blob_store() -> BlobStore:
+    backend = os.environ.get("BLOB_STORE", "local")
+    if backend == "local":
+        return LocalBlobStore()
+    raise ValueError(f"Unknown BLOB_STORE: {backend}")
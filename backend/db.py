@@ -0,0 +1,145 @@
+"""
+asyncpg 連線池：設定從環境變數讀，並記錄 metrics (見 metrics.py)
+
+  DATABASE_URL               連線字串 (docker compose 有設)
+  DB_POOL_MIN_SIZE           預設 2
+  DB_POOL_MAX_SIZE           預設 20
+  DB_ACQUIRE_TIMEOUT         等不到連線幾秒後放棄 (回 503)，預設 5
+  DB_COMMAND_TIMEOUT         單一查詢的上限秒數，預設 30
+  DB_STATEMENT_CACHE_SIZE    每條連線快取幾個 prepared statement，預設 512；
+                             前面有 pgbouncer (transaction mode) 時要設成 0
+  DB_MAX_QUERIES             一條連線執行幾次查詢後換新的，預設 50000
+  DB_MAX_INACTIVE_LIFETIME   閒置幾秒的連線會被關掉，預設 300
+
+asyncpg 會把查詢字串當 key 快取 prepared statement，同一條連線再執行同一段 SQL
+就不用重新 parse / plan。所以常用的查詢都寫成模組層級的常數 (字串固定)，
+並用 named_query() 取名字，metrics 的 db_query_duration_seconds 才有可讀的 label。
+"""
+import asyncio
+import os
+import time
+from typing import Dict
+
+import asyncpg
+from fastapi import HTTPException
+
+import profiling
+from metrics import Counter, Gauge, Histogram
+
+DATABASE_URL = os.environ.get("DATABASE_URL", "postgresql://postgres:password@db:5432/focusmate")
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "20"))
+DB_ACQUIRE_TIMEOUT = float(os.environ.get("DB_ACQUIRE_TIMEOUT", "5"))
+DB_COMMAND_TIMEOUT = float(os.environ.get("DB_COMMAND_TIMEOUT", "30"))
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", "512"))
+DB_MAX_QUERIES = int(os.environ.get("DB_MAX_QUERIES", "50000"))
+DB_MAX_INACTIVE_LIFETIME = float(os.environ.get("DB_MAX_INACTIVE_LIFETIME", "300"))
+
+# SQL 字串 -> 名字 (metrics 的 label)
+QUERY_NAMES: Dict[str, str] = {}
+
+
+def named_query(name: str, sql: str) -> str:
+    """登記常用查詢的名字，回傳原本的 SQL。沒登記的查詢在 metrics 裡算 "other"。"""
+    QUERY_NAMES[sql] = name
+    return sql
+
+
+ACQUIRE_WAIT = Histogram("db_pool_acquire_wait_seconds", "Time spent waiting for a pooled connection", ["pool"])
+ACQUIRE_TIMEOUTS = Counter("db_pool_acquire_timeouts_total", "Acquires that gave up after DB_ACQUIRE_TIMEOUT", ["pool"])
+QUERY_DURATION = Histogram("db_query_duration_seconds", "Query latency as seen by asyncpg", ["query"])
+QUERY_ERRORS = Counter("db_query_errors_total", "Queries that raised", ["query"])
+
+_pools: Dict[str, "InstrumentedPool"] = {}
+
+
+def _pool_connections():
+    values = {}
+    for name, pool in _pools.items():
+        size, idle = pool.get_size(), pool.get_idle_size()
+        values[(name, "in_use")] = size - idle
+        values[(name, "idle")] = idle
+        values[(name, "max")] = pool.get_max_size()
+    return values
+
+
+Gauge("db_pool_connections", "Pool connections by state", ["pool", "state"], callback=_pool_connections)
+
+
+def _log_query(record):
+    name = QUERY_NAMES.get(record.query, "other")
+    QUERY_DURATION.observe(record.elapsed, name)
+    if record.exception is not None:
+        QUERY_ERRORS.inc(name)
+    # 算進目前 request 的 DB 時間；太慢的留下來給 /debug/slow-queries
+    profiling.record_query(name, record.query, record.args, record.elapsed, record.exception)
+
+
+async def _init_connection(conn: asyncpg.Connection):
+    conn.add_query_logger(_log_query)
+
+
+class _Acquire:
+    """和 asyncpg 的 pool.acquire() 一樣可以 `async with` 也可以 `await`，多記錄等待時間。"""
+
+    def __init__(self, pool: "InstrumentedPool", timeout: float):
+        self.pool = pool
+        self.timeout = timeout
+        self.conn = None
+
+    async def _acquire(self) -> asyncpg.Connection:
+        started = time.perf_counter()
+        try:
+            return await self.pool.raw.acquire(timeout=self.timeout)
+        except asyncio.TimeoutError:
+            ACQUIRE_TIMEOUTS.inc(self.pool.name)
+            raise HTTPException(status_code=503, detail="資料庫忙碌中，請稍後再試", headers={"Retry-After": "1"})
+        finally:
+            waited = time.perf_counter() - started
+            ACQUIRE_WAIT.observe(waited, self.pool.name)
+            profiling.record_pool_wait(waited)
+
+    def __await__(self):
+        return self._acquire().__await__()
+
+    async def __aenter__(self) -> asyncpg.Connection:
+        self.conn = await self._acquire()
+        return self.conn
+
+    async def __aexit__(self, *exc):
+        conn, self.conn = self.conn, None
+        await self.pool.raw.release(conn)
+
+
+class InstrumentedPool:
+    """包住 asyncpg.Pool：acquire() 會記錄等待時間，其他方法 (release / close / get_size ...) 直接轉給原本的 pool。"""
+
+    def __init__(self, raw: asyncpg.Pool, name: str = "primary"):
+        self.raw = raw
+        self.name = name
+        _pools[name] = self
+
+    def acquire(self, *, timeout: float = DB_ACQUIRE_TIMEOUT) -> _Acquire:
+        return _Acquire(self, timeout)
+
+    async def close(self):
+        _pools.pop(self.name, None)
+        await self.raw.close()
+
+    def __getattr__(self, attr):
+        return getattr(self.raw, attr)
+
+
+async def create_pool(dsn: str = DATABASE_URL, name: str = "primary", **overrides) -> InstrumentedPool:
+    options = dict(
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        command_timeout=DB_COMMAND_TIMEOUT,
+        statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+        max_queries=DB_MAX_QUERIES,
+        max_inactive_connection_lifetime=DB_MAX_INACTIVE_LIFETIME,
+        init=_init_connection,
+    )
+    options.update(overrides)
+    raw = await asyncpg.create_pool(dsn, **options)
+    return InstrumentedPool(raw, name)
@@ -0,0 +1,117 @@
+"""
+照片縮圖 / 多解析度版本 (derivatives)
+
+「我的紀錄」的照片牆只需要小圖，不用每次都傳相機原圖。
+縮圖在 ProcessPoolExecutor 裡用 Pillow 產生，不會卡住 asyncio event loop；
+產生好的檔案存進 blob store，對應關係記在 picture_derivatives 表 (migrations/0001_baseline.py)，之後直接讀。
+"""
+import asyncio
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from blob_store import BlobStore
+
+# 尺寸名稱 -> 長邊像素
+IMAGE_VARIANTS = {
+    "thumb": 256,
+    "small": 640,
+    "large": 1280,
+}
+
+# 格式名稱 -> (Pillow format, Content-Type, 編碼參數)
+IMAGE_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 80, "optimize": True, "progressive": True}),
+    "webp": ("WEBP", "image/webp", {"quality": 75, "method": 4}),
+}
+
+class UndecodableImage(ValueError):
+    """來源不是 Pillow 解得開的圖片 (上傳了別的檔案、檔案壞掉)，沒辦法產生縮圖。"""
+
+
+def render_derivative(data: bytes, max_side: int, fmt: str) -> bytes:
+    """在 worker process 裡執行：縮到長邊 max_side (不放大) 並重新編碼。"""
+    pil_format, _, options = IMAGE_FORMATS[fmt]
+    with Image.open(io.BytesIO(data)) as im:
+        if im.format == "JPEG":
+            # JPEG 可以在解碼時直接用 DCT 縮小，大圖快很多
+            im.draft("RGB", (max_side, max_side))
+        im = ImageOps.exif_transpose(im)
+        im.thumbnail((max_side, max_side), Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+        if pil_format == "JPEG" and im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        elif im.mode not in ("RGB", "RGBA", "L"):
+            im = im.convert("RGBA")
+
+        out = io.BytesIO()
+        im.save(out, pil_format, **options)
+        return out.getvalue()
+
+
+class ImagePipeline:
+    """產生並快取 derivatives；同一張圖同一個尺寸同時被要求時只算一次。"""
+
+    def __init__(self, db_pool, blob_store: BlobStore, workers: Optional[int] = None):
+        self.db_pool = db_pool
+        self.blob_store = blob_store
+        workers = workers or int(os.environ.get("IMAGE_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+        # 用 spawn，不要 fork 已經在跑 event loop / DB 連線的 process
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        self._inflight: Dict[Tuple[str, str, str], asyncio.Task] = {}
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def get_derivative(
+        self,
+        source_key: str,
+        load_source: Callable[[], Awaitable[bytes]],
+        variant: str,
+        fmt: str,
+        cached: Optional[dict] = None,
+    ) -> dict:
+        """
+        回傳 {blob_key, size_bytes, content_type}。
+        cached: 呼叫端已經 JOIN 查到的 picture_derivatives 資料，有的話就不再查 DB。
+        """
+        if cached:
+            return cached
+
+        key = (source_key, variant, fmt)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._lookup_or_render(source_key, load_source, variant, fmt))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _lookup_or_render(self, source_key, load_source, variant, fmt) -> dict:
+        async with self.db_pool.acquire() as conn:
+            row = await conn.fetchrow("""
+                SELECT blob_key, size_bytes, content_type FROM picture_derivatives
+                WHERE source_key = $1 AND variant = $2 AND format = $3
+            """, source_key, variant, fmt)
+        if row:
+            return dict(row)
+
+        data = await load_source()
+        loop = asyncio.get_running_loop()
+        try:
+            out = await loop.run_in_executor(self.executor, render_derivative, data, IMAGE_VARIANTS[variant], fmt)
+        except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+            raise UndecodableImage(f"{source_key}: {e}") from e
+        blob_key, size = await self.blob_store.put_bytes(out)
+        content_type = IMAGE_FORMATS[fmt][1]
+
+        async with self.db_pool.acquire() as conn:
+            await conn.execute("""
+                INSERT INTO picture_derivatives (source_key, variant, format, blob_key, size_bytes, content_type)
+                VALUES ($1, $2, $3, $4, $5, $6)
+                ON CONFLICT DO NOTHING
+            """, source_key, variant, fmt, blob_key, size, content_type)
+        return {"blob_key": blob_key, "size_bytes": size, "content_type": content_type}
@@ -0,0 +1,257 @@
+"""
+背景工作佇列 (存在 Postgres 的 jobs 表，schema 見 migrations/0001_baseline.py)
+
+request handler 只要把工作 enqueue (可以和原本的寫入放在同一個 transaction，
+commit 了工作才會出現) 就能馬上回應，比較重的事交給背景 worker：
+  - 每個 uvicorn process 開 JOB_WORKERS 個 worker task，用 FOR UPDATE SKIP LOCKED 搶工作，
+    多個 process 同時跑也不會重複拿到同一筆
+  - enqueue 時 NOTIFY jobs 叫醒 worker，沒收到通知也會每 JOB_POLL_SECONDS 秒檢查一次
+  - 失敗會依 attempts 指數退避重試，超過 max_attempts 標成 failed
+  - worker 當掉時，running 超過 JOB_LEASE_SECONDS 的工作會被別的 worker 重新拿走，
+    所以 handler 要能重複執行 (idempotent)
+  - idempotency_key：同一個 key 同時只會有一筆「還沒開始」的工作，重複 enqueue 會合併
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import deque
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+import asyncpg
+
+from db import named_query
+from metrics import Counter, Histogram
+
+JOBS_CHANNEL = "jobs"
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", "1.0"))
+JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", "300"))
+JOB_RETENTION_HOURS = int(os.environ.get("JOB_RETENTION_HOURS", "24"))
+JOB_MAX_ATTEMPTS = 5
+
+ENQUEUE_SQL = named_query("jobs.enqueue", """
+    WITH queued AS (
+        INSERT INTO jobs (kind, payload, idempotency_key, max_attempts, run_at)
+        SELECT t.kind, t.payload, t.idempotency_key, $4, now() + make_interval(secs => $5)
+        FROM unnest($1::text[], $2::jsonb[], $3::text[]) AS t(kind, payload, idempotency_key)
+        ON CONFLICT (idempotency_key) WHERE status = 'queued' DO NOTHING
+        RETURNING id
+    )
+    SELECT id, pg_notify('""" + JOBS_CHANNEL + """', '') FROM queued
+""")
+
+# 同時也把 lease 過期 (worker 當掉) 的 running 工作拿回來
+CLAIM_SQL = named_query("jobs.claim", """
+    UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = now(), finished_at = NULL
+    WHERE id = (
+        SELECT id FROM jobs
+        WHERE (status = 'queued' AND run_at <= now())
+           OR (status = 'running' AND started_at < now() - make_interval(secs => $1))
+        ORDER BY run_at, id
+        FOR UPDATE SKIP LOCKED
+        LIMIT 1
+    )
+    RETURNING id, kind, payload, attempts, max_attempts, created_at
+""")
+
+# 失敗重試：放回佇列 (backoff 之後再跑)，超過次數標成 failed
+FAIL_SQL = named_query("jobs.fail", """
+    UPDATE jobs
+    SET status = CASE
+            WHEN NOT $2 THEN 'failed'
+            -- 已經有同一個 key 的新工作在排隊：交給它做，這筆就結束
+            WHEN idempotency_key IS NOT NULL AND EXISTS (
+                SELECT 1 FROM jobs j WHERE j.idempotency_key = jobs.idempotency_key AND j.status = 'queued'
+            ) THEN 'done'
+            ELSE 'queued'
+        END,
+        run_at = now() + make_interval(secs => $3),
+        finished_at = now(),
+        last_error = $4
+    WHERE id = $1
+""")
+
+# 上面的 EXISTS 檢查之後才有同一個 key 的工作排進來時，放回佇列會違反 idx_jobs_idempotency：一樣交給新的那筆
+FAIL_MERGED_SQL = named_query("jobs.fail_merged", """
+    UPDATE jobs SET status = 'done', finished_at = now(), last_error = $2
+    WHERE id = $1
+""")
+
+JOBS_PROCESSED = Counter("jobs_processed_total", "Jobs finished by this process", ["kind", "result"])
+JOB_QUEUE_WAIT = Histogram("job_queue_wait_seconds", "Time from enqueue to start", ["kind"],
+                           buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300))
+JOB_RUN = Histogram("job_run_seconds", "Handler run time", ["kind"])
+
+Handler = Callable[[dict], Awaitable[None]]
+Job = Tuple[str, dict, Optional[str]]  # (kind, payload, idempotency_key)
+
+
+async def enqueue(conn: asyncpg.Connection, kind: str, payload: dict, key: Optional[str] = None,
+                  delay: float = 0, max_attempts: int = JOB_MAX_ATTEMPTS) -> Optional[int]:
+    """回傳 job id；同一個 key 已經有排隊中的工作時回傳 None。"""
+    ids = await enqueue_many(conn, [(kind, payload, key)], delay, max_attempts)
+    return ids[0] if ids else None
+
+
+async def enqueue_many(conn: asyncpg.Connection, jobs: Iterable[Job], delay: float = 0,
+                       max_attempts: int = JOB_MAX_ATTEMPTS) -> list:
+    """一個 INSERT 寫入多筆工作。在呼叫端的 transaction 裡執行，commit 後 worker 才看得到。"""
+    jobs = list(jobs)
+    if not jobs:
+        return []
+    rows = await conn.fetch(
+        ENQUEUE_SQL,
+        [kind for kind, _, _ in jobs],
+        [json.dumps(payload) for _, payload, _ in jobs],
+        [key for _, _, key in jobs],
+        max_attempts,
+        float(delay),
+    )
+    return [row["id"] for row in rows]
+
+
+class JobQueue:
+    def __init__(self, pool: asyncpg.Pool, workers: int = JOB_WORKERS):
+        self.pool = pool
+        self.workers = workers
+        self.node_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._handlers: Dict[str, Handler] = {}
+        self._tasks = []
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        # 這個 process 的統計 (給 metrics 用)
+        self.counters = {"succeeded": 0, "retried": 0, "failed": 0}
+        self.latencies = deque(maxlen=1000)  # (kind, 排隊秒數, 執行秒數)
+
+    def register(self, kind: str, handler: Handler):
+        self._handlers[kind] = handler
+
+    async def start(self, hub):
+        self._stopping = False
+        await hub.add_channel_listener(JOBS_CHANNEL, self._on_notify)
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(loop.create_task(self._cleanup_loop()))
+
+    async def stop(self):
+        """不再拿新工作；正在執行的工作做完才結束。"""
+        self._stopping = True
+        self._wakeup.set()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _on_notify(self, conn, pid, channel, payload):
+        self._wakeup.set()
+
+    async def _worker(self):
+        while not self._stopping:
+            try:
+                job = await self._claim()
+            except Exception as e:
+                print(f"job 取得失敗: {e}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run(job)
+            except Exception as e:
+                # 結果沒寫回去的話，lease 過期後會再被拿出來執行
+                print(f"job {job['id']} 狀態更新失敗: {e}")
+
+    async def _claim(self) -> Optional[asyncpg.Record]:
+        async with self.pool.acquire() as conn:
+            return await conn.fetchrow(CLAIM_SQL, float(JOB_LEASE_SECONDS))
+
+    async def _run(self, job: asyncpg.Record):
+        handler = self._handlers.get(job["kind"])
+        started = time.time()
+        try:
+            if handler is None:
+                raise RuntimeError(f"沒有註冊 {job['kind']} 的 handler")
+            await handler(json.loads(job["payload"]))
+        except Exception as e:
+            await self._fail(job, e)
+            return
+
+        async with self.pool.acquire() as conn:
+            await conn.execute("""
+                UPDATE jobs SET status = 'done', finished_at = now(), last_error = NULL WHERE id = $1
+            """, job["id"])
+        self.counters["succeeded"] += 1
+        waited, ran = started - job["created_at"].timestamp(), time.time() - started
+        self.latencies.append((job["kind"], waited, ran))
+        JOBS_PROCESSED.inc(job["kind"], "succeeded")
+        JOB_QUEUE_WAIT.observe(max(0.0, waited), job["kind"])
+        JOB_RUN.observe(ran, job["kind"])
+
+    async def _fail(self, job: asyncpg.Record, error: Exception):
+        retry = job["attempts"] < job["max_attempts"]
+        backoff = min(2 ** job["attempts"], 300)
+        last_error = f"{type(error).__name__}: {error}"
+        async with self.pool.acquire() as conn:
+            try:
+                await conn.execute(FAIL_SQL, job["id"], retry, float(backoff), last_error)
+            except asyncpg.UniqueViolationError:
+                await conn.execute(FAIL_MERGED_SQL, job["id"], last_error)
+        self.counters["retried" if retry else "failed"] += 1
+        JOBS_PROCESSED.inc(job["kind"], "retried" if retry else "failed")
+        print(f"job {job['id']} ({job['kind']}) 失敗 (第 {job['attempts']} 次): {error}")
+
+    async def _cleanup_loop(self):
+        # 定期清掉完成很久的工作；failed 的留著查原因
+        while not self._stopping:
+            try:
+                async with self.pool.acquire() as conn:
+                    await conn.execute("""
+                        DELETE FROM jobs
+                        WHERE status = 'done' AND finished_at < now() - make_interval(hours => $1)
+                    """, JOB_RETENTION_HOURS)
+            except Exception as e:
+                print(f"jobs 清理失敗: {e}")
+            for _ in range(600):
+                if self._stopping:
+                    return
+                await asyncio.sleep(1)
+
+    async def metrics(self) -> dict:
+        """佇列深度 (全部 process 共用，查 DB) + 這個 process 的成功/失敗數與延遲。"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT kind, status, count(*) AS count,
+                       EXTRACT(EPOCH FROM now() - min(run_at)) AS oldest_seconds
+                FROM jobs
+                WHERE status IN ('queued', 'running', 'failed')
+                GROUP BY kind, status
+            """)
+
+        depth = {}
+        for row in rows:
+            entry = depth.setdefault(row["kind"], {})
+            entry[row["status"]] = row["count"]
+            if row["status"] == "queued":
+                entry["oldest_queued_seconds"] = max(0.0, float(row["oldest_seconds"]))
+
+        latency = {}
+        for kind in {k for k, _, _ in self.latencies}:
+            waits = sorted(w for k, w, _ in self.latencies if k == kind)
+            runs = sorted(r for k, _, r in self.latencies if k == kind)
+            latency[kind] = {
+                "samples": len(waits),
+                "queue_p50_ms": _percentile(waits, 0.5) * 1000,
+                "queue_p95_ms": _percentile(waits, 0.95) * 1000,
+                "run_p50_ms": _percentile(runs, 0.5) * 1000,
+                "run_p95_ms": _percentile(runs, 0.95) * 1000,
+            }
+        return {"node": self.node_id, "workers": self.workers, "depth": depth,
+                "counters": dict(self.counters), "latency": latency}
+
+
+def _percentile(sorted_values, q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
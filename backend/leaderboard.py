@@ -0,0 +1,255 @@
+"""
+好友專注排行榜 (今天 / 這週)
+
+以前要排好友的名次得把每個好友這週的 focus_time (每小時一列) 加總；現在：
+  - focus_totals 存每個 user 每天 / 每週的總分鐘數 (migrations/0006)，
+    save_focus_sessions 寫 focus_time 的同一個 statement 就把實際增加的分鐘數累加上去 (見 main.FOCUS_UPSERT_SQL)
+  - focus.rollup 背景 job 重算 focus_daily 時順便用 reconcile_totals() 對一次帳 (同一小時的上限、併發寫入造成的誤差)
+  - 排行榜 = 好友列表 + 每個人的總數，兩者都快取在記憶體 (最多 LEADERBOARD_CACHE_SECONDS 秒)；
+    寫入後 invalidate() 清掉相關的項目，再由背景 task 每 LEADERBOARD_PUBLISH_SECONDS 秒
+    合併成幾個 NOTIFY 通知其他 worker (request 不用多等一次 DB)
+  - 名次在 Python 算：500 個好友也只是 500 次 dict 查詢，快取命中時不碰 DB
+
+  LEADERBOARD_CACHE_SECONDS       快取的上限秒數，預設 60 (載入和寫入同時發生時最多舊這麼久)
+  LEADERBOARD_RETENTION_WEEKS     focus_totals 保留幾週，預設 8
+  LEADERBOARD_PUBLISH_SECONDS     多久通知其他 worker 一次，預設 1 (其他 worker 最多晚這麼久看到寫入)
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import asyncpg
+
+from db import named_query
+from metrics import Counter
+from presence import BROADCAST_BATCH, BROADCAST_SQL
+
+LEADERBOARD_CHANNEL = "leaderboard"
+LEADERBOARD_CACHE_SECONDS = float(os.environ.get("LEADERBOARD_CACHE_SECONDS", "60"))
+LEADERBOARD_RETENTION_WEEKS = int(os.environ.get("LEADERBOARD_RETENTION_WEEKS", "8"))
+LEADERBOARD_PUBLISH_SECONDS = float(os.environ.get("LEADERBOARD_PUBLISH_SECONDS", "1.0"))
+LEADERBOARD_PURGE_SECONDS = 3600
+
+TOTALS_SQL = named_query("leaderboard.totals", """
+    SELECT user_id, focus_minutes FROM focus_totals
+    WHERE period = $1 AND period_start = $2 AND user_id = ANY($3::int[])
+""")
+
+FRIEND_IDS_SQL = named_query("leaderboard.friend_ids", """
+    SELECT friend_id FROM friends WHERE user_id = $1
+""")
+
+# 從 focus_time 重算某一天和那一週的總數，有變才寫 (RETURNING 有列就要 invalidate)
+RECONCILE_SQL = named_query("leaderboard.reconcile", """
+    WITH sums AS (
+        SELECT COALESCE(SUM(focus_minutes) FILTER (WHERE record_date = $2), 0) AS day_minutes,
+               COALESCE(SUM(focus_minutes), 0) AS week_minutes
+        FROM focus_time
+        WHERE user_id = $1 AND record_date >= $3 AND record_date < $3 + 7
+    )
+    INSERT INTO focus_totals (period, period_start, user_id, focus_minutes)
+    SELECT 'day', $2, $1, day_minutes FROM sums
+    UNION ALL
+    SELECT 'week', $3, $1, week_minutes FROM sums
+    ON CONFLICT (period, period_start, user_id)
+    DO UPDATE SET focus_minutes = EXCLUDED.focus_minutes
+    WHERE focus_totals.focus_minutes <> EXCLUDED.focus_minutes
+    RETURNING period
+""")
+
+PURGE_SQL = named_query("leaderboard.purge", """
+    DELETE FROM focus_totals WHERE period_start < $1
+""")
+
+CACHE_LOOKUPS = Counter("leaderboard_cache_lookups_total", "Leaderboard cache lookups", ["kind", "result"])
+
+
+def period_start(period: str, day: date) -> date:
+    """day 所在的那一天 / 那一週 (週一開始，同 date_trunc('week'))。"""
+    if period == "day":
+        return day
+    return day - timedelta(days=day.weekday())
+
+
+async def reconcile_totals(conn: asyncpg.Connection, user_id: int, day: date) -> bool:
+    """focus.rollup job 呼叫；回傳 focus_totals 有沒有被修正。"""
+    rows = await conn.fetch(RECONCILE_SQL, user_id, day, period_start("week", day))
+    return bool(rows)
+
+
+class Leaderboard:
+    def __init__(self, pool: asyncpg.Pool, ttl: float = LEADERBOARD_CACHE_SECONDS,
+                 publish_interval: float = LEADERBOARD_PUBLISH_SECONDS):
+        self.pool = pool
+        self.ttl = ttl
+        self.publish_interval = publish_interval
+        self.node_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        # (period, period_start) -> user_id -> (expires_at, minutes)；只留目前這一天 / 這一週
+        self._totals: Dict[Tuple[str, date], Dict[int, Tuple[float, int]]] = {}
+        self._friends: Dict[int, Tuple[float, List[int]]] = {}
+        # 還沒通知其他 worker 的 invalidation
+        self._outbox_users: Set[int] = set()
+        self._outbox_friends: Set[int] = set()
+        self._purger: Optional[asyncio.Task] = None
+        self._publisher: Optional[asyncio.Task] = None
+
+    async def start(self, hub):
+        await hub.add_channel_listener(LEADERBOARD_CHANNEL, self._on_notify)
+        loop = asyncio.get_running_loop()
+        self._purger = loop.create_task(self._purge_loop())
+        self._publisher = loop.create_task(self._publish_loop())
+
+    async def stop(self):
+        for task in (self._purger, self._publisher):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        await self.publish()
+
+    # --- 查詢 ---
+
+    async def top(self, user_id: int, period: str = "week", limit: int = 10,
+                  day: Optional[date] = None) -> dict:
+        """
+        自己和好友在這一天 / 這一週的專注分鐘數排名 (同分同名次)。
+        回傳前 limit 名 (items) 與自己的名次 (me)。
+        """
+        start = period_start(period, day or date.today())
+        members = [user_id, *(await self.friend_ids(user_id))]
+        totals = await self.totals(period, start, members)
+
+        ranked = sorted(set(members), key=lambda u: (-totals[u], u))
+        items, me = [], None
+        rank, previous = 0, None
+        for position, member in enumerate(ranked, 1):
+            if totals[member] != previous:
+                rank, previous = position, totals[member]
+            entry = {"rank": rank, "user_id": member, "focus_minutes": totals[member]}
+            if position <= limit:
+                items.append(entry)
+            if member == user_id:
+                me = entry
+            if position >= limit and me is not None:
+                break
+        return {"period": period, "start": start, "members": len(ranked), "items": items, "me": me}
+
+    async def friend_ids(self, user_id: int) -> List[int]:
+        now = time.monotonic()
+        cached = self._friends.get(user_id)
+        if cached and cached[0] > now:
+            CACHE_LOOKUPS.inc("friends", "hit")
+            return cached[1]
+        CACHE_LOOKUPS.inc("friends", "miss")
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(FRIEND_IDS_SQL, user_id)
+        friend_ids = [row["friend_id"] for row in rows]
+        self._friends[user_id] = (now + self.ttl, friend_ids)
+        return friend_ids
+
+    async def totals(self, period: str, start: date, user_ids: Iterable[int]) -> Dict[int, int]:
+        """快取沒有的一次查 DB；沒有紀錄的 user 是 0。"""
+        now = time.monotonic()
+        cache = self._totals.get((period, start))
+        if cache is None:
+            # 換日 / 換週：舊的那份用不到了
+            for key in [k for k in self._totals if k[0] == period]:
+                del self._totals[key]
+            cache = self._totals[(period, start)] = {}
+
+        result, misses = {}, []
+        for user_id in user_ids:
+            cached = cache.get(user_id)
+            if cached and cached[0] > now:
+                result[user_id] = cached[1]
+            else:
+                misses.append(user_id)
+        CACHE_LOOKUPS.inc("totals", "hit", amount=len(result))
+        if misses:
+            CACHE_LOOKUPS.inc("totals", "miss", amount=len(misses))
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(TOTALS_SQL, period, start, misses)
+            found = {row["user_id"]: row["focus_minutes"] for row in rows}
+            expires_at = now + self.ttl
+            for user_id in misses:
+                minutes = found.get(user_id, 0)
+                cache[user_id] = (expires_at, minutes)
+                result[user_id] = minutes
+        return result
+
+    # --- invalidation ---
+
+    async def invalidate(self, user_ids: Iterable[int] = (), friends_of: Iterable[int] = ()):
+        """
+        commit 之後呼叫：user_ids 是專注時間有變的人，friends_of 是好友列表有變的人。
+        """
+        user_ids, friends_of = set(user_ids), set(friends_of)
+        self._drop(user_ids, friends_of)
+        self._outbox_users |= user_ids
+        self._outbox_friends |= friends_of
+
+    async def publish(self):
+        """把 outbox 合併成幾個 NOTIFY 送出。"""
+        if not self._outbox_users and not self._outbox_friends:
+            return
+        user_ids, self._outbox_users = list(self._outbox_users), set()
+        friends_of, self._outbox_friends = list(self._outbox_friends), set()
+        try:
+            async with self.pool.acquire() as conn:
+                for i in range(0, max(len(user_ids), len(friends_of)), BROADCAST_BATCH):
+                    event = {"n": self.node_id, "u": user_ids[i:i + BROADCAST_BATCH], "f": friends_of[i:i + BROADCAST_BATCH]}
+                    await conn.execute(BROADCAST_SQL, LEADERBOARD_CHANNEL, json.dumps(event))
+        except Exception:
+            # 送失敗就放回去下次再送
+            self._outbox_users.update(user_ids)
+            self._outbox_friends.update(friends_of)
+            raise
+
+    def _drop(self, user_ids: Iterable[int], friends_of: Iterable[int]):
+        for cache in self._totals.values():
+            for user_id in user_ids:
+                cache.pop(user_id, None)
+        for user_id in friends_of:
+            self._friends.pop(user_id, None)
+
+    def _on_notify(self, conn, pid, channel, payload):
+        try:
+            event = json.loads(payload)
+        except json.JSONDecodeError:
+            return
+        if event.get("n") == self.node_id:
+            return
+        self._drop(event.get("u", ()), event.get("f", ()))
+
+    async def _publish_loop(self):
+        while True:
+            await asyncio.sleep(self.publish_interval)
+            try:
+                await self.publish()
+            except Exception as e:
+                print(f"排行榜 invalidation 廣播失敗: {e}")
+
+    async def _purge_loop(self):
+        # 每個 worker 都會跑，DELETE 重複執行沒關係
+        while True:
+            try:
+                cutoff = period_start("week", date.today()) - timedelta(weeks=LEADERBOARD_RETENTION_WEEKS)
+                async with self.pool.acquire() as conn:
+                    await conn.execute(PURGE_SQL, cutoff)
+                now = time.monotonic()
+                for user_id, (expires_at, _) in list(self._friends.items()):
+                    if expires_at <= now:
+                        del self._friends[user_id]
+                for cache in self._totals.values():
+                    for user_id, (expires_at, _) in list(cache.items()):
+                        if expires_at <= now:
+                            del cache[user_id]
+            except Exception as e:
+                print(f"focus_totals 清理失敗: {e}")
+            await asyncio.sleep(LEADERBOARD_PURGE_SECONDS)
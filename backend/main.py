@@ -1,13 +1,47 @@
-from fastapi import FastAPI, Query, HTTPException
+from fastapi import FastAPI, Query, HTTPException, WebSocket, WebSocketDisconnect, Header, Form, File, UploadFile, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse, PlainTextResponse
 import asyncpg
+import asyncio
 from pydantic import BaseModel
-from datetime import datetime, timedelta
-from typing import Optional, List
-import json
+from datetime import datetime, timedelta, date
+from typing import Optional, List, Literal
 import base64
+import hashlib
+import hmac
+import json
+import threading
+from contextlib import asynccontextmanager
+
+from realtime import MessageHub
+from blob_store import get_blob_store, sniff_image_type
+from partitions import MESSAGES, PartitionMaintenance, retention_cutoff
+from presence import PresenceCache
+from replicas import ReadRouter
+from leaderboard import Leaderboard, reconcile_totals
+from badges import BadgeCompactor, BADGE_BALANCE_SQL
+from reminders import ReminderScheduler
+from images import ImagePipeline, UndecodableImage
+from ordering import key_between, plan_reorder
+from versions import get_version, make_etag
+from jobs import JobQueue, enqueue, enqueue_many
+from db import create_pool, named_query
+from migrate import verify_schema
+import metrics
+import profiling
+from responses import FastJSONResponse, dumps
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # startup / shutdown 定義在下面 (DB basic setting)
+    await startup()
+    try:
+        yield
+    finally:
+        await shutdown()
 
-app = FastAPI()
+# 回應一律用 orjson 序列化 (responses.py)
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 
 # CORS: 讓前端連得上後端
 app.add_middleware(
@@ -18,16 +52,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 每個 request 的耗時 / DB 時間 / 回應大小 (profiling.py)，放最外層才算得到全部的時間
+app.add_middleware(profiling.ProfilingMiddleware)
+
 # === 資料模型 (Models) ===
 
 class FocusSession(BaseModel):
     duration_seconds: int
     note: str = ""
     user_id: int = 1  # 預設 User ID
+    ended_at: Optional[datetime] = None  # 離線補傳時帶結束時間，不給就是現在
 
 class UserStatus(BaseModel):
     user_id: int = 1
     is_studying: bool
+    is_breaking: Optional[bool] = None  # 不給的話：開始專注時清掉，其他情況維持原狀
+
+class Heartbeat(BaseModel):
+    user_id: int
 
 class DeadlineItem(BaseModel):
     id: int = 1
@@ -38,6 +80,30 @@ class DeadlineItem(BaseModel):
     display_order: int = 1
     current_doing: bool = False
 
+class DeadlineMove(BaseModel):
+    user_id: int
+    id: int
+    prev_id: Optional[int] = None  # 移動後排在它上面的項目，移到最上面就不給
+    next_id: Optional[int] = None  # 移動後排在它下面的項目，移到最下面就不給
+
+class DeadlineMutation(BaseModel):
+    """/deadlines/sync 的一筆離線修改，依 client 排隊的順序套用。"""
+    op: Literal["add", "edit", "done", "doing", "move", "remove"]
+    id: Optional[int] = None            # add 以外都要給 (或用 client_id 指同一批裡 add 的項目)
+    client_id: Optional[str] = None     # add 時 client 給的暫時 id，結果會帶回來對應到 server 的 id
+    base_version: Optional[int] = None  # client 修改時看到的 row_version；server 上已經被改過就回報衝突、不套用
+    task: Optional[str] = None
+    deadline_date: Optional[date] = None
+    is_done: Optional[bool] = None
+    current_doing: Optional[bool] = None
+    prev_id: Optional[int] = None       # move：同 DeadlineMove
+    next_id: Optional[int] = None
+
+class DeadlineSync(BaseModel):
+    user_id: int
+    since: int = 0  # 上次 /deadlines/changes 或 /deadlines/sync 回傳的 version
+    mutations: List[DeadlineMutation] = []
+
 class UserRecordStatus(BaseModel):
     title_name: str
     badge_count: int
@@ -50,170 +116,80 @@ class FriendStatusResponse(BaseModel):
     is_studying: bool
     current_timer: Optional[str] = None
 
+class FriendEdge(BaseModel):
+    user_id: int
+    friend_id: int
+
 class PictureData(BaseModel):
     user_id: int
     image_base64: str
     description: Optional[str] = "" 
+
+# 縮圖尺寸 / 格式 (對應 images.IMAGE_VARIANTS / IMAGE_FORMATS)
+ImageSize = Literal["thumb", "small", "large"]
+ImageFormat = Literal["jpeg", "webp"]
     
 # DB basic setting
-@app.on_event("startup")
 async def startup():
-    app.state.db_pool = await asyncpg.create_pool(
-        user="postgres",
-        password="password",
-        database="focusmate",
-        host="db",
-        port=5432,
-        min_size=1,
-        max_size=10
-    )
+    # 連線設定 (DATABASE_URL、pool 大小、timeout、statement cache) 見 db.py
+    app.state.db_pool = await create_pool()
 
-    # create table
+    # schema 由 migrate.py 負責 (部署時先執行 `python migrate.py`)，這裡只確認版本是最新的
     async with app.state.db_pool.acquire() as conn:
-        # users
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id SERIAL PRIMARY KEY,
-                name TEXT not NULL,
-                is_studying BOOLEAN,
-                title TEXT,
-                badge INTEGER
-            );
-        """)
-
-        await conn.execute("""
-            ALTER TABLE users
-            ADD COLUMN IF NOT EXISTS is_breaking BOOLEAN;
-        """)
-        
-        # friends
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS friends (
-                user_id   INTEGER NOT NULL,
-                friend_id INTEGER NOT NULL,
-                PRIMARY KEY (user_id, friend_id),
-                FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
-                FOREIGN KEY (friend_id) REFERENCES users(user_id) ON DELETE CASCADE
-            );
-        """)
-
-        # new friends
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS new_friends (
-                user_id          INTEGER NOT NULL PRIMARY KEY,
-                friend_id_list   JSON,
-                FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
-            );
-        """)
-        # messages
-        # 修正重點 1: PostgreSQL 使用 SERIAL 來自動遞增，而不是 AUTOINCREMENT
-        # 修正重點 2: Boolean 預設值建議使用 FALSE，而不是 0
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS messages (
-                id           SERIAL PRIMARY KEY,
-                sender_id    INTEGER NOT NULL,
-                receiver_id  INTEGER NOT NULL,
-                content      TEXT NOT NULL,
-                is_read      BOOLEAN DEFAULT FALSE,
-                created_at   TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (sender_id) REFERENCES users(user_id) ON DELETE CASCADE,
-                FOREIGN KEY (receiver_id) REFERENCES users(user_id) ON DELETE CASCADE
-            );
-        """)
-
-        # 建立索引 (Index)
-        await conn.execute("""
-            CREATE INDEX IF NOT EXISTS idx_messages_receiver_read 
-            ON messages (receiver_id, is_read);
-        """)
-
-        # deadlines
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS deadlines (
-                id        SERIAL PRIMARY KEY,
-                user_id   INTEGER NOT NULL,
-                deadline_date   DATE,
-                task      TEXT,
-                is_done   BOOLEAN,
-                display_order INTEGER,
-                
-                FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
-            );
-        """)
-
-        await conn.execute("""
-            ALTER TABLE deadlines ADD COLUMN IF NOT EXISTS current_doing BOOLEAN DEFAULT false;
-        """)
-
-        await conn.execute("""
-            ALTER TABLE IF EXISTS public.deadlines
-            DROP CONSTRAINT IF EXISTS deadlines_user_id_display_order_key;
-        """)
-
-        # focus_time
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS focus_time (
-                user_id       INTEGER NOT NULL,
-                record_date   DATE NOT NULL,
-                record_hour   INT NOT NULL CHECK (record_hour BETWEEN 0 AND 23),
-                focus_minutes INT DEFAULT 0 CHECK (focus_minutes BETWEEN 0 AND 60),
-
-                FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
-                PRIMARY KEY (user_id, record_date, record_hour)
-            );
-        """)
-        # 註: 我在這裡將 PRIMARY KEY 加入到 focus_time 表格，以便 ON CONFLICT 生效
-
-        await conn.execute("""
-            ALTER TABLE IF EXISTS public.focus_time
-            DROP CONSTRAINT IF EXISTS focus_time_user_id_record_date_record_hour_key;
-        """)
-
-
-        # picture
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS pictures (
-                id      SERIAL PRIMARY KEY,
-                user_id INTEGER NOT NULL,
-                img     BYTEA,
-                description TEXT,
-                FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
-            );
-        """)
-        
+        await verify_schema(conn)
+
+    # 圖片檔案存放 (預設是 ./uploads/pictures)
+    app.state.blob_store = get_blob_store()
+    # 縮圖在獨立的 process pool 產生
+    app.state.image_pipeline = ImagePipeline(app.state.db_pool, app.state.blob_store)
+
+    # 訊息推播：一條 LISTEN 連線負責所有 WebSocket client
+    app.state.message_hub = MessageHub(app.state.db_pool)
+    await app.state.message_hub.start()
+
+    # 好友在線狀態放在記憶體，定期批次寫回 users
+    app.state.presence = PresenceCache(app.state.db_pool)
+    await app.state.presence.start(app.state.message_hub)
+
+    # 背景 job worker (縮圖、focus_daily、稱號升級)，handler 定義在下面各功能的區塊
+    app.state.jobs = JobQueue(app.state.db_pool)
+    for kind, handler in JOB_HANDLERS.items():
+        app.state.jobs.register(kind, handler)
+    await app.state.jobs.start(app.state.message_hub)
+
+    # deadline 到期提醒：全部未完成的 deadline 放在記憶體，每個 tick 一次寄出到期的 (見 reminders.py)
+    app.state.reminders = ReminderScheduler(app.state.db_pool)
+    await app.state.reminders.start(app.state.message_hub)
+
+    # messages / focus_time 的 partition：建立未來月份、刪除超過保留期限的 (見 partitions.py)
+    app.state.partitions = PartitionMaintenance(app.state.db_pool)
+    app.state.partitions.start()
+
+    # 唯讀 route 用的連線：有設 DATABASE_REPLICA_URL 就讀 replica (落後太多或剛寫過的 user 讀 primary，見 replicas.py)
+    app.state.read_pool = await ReadRouter.from_env(app.state.db_pool)
+    await app.state.read_pool.start(app.state.message_hub)
+
+    # 好友排行榜：每個人的今天 / 這週總數和好友列表快取在記憶體，寫入後清掉 (見 leaderboard.py)
+    app.state.leaderboard = Leaderboard(app.state.db_pool)
+    await app.state.leaderboard.start(app.state.message_hub)
+
+    # 徽章帳本定期壓縮成每人一列的快照 (見 badges.py)
+    app.state.badge_compactor = BadgeCompactor(app.state.db_pool)
+    app.state.badge_compactor.start()
+
 
-        # 💡 [新增] 確保 User 1 和 User 2 存在 (解決 ForeignKeyViolationError)
-        await conn.execute("""
-        INSERT INTO users (user_id, name, is_studying, title, badge)
-        VALUES (1, 'User 1', FALSE, 'Beginner', 0)
-        ON CONFLICT (user_id) DO NOTHING;
-        """)
-        await conn.execute("""
-            INSERT INTO users (user_id, name, is_studying, title, badge)
-            VALUES (2, 'User 2', FALSE, 'Beginner', 0)
-            ON CONFLICT (user_id) DO NOTHING;
-        """)
-        # # --- 2. [新增] 設定 User 1 的好友列表包含 2 ---
-        # # 如果 user_id=1 已經在 new_friends 裡，就更新它的列表
-        # await conn.execute("""
-        #     INSERT INTO new_friends (user_id, friend_id_list)
-        #     VALUES (1, '[2]') 
-        #     ON CONFLICT (user_id) 
-        #     DO UPDATE SET friend_id_list = '[2]';
-        # """)
-
-        # # --- 3. [新增] 設定 User 2 的好友列表包含 1 ---
-        # # 如果 user_id=2 已經在 new_friends 裡，就更新它的列表
-        # await conn.execute("""
-        #     INSERT INTO new_friends (user_id, friend_id_list)
-        #     VALUES (2, '[1]') 
-        #     ON CONFLICT (user_id) 
-        #     DO UPDATE SET friend_id_list = '[1]';
-        # """)
-
-
-@app.on_event("shutdown")
 async def shutdown():
+    # uvicorn 收到 SIGTERM 後會先停止接新連線、等進行中的 request (上傳) 做完
+    # (最多 GRACEFUL_TIMEOUT 秒，見 serve.py)，之後才會執行到這裡
+    await app.state.badge_compactor.stop()
+    await app.state.leaderboard.stop()
+    await app.state.read_pool.stop()
+    await app.state.partitions.stop()
+    await app.state.reminders.stop()
+    await app.state.jobs.stop()
+    await app.state.presence.stop()
+    await app.state.message_hub.stop()
+    app.state.image_pipeline.close()
     await app.state.db_pool.close()
 
 async def get_conn():
@@ -226,9 +202,39 @@ async def get_conn():
 async def root():
     return {"message": "Backend is running!"}
 
+# === 條件式 GET (ETag / If-None-Match) ===
+# DB 裡的資料用 resource_versions 的版本號當 ETag (見 versions.py)：
+# 版本沒變就直接回 304，不跑原本的查詢、也不序列化 payload。
+# 完全從記憶體快取組出來的回應 (presence / profile) 則用內容的 hash。
+ETAG_CACHE_CONTROL = "private, no-cache"  # client 可以留著，但每次都要帶 If-None-Match 回來確認
+
+async def resource_etag(conn: asyncpg.Connection, user_id: int, resource: str, *variant) -> str:
+    return make_etag(resource, await get_version(conn, user_id, resource), *variant)
+
+def content_etag(payload) -> str:
+    return 'W/"' + hashlib.blake2b(dumps(payload, sort_keys=True), digest_size=12).hexdigest() + '"'
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": ETAG_CACHE_CONTROL})
+
+def set_etag(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = ETAG_CACHE_CONTROL
+
+def json_response(payload, etag: Optional[str] = None) -> FastJSONResponse:
+    """
+    直接用 orjson 序列化 (可以放 asyncpg Record、date)，跳過 FastAPI 的 jsonable_encoder 與 response_model 檢查。
+    列表很長的 API 用這個；有 etag 時一起設定 ETag header。
+    """
+    headers = {"ETag": etag, "Cache-Control": ETAG_CACHE_CONTROL} if etag else None
+    return FastJSONResponse(payload, headers=headers)
+
 # 💡 新增：處理 /api/v1/friends/status 的路由
 @app.get("/api/v1/friends/status", response_model=List[FriendStatusResponse])
-async def get_friends_status(ids: str = Query(..., description="好友 User ID 列表，以逗號分隔, e.g., 1,2,3")):
+async def get_friends_status(
+    ids: str = Query(..., description="好友 User ID 列表，以逗號分隔, e.g., 1,2,3"),
+    if_none_match: Optional[str] = Header(None),
+):
     """
     獲取指定 ID 列表的好友專注狀態。
     """
@@ -241,73 +247,117 @@ async def get_friends_status(ids: str = Query(..., description="好友 User ID 
     if not friend_ids:
         return []
 
-    # 將 ID 列表轉換為 PostgreSQL 查詢參數
-    id_tuple = tuple(friend_ids)
+    # name 與專注狀態都從 presence 快取拿，快取命中時不查 DB
+    presence: PresenceCache = app.state.presence
+    profiles = await presence.get_profiles(friend_ids)
 
-    async with app.state.db_pool.acquire() as conn:
-        # 查詢 users 表格獲取 user_id 和 is_studying 狀態
-        rows = await conn.fetch("""
-            SELECT 
-                user_id, 
-                name,
-                is_studying,
-                badge -- 額外獲取 badge 欄位
-            FROM users 
-            WHERE user_id = ANY($1::int[])
-        """, id_tuple)
-        
-        results: List[FriendStatusResponse] = []
-        
-        for row in rows:
-            timer = None
-            # if row["is_studying"] is True and row["user_id"] == 3:
-            #     # 假設 ID=3 的人正在專注且有計時器顯示
-            #     timer = "01:30:00"
-
-            results.append(FriendStatusResponse(
-                friend_id=row["user_id"],
-                name=row["name"],
-                is_studying=row["is_studying"] if row["is_studying"] is not None else False,
-                current_timer=timer
-            ))
-            
-        return results
+    # 欄位同 FriendStatusResponse；直接組 dict，不用每列建一個 Pydantic 物件再轉回來
+    results = []
+
+    for friend_id in friend_ids:
+        profile = profiles.get(friend_id)
+        if profile is None:
+            continue
+        timer = None
+        is_studying, _ = presence.get(friend_id)
+
+        results.append({
+            "friend_id": friend_id,
+            "name": profile["name"],
+            "is_studying": is_studying,
+            "current_timer": timer,
+        })
+
+    etag = content_etag(results)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    return json_response(results, etag)
 
 # === 好友列表功能 ===
+# 好友關係存在 friends (user_id -> friend_id) 表，PK 就是查詢用的 index
+
+@app.get("/api/v1/friends")
+async def get_friend_feed(
+    user_id: int = Query(..., description="自己的 User ID"),
+    cursor: Optional[int] = Query(None, description="上一頁回傳的 next_cursor"),
+    limit: int = Query(50, ge=1, le=200),
+):
+    """
+    一次拿到好友列表 + 每個好友的名字、專注/休息狀態與徽章 (一個 JOIN)，
+    取代先呼叫 /api/v1/new-friends 再呼叫 /api/v1/friends/status 的兩段式查詢。
+    """
+    async with app.state.read_pool.acquire(user_id) as conn:
+        rows = await conn.fetch("""
+            SELECT u.user_id AS friend_id,
+                   u.name,
+                   COALESCE(u.is_studying, FALSE) AS is_studying,
+                   COALESCE(u.is_breaking, FALSE) AS is_breaking,
+                   b.badge,
+                   u.title
+            FROM friends f
+            JOIN users u ON u.user_id = f.friend_id
+            JOIN user_badges b ON b.user_id = f.friend_id
+            WHERE f.user_id = $1 AND ($2::int IS NULL OR f.friend_id > $2)
+            ORDER BY f.friend_id
+            LIMIT $3
+        """, user_id, cursor, limit + 1)
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    presence: PresenceCache = app.state.presence
+    items = []
+    for row in rows:
+        # users 表的狀態是 write-behind，以記憶體裡最新的為準
+        is_studying, is_breaking = presence.get(row["friend_id"])
+        items.append({**dict(row), "is_studying": is_studying, "is_breaking": is_breaking, "current_timer": None})
+    return {
+        "items": items,
+        "next_cursor": rows[-1]["friend_id"] if has_more else None,
+    }
+
+@app.post("/api/v1/friends")
+async def add_friend(body: FriendEdge):
+    if body.user_id == body.friend_id:
+        raise HTTPException(status_code=400, detail="不能加自己為好友")
+    async with app.state.db_pool.acquire() as conn:
+        try:
+            result = await conn.execute("""
+                INSERT INTO friends (user_id, friend_id) VALUES ($1, $2)
+                ON CONFLICT DO NOTHING
+            """, body.user_id, body.friend_id)
+        except asyncpg.ForeignKeyViolationError:
+            raise HTTPException(status_code=404, detail="找不到這個使用者")
+
+    app.state.read_pool.mark_write(body.user_id)
+    if result == "INSERT 0 1":
+        await app.state.leaderboard.invalidate(friends_of=[body.user_id])
+    return {"status": "success", "added": result == "INSERT 0 1"}
+
+@app.delete("/api/v1/friends/{friend_id}")
+async def remove_friend(friend_id: int, user_id: int = Query(..., description="自己的 User ID")):
+    async with app.state.db_pool.acquire() as conn:
+        result = await conn.execute("""
+            DELETE FROM friends WHERE user_id = $1 AND friend_id = $2
+        """, user_id, friend_id)
+
+    app.state.read_pool.mark_write(user_id)
+    if result == "DELETE 1":
+        await app.state.leaderboard.invalidate(friends_of=[user_id])
+    return {"status": "success", "removed": result == "DELETE 1"}
 
 @app.get("/api/v1/new-friends/{user_id}")
 async def get_new_friend_list(user_id: int):
-    async with app.state.db_pool.acquire() as conn:
+    """舊版 client 用：只回傳好友 ID 列表。"""
+    async with app.state.read_pool.acquire(user_id) as conn:
         try:
-            row = await conn.fetchrow("""
-                SELECT friend_id_list 
-                FROM new_friends 
+            rows = await conn.fetch("""
+                SELECT friend_id
+                FROM friends
                 WHERE user_id = $1
+                ORDER BY friend_id
             """, user_id)
             
-            if not row or row["friend_id_list"] is None:
-                return {"user_id": user_id, "friend_ids": []}
-
-            raw_data = row["friend_id_list"]
-            
-            # 2. 進行型別檢查與轉換邏輯
-            final_list = []
-
-            # 情況 A: 如果已經是 List (asyncpg 針對某些 array 類型會自動轉)
-            if isinstance(raw_data, list):
-                final_list = raw_data
-            
-            # 情況 B: 如果是 String (常見於 json/text 欄位)，需要解析
-            elif isinstance(raw_data, str):
-                try:
-                    parsed_data = json.loads(raw_data)
-                    if isinstance(parsed_data, list):
-                        final_list = parsed_data
-                except json.JSONDecodeError:
-                    print(f"JSON 解析錯誤: {raw_data}")
-                    final_list = []
-            
-            return {"user_id": user_id, "friend_ids": final_list}
+            return {"user_id": user_id, "friend_ids": [row["friend_id"] for row in rows]}
 
         except Exception as e:
             print(f"Database error: {e}") # 建議印出錯誤以便除錯
@@ -319,75 +369,185 @@ class MessageCreate(BaseModel):
     receiver_id: int
     content: str
 
+class MarkReadUpTo(BaseModel):
+    user_id: int
+    up_to_id: int  # 這個 id (含) 以前的未讀訊息全部標成已讀
+
+class NudgeRequest(BaseModel):
+    sender_id: int
+    content: str
+    receiver_ids: Optional[List[int]] = None  # 不給就是「所有正在休息的好友」
+
+# 每則訊息花費 1 個徽章。
+# 扣徽章 (badge_ledger 一筆 -1) 和寫訊息在同一個 statement：badge_balance_for_update 會拿 sender 的
+# advisory lock 再讀餘額，同時送出的 request 會排隊，不會扣成負的 (見 badges.py)。
+SEND_MESSAGE_SQL = named_query("messages.send", """
+    WITH spent AS (
+        INSERT INTO badge_ledger (user_id, amount, reason)
+        SELECT $1, -1, 'message'
+        WHERE badge_balance_for_update($1) >= 1
+        RETURNING user_id
+    )
+    INSERT INTO messages (sender_id, receiver_id, content)
+    SELECT user_id, $2, $3 FROM spent
+    RETURNING id
+""")
+
+async def spend_badge_and_send(conn: asyncpg.Connection, msg: MessageCreate) -> Optional[int]:
+    """回傳新訊息的 id；徽章不足時回傳 None (什麼都不會寫)。"""
+    try:
+        return await conn.fetchval(SEND_MESSAGE_SQL, msg.sender_id, msg.receiver_id, msg.content)
+    except asyncpg.ForeignKeyViolationError:
+        raise HTTPException(status_code=404, detail="找不到收件者")
+
+async def send_nudges(conn: asyncpg.Connection, sender_id: int, receiver_ids: List[int], content: str) -> List[dict]:
+    """
+    一次寄給多個人 (同一個 transaction)，徽章不夠時依順序寄到用完為止。
+    回傳每個收件者的結果: sent / insufficient_badge / not_found。
+    """
+    receiver_ids = [r for r in dict.fromkeys(receiver_ids) if r != sender_id]
+    async with conn.transaction():
+        # 只鎖 sender 的徽章 (advisory lock，到 transaction 結束)，收件者不用鎖
+        badge = await conn.fetchval("SELECT badge_balance_for_update($1)", sender_id)
+        if badge is None:
+            raise HTTPException(status_code=404, detail="找不到寄件者")
+
+        rows = await conn.fetch("""
+            WITH allowed AS (
+                SELECT t.receiver_id
+                FROM unnest($2::int[]) WITH ORDINALITY AS t(receiver_id, ord)
+                JOIN users u ON u.user_id = t.receiver_id
+                ORDER BY t.ord
+                LIMIT $4
+            ), sent AS (
+                INSERT INTO messages (sender_id, receiver_id, content)
+                SELECT $1, receiver_id, $3 FROM allowed
+                RETURNING id, receiver_id
+            ), spent AS (
+                INSERT INTO badge_ledger (user_id, amount, reason)
+                SELECT $1, -count(*), 'nudge' FROM sent
+                HAVING count(*) > 0
+            )
+            SELECT id, receiver_id FROM sent
+        """, sender_id, receiver_ids, content, max(badge, 0))
+
+        sent = {row["receiver_id"]: row["id"] for row in rows}
+        existing = set(sent)
+        if len(sent) < len(receiver_ids):
+            existing |= {row["user_id"] for row in await conn.fetch("""
+                SELECT user_id FROM users WHERE user_id = ANY($1::int[])
+            """, [r for r in receiver_ids if r not in sent])}
+
+    results = []
+    for receiver_id in receiver_ids:
+        if receiver_id in sent:
+            results.append({"receiver_id": receiver_id, "status": "sent", "message_id": sent[receiver_id]})
+        elif receiver_id in existing:
+            results.append({"receiver_id": receiver_id, "status": "insufficient_badge"})
+        else:
+            results.append({"receiver_id": receiver_id, "status": "not_found"})
+    return results
+
 # 請確保後端有這個 API 接口
 # 2. 修改傳送訊息 API (加入餘額檢查防呆)
 @app.post("/api/v1/messages")
 async def send_message(msg: MessageCreate):
     async with app.state.db_pool.acquire() as conn:
-        async with conn.transaction():
-            # A. 先查詢目前徽章數量
-            row = await conn.fetchrow("SELECT badge FROM users WHERE user_id = $1", msg.sender_id)
-            current_badge = row['badge'] if row and row['badge'] else 0
+        message_id = await spend_badge_and_send(conn, msg)
 
-            # B. 判斷餘額是否足夠
-            if current_badge < 1:
-                # 若不足，回傳 400 錯誤，停止交易
-                raise HTTPException(status_code=400, detail="徽章不足，無法傳送訊息")
+    if message_id is None:
+        raise HTTPException(status_code=400, detail="徽章不足，無法傳送訊息")
 
-            # C. 扣除徽章
-            await conn.execute("""
-                UPDATE users SET badge = badge - 1 WHERE user_id = $1
-            """, msg.sender_id)
+    app.state.read_pool.mark_write(msg.sender_id, msg.receiver_id)
+    await app.state.presence.invalidate_profile(msg.sender_id)
+    return {"status": "success", "message": "Message sent", "message_id": message_id}
 
-            # D. 寫入訊息
-            await conn.execute("""
-                INSERT INTO messages (sender_id, receiver_id, content)
-                VALUES ($1, $2, $3)
-            """, msg.sender_id, msg.receiver_id, msg.content)
+@app.post("/api/v1/messages/nudge")
+async def nudge_friends(body: NudgeRequest):
+    """
+    一次提醒多個好友 (每人 1 個徽章)。
+    沒指定 receiver_ids 時，寄給所有「正在休息」的好友 (狀態來自 presence 快取)。
+    """
+    receiver_ids = body.receiver_ids
+    if receiver_ids is None:
+        async with app.state.db_pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT friend_id FROM friends WHERE user_id = $1 ORDER BY friend_id
+            """, body.sender_id)
+        presence: PresenceCache = app.state.presence
+        receiver_ids = [row["friend_id"] for row in rows if presence.get(row["friend_id"])[1]]
+
+    async with app.state.db_pool.acquire() as conn:
+        results = await send_nudges(conn, body.sender_id, receiver_ids, body.content)
 
-    return {"status": "success", "message": "Message sent"}
+    sent = sum(1 for r in results if r["status"] == "sent")
+    if sent:
+        app.state.read_pool.mark_write(body.sender_id, *(r["receiver_id"] for r in results if r["status"] == "sent"))
+        await app.state.presence.invalidate_profile(body.sender_id)
+    return {"status": "success", "sent": sent, "results": results}
 
 @app.get("/api/v1/messages/unread/latest")
-async def get_latest_unread_message(user_id: int = Query(..., description="接收者的 User ID")):
+async def get_latest_unread_message(
+    response: Response,
+    user_id: int = Query(..., description="接收者的 User ID"),
+    if_none_match: Optional[str] = Header(None),
+):
     """
     [Polling 專用] 獲取該用戶「最新」的一則未讀訊息。
     用途：前端每幾秒呼叫一次，檢查是否有新通知。
     注意：此 API **不會** 將訊息標記為已讀。
+    沒有新訊息時帶 If-None-Match 會拿到 304。
     """
-    async with app.state.db_pool.acquire() as conn:
-        # 查詢邏輯：
-        # 1. 找 receiver_id 是我自己 ($1)
-        # 2. 找 is_read = False
-        # 3. JOIN users 表拿到寄件者名字 (sender_name)
-        # 4. ORDER BY created_at DESC (倒序，拿最新的)
-        # 5. LIMIT 1 (只需要一筆來做通知)
-        
-        row = await conn.fetchrow("""
-            SELECT 
-                m.id, 
-                m.content, 
-                m.created_at, 
-                m.sender_id,
-                u.name as sender_name
-            FROM messages m
-            JOIN users u ON m.sender_id = u.user_id
-            WHERE m.receiver_id = $1 
-              AND m.is_read = FALSE
-            ORDER BY m.created_at DESC
-            LIMIT 1
-        """, user_id)
-
-        # 回傳格式配合前端: { has_unread: bool, data: object }
-        if row:
-            return {
-                "has_unread": True,
-                "data": dict(row)
-            }
-        else:
-            return {
-                "has_unread": False,
-                "data": None
-            }
+    async with app.state.read_pool.acquire(user_id) as conn:
+        etag = await resource_etag(conn, user_id, "messages", "latest")
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        latest = await fetch_latest_unread(conn, user_id)
+
+    set_etag(response, etag)
+    return latest
+
+# 查詢邏輯：
+# 1. 找 receiver_id 是我自己 ($1)
+# 2. 找 is_read = False
+# 3. JOIN users 表拿到寄件者名字 (sender_name)
+# 4. ORDER BY created_at DESC (倒序，拿最新的)
+# 5. LIMIT 1 (只需要一筆來做通知)
+# 6. created_at 下限 messages_floor($2) (見 partitions.py)，比較舊的 partition 不用掃
+LATEST_UNREAD_SQL = named_query("messages.latest_unread", """
+    SELECT 
+        m.id, 
+        m.content, 
+        m.created_at, 
+        m.sender_id,
+        u.name as sender_name
+    FROM messages m
+    JOIN users u ON m.sender_id = u.user_id
+    WHERE m.receiver_id = $1 
+      AND m.is_read = FALSE
+      AND m.created_at >= messages_floor($1, $2)
+    ORDER BY m.created_at DESC
+    LIMIT 1
+""")
+
+def message_cutoff() -> datetime:
+    """messages 的保留期限：messages_floor() 的第二個參數。"""
+    return retention_cutoff(MESSAGES)
+
+async def fetch_latest_unread(conn: asyncpg.Connection, user_id: int) -> dict:
+    row = await conn.fetchrow(LATEST_UNREAD_SQL, user_id, message_cutoff())
+
+    # 回傳格式配合前端: { has_unread: bool, data: object }
+    if row:
+        return {
+            "has_unread": True,
+            "data": dict(row)
+        }
+    else:
+        return {
+            "has_unread": False,
+            "data": None
+        }
 
 @app.get("/api/v1/messages/unread/{user_id}")
 async def get_unread_messages(user_id: int):
@@ -395,26 +555,180 @@ async def get_unread_messages(user_id: int):
     [Polling] 僅獲取指定用戶的「未讀」訊息。
     注意：此 API 不會修改已讀狀態！
     """
-    async with app.state.db_pool.acquire() as conn:
-        rows = await conn.fetch("""
-            SELECT 
-                m.id, 
-                m.sender_id, 
-                m.content, 
-                m.created_at,
-                u.name as sender_name
-            FROM messages m
-            JOIN users u ON m.sender_id = u.user_id
-            WHERE m.receiver_id = $1 AND m.is_read = FALSE
-            ORDER BY m.created_at DESC  -- 改成 DESC 抓最新的比較符合通知邏輯
-            LIMIT 1                     -- 為了通知，我們通常只需要最新的一則
-        """, user_id)
+    async with app.state.read_pool.acquire(user_id) as conn:
+        # 跟 /unread/latest 同一個查詢：最新的一則未讀
+        row = await conn.fetchrow(LATEST_UNREAD_SQL, user_id, message_cutoff())
 
-        if not rows:
+        if not row:
             return None # 或是 return {}，看你前端習慣怎麼接
 
         # 直接回傳最新的一筆資料
-        return dict(rows[0])
+        return dict(row)
+
+@app.websocket("/api/v1/messages/ws")
+async def message_push(websocket: WebSocket, user_id: int = Query(..., description="接收者的 User ID")):
+    """
+    [Push] 取代每 3 秒 polling /api/v1/messages/unread/latest。
+    連上時先送一次目前最新的未讀訊息，之後有新訊息才推送，
+    格式和 polling API 相同: { has_unread: bool, data: object }。
+    """
+    hub: MessageHub = app.state.message_hub
+    queue = hub.subscribe(user_id)
+    try:
+        await websocket.accept()
+
+        # 連線期間漏掉的訊息：只在連上時查一次
+        async with app.state.db_pool.acquire() as conn:
+            latest = await fetch_latest_unread(conn, user_id)
+        await websocket.send_text(dumps(latest).decode())
+
+        # 另外開一個 task 讀 client 端，用來偵測斷線
+        receiver = asyncio.create_task(_wait_for_disconnect(websocket))
+        try:
+            while True:
+                getter = asyncio.create_task(queue.get())
+                done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+                if receiver in done:
+                    getter.cancel()
+                    break
+                await websocket.send_text(dumps({"has_unread": True, "data": getter.result()}).decode())
+        finally:
+            receiver.cancel()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        hub.unsubscribe(user_id, queue)
+
+async def _wait_for_disconnect(websocket: WebSocket):
+    while True:
+        # client 可以送 ping 之類的訊息，這裡不處理內容
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+
+def parse_inbox_cursor(cursor: str):
+    """cursor 格式: "<created_at ISO>,<id>" (上一頁最後一則)。"""
+    try:
+        created_at, message_id = cursor.rsplit(",", 1)
+        return datetime.fromisoformat(created_at), int(message_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="cursor 格式錯誤")
+
+# created_at 下限 messages_floor (見 partitions.py)：比保留期限舊的 partition 不用掃
+INBOX_SQL = """
+    SELECT m.id, m.sender_id, u.name AS sender_name, m.content, m.is_read, m.created_at
+    FROM messages m
+    JOIN users u ON u.user_id = m.sender_id
+    WHERE m.receiver_id = $1 {unread_filter} {cursor_filter}
+      AND m.created_at >= messages_floor($1, ${floor_param})
+    ORDER BY m.created_at DESC, m.id DESC
+    LIMIT ${limit_param}
+"""
+# row 比較不會觸發 partition pruning，另外加上單純的 created_at 條件，比 cursor 新的月份不用掃
+INBOX_CURSOR_FILTER = "AND (m.created_at, m.id) < ($2::timestamp, $3::int) AND m.created_at <= $2::timestamp"
+
+def _inbox_sql(name: str, unread_only: bool, with_cursor: bool) -> str:
+    return named_query(name, INBOX_SQL.format(
+        unread_filter="AND m.is_read = FALSE" if unread_only else "",
+        cursor_filter=INBOX_CURSOR_FILTER if with_cursor else "",
+        floor_param=4 if with_cursor else 2,
+        limit_param=5 if with_cursor else 3,
+    ))
+
+# (只看未讀, 有沒有 cursor) 各是一段固定的 SQL，各自的 prepared statement 都能重複使用，
+# 條件裡也沒有 "$2 IS NULL OR ..."，generic plan 一樣能 pruning
+INBOX_SQL_BY_FILTER = {
+    (False, False): _inbox_sql("messages.inbox", False, False),
+    (True, False): _inbox_sql("messages.inbox_unread", True, False),
+    (False, True): _inbox_sql("messages.inbox_page", False, True),
+    (True, True): _inbox_sql("messages.inbox_unread_page", True, True),
+}
+
+@app.get("/api/v1/messages/inbox")
+async def get_inbox(
+    user_id: int = Query(..., description="接收者的 User ID"),
+    cursor: Optional[str] = Query(None, description="上一頁回傳的 next_cursor"),
+    limit: int = Query(30, ge=1, le=100),
+    unread_only: bool = Query(False, description="只列出未讀訊息"),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    收件匣：由新到舊，用 (created_at, id) 做 keyset 分頁。
+    不會修改已讀狀態；看完之後用 /api/v1/messages/read-up-to 一次標記。
+    """
+    before_at, before_id = parse_inbox_cursor(cursor) if cursor else (None, None)
+    async with app.state.read_pool.acquire(user_id) as conn:
+        etag = await resource_etag(conn, user_id, "messages", "inbox", cursor, limit, unread_only)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        if cursor:
+            rows = await conn.fetch(INBOX_SQL_BY_FILTER[unread_only, True], user_id, before_at, before_id,
+                                    message_cutoff(), limit + 1)
+        else:
+            rows = await conn.fetch(INBOX_SQL_BY_FILTER[unread_only, False], user_id, message_cutoff(), limit + 1)
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return json_response({
+        "items": rows,
+        "next_cursor": f"{rows[-1]['created_at'].isoformat()},{rows[-1]['id']}" if has_more else None,
+    }, etag)
+
+# 只掃每個 partition 的 idx_messages_receiver_unread (partial index)；
+# messages_floor 以前的 partition 不用掃 (超過保留期限還沒讀的訊息在 messages_default，下限會往前推)
+UNREAD_COUNT_SQL = named_query("messages.unread_count", """
+    SELECT count(*) FROM messages
+    WHERE receiver_id = $1 AND is_read = FALSE AND created_at >= messages_floor($1, $2)
+""")
+
+@app.get("/api/v1/messages/unread-count")
+async def get_unread_count(
+    response: Response,
+    user_id: int = Query(..., description="接收者的 User ID"),
+    if_none_match: Optional[str] = Header(None),
+):
+    async with app.state.read_pool.acquire(user_id) as conn:
+        etag = await resource_etag(conn, user_id, "messages", "count")
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        count = await conn.fetchval(UNREAD_COUNT_SQL, user_id, message_cutoff())
+    set_etag(response, etag)
+    return {"user_id": user_id, "unread": count}
+
+# messages 依 created_at 分割 (partitions.py)：只有 id 的條件另外換算成 created_at 的範圍，
+# 才不會每個 partition 都掃一次
+MARK_READ_UP_TO_SQL = named_query("messages.read_up_to", """
+    WITH marked AS (
+        UPDATE messages
+        SET is_read = TRUE
+        WHERE receiver_id = $1 AND is_read = FALSE AND id <= $2
+          AND created_at < messages_created_before($2)
+        RETURNING id
+    )
+    SELECT
+        (SELECT count(*) FROM marked) AS marked,
+        (SELECT count(*) FROM messages
+         WHERE receiver_id = $1 AND is_read = FALSE AND id > $2
+           AND created_at >= messages_created_after($2)) AS unread
+""")
+
+MARK_READ_SQL = named_query("messages.mark_read", """
+    UPDATE messages
+    SET is_read = TRUE
+    WHERE id = $1
+      AND created_at >= messages_created_after($1) AND created_at < messages_created_before($1)
+    RETURNING receiver_id
+""")
+
+@app.post("/api/v1/messages/read-up-to")
+async def mark_messages_read_up_to(body: MarkReadUpTo):
+    """把 up_to_id (含) 以前的未讀訊息一次標成已讀 (一個 UPDATE)，回傳剩下的未讀數。"""
+    async with app.state.db_pool.acquire() as conn:
+        row = await conn.fetchrow(MARK_READ_UP_TO_SQL, body.user_id, body.up_to_id)
+    app.state.read_pool.mark_write(body.user_id)
+
+    return {"status": "success", "marked": row["marked"], "unread": row["unread"]}
+
 # 5. [新增] 標記單一訊息已讀 (點擊通知專用)
 @app.post("/api/v1/messages/{message_id}/read")
 async def mark_single_message_read(message_id: int):
@@ -422,16 +736,14 @@ async def mark_single_message_read(message_id: int):
     當使用者點擊通知時呼叫，將該則訊息標記為已讀。
     """
     async with app.state.db_pool.acquire() as conn:
-        result = await conn.execute("""
-            UPDATE messages 
-            SET is_read = TRUE 
-            WHERE id = $1
-        """, message_id)
+        receiver_id = await conn.fetchval(MARK_READ_SQL, message_id)
         
         # 檢查是否有更新到資料
-        if result == "UPDATE 0":
+        if receiver_id is None:
             return {"status": "warning", "message": "Message not found or already read"}
 
+    app.state.read_pool.mark_write(receiver_id)
+
     return {"status": "success", "message": f"Message {message_id} marked as read"}
 
 # === focus mode的功能(by sandra) ===
@@ -447,178 +759,695 @@ async def mark_single_message_read(message_id: int):
 #             ORDER BY display_order ASC
 #         """, user_id)
 #         return [dict(row) for row in rows]
+DEADLINE_DOING_SQL = named_query("deadlines.doing", """
+    SELECT id, task as thing, is_done, display_order, deadline_date
+    FROM (
+        SELECT id, task, is_done, deadline_date, current_doing, sort_key,
+               CASE WHEN is_done THEN -1
+                    ELSE row_number() OVER (PARTITION BY is_done ORDER BY sort_key, id)
+               END AS display_order
+        FROM deadlines
+        WHERE user_id = $1
+    ) d
+    WHERE current_doing = true
+    ORDER BY display_order, sort_key, id
+""")
+
 @app.get("/deadlines")
-async def get_deadlines(user_id: int = Query(..., description="要查詢的使用者 ID")): # 💡 修正 1: 接收 user_id
-    async with app.state.db_pool.acquire() as conn:
-        rows = await conn.fetch("""
-            SELECT id, task as thing, is_done, display_order, deadline_date 
-            FROM deadlines 
-            WHERE user_id = $1 AND current_doing = true
-            ORDER BY display_order ASC
-        """, user_id)
-        return [dict(row) for row in rows]
+async def get_deadlines(
+    user_id: int = Query(..., description="要查詢的使用者 ID"), # 💡 修正 1: 接收 user_id
+    if_none_match: Optional[str] = Header(None),
+):
+    async with app.state.read_pool.acquire(user_id) as conn:
+        etag = await resource_etag(conn, user_id, "deadlines", "doing")
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        rows = await conn.fetch(DEADLINE_DOING_SQL, user_id)
+    return json_response(rows, etag)
 
 # 修改 is_studying
 # 開始 & 結束時修改
+async def apply_user_status(user_id: int, is_studying: bool, is_breaking: Optional[bool]) -> bool:
+    """只更新 presence 快取，users 表由背景批次寫回。回傳實際的 is_breaking。"""
+    presence: PresenceCache = app.state.presence
+    if is_breaking is None:
+        is_breaking = False if is_studying else presence.get(user_id)[1]
+    await presence.set(user_id, is_studying, is_breaking)
+    return is_breaking
+
 @app.post("/user/status")
 async def update_status(status: UserStatus):
-    async with app.state.db_pool.acquire() as conn:
-        await conn.execute(
-            "UPDATE users SET is_studying = $1 WHERE user_id = $2",
-            status.is_studying, status.user_id
-        )
-    return {"status": "updated", "is_studying": status.is_studying}
+    is_breaking = await apply_user_status(status.user_id, status.is_studying, status.is_breaking)
+    return {"status": "updated", "is_studying": status.is_studying, "is_breaking": is_breaking}
+
+@app.post("/user/heartbeat")
+async def presence_heartbeat(body: Heartbeat):
+    """
+    專注/休息中的 client 定期呼叫 (間隔要小於 PRESENCE_TTL_SECONDS)，
+    太久沒 heartbeat 的人會自動變成離線。known=False 表示要重送 /user/status。
+    """
+    known = await app.state.presence.heartbeat(body.user_id)
+    return {"status": "ok", "known": known}
 
 # 專注結束的時間存檔
 
-@app.post("/focus/save")
-async def save_focus_session(session: FocusSession):
-    async with app.state.db_pool.acquire() as conn:
-        
-        # 計算時間與徽章
-        minutes = session.duration_seconds // 60
-        earned_badge = False
-        if minutes >= 5:
-            earned_badge = True
+BADGE_MIN_MINUTES = 5  # 專注滿 5 分鐘得一個徽章
+
+def split_focus_buckets(end_time: datetime, duration_seconds: int) -> List[tuple]:
+    """把一段專注時間切成每小時的 (record_date, record_hour, minutes)。"""
+    buckets = []
+    start_time = end_time - timedelta(seconds=duration_seconds)
+    current_cursor = start_time
+
+    while current_cursor < end_time:
+        next_hour = (current_cursor + timedelta(hours=1)).replace(minute=0, second=0, microsecond=0)
+        segment_end = min(next_hour, end_time)
+        segment_minutes = int((segment_end - current_cursor).total_seconds() / 60)
+
+        if segment_minutes > 0:
+            buckets.append((current_cursor.date(), current_cursor.hour, segment_minutes))
+
+        current_cursor = segment_end
+    return buckets
+
+def session_end_time(session: FocusSession) -> datetime:
+    if session.ended_at is None:
+        return datetime.now()
+    if session.ended_at.tzinfo is not None:
+        # focus_time 存的是 server 的 local time
+        return session.ended_at.astimezone().replace(tzinfo=None)
+    return session.ended_at
+
+# 同一小時最多 60 分鐘 (重疊的 session 不能超過 CHECK 限制)。
+# 同一個 statement 把實際增加的分鐘數 (upsert 後 - upsert 前，扣掉上限) 累加到排行榜用的 focus_totals：
+# CTE 裡的 before 看到的是這個 statement 開始時的 snapshot，也就是 upsert 之前的值。
+# 併發寫入同一小時的誤差由 focus.rollup job 對帳 (leaderboard.reconcile_totals)。
+FOCUS_UPSERT_SQL = named_query("focus.upsert", """
+    WITH input AS (
+        SELECT * FROM unnest($1::int[], $2::date[], $3::int[], $4::int[])
+            AS t(user_id, record_date, record_hour, focus_minutes)
+    ), before AS (
+        SELECT f.user_id, f.record_date, f.record_hour, f.focus_minutes
+        FROM focus_time f JOIN input USING (user_id, record_date, record_hour)
+        WHERE f.record_date = ANY($2::date[])
+    ), upserted AS (
+        INSERT INTO focus_time (user_id, record_date, record_hour, focus_minutes)
+        SELECT user_id, record_date, record_hour, LEAST(focus_minutes, 60) FROM input
+        ON CONFLICT (user_id, record_date, record_hour)
+        DO UPDATE SET focus_minutes = LEAST(focus_time.focus_minutes + EXCLUDED.focus_minutes, 60)
+        RETURNING user_id, record_date, record_hour, focus_minutes
+    ), added AS (
+        SELECT u.user_id, u.record_date, u.focus_minutes - COALESCE(b.focus_minutes, 0) AS minutes
+        FROM upserted u LEFT JOIN before b USING (user_id, record_date, record_hour)
+    )
+    INSERT INTO focus_totals (period, period_start, user_id, focus_minutes)
+    SELECT p.period, p.period_start, a.user_id, SUM(a.minutes)
+    FROM added a
+    CROSS JOIN LATERAL (VALUES ('day', a.record_date), ('week', date_trunc('week', a.record_date)::date))
+        AS p(period, period_start)
+    WHERE a.minutes > 0
+    GROUP BY a.user_id, p.period, p.period_start
+    ORDER BY a.user_id, p.period, p.period_start
+    ON CONFLICT (period, period_start, user_id)
+    DO UPDATE SET focus_minutes = focus_totals.focus_minutes + EXCLUDED.focus_minutes
+""")
+
+# 徽章只 INSERT 到帳本，不碰 users 那一列 (見 badges.py)
+BADGE_CREDIT_SQL = named_query("badges.credit", """
+    INSERT INTO badge_ledger (user_id, amount, reason)
+    SELECT user_id, earned, 'focus'
+    FROM unnest($1::int[], $2::int[]) AS t(user_id, earned)
+""")
+
+async def save_focus_sessions(conn, sessions: List[FocusSession]) -> List[dict]:
+    """
+    在同一個 transaction 裡寫入多段專注時間：
+    所有小時區間先在 Python 算好並合併，再用一個 unnest upsert 寫進 focus_time (同時累加 focus_totals)，
+    徽章也合併成一筆帳本 INSERT。commit 之後 caller 要呼叫 app.state.leaderboard.invalidate。
+    """
+    results = []
+    minutes_by_bucket = {}
+    badges_by_user = {}
 
-        # 拿到徽章，加到badge
+    for session in sessions:
+        minutes = session.duration_seconds // 60
+        earned_badge = minutes >= BADGE_MIN_MINUTES
         if earned_badge:
-            await conn.execute("UPDATE users SET badge = COALESCE(badge, 0) + 1 WHERE user_id = $1", session.user_id)
+            badges_by_user[session.user_id] = badges_by_user.get(session.user_id, 0) + 1
+
+        for r_date, r_hour, segment_minutes in split_focus_buckets(session_end_time(session), session.duration_seconds):
+            key = (session.user_id, r_date, r_hour)
+            minutes_by_bucket[key] = minutes_by_bucket.get(key, 0) + segment_minutes
+
+        results.append({"minutes": minutes, "badge_earned": earned_badge})
+
+    async with conn.transaction():
+        if minutes_by_bucket:
+            user_ids, dates, hours = zip(*minutes_by_bucket.keys())
+            await conn.execute(FOCUS_UPSERT_SQL, list(user_ids), list(dates), list(hours), list(minutes_by_bucket.values()))
+
+            # 受影響那幾天的 focus_daily 交給背景 job 重算 (同一天排隊中的會合併成一個)
+            days = sorted({(user_id, r_date) for user_id, r_date, _ in minutes_by_bucket})
+            await enqueue_many(conn, [
+                ("focus.rollup", {"user_id": user_id, "date": r_date.isoformat()}, f"focus-rollup:{user_id}:{r_date}")
+                for user_id, r_date in days
+            ])
+
+        # 拿到徽章，寫進徽章帳本 (回應要告訴 client 有沒有拿到，所以直接寫)；稱號升級交給背景 job
+        if badges_by_user:
+            await conn.execute(BADGE_CREDIT_SQL, list(badges_by_user.keys()), list(badges_by_user.values()))
+            await enqueue_many(conn, [
+                ("user.title", {"user_id": user_id}, f"title:{user_id}") for user_id in badges_by_user
+            ])
+
+    return results
+
+async def refresh_focus_daily(conn, user_id: int, record_date: date):
+    """從 focus_time 重算一天的 focus_daily (最多 24 列)，重複執行結果一樣。"""
+    await conn.execute("""
+        INSERT INTO focus_daily (user_id, record_date, focus_minutes)
+        SELECT user_id, record_date, SUM(focus_minutes)
+        FROM focus_time
+        WHERE user_id = $1 AND record_date = $2
+        GROUP BY user_id, record_date
+        ON CONFLICT (user_id, record_date) DO UPDATE SET focus_minutes = EXCLUDED.focus_minutes
+    """, user_id, record_date)
+
+async def focus_rollup_job(payload: dict):
+    user_id, record_date = payload["user_id"], date.fromisoformat(payload["date"])
+    async with app.state.db_pool.acquire() as conn:
+        await refresh_focus_daily(conn, user_id, record_date)
+        corrected = await reconcile_totals(conn, user_id, record_date)
+    if corrected:
+        await app.state.leaderboard.invalidate(user_ids=[user_id])
 
-        # 寫入 focus_time (每小時統計)
-        end_time = datetime.now()
-        start_time = end_time - timedelta(seconds=session.duration_seconds)
-        current_cursor = start_time
-        
-        while current_cursor < end_time:
-            next_hour = (current_cursor + timedelta(hours=1)).replace(minute=0, second=0, microsecond=0)
-            segment_end = min(next_hour, end_time)
-            segment_duration = (segment_end - current_cursor).total_seconds() / 60
-            segment_minutes = int(segment_duration)
-            
-            if segment_minutes > 0:
-                r_date = current_cursor.date()
-                r_hour = current_cursor.hour
-                
-                await conn.execute("""
-                    INSERT INTO focus_time (user_id, record_date, record_hour, focus_minutes)
-                    VALUES ($1, $2, $3, $4)
-                    ON CONFLICT (user_id, record_date, record_hour)
-                    DO UPDATE SET focus_minutes = focus_time.focus_minutes + EXCLUDED.focus_minutes
-                """, session.user_id, r_date, r_hour, segment_minutes)
-            
-            current_cursor = segment_end
+# 徽章數達到門檻自動升級稱號 (只升不降；使用者自己改過、不在表上的稱號不會被覆蓋)
+TITLE_LEVELS = [(0, "Beginner"), (10, "專注新人"), (50, "閱讀專家"), (200, "時光大師")]
 
-        return {
-            "status": "success", 
-            "minutes": minutes, 
-            "badge_earned": earned_badge
-        }
+def title_for_badges(badges: int) -> str:
+    return [title for threshold, title in TITLE_LEVELS if badges >= threshold][-1]
 
+async def title_upgrade_job(payload: dict):
+    user_id = payload["user_id"]
+    async with app.state.db_pool.acquire() as conn:
+        badges = await conn.fetchval(BADGE_BALANCE_SQL, user_id)
+        if badges is None:
+            return
+        title = title_for_badges(badges)
+        lower = [t for _, t in TITLE_LEVELS[:[t for _, t in TITLE_LEVELS].index(title)]]
+        result = await conn.execute("""
+            UPDATE users SET title = $2
+            WHERE user_id = $1 AND (title IS NULL OR title = ANY($3::text[]))
+        """, user_id, title, lower)
+    if result != "UPDATE 0":
+        await app.state.presence.invalidate_profile(user_id)
 
-# === deadline list ===
-@app.get("/deadlines/get-deadlines")
-async def get_deadlines_with_reorder(user_id: int = Query(..., description="要查詢的使用者 ID")): 
+@app.post("/focus/save")
+async def save_focus_session(session: FocusSession):
     async with app.state.db_pool.acquire() as conn:
-        rows = await conn.fetch("""
-            SELECT id, display_order, is_done
-            FROM deadlines
-            WHERE user_id = $1 
-            ORDER BY display_order ASC
-        """, user_id) 
-
-        # calculate the correct display_order
-        undone = [row for row in rows if row["is_done"] is False]
-        done = [row for row in rows if row["is_done"] is True]
-
-        correct_orders = {}
-        for i, row in enumerate(undone):
-            correct_orders[row["id"]] = i + 1
-        for row in done:
-            correct_orders[row["id"]] = -1
-
-        # update display_order in db
-        updates = []
-        for row in undone:
-            correct = correct_orders[row["id"]]
-            if row["display_order"] != correct:
-                updates.append((correct, row["id"]))
-        for row in done:
-            if row["display_order"] != -1:
-                updates.append((-1, row["id"]))
-
-        if updates:
+        result, = await save_focus_sessions(conn, [session])
+    app.state.read_pool.mark_write(session.user_id)
+    await app.state.leaderboard.invalidate(user_ids=[session.user_id])
+    if result["badge_earned"]:
+        await app.state.presence.invalidate_profile(session.user_id)
+
+    return {
+        "status": "success", 
+        "minutes": result["minutes"], 
+        "badge_earned": result["badge_earned"]
+    }
+
+@app.post("/focus/save-batch")
+async def save_focus_session_batch(sessions: List[FocusSession]):
+    """
+    離線的 client 一次補傳多段專注 (每段請帶 ended_at)，全部在同一個 transaction 寫入。
+    """
+    if not sessions:
+        return {"status": "success", "results": []}
+
+    async with app.state.db_pool.acquire() as conn:
+        results = await save_focus_sessions(conn, sessions)
+    app.state.read_pool.mark_write(*{s.user_id for s in sessions})
+    await app.state.leaderboard.invalidate(user_ids={s.user_id for s in sessions})
+    for user_id in {s.user_id for s, r in zip(sessions, results) if r["badge_earned"]}:
+        await app.state.presence.invalidate_profile(user_id)
+
+    return {"status": "success", "results": results}
+
+@app.post("/focus/sessions")
+async def end_focus_session(
+    session_id: str = Form(..., min_length=8, max_length=64, description="client 產生的唯一 ID (例如 UUID)，重送時帶同一個"),
+    user_id: int = Form(...),
+    duration_seconds: int = Form(..., ge=0),
+    note: str = Form(""),
+    ended_at: Optional[datetime] = Form(None, description="結束時間，不給就是現在"),
+    is_studying: Optional[bool] = Form(None, description="要同時更新的狀態，不給就不改"),
+    is_breaking: Optional[bool] = Form(None),
+    description: str = Form(""),
+    file: Optional[UploadFile] = File(None),
+    image_base64: Optional[str] = Form(None, description="沒辦法送檔案的 client 可以改送 base64"),
+):
+    """
+    結束一段專注：專注時間、徽章、照片在同一個 transaction 寫入，狀態在 commit 之後更新，
+    取代依序呼叫 /user/status、/focus/save、/camera/upload。
+    同一個 session_id 重送時不會重複計算，直接回傳第一次的結果 (replayed = true)；
+    狀態 (is_studying / is_breaking) 重送時還是會套用 (設成同一個值，重複做沒關係)，
+    第一次 commit 了但回應沒送到的話，重送的那次才會把狀態改掉。
+    """
+    # 照片先寫進 blob store (以內容命名，重送也是同一個檔案)；DB 的部分才在 transaction 裡
+    blob = None
+    if file is not None:
+        blob = await app.state.blob_store.put_stream(file.file)
+    elif image_base64:
+        try:
+            img_bytes = base64.b64decode(image_base64.split(",")[-1], validate=True)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="image_base64 格式錯誤")
+        blob = await app.state.blob_store.put_bytes(img_bytes)
+    if blob is not None and blob[1] == 0:
+        await discard_unreferenced_blob(blob[0])
+        raise HTTPException(status_code=400, detail="圖片是空的")
+
+    session = FocusSession(duration_seconds=duration_seconds, note=note, user_id=user_id, ended_at=ended_at)
+    stored = False
+    try:
+        async with app.state.db_pool.acquire() as conn:
             async with conn.transaction():
-                for new_order, id_ in updates:
+                # 先佔住 session_id：同一個 id 同時重送時，後到的會等前一個 commit 再拿到衝突
+                claimed = await conn.fetchval("""
+                    INSERT INTO focus_sessions (user_id, session_id, duration_seconds, note, ended_at)
+                    VALUES ($1, $2, $3, $4, $5)
+                    ON CONFLICT DO NOTHING
+                    RETURNING TRUE
+                """, user_id, session_id, duration_seconds, note, session_end_time(session))
+
+                if claimed:
+                    result, = await save_focus_sessions(conn, [session])
+                    picture_id = None
+                    if blob is not None:
+                        picture_id = await save_picture(conn, user_id, blob[0], blob[1], description)
                     await conn.execute("""
-                        UPDATE deadlines
-                        SET display_order = $1
-                        WHERE id = $2 AND user_id = $3
-                    """, new_order, id_, user_id) 
+                        UPDATE focus_sessions SET badge_earned = $3, picture_id = $4
+                        WHERE user_id = $1 AND session_id = $2
+                    """, user_id, session_id, result["badge_earned"], picture_id)
+                else:
+                    row = await conn.fetchrow("""
+                        SELECT duration_seconds, badge_earned, picture_id FROM focus_sessions
+                        WHERE user_id = $1 AND session_id = $2
+                    """, user_id, session_id)
+                    result = {"minutes": row["duration_seconds"] // 60, "badge_earned": row["badge_earned"]}
+                    picture_id = row["picture_id"]
+            stored = claimed and blob is not None
+    except asyncpg.ForeignKeyViolationError:
+        raise HTTPException(status_code=404, detail="找不到這個使用者")
+    finally:
+        # 照片沒有寫進 pictures (user 不存在、rollback、重送)：檔案沒有其他 pictures 用到就刪掉
+        if blob is not None and not stored:
+            await discard_unreferenced_blob(blob[0])
+
+    if claimed:
+        app.state.read_pool.mark_write(user_id)
+        await app.state.leaderboard.invalidate(user_ids=[user_id])
+        if result["badge_earned"]:
+            await app.state.presence.invalidate_profile(user_id)
+    if is_studying is not None:
+        await apply_user_status(user_id, is_studying, is_breaking)
+
+    return {
+        "status": "success",
+        "session_id": session_id,
+        "replayed": not claimed,
+        "minutes": result["minutes"],
+        "badge_earned": result["badge_earned"],
+        "picture_id": picture_id,
+        "picture_url": f"/pictures/{picture_id}" if picture_id else None,
+    }
+
+
+# === 專注統計 (我的紀錄) ===
+# 每日 / 每週 / 每月總量讀 focus_daily，每小時的熱度圖才讀 focus_time，查詢量都跟天數成正比
+# focus_time 依 record_date 每月一個 partition，查詢都帶日期範圍，只會讀到範圍內的月份；
+# 熱度圖的 cells 只有 FOCUS_HOURLY_RETENTION_MONTHS 個月內的 (更舊的只留每月每小時的總量)
+
+FOCUS_STATS_MAX_DAYS = 366
+
+def focus_stats_range(start: Optional[date], end: Optional[date]) -> tuple:
+    """預設查最近 7 天 (含今天)。"""
+    end = end or date.today()
+    start = start or end - timedelta(days=6)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start 不能晚於 end")
+    if (end - start).days + 1 > FOCUS_STATS_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"查詢範圍最多 {FOCUS_STATS_MAX_DAYS} 天")
+    return start, end
+
+FOCUS_DAILY_SQL = named_query("focus.stats_daily", """
+    SELECT d::date AS record_date, COALESCE(f.focus_minutes, 0) AS focus_minutes
+    FROM generate_series($2::date, $3::date, interval '1 day') AS d
+    LEFT JOIN focus_daily f ON f.user_id = $1 AND f.record_date = d::date
+    ORDER BY d
+""")
+
+FOCUS_ROLLUP_SQL = named_query("focus.stats_rollup", """
+    SELECT date_trunc($4, record_date)::date AS period_start,
+           SUM(focus_minutes)::int AS focus_minutes,
+           COUNT(*) FILTER (WHERE focus_minutes > 0)::int AS active_days
+    FROM focus_daily
+    WHERE user_id = $1 AND record_date BETWEEN $2 AND $3
+    GROUP BY 1
+    ORDER BY 1
+""")
+
+FOCUS_HOURLY_SQL = named_query("focus.stats_hourly", """
+    SELECT record_date, record_hour, focus_minutes
+    FROM focus_time
+    WHERE user_id = $1 AND record_date BETWEEN $2 AND $3 AND focus_minutes > 0
+    ORDER BY record_date, record_hour
+""")
+
+# 超過保留期限的 focus_time 已經彙總成每月每小時 (focus_hourly_monthly, 見 partitions.py)，
+# 兩邊的月份不會重疊；舊的月份只能整個月一起算
+FOCUS_BEST_HOUR_SQL = named_query("focus.stats_best_hour", """
+    SELECT record_hour, SUM(focus_minutes)::int AS focus_minutes
+    FROM (
+        SELECT record_hour, focus_minutes
+        FROM focus_time
+        WHERE user_id = $1 AND record_date BETWEEN $2 AND $3
+        UNION ALL
+        SELECT record_hour, focus_minutes
+        FROM focus_hourly_monthly
+        WHERE user_id = $1 AND month BETWEEN date_trunc('month', $2::date) AND $3
+    ) AS hours
+    GROUP BY record_hour
+""")
+
+@app.get("/api/v1/focus/stats/daily")
+async def get_focus_daily(
+    user_id: int = Query(..., description="要查詢的使用者 ID"),
+    start: Optional[date] = Query(None, description="開始日期 YYYY-MM-DD"),
+    end: Optional[date] = Query(None, description="結束日期 YYYY-MM-DD (含)"),
+    if_none_match: Optional[str] = Header(None),
+):
+    """每天的專注分鐘數，沒有專注的日子補 0。"""
+    start, end = focus_stats_range(start, end)
+    async with app.state.read_pool.acquire(user_id) as conn:
+        etag = await resource_etag(conn, user_id, "focus", "daily", start, end)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        rows = await conn.fetch(FOCUS_DAILY_SQL, user_id, start, end)
+
+    return json_response({
+        "user_id": user_id,
+        "start": start,
+        "end": end,
+        "total_minutes": sum(row["focus_minutes"] for row in rows),
+        "days": rows,
+    }, etag)
+
+@app.get("/api/v1/focus/stats/rollup")
+async def get_focus_rollup(
+    user_id: int = Query(..., description="要查詢的使用者 ID"),
+    period: Literal["week", "month"] = Query("week"),
+    start: Optional[date] = Query(None, description="開始日期 YYYY-MM-DD"),
+    end: Optional[date] = Query(None, description="結束日期 YYYY-MM-DD (含)"),
+    if_none_match: Optional[str] = Header(None),
+):
+    """每週 (週一開始) 或每月的專注總分鐘數。"""
+    start, end = focus_stats_range(start, end)
+    async with app.state.read_pool.acquire(user_id) as conn:
+        etag = await resource_etag(conn, user_id, "focus", "rollup", period, start, end)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        rows = await conn.fetch(FOCUS_ROLLUP_SQL, user_id, start, end, period)
+
+    return json_response({"user_id": user_id, "period": period, "start": start, "end": end, "periods": rows}, etag)
+
+@app.get("/api/v1/focus/stats/hourly")
+async def get_focus_heatmap(
+    user_id: int = Query(..., description="要查詢的使用者 ID"),
+    start: Optional[date] = Query(None, description="開始日期 YYYY-MM-DD"),
+    end: Optional[date] = Query(None, description="結束日期 YYYY-MM-DD (含)"),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    每小時熱度圖：cells 只列出有專注的 (日期, 小時)，
+    by_hour 是範圍內每個時段 (0~23 點) 的總分鐘數。
+    """
+    start, end = focus_stats_range(start, end)
+    async with app.state.read_pool.acquire(user_id) as conn:
+        etag = await resource_etag(conn, user_id, "focus", "hourly", start, end)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        rows = await conn.fetch(FOCUS_HOURLY_SQL, user_id, start, end)
+
+    by_hour = [0] * 24
+    for row in rows:
+        by_hour[row["record_hour"]] += row["focus_minutes"]
+    return json_response({"user_id": user_id, "start": start, "end": end, "by_hour": by_hour, "cells": rows}, etag)
+
+@app.get("/api/v1/focus/stats/best-hour")
+async def get_focus_best_hour(
+    response: Response,
+    user_id: int = Query(..., description="要查詢的使用者 ID"),
+    start: Optional[date] = Query(None, description="開始日期 YYYY-MM-DD"),
+    end: Optional[date] = Query(None, description="結束日期 YYYY-MM-DD (含)"),
+    if_none_match: Optional[str] = Header(None),
+):
+    """範圍內最常專注的時段 (0~23 點)，沒有任何紀錄時 best_hour 為 null。"""
+    start, end = focus_stats_range(start, end)
+    async with app.state.read_pool.acquire(user_id) as conn:
+        etag = await resource_etag(conn, user_id, "focus", "best-hour", start, end)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        rows = await conn.fetch(FOCUS_BEST_HOUR_SQL, user_id, start, end)
+
+    by_hour = [0] * 24
+    for row in rows:
+        by_hour[row["record_hour"]] = row["focus_minutes"]
+    best_minutes = max(by_hour)
+    set_etag(response, etag)
+    return {
+        "user_id": user_id,
+        "start": start,
+        "end": end,
+        "best_hour": by_hour.index(best_minutes) if best_minutes > 0 else None,
+        "best_hour_minutes": best_minutes,
+        "by_hour": by_hour,
+    }
+
+@app.get("/api/v1/leaderboard/friends")
+async def get_friends_leaderboard(
+    user_id: int = Query(..., description="自己的 User ID"),
+    period: Literal["day", "week"] = Query("week", description="今天或這週 (週一開始)"),
+    limit: int = Query(10, ge=1, le=100),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    自己和好友的專注排行榜，同分同名次；me 是自己的名次 (不在前 limit 名也會有)。
+    總數和好友列表都在記憶體快取 (見 leaderboard.py)，讀 primary 的 focus_totals，不經過 replica：
+    快取在寫入後才清掉，從落後的 replica 讀回來會把舊的值又放回快取。
+    """
+    board = await app.state.leaderboard.top(user_id, period, limit)
+    profiles = await app.state.presence.get_profiles([entry["user_id"] for entry in board["items"]])
+    for entry in board["items"]:
+        profile = profiles.get(entry["user_id"]) or {}
+        entry["name"] = profile.get("name")
+        entry["title"] = profile.get("title")
+
+    etag = content_etag(board)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    return json_response(board, etag)
 
+
+# === deadline list ===
+# 排序用 sort_key 字串 (ordering.py)：拖曳一個項目只改它自己那一列。
+# display_order 不再存，讀取時用 row_number() 算 (已完成的固定是 -1，前端用來判斷顏色)。
+DEADLINE_LIST_SQL = named_query("deadlines.list", """
+    SELECT id, user_id, deadline_date, task as thing, is_done,
+           CASE WHEN is_done THEN -1
+                ELSE row_number() OVER (PARTITION BY is_done ORDER BY sort_key, id)
+           END AS display_order,
+           current_doing
+    FROM deadlines
+    WHERE user_id = $1
+    ORDER BY is_done ASC, sort_key ASC, id ASC
+""")
+
+async def fetch_deadlines(conn: asyncpg.Connection, user_id: int) -> List[asyncpg.Record]:
+    # Record 可以直接交給 json_response，不用先轉成 dict
+    return await conn.fetch(DEADLINE_LIST_SQL, user_id)
+
+async def lock_deadline_order(conn: asyncpg.Connection, user_id: int):
+    # 同一個 user 的排序變更排隊執行，避免兩個 request 算出同一個 sort_key (transaction 結束自動釋放)
+    await conn.execute("SELECT pg_advisory_xact_lock(hashtext('deadline_order'), $1)", user_id)
+
+async def apply_deadline_keys(conn: asyncpg.Connection, user_id: int, changes) -> int:
+    """changes: [(id, sort_key)]，一個 UPDATE ... FROM unnest 寫完。"""
+    if not changes:
+        return 0
+    ids = [c[0] for c in changes]
+    keys = [c[1] for c in changes]
+    await conn.execute("""
+        UPDATE deadlines d
+        SET sort_key = t.sort_key
+        FROM unnest($1::int[], $2::text[]) AS t(id, sort_key)
+        WHERE d.id = t.id AND d.user_id = $3
+    """, ids, keys, user_id)
+    return len(changes)
+
+async def reorder_deadline_ids(conn: asyncpg.Connection, user_id: int, ordered_ids: List[int]) -> int:
+    """依 ordered_ids 的順序重排，只改不在最長已排序子序列裡的項目。回傳寫入的列數。"""
+    await lock_deadline_order(conn, user_id)
+    rows = await conn.fetch("""
+        SELECT id, is_done, sort_key FROM deadlines WHERE user_id = $1
+    """, user_id)
+    # 未完成 / 已完成各自排序
+    groups = {False: {}, True: {}}
+    for row in rows:
+        groups[bool(row["is_done"])][row["id"]] = row["sort_key"]
+
+    changes = []
+    for current in groups.values():
+        changes.extend(plan_reorder(current, [i for i in ordered_ids if i in current]))
+    return await apply_deadline_keys(conn, user_id, changes)
+
+async def move_deadline(conn: asyncpg.Connection, move: DeadlineMove) -> int:
+    """把一個項目移到 prev_id 與 next_id 之間，正常情況只寫一列。回傳寫入的列數。"""
+    await lock_deadline_order(conn, move.user_id)
+    neighbours = [i for i in (move.prev_id, move.next_id) if i is not None]
+    rows = await conn.fetch("""
+        SELECT id, is_done, sort_key FROM deadlines WHERE user_id = $1 AND id = ANY($2::int[])
+    """, move.user_id, [move.id, *neighbours])
+    found = {row["id"]: row for row in rows}
+    if move.id not in found or any(i not in found for i in neighbours):
+        raise HTTPException(status_code=404, detail="deadline not found")
+    is_done = found[move.id]["is_done"]
+    if any(found[i]["is_done"] != is_done for i in neighbours):
+        raise HTTPException(status_code=409, detail="只能在同一組 (未完成 / 已完成) 裡移動")
+    if not neighbours:
+        return 0
+
+    prev_key = found[move.prev_id]["sort_key"] if move.prev_id is not None else None
+    next_key = found[move.next_id]["sort_key"] if move.next_id is not None else None
+    try:
+        new_key = key_between(prev_key, next_key)
+    except ValueError:
+        # 前後兩列的 key 相同 (同時新增) 或 client 的順序過期：整組重排一次
         rows = await conn.fetch("""
-            SELECT id, user_id, deadline_date, task as thing, is_done, display_order, current_doing
-            FROM deadlines
-            WHERE user_id = $1
-            ORDER BY is_done ASC, display_order ASC
-        """, user_id)
+            SELECT id FROM deadlines
+            WHERE user_id = $1 AND is_done IS NOT DISTINCT FROM $2 AND id <> $3
+            ORDER BY sort_key, id
+        """, move.user_id, is_done, move.id)
+        order = [row["id"] for row in rows]
+        pos = order.index(move.prev_id) + 1 if move.prev_id is not None else order.index(move.next_id)
+        order.insert(pos, move.id)
+        return await reorder_deadline_ids(conn, move.user_id, order)
+
+    return await apply_deadline_keys(conn, move.user_id, [(move.id, new_key)])
 
-        return [dict(row) for row in rows]
+@app.get("/deadlines/get-deadlines")
+async def get_deadlines_with_reorder(
+    user_id: int = Query(..., description="要查詢的使用者 ID"),
+    if_none_match: Optional[str] = Header(None),
+):
+    # 唯讀，一個查詢 (以前每次讀取都會把 display_order 重算寫回)
+    async with app.state.read_pool.acquire(user_id) as conn:
+        etag = await resource_etag(conn, user_id, "deadlines", "list")
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        items = await fetch_deadlines(conn, user_id)
+    return json_response(items, etag)
+
+
+@app.post("/deadlines/move")
+async def move_deadline_item(move: DeadlineMove):
+    """拖曳排序：只需告訴 server 移動後的上一個 / 下一個項目。"""
+    async with app.state.db_pool.acquire() as conn:
+        async with conn.transaction():
+            updated = await move_deadline(conn, move)
+
+    app.state.read_pool.mark_write(move.user_id)
+    return {"status": "success", "updated": updated}
 
 
 @app.post("/deadlines/reorder")
 async def reorder_deadlines(items: List[DeadlineItem]):
+    # 舊版 client 會送整份清單；只有順序真的變了的項目才會寫入
+    if not items:
+        return {"status": "success", "updated": 0}
+    user_id = items[0].user_id
+    ordered_ids = [item.id for item in sorted(items, key=lambda item: item.display_order)]
     async with app.state.db_pool.acquire() as conn:
         async with conn.transaction():
-            for item in items:
-                await conn.execute("""
-                    UPDATE deadlines
-                    SET display_order = $1
-                    WHERE id = $2 AND user_id = $3
-                """, item.display_order, item.id, item.user_id)
-
-    return {"status": "success", "updated": len(items)}
+            updated = await reorder_deadline_ids(conn, user_id, ordered_ids)
+
+    app.state.read_pool.mark_write(user_id)
+    return {"status": "success", "updated": updated}
+
+# 新增 / 修改後回傳給 reminders.track() 的欄位
+DEADLINE_REMINDER_COLUMNS = "id, user_id, deadline_date, task, is_done"
+
+# 新項目排在同一組的最後面；取消完成的放回未完成清單的最上面
+DEADLINE_LAST_KEY_SQL = named_query("deadlines.last_key", """
+    SELECT MAX(sort_key) FROM deadlines WHERE user_id = $1 AND is_done = $2
+""")
+DEADLINE_FIRST_OPEN_KEY_SQL = named_query("deadlines.first_open_key", """
+    SELECT MIN(sort_key) FROM deadlines WHERE user_id = $1 AND is_done = FALSE AND id <> $2
+""")
+
+@app.get("/deadlines/upcoming")
+async def get_upcoming_deadlines(
+    user_id: int = Query(..., description="要查詢的使用者 ID"),
+    limit: int = Query(3, ge=1, le=20),
+):
+    """最近要到期的未完成 deadline (休息畫面的提醒用)，直接從提醒排程的記憶體索引拿，不查 DB。"""
+    return {"user_id": user_id, "items": app.state.reminders.upcoming(user_id, limit)}
 
 @app.post("/deadlines/click-done")
 async def deadline_done(item: DeadlineItem):
     async with app.state.db_pool.acquire() as conn:
         async with conn.transaction():
-            await conn.execute("""
-                UPDATE deadlines
-                SET is_done = $1, display_order = -1
-                WHERE id = $2 AND user_id = $3 
-            """, item.is_done, item.id, item.user_id)
+            if item.is_done:
+                row = await conn.fetchrow("""
+                    UPDATE deadlines
+                    SET is_done = TRUE
+                    WHERE id = $1 AND user_id = $2
+                    RETURNING """ + DEADLINE_REMINDER_COLUMNS, item.id, item.user_id)
+            else:
+                # 取消完成：放回未完成清單的最上面
+                await lock_deadline_order(conn, item.user_id)
+                first_key = await conn.fetchval(DEADLINE_FIRST_OPEN_KEY_SQL, item.user_id, item.id)
+                row = await conn.fetchrow("""
+                    UPDATE deadlines
+                    SET is_done = FALSE, sort_key = $1
+                    WHERE id = $2 AND user_id = $3
+                    RETURNING """ + DEADLINE_REMINDER_COLUMNS, key_between(None, first_key), item.id, item.user_id)
 
+    app.state.read_pool.mark_write(item.user_id)
+    if row:
+        await app.state.reminders.track([row])
     return {"status": "success", "updated": 1}
 
 @app.post("/deadlines/add-item")
 async def add_deadline(item: DeadlineItem):
     async with app.state.db_pool.acquire() as conn:
         async with conn.transaction():
-            # get new display_order
-            # row = await conn.fetchrow("""
-            #     SELECT COALESCE(MAX(display_order), 0) AS max_order
-            #     FROM deadlines
-            #     WHERE user_id = 1
-            # """)
-            # 1. 查詢最大排序號碼 (必須針對該使用者)
-            row = await conn.fetchrow("""
-                SELECT COALESCE(MAX(display_order), 0) AS max_order
-                FROM deadlines
-                WHERE user_id = $1 
-            """, item.user_id) 
-
-            next_order = row["max_order"] + 1
+            # 新項目排在同一組的最後面
+            await lock_deadline_order(conn, item.user_id)
+            last_key = await conn.fetchval(DEADLINE_LAST_KEY_SQL, item.user_id, item.is_done)
 
             deadline_date = datetime.strptime(item.deadline_date, "%Y-%m-%d").date()
 
             # add item
-            await conn.execute("""
-                INSERT INTO deadlines (user_id, deadline_date, task, is_done, display_order)
+            row = await conn.fetchrow("""
+                INSERT INTO deadlines (user_id, deadline_date, task, is_done, sort_key)
                 VALUES ($1, $2, $3, $4, $5)
-            """, 
-            item.user_id, deadline_date, item.task, item.is_done, next_order)
+                RETURNING """ + DEADLINE_REMINDER_COLUMNS,
+            item.user_id, deadline_date, item.task, item.is_done, key_between(last_key, None))
 
+    app.state.read_pool.mark_write(item.user_id)
+    await app.state.reminders.track([row])
     return {"status": "success", "update": 1}
 
 @app.post("/deadlines/edit-item")
@@ -626,24 +1455,30 @@ async def edit_deadline(item: DeadlineItem):
     async with app.state.db_pool.acquire() as conn:
         async with conn.transaction():
             deadline_date = datetime.strptime(item.deadline_date, "%Y-%m-%d").date()
-            await conn.execute("""
+            row = await conn.fetchrow("""
                 UPDATE deadlines
                 SET task = $1, deadline_date = $2
                 WHERE id = $3 AND user_id = $4
-            """, 
+                RETURNING """ + DEADLINE_REMINDER_COLUMNS,
             item.task, deadline_date, item.id, item.user_id)
 
+    app.state.read_pool.mark_write(item.user_id)
+    if row:
+        await app.state.reminders.track([row])
     return {"status": "success", "update": 1}
 
 @app.post("/deadlines/remove-item")
 async def remove_deadline(item: DeadlineItem):
     async with app.state.db_pool.acquire() as conn:
         async with conn.transaction():
-            await conn.execute("""
-                DELETE FROM deadlines WHERE id = $1 AND user_id = $2;
+            deleted = await conn.fetchval("""
+                DELETE FROM deadlines WHERE id = $1 AND user_id = $2 RETURNING id;
             """, 
             item.id, item.user_id) 
 
+    app.state.read_pool.mark_write(item.user_id)
+    if deleted:
+        await app.state.reminders.forget([deleted])
     return {"status": "success", "update": 1}
 
 @app.post("/deadlines/doing-item")
@@ -656,12 +1491,295 @@ async def set_doing(item: DeadlineItem):
                 WHERE id = $2 AND user_id = $3 
             """, item.current_doing, item.id, item.user_id)
 
+    app.state.read_pool.mark_write(item.user_id)
     return {"status": "success", "update": 1}
-            
+
+# === deadline 增量同步 (offline-first) ===
+# 每列的 row_version 是最後寫入它的 transaction id，刪掉的留在 deadline_tombstones (migrations/0005)。
+# client 記住上次回傳的 version，之後只拿 row_version >= version 的列：改一筆只傳那一筆，不用重抓整份清單。
+# version 是讀取當下 snapshot 的 xmin (比它小的 transaction 都已經結束)，不會漏掉比較晚 commit 的寫入；
+# 代價是 xmin 之後已經 commit 的列下次可能再傳一次 (client 用 id 覆蓋即可)。
+DEADLINE_SYNC_COLUMNS = "id, user_id, deadline_date, task, is_done, current_doing, sort_key, row_version"
+
+DEADLINE_SYNC_VERSION_SQL = named_query("deadlines.sync_version", """
+    SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint AS version,
+           (SELECT min_version FROM deadline_sync_floor) AS floor
+""")
+
+DEADLINE_CHANGES_SQL = named_query("deadlines.changes", """
+    SELECT id, user_id, deadline_date, task AS thing, is_done, current_doing, sort_key, row_version
+    FROM deadlines
+    WHERE user_id = $1 AND row_version >= $2
+""")
+
+DEADLINE_DELETED_SQL = named_query("deadlines.deleted", """
+    SELECT id FROM deadline_tombstones WHERE user_id = $1 AND row_version >= $2
+""")
+
+DEADLINE_SYNC_ROW_SQL = named_query("deadlines.sync_row", """
+    SELECT id, user_id, deadline_date, task AS thing, is_done, current_doing, sort_key, row_version
+    FROM deadlines
+    WHERE id = $1 AND user_id = $2
+""")
+
+async def fetch_deadline_changes(conn: asyncpg.Connection, user_id: int, since: int) -> dict:
+    """
+    since 之後新增 / 修改的列 (upserts) 與刪除的 id (deleted)。
+    since = 0，或比已經清掉的 tombstone 還舊時整份回傳 (reset = true，client 要先清空本地的清單)。
+    """
+    async with conn.transaction(isolation="repeatable_read", readonly=True):
+        # 第一個查詢決定 snapshot：後面兩個查詢看到的資料和回傳的 version 是同一個時間點
+        state = await conn.fetchrow(DEADLINE_SYNC_VERSION_SQL)
+        reset = since <= 0 or since < state["floor"]
+        upserts = await conn.fetch(DEADLINE_CHANGES_SQL, user_id, 0 if reset else since)
+        deleted = [] if reset else [row["id"] for row in await conn.fetch(DEADLINE_DELETED_SQL, user_id, since)]
+    return {"version": state["version"], "reset": reset, "upserts": upserts, "deleted": deleted}
+
+@app.get("/deadlines/changes")
+async def get_deadline_changes(
+    user_id: int = Query(..., description="要查詢的使用者 ID"),
+    since: int = Query(0, ge=0, description="上次回傳的 version，第一次用 0"),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    增量同步：只回傳 since 之後的變動，下次帶回傳的 version。
+    清單的順序由 client 排：未完成在前，再依 sort_key、id (同 /deadlines/get-deadlines)。
+    """
+    async with app.state.read_pool.acquire(user_id) as conn:
+        etag = await resource_etag(conn, user_id, "deadlines", "changes", since)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        changes = await fetch_deadline_changes(conn, user_id, since)
+    return json_response(changes, etag)
+
+class DeadlineSyncBatch:
+    """一次 /deadlines/sync：在同一個 transaction 裡依序套用 client 排隊的修改。"""
+
+    def __init__(self, conn: asyncpg.Connection, user_id: int):
+        self.conn = conn
+        self.user_id = user_id
+        self.base_versions = {}  # id -> 這批修改之前的 row_version (同一批裡改兩次同一列，第二次不算衝突)
+        self.client_ids = {}     # client_id -> 這批新增的 id
+        self.changed = {}        # id -> 寫入後的列，commit 後交給 reminders.track()
+        self.removed = []
+
+    async def apply(self, m: DeadlineMutation) -> dict:
+        if m.op == "add":
+            return await self._add(m)
+
+        deadline_id = m.id if m.id is not None else self.client_ids.get(m.client_id)
+        result = {"op": m.op, "id": deadline_id, "client_id": m.client_id}
+        row = None
+        if deadline_id is not None:
+            row = await self.conn.fetchrow(DEADLINE_SYNC_ROW_SQL, deadline_id, self.user_id)
+        if row is None:
+            return {**result, "status": "not_found"}
+        base_version = self.base_versions.setdefault(deadline_id, row["row_version"])
+        if m.base_version is not None and m.base_version != base_version:
+            return {**result, "status": "conflict", "current": row}
+
+        if m.op == "edit":
+            await self._write(DEADLINE_SYNC_EDIT_SQL, deadline_id, m.task, m.deadline_date)
+        elif m.op == "done":
+            is_done = (not row["is_done"]) if m.is_done is None else m.is_done
+            if is_done and not row["is_done"]:
+                await self._write(DEADLINE_SYNC_DONE_SQL, deadline_id)
+            elif not is_done and row["is_done"]:
+                first_key = await self.conn.fetchval(DEADLINE_FIRST_OPEN_KEY_SQL, self.user_id, deadline_id)
+                await self._write(DEADLINE_SYNC_UNDONE_SQL, deadline_id, key_between(None, first_key))
+        elif m.op == "doing":
+            await self._write(DEADLINE_SYNC_DOING_SQL, deadline_id, bool(m.current_doing))
+        elif m.op == "move":
+            try:
+                await move_deadline(self.conn, DeadlineMove(
+                    user_id=self.user_id, id=deadline_id, prev_id=m.prev_id, next_id=m.next_id))
+            except HTTPException as e:
+                # move_deadline 在寫入之前就檢查完，拒絕時這批的其他修改照常套用
+                return {**result, "status": "rejected", "detail": e.detail}
+        elif m.op == "remove":
+            await self.conn.execute(DEADLINE_SYNC_REMOVE_SQL, deadline_id, self.user_id)
+            self.changed.pop(deadline_id, None)
+            self.removed.append(deadline_id)
+        return {**result, "status": "applied"}
+
+    async def _add(self, m: DeadlineMutation) -> dict:
+        result = {"op": "add", "id": None, "client_id": m.client_id}
+        if not m.task or m.deadline_date is None:
+            return {**result, "status": "rejected", "detail": "add 需要 task 和 deadline_date"}
+        is_done = bool(m.is_done)
+        last_key = await self.conn.fetchval(DEADLINE_LAST_KEY_SQL, self.user_id, is_done)
+        row = await self.conn.fetchrow(DEADLINE_SYNC_ADD_SQL, self.user_id, m.deadline_date, m.task, is_done,
+                                       key_between(last_key, None), m.client_id)
+        status = "applied"
+        if row is None:
+            # 同一個 client_id 已經新增過 (上次送出後沒收到回應又重送)，不重複新增
+            row = await self.conn.fetchrow(DEADLINE_BY_CLIENT_ID_SQL, self.user_id, m.client_id)
+            status = "replayed"
+        else:
+            self.changed[row["id"]] = row
+        if m.client_id is not None:
+            self.client_ids[m.client_id] = row["id"]
+        return {**result, "id": row["id"], "status": status}
+
+    async def _write(self, sql: str, deadline_id: int, *args):
+        row = await self.conn.fetchrow(sql, deadline_id, self.user_id, *args)
+        if row is not None:
+            self.changed[deadline_id] = row
+
+DEADLINE_SYNC_ADD_SQL = named_query("deadlines.sync_add", """
+    INSERT INTO deadlines (user_id, deadline_date, task, is_done, sort_key, client_id)
+    VALUES ($1, $2, $3, $4, $5, $6)
+    ON CONFLICT (user_id, client_id) WHERE client_id IS NOT NULL DO NOTHING
+    RETURNING """ + DEADLINE_SYNC_COLUMNS)
+
+DEADLINE_BY_CLIENT_ID_SQL = named_query("deadlines.by_client_id", """
+    SELECT id FROM deadlines WHERE user_id = $1 AND client_id = $2
+""")
+
+DEADLINE_SYNC_EDIT_SQL = named_query("deadlines.sync_edit", """
+    UPDATE deadlines
+    SET task = COALESCE($3, task), deadline_date = COALESCE($4, deadline_date)
+    WHERE id = $1 AND user_id = $2
+    RETURNING """ + DEADLINE_SYNC_COLUMNS)
+
+DEADLINE_SYNC_DONE_SQL = named_query("deadlines.sync_done", """
+    UPDATE deadlines SET is_done = TRUE
+    WHERE id = $1 AND user_id = $2
+    RETURNING """ + DEADLINE_SYNC_COLUMNS)
+
+DEADLINE_SYNC_UNDONE_SQL = named_query("deadlines.sync_undone", """
+    UPDATE deadlines SET is_done = FALSE, sort_key = $3
+    WHERE id = $1 AND user_id = $2
+    RETURNING """ + DEADLINE_SYNC_COLUMNS)
+
+DEADLINE_SYNC_DOING_SQL = named_query("deadlines.sync_doing", """
+    UPDATE deadlines SET current_doing = $3
+    WHERE id = $1 AND user_id = $2
+    RETURNING """ + DEADLINE_SYNC_COLUMNS)
+
+DEADLINE_SYNC_REMOVE_SQL = named_query("deadlines.sync_remove", """
+    DELETE FROM deadlines WHERE id = $1 AND user_id = $2
+""")
+
+@app.post("/deadlines/sync")
+async def sync_deadlines(body: DeadlineSync):
+    """
+    套用 client 離線時排隊的修改 (同一個 transaction，依送來的順序)，
+    回傳每一筆的結果 (results) 和 since 之後的變動 (格式同 /deadlines/changes)。
+    results 的 status：
+      applied    已套用；add 的 id 是 server 給的 id (用 client_id 對應)
+      replayed   同一個 client_id 的 add 之前已經套用過
+      conflict   base_version 跟 server 上的不一樣 (別的裝置改過)，沒有套用；current 是 server 上目前的內容
+      not_found  項目已經被刪掉了 (remove 的話等於成功)
+      rejected   缺少欄位，或 move 的前後項目不存在 / 不在同一組
+    """
+    async with app.state.db_pool.acquire() as conn:
+        batch = DeadlineSyncBatch(conn, body.user_id)
+        try:
+            async with conn.transaction():
+                await lock_deadline_order(conn, body.user_id)
+                results = [await batch.apply(m) for m in body.mutations]
+        except asyncpg.ForeignKeyViolationError:
+            raise HTTPException(status_code=404, detail="找不到這個使用者")
+        changes = await fetch_deadline_changes(conn, body.user_id, body.since)
+
+    if body.mutations:
+        app.state.read_pool.mark_write(body.user_id)
+    if batch.changed:
+        await app.state.reminders.track(list(batch.changed.values()))
+    if batch.removed:
+        await app.state.reminders.forget(batch.removed)
+    return json_response({"results": results, **changes})
+
 # 💡 [新增] 獲取最新圖片 API (用於回顧頁面)
 
+# === 圖片: metadata 列表 + 二進位串流 ===
+# 新上傳的圖片存在 blob store (pictures.blob_key)，
+# 舊資料在跑 migrate_pictures.py 之前仍在 pictures.img，讀取時兩者都支援。
+PICTURE_CHUNK_SIZE = 256 * 1024
+PICTURE_CACHE_CONTROL = "private, max-age=31536000, immutable"  # 照片上傳後不會再修改
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 可能是 "*" 或逗號分隔的多個 (weak) ETag。"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag.removeprefix("W/") in candidates
+
+def picture_source_key(picture_id: int, blob_key: Optional[str]) -> str:
+    # 縮圖依來源內容快取；還沒搬到 blob store 的舊圖用 id 當 key
+    return blob_key or f"pic-{picture_id}"
+
+def picture_source_loader(picture_id: int, blob_key: Optional[str]):
+    async def load() -> bytes:
+        if blob_key:
+            return await app.state.blob_store.read(blob_key)
+        async with app.state.db_pool.acquire() as conn:
+            return await conn.fetchval("SELECT img FROM pictures WHERE id = $1", picture_id)
+    return load
+
+async def save_picture(conn, user_id: int, blob_key: str, size: int, description: Optional[str]):
+    head = await app.state.blob_store.read_head(blob_key)
+    async with conn.transaction():
+        picture_id = await conn.fetchval("""
+            INSERT INTO pictures (user_id, blob_key, description, size_bytes, content_type)
+            VALUES ($1, $2, $3, $4, $5)
+            RETURNING id
+        """, user_id, blob_key, description, size, sniff_image_type(head))
+
+        # 照片牆一定會用到縮圖，交給背景 job 先產生 (失敗的話第一次讀取時也會產生)
+        await enqueue(conn, "picture.derivatives", {"picture_id": picture_id, "blob_key": blob_key},
+                      key=f"derivatives:{picture_source_key(picture_id, blob_key)}")
+    return picture_id
+
+async def discard_unreferenced_blob(blob_key: str):
+    """request 失敗時清掉先寫好的檔案；同樣內容的圖片 (content-addressed) 已經有 pictures 在用就留著。"""
+    try:
+        async with app.state.db_pool.acquire() as conn:
+            referenced = await conn.fetchval("""
+                SELECT EXISTS (SELECT 1 FROM pictures WHERE blob_key = $1)
+                    OR EXISTS (SELECT 1 FROM picture_derivatives WHERE blob_key = $1)
+            """, blob_key)
+        if not referenced:
+            await app.state.blob_store.delete(blob_key)
+    except Exception as e:
+        print(f"清理沒用到的圖片檔案失敗 ({blob_key}): {e}")
+
+PREFETCH_VARIANTS = [("thumb", "jpeg")]
+
+async def picture_derivatives_job(payload: dict):
+    picture_id, blob_key = payload["picture_id"], payload.get("blob_key")
+    for variant, fmt in PREFETCH_VARIANTS:
+        try:
+            await app.state.image_pipeline.get_derivative(
+                picture_source_key(picture_id, blob_key), picture_source_loader(picture_id, blob_key), variant, fmt
+            )
+        except UndecodableImage as e:
+            # 不是圖片，重試也一樣
+            print(f"picture {picture_id} 無法產生縮圖: {e}")
+            return
+
+async def load_picture_bytes(row, size: Optional[str] = None, fmt: str = "jpeg") -> Optional[bytes]:
+    """舊版 base64 API 用：row 需要有 id, blob_key, has_img 欄位；有 size 時回傳縮圖。"""
+    if not row["blob_key"] and not row["has_img"]:
+        return None
+    loader = picture_source_loader(row["id"], row["blob_key"])
+    if not size:
+        return await loader()
+    try:
+        derivative = await app.state.image_pipeline.get_derivative(
+            picture_source_key(row["id"], row["blob_key"]), loader, size, fmt
+        )
+    except UndecodableImage:
+        # 解不開的圖沒有縮圖，跟改版前一樣回傳原檔
+        return await loader()
+    return await app.state.blob_store.read(derivative["blob_key"])
+
 @app.post("/camera/upload")
 async def upload_picture(data: PictureData):
+    """舊版 (base64 JSON) 上傳，新版 client 請用 /camera/upload-file。"""
     async with app.state.db_pool.acquire() as conn:
         try:
             img_str = data.image_base64
@@ -670,11 +1788,10 @@ async def upload_picture(data: PictureData):
             
             img_bytes = base64.b64decode(img_str)
 
-            # 存入 user_id, img, description
-            await conn.execute("""
-                INSERT INTO pictures (user_id, img, description)
-                VALUES ($1, $2, $3)
-            """, data.user_id, img_bytes, data.description)
+            # 圖片本體存到 blob store，DB 只存 key 與 metadata
+            blob_key, size = await app.state.blob_store.put_bytes(img_bytes)
+            await save_picture(conn, data.user_id, blob_key, size, data.description)
+            app.state.read_pool.mark_write(data.user_id)
             
             print(f"User {data.user_id} 上傳照片成功")
             return {"status": "success", "message": "Photo saved!"}
@@ -682,78 +1799,343 @@ async def upload_picture(data: PictureData):
             print(f"上傳失敗: {str(e)}")
             return {"status": "error", "message": str(e)}
 
+@app.post("/camera/upload-file")
+async def upload_picture_file(
+    user_id: int = Form(...),
+    description: str = Form(""),
+    file: UploadFile = File(...),
+):
+    """
+    multipart/form-data 上傳，檔案分段寫進 blob store，不會整張圖讀進記憶體。
+    """
+    blob_key, size = await app.state.blob_store.put_stream(file.file)
+    if size == 0:
+        raise HTTPException(status_code=400, detail="圖片是空的")
+
+    async with app.state.db_pool.acquire() as conn:
+        picture_id = await save_picture(conn, user_id, blob_key, size, description)
+
+    app.state.read_pool.mark_write(user_id)
+    print(f"User {user_id} 上傳照片成功")
+    return {"status": "success", "message": "Photo saved!", "id": picture_id, "url": f"/pictures/{picture_id}"}
+
+PICTURE_LIST_SQL = named_query("pictures.list", """
+    SELECT id, description, COALESCE(size_bytes, octet_length(img)) AS size_bytes,
+           content_type, created_at
+    FROM pictures
+    WHERE user_id = $1 AND ($2::int IS NULL OR id < $2)
+    ORDER BY id DESC
+    LIMIT $3
+""")
+
+@app.get("/pictures/list")
+async def list_pictures(
+    user_id: int = Query(..., description="要查詢的使用者 ID"),
+    cursor: Optional[int] = Query(None, description="上一頁回傳的 next_cursor"),
+    limit: int = Query(20, ge=1, le=100),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    只回傳圖片 metadata (不含圖片本體)，依 id 由新到舊，用 cursor 分頁。
+    圖片本體請用 item["url"] (原圖) 或 item["thumbnail_url"] (照片牆用的縮圖) 另外載入。
+    """
+    async with app.state.read_pool.acquire(user_id) as conn:
+        etag = await resource_etag(conn, user_id, "pictures", "list", cursor, limit)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        rows = await conn.fetch(PICTURE_LIST_SQL, user_id, cursor, limit + 1)
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    items = [{
+        **dict(row),
+        "url": f"/pictures/{row['id']}",
+        "thumbnail_url": f"/pictures/{row['id']}?size=thumb",
+    } for row in rows]
+    return json_response({
+        "items": items,
+        "next_cursor": rows[-1]["id"] if has_more else None,
+    }, etag)
+
+@app.get("/pictures/{picture_id:int}")
+async def get_picture(
+    picture_id: int,
+    size: Optional[ImageSize] = Query(None, description="thumb / small / large，不給就是原圖"),
+    fmt: ImageFormat = Query("jpeg", alias="format", description="縮圖的格式: jpeg / webp"),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    直接回傳圖片 bytes (從 blob store 或 DB 分段讀出來串流)，
+    支援 ETag / If-None-Match，未變更時回 304 不讀圖片本體。
+    """
+    async with app.state.db_pool.acquire() as conn:
+        # 順便 JOIN 已經產生過的縮圖，快取命中時只要這一個查詢
+        row = await conn.fetchrow("""
+            SELECT p.blob_key, COALESCE(p.size_bytes, octet_length(p.img)) AS size_bytes, p.content_type,
+                   substring(p.img from 1 for 16) AS head,
+                   d.blob_key AS derivative_key, d.size_bytes AS derivative_size,
+                   d.content_type AS derivative_type
+            FROM pictures p
+            LEFT JOIN picture_derivatives d
+              ON d.source_key = COALESCE(p.blob_key, 'pic-' || p.id)
+             AND d.variant = $2 AND d.format = $3
+            WHERE p.id = $1 AND (p.blob_key IS NOT NULL OR p.img IS NOT NULL)
+        """, picture_id, size, fmt)
+
+    if not row:
+        raise HTTPException(status_code=404, detail="Picture not found")
+
+    if size:
+        cached = None
+        if row["derivative_key"]:
+            cached = {
+                "blob_key": row["derivative_key"],
+                "size_bytes": row["derivative_size"],
+                "content_type": row["derivative_type"],
+            }
+        try:
+            derivative = await app.state.image_pipeline.get_derivative(
+                picture_source_key(picture_id, row["blob_key"]),
+                picture_source_loader(picture_id, row["blob_key"]),
+                size, fmt, cached,
+            )
+        except UndecodableImage:
+            raise HTTPException(status_code=415, detail="這個檔案不是可以縮圖的圖片，請拿掉 size 取得原檔")
+        return _picture_response(
+            f'"{derivative["blob_key"]}"', derivative["size_bytes"], derivative["content_type"],
+            app.state.blob_store.iter_chunks(derivative["blob_key"], PICTURE_CHUNK_SIZE),
+            if_none_match,
+        )
+
+    size_bytes = row["size_bytes"]
+    media_type = row["content_type"] or sniff_image_type(row["head"] or b"")
+    if row["blob_key"]:
+        # blob 的 key 就是內容 hash，直接當 ETag
+        etag = f'"{row["blob_key"]}"'
+        body = app.state.blob_store.iter_chunks(row["blob_key"], PICTURE_CHUNK_SIZE)
+    else:
+        etag = f'"pic-{picture_id}-{size_bytes}"'
+        body = _stream_picture_from_db(picture_id, size_bytes)
+    return _picture_response(etag, size_bytes, media_type, body, if_none_match)
+
+def _picture_response(etag: str, size: int, media_type: str, body, if_none_match: Optional[str]):
+    headers = {"ETag": etag, "Cache-Control": PICTURE_CACHE_CONTROL}
+    if etag_matches(if_none_match, etag):
+        # body 還沒開始迭代，不會讀到任何圖片內容
+        return Response(status_code=304, headers=headers)
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+async def _stream_picture_from_db(picture_id: int, size: int):
+    # 每個 chunk 各自借連線，慢速 client 不會一直佔著 pool
+    offset = 1  # substring 是 1-based
+    while offset <= size:
+        async with app.state.db_pool.acquire() as conn:
+            chunk = await conn.fetchval("""
+                SELECT substring(img from $2 for $3) FROM pictures WHERE id = $1
+            """, picture_id, offset, PICTURE_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+        offset += len(chunk)
+
 # 2. 取得圖片列表 API (支援動態 user_id)
+# 舊版 client 用，會把每張圖片轉成 base64 塞進 JSON；新版請用 /pictures/list
+# 加上 size=thumb 可以只拿縮圖，payload 小很多
 # 前端呼叫: api.get('/pictures?user_id=2')
 @app.get("/pictures")
-async def get_pictures(user_id: int = Query(..., description="要查詢的使用者 ID")):
-    async with app.state.db_pool.acquire() as conn:
+async def get_pictures(
+    user_id: int = Query(..., description="要查詢的使用者 ID"),
+    size: Optional[ImageSize] = Query(None, description="thumb / small / large，不給就是原圖"),
+    if_none_match: Optional[str] = Header(None),
+):
+    async with app.state.read_pool.acquire(user_id) as conn:
+        # 這個 API 的回應很大 (整份 base64)，沒變就不要重讀圖片
+        etag = await resource_etag(conn, user_id, "pictures", "all", size)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
         # 記得抓取 description
         rows = await conn.fetch("""
-            SELECT id, img, description FROM pictures 
+            SELECT id, blob_key, img IS NOT NULL AS has_img, description FROM pictures 
             WHERE user_id = $1 
             ORDER BY id DESC
         """, user_id)
         
-        results = []
-        for row in rows:
-            img_bytes = row['img']
-            if img_bytes:
-                img_base64 = base64.b64encode(img_bytes).decode('utf-8')
-                results.append({
-                    "id": row['id'],
-                    "uri": f"data:image/jpg;base64,{img_base64}",
-                    "description": row['description'] # 回傳附註文字
-                })
-            
-        return results
+    results = []
+    for row in rows:
+        img_bytes = await load_picture_bytes(row, size)
+        if img_bytes:
+            img_base64 = base64.b64encode(img_bytes).decode('utf-8')
+            results.append({
+                "id": row['id'],
+                "uri": f"data:image/jpg;base64,{img_base64}",
+                "description": row['description'] # 回傳附註文字
+            })
+
+    return json_response(results, etag)
         
 @app.get("/pictures/recent/{user_id}")
-async def get_recent_picture(user_id: int):
+async def get_recent_picture(
+    user_id: int,
+    response: Response,
+    size: Optional[ImageSize] = Query(None, description="thumb / small / large，不給就是原圖"),
+    if_none_match: Optional[str] = Header(None),
+):
     """
     獲取指定 ID 的最新圖片 (返回 Base64 編碼字串)。
     """
-    import base64
-    async with app.state.db_pool.acquire() as conn:
+    async with app.state.read_pool.acquire(user_id) as conn:
+        etag = await resource_etag(conn, user_id, "pictures", "recent", size)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
         # 假設 'id' 越大表示越新，獲取該 user_id 的最大 id 記錄
         row = await conn.fetchrow(
-            "SELECT img FROM pictures WHERE user_id = $1 ORDER BY id DESC LIMIT 1",
+            "SELECT id, blob_key, img IS NOT NULL AS has_img FROM pictures WHERE user_id = $1 ORDER BY id DESC LIMIT 1",
             user_id
         )
         
-        if not row or not row["img"]:
-            # 如果找不到圖片，返回一個空字串或 404
-            return {"image_data": None, "message": "No recent picture found."}
-            
-        # 將 BYTEA 數據重新編碼為 Base64 字串
-        encoded_image = base64.b64encode(row["img"]).decode('utf-8')
+    img_bytes = await load_picture_bytes(row, size) if row else None
+    if not img_bytes:
+        # 如果找不到圖片，返回一個空字串或 404
+        return {"image_data": None, "message": "No recent picture found."}
         
-        # 返回 Base64 URI 格式，方便前端 Image 元件直接使用
-        return {"image_data": f"data:image/jpeg;base64,{encoded_image}"}
+    # 將圖片重新編碼為 Base64 字串
+    encoded_image = base64.b64encode(img_bytes).decode('utf-8')
+    
+    # 返回 Base64 URI 格式，方便前端 Image 元件直接使用
+    set_etag(response, etag)
+    return {"image_data": f"data:image/jpeg;base64,{encoded_image}"}
 
 
 # 1. 修改獲取用戶狀態的 API (讓它讀取真實 DB 數據)
 @app.get("/api/v1/user/record_status", response_model=UserRecordStatus)
-async def get_user_record_status(user_id: int = Query(1)):
-    async with app.state.db_pool.acquire() as conn:
-        # 2. 修改 SQL：增加 SELECT is_studying
-        # 請確認你的資料庫 users 表格中確實有 'is_studying' 這個欄位
-        row = await conn.fetchrow("""
-            SELECT title, badge, is_studying 
-            FROM users 
-            WHERE user_id = $1
-        """, user_id)
-        
-        if not row:
-            # 如果找不到人，回傳預設值 (is_studying 預設為 False)
-            return UserRecordStatus(
-                title_name="新手", 
-                badge_count=0, 
-                is_studying=False
-            )
-
+async def get_user_record_status(
+    response: Response,
+    user_id: int = Query(1),
+    if_none_match: Optional[str] = Header(None),
+):
+    # title / badge 從 profile 快取拿，is_studying 從 presence 快取拿
+    presence: PresenceCache = app.state.presence
+    row = (await presence.get_profiles([user_id])).get(user_id)
+    
+    if not row:
+        # 如果找不到人，回傳預設值 (is_studying 預設為 False)
         return UserRecordStatus(
-            title_name=row['title'] if row['title'] else "無稱號",
-            badge_count=row['badge'] if row['badge'] else 0,
-            # 3. 回傳狀態 (如果資料庫欄位可能是 NULL，這裡做個防呆轉成 False)
-            is_studying=row['is_studying'] if row['is_studying'] is not None else False
-        )
\ No newline at end of file
+            title_name="新手", 
+            badge_count=0, 
+            is_studying=False
+        )
+
+    is_studying, _ = presence.get(user_id)
+    status = UserRecordStatus(
+        title_name=row['title'] if row['title'] else "無稱號",
+        badge_count=row['badge'] if row['badge'] else 0,
+        is_studying=is_studying
+    )
+    etag = content_etag(status.model_dump())
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+    return status
+
+
+# === 背景工作 (jobs.py) ===
+JOB_HANDLERS = {
+    "focus.rollup": focus_rollup_job,
+    "user.title": title_upgrade_job,
+    "picture.derivatives": picture_derivatives_job,
+}
+
+@app.get("/api/v1/jobs/metrics")
+async def get_job_metrics():
+    """佇列深度 (各 kind 排隊 / 執行中 / 失敗的數量、最久的排隊時間) 與這個 worker process 的延遲。"""
+    return await app.state.jobs.metrics()
+
+
+# === Prometheus metrics (metrics.py) ===
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    """
+    這個 worker process 的 pool 連線數、等待連線的時間、各查詢的延遲 (db.py) 與 job 統計。
+    只讀記憶體，不查 DB：pool 滿了的時候也能 scrape。
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+# === 效能除錯 (profiling.py) ===
+# 需要設定 DEBUG_TOKEN 環境變數，request 帶 X-Debug-Token header；沒設的話這些路徑都是 404
+def require_debug_token(x_debug_token: Optional[str] = Header(None)):
+    if not profiling.DEBUG_TOKEN or not hmac.compare_digest(x_debug_token or "", profiling.DEBUG_TOKEN):
+        raise HTTPException(status_code=404)
+
+@app.get("/debug/profile/routes", dependencies=[Depends(require_debug_token)], include_in_schema=False)
+async def debug_route_profile():
+    """各 route 最近的延遲 (p50 / p95)、平均 DB 時間與 Python 時間、回應大小，依總耗時排序。"""
+    return {"routes": profiling.route_summary()}
+
+@app.get("/debug/slow-queries", dependencies=[Depends(require_debug_token)], include_in_schema=False)
+async def debug_slow_queries():
+    """超過 SLOW_QUERY_MS 的查詢 (新的在前)，參數不回傳。"""
+    return {
+        "threshold_ms": profiling.SLOW_QUERY_MS,
+        "queries": [{
+            "id": q.id, "name": q.name, "route": q.route, "elapsed_ms": q.elapsed_ms,
+            "at": datetime.fromtimestamp(q.at), "error": q.error, "sql": q.sql, "plan": q.plan,
+        } for q in profiling.slow_queries()],
+    }
+
+@app.post("/debug/slow-queries/{query_id}/explain", dependencies=[Depends(require_debug_token)], include_in_schema=False)
+async def debug_explain_slow_query(
+    query_id: int,
+    analyze: bool = Query(False, description="真的執行一次 (EXPLAIN ANALYZE)，在 transaction 裡做完就 rollback"),
+):
+    """用當時的參數重新 EXPLAIN 這個慢查詢，結果也會留在 /debug/slow-queries。"""
+    query = profiling.find_slow_query(query_id)
+    if query is None:
+        raise HTTPException(status_code=404, detail="找不到這筆慢查詢 (可能已經被新的擠掉)")
+
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+    async with app.state.db_pool.acquire() as conn:
+        # 寫入的查詢也可能被 ANALYZE 執行，一律 rollback
+        tr = conn.transaction()
+        await tr.start()
+        try:
+            await conn.execute("SET LOCAL statement_timeout = '30s'")
+            plan = await conn.fetchval(f"EXPLAIN ({options}) {query.sql}", *query.args)
+        except asyncpg.PostgresError as e:
+            raise HTTPException(status_code=400, detail=f"EXPLAIN 失敗: {e}")
+        finally:
+            await tr.rollback()
+
+    query.plan = json.loads(plan) if isinstance(plan, str) else plan
+    return {"id": query.id, "name": query.name, "analyze": analyze, "plan": query.plan}
+
+@app.post("/debug/profiler/start", dependencies=[Depends(require_debug_token)], include_in_schema=False)
+async def debug_start_profiler(
+    seconds: float = Query(30, gt=0, le=300),
+    interval_ms: float = Query(5, ge=1, le=1000),
+):
+    """
+    開始 sampling profiler (只看這個 worker process)，時間到自動停止，
+    之後用 GET /debug/profiler 看結果。
+    """
+    try:
+        # 這裡在 event loop 的 thread 上執行，就是要取樣的 thread
+        profiling.profiler.start(threading.get_ident(), seconds, interval_ms / 1000)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"status": "started", "seconds": seconds, "interval_ms": interval_ms}
+
+@app.post("/debug/profiler/stop", dependencies=[Depends(require_debug_token)], include_in_schema=False)
+async def debug_stop_profiler():
+    profiling.profiler.stop()
+    return {"status": "stopping"}
+
+@app.get("/debug/profiler", dependencies=[Depends(require_debug_token)], include_in_schema=False)
+async def debug_profiler_report(
+    format: Literal["json", "collapsed"] = Query("json", description="collapsed 可以直接給 flamegraph.pl / speedscope"),
+    top: int = Query(50, ge=1, le=1000),
+):
+    if format == "collapsed":
+        return PlainTextResponse(profiling.profiler.collapsed())
+    return profiling.profiler.report(top)
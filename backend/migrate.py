@@ -0,0 +1,182 @@
+"""
+資料庫 schema migration
+
+migrations/ 裡的檔案依編號執行，每個只會執行一次，執行過的記在 schema_migrations：
+  - NNNN_名稱.sql：直接執行整個檔案
+  - NNNN_名稱.py：定義 `async def upgrade(conn)`，需要 Python 邏輯 (依現有資料決定做什麼) 時用。
+    SQL 一律寫在 migration 檔案裡，不要 import app 模組的常數：checksum 只涵蓋這個檔案，
+    常數之後被改掉時，已經執行過的 migration 會在新的資料庫上做出不一樣的 schema
+每個 migration 在自己的 transaction 裡執行 (失敗就整個 rollback，不會寫進 schema_migrations)；
+需要在 transaction 外執行的 (例如 CREATE INDEX CONCURRENTLY)：.sql 第一行寫 `-- migrate: no-transaction`，
+.py 設 `TRANSACTIONAL = False`。
+
+執行期間拿 advisory lock，同時啟動的多個 process 只有一個會真的執行，其他的等它做完。
+app 啟動時只檢查版本 (verify_schema)，不執行 DDL：
+    docker compose exec backend python migrate.py          # 執行還沒跑過的 migration
+    docker compose exec backend python migrate.py status   # 列出每個 migration 的狀態
+
+新增 migration：在 migrations/ 加下一個編號的檔案，已經發佈的檔案不要再改
+(status 會比對 checksum 提醒)。
+"""
+import argparse
+import asyncio
+import hashlib
+import importlib.util
+import os
+import re
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+import asyncpg
+
+DATABASE_URL = os.environ.get("DATABASE_URL", "postgresql://postgres:password@db:5432/focusmate")
+MIGRATIONS_DIR = Path(__file__).resolve().parent / "migrations"
+MIGRATION_FILE_RE = re.compile(r"^(\d{4})_(\w+)\.(sql|py)$")
+# pg_advisory_lock 的 key (任意固定的數字，不要跟其他地方的 advisory lock 撞到)
+MIGRATION_LOCK_KEY = 7_310_001
+
+CREATE_MIGRATIONS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version     INTEGER PRIMARY KEY,
+        name        TEXT NOT NULL,
+        checksum    TEXT NOT NULL,
+        applied_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+        duration_ms INTEGER NOT NULL
+    );
+"""
+
+
+class SchemaOutOfDate(RuntimeError):
+    pass
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    path: Path
+
+    @property
+    def checksum(self) -> str:
+        return hashlib.sha256(self.path.read_bytes()).hexdigest()
+
+    @property
+    def transactional(self) -> bool:
+        if self.path.suffix == ".sql":
+            first_line = self.path.read_text(encoding="utf-8").split("\n", 1)[0]
+            return "migrate: no-transaction" not in first_line
+        return getattr(self.load_module(), "TRANSACTIONAL", True)
+
+    def load_module(self):
+        """.py migration 的 module (benchmark 也用它拿 migration 裡的 SQL)。"""
+        spec = importlib.util.spec_from_file_location(f"migrations.m{self.version:04d}", self.path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+    async def apply(self, conn: asyncpg.Connection):
+        if self.path.suffix == ".sql":
+            await conn.execute(self.path.read_text(encoding="utf-8"))
+        else:
+            await self.load_module().upgrade(conn)
+
+
+def discover(directory: Path = MIGRATIONS_DIR) -> List[Migration]:
+    migrations = []
+    for path in sorted(directory.iterdir()):
+        match = MIGRATION_FILE_RE.match(path.name)
+        if match:
+            migrations.append(Migration(int(match.group(1)), match.group(2), path))
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"{directory} 有重複的 migration 編號")
+    return migrations
+
+
+async def applied_versions(conn: asyncpg.Connection) -> dict:
+    exists = await conn.fetchval("SELECT to_regclass('schema_migrations') IS NOT NULL")
+    if not exists:
+        return {}
+    rows = await conn.fetch("SELECT version, checksum FROM schema_migrations")
+    return {row["version"]: row["checksum"] for row in rows}
+
+
+async def migrate(conn: asyncpg.Connection, target: Optional[int] = None, log=print) -> List[Migration]:
+    """執行還沒跑過的 migration (到 target 為止)，回傳這次執行的。"""
+    migrations = [m for m in discover() if target is None or m.version <= target]
+    await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_KEY)
+    try:
+        await conn.execute(CREATE_MIGRATIONS_TABLE_SQL)
+        # 拿到 lock 之後才讀：前一個拿 lock 的 process 可能已經做完了
+        done = await applied_versions(conn)
+        ran = []
+        for migration in migrations:
+            if migration.version in done:
+                continue
+            log(f"執行 migration {migration.version:04d}_{migration.name} ...")
+            started = time.perf_counter()
+            if migration.transactional:
+                async with conn.transaction():
+                    await migration.apply(conn)
+                    await _record(conn, migration, started)
+            else:
+                await migration.apply(conn)
+                await _record(conn, migration, started)
+            log(f"  完成 ({(time.perf_counter() - started) * 1000:.0f}ms)")
+            ran.append(migration)
+        return ran
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_KEY)
+
+
+async def _record(conn: asyncpg.Connection, migration: Migration, started: float):
+    await conn.execute("""
+        INSERT INTO schema_migrations (version, name, checksum, duration_ms)
+        VALUES ($1, $2, $3, $4)
+    """, migration.version, migration.name, migration.checksum, int((time.perf_counter() - started) * 1000))
+
+
+async def verify_schema(conn: asyncpg.Connection):
+    """app 啟動時呼叫：只讀 schema_migrations (一個查詢)，有還沒執行的 migration 就拒絕啟動。"""
+    done = await applied_versions(conn)
+    pending = [m for m in discover() if m.version not in done]
+    if pending:
+        names = ", ".join(f"{m.version:04d}_{m.name}" for m in pending)
+        raise SchemaOutOfDate(f"資料庫 schema 不是最新的 (還沒執行: {names})，請先執行 `python migrate.py`")
+
+
+async def status(conn: asyncpg.Connection):
+    done = await applied_versions(conn)
+    for migration in discover():
+        checksum = done.get(migration.version)
+        if checksum is None:
+            state = "pending"
+        elif checksum != migration.checksum:
+            state = "applied (檔案在執行後被修改過!)"
+        else:
+            state = "applied"
+        print(f"{migration.version:04d}_{migration.name}: {state}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", nargs="?", choices=["up", "status"], default="up")
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    parser.add_argument("--target", type=int, default=None, help="只執行到這個編號")
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(args.dsn)
+    try:
+        if args.command == "status":
+            await status(conn)
+        else:
+            ran = await migrate(conn, args.target)
+            print(f"執行了 {len(ran)} 個 migration" if ran else "schema 已經是最新的")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+"""
+把 pictures.img (BYTEA) 裡的舊圖片搬到 blob store，搬完後把 img 清成 NULL。
+已經產生過的縮圖 (picture_derivatives 以 'pic-<id>' 為 source_key) 同時改掛到新的 blob_key，
+不用重新產生；新的 key 已經有同尺寸的縮圖 (內容重複的圖片) 時，舊的那份連檔案一起刪掉。
+
+一次只讀一張圖片進記憶體，可以重複執行 (只處理還沒搬的資料)。
+    docker compose exec backend python migrate_pictures.py
+搬完之後建議跑 `VACUUM FULL pictures;` 把空間還給作業系統。
+"""
+import argparse
+import asyncio
+import os
+
+import asyncpg
+
+from blob_store import get_blob_store, sniff_image_type
+
+DATABASE_URL = os.environ.get("DATABASE_URL", "postgresql://postgres:password@db:5432/focusmate")
+
+# 新 key 已經有同 variant / format 的縮圖：舊的那列是多餘的
+DROP_DUPLICATE_DERIVATIVES_SQL = """
+    DELETE FROM picture_derivatives d
+    WHERE d.source_key = $1
+      AND EXISTS (
+          SELECT 1 FROM picture_derivatives e
+          WHERE e.source_key = $2 AND e.variant = d.variant AND e.format = d.format
+      )
+    RETURNING d.blob_key
+"""
+
+REKEY_DERIVATIVES_SQL = """
+    UPDATE picture_derivatives SET source_key = $2 WHERE source_key = $1
+"""
+
+# 刪掉的縮圖檔案可能跟別張圖的縮圖 / 原圖內容相同 (content-addressed)，還有人用就留著
+UNREFERENCED_BLOBS_SQL = """
+    SELECT k FROM unnest($1::text[]) AS k
+    WHERE NOT EXISTS (SELECT 1 FROM picture_derivatives WHERE blob_key = k)
+      AND NOT EXISTS (SELECT 1 FROM pictures WHERE blob_key = k)
+"""
+
+
+async def rekey_derivatives(conn: asyncpg.Connection, picture_id: int, blob_key: str):
+    """呼叫端的 transaction 裡執行；回傳 commit 之後可以刪掉的縮圖檔案。"""
+    old_key = f"pic-{picture_id}"
+    dropped = [r["blob_key"] for r in await conn.fetch(DROP_DUPLICATE_DERIVATIVES_SQL, old_key, blob_key)]
+    await conn.execute(REKEY_DERIVATIVES_SQL, old_key, blob_key)
+    if not dropped:
+        return []
+    return [r["k"] for r in await conn.fetch(UNREFERENCED_BLOBS_SQL, dropped)]
+
+
+async def migrate(dsn: str, batch_size: int):
+    store = get_blob_store()
+    conn = await asyncpg.connect(dsn)
+    moved = 0
+    total_bytes = 0
+    try:
+        while True:
+            ids = await conn.fetch("""
+                SELECT id FROM pictures
+                WHERE img IS NOT NULL AND blob_key IS NULL
+                ORDER BY id
+                LIMIT $1
+            """, batch_size)
+            if not ids:
+                break
+
+            for r in ids:
+                img = await conn.fetchval("SELECT img FROM pictures WHERE id = $1", r["id"])
+                if img is None:
+                    continue
+                key, size = await store.put_bytes(img)
+                # 檔案先寫好再改 DB，中途中斷的話下次會再搬一次 (內容相同所以會 dedupe)
+                async with conn.transaction():
+                    await conn.execute("""
+                        UPDATE pictures
+                        SET blob_key = $2, size_bytes = $3,
+                            content_type = COALESCE(content_type, $4),
+                            img = NULL
+                        WHERE id = $1
+                    """, r["id"], key, size, sniff_image_type(img[:16]))
+                    orphans = await rekey_derivatives(conn, r["id"], key)
+                for orphan in orphans:
+                    await store.delete(orphan)
+                moved += 1
+                total_bytes += size
+
+            print(f"已搬移 {moved} 張 ({total_bytes / 1024 / 1024:.1f} MB)")
+
+        # 以前的版本搬過的圖片：blob_key 有了，縮圖還掛在 'pic-<id>'
+        leftovers = await conn.fetch("""
+            SELECT p.id, p.blob_key FROM pictures p
+            WHERE p.blob_key IS NOT NULL
+              AND EXISTS (SELECT 1 FROM picture_derivatives d WHERE d.source_key = 'pic-' || p.id)
+        """)
+        for r in leftovers:
+            async with conn.transaction():
+                orphans = await rekey_derivatives(conn, r["id"], r["blob_key"])
+            for orphan in orphans:
+                await store.delete(orphan)
+        if leftovers:
+            print(f"已改掛 {len(leftovers)} 張已搬移圖片的縮圖")
+    finally:
+        await conn.close()
+
+    print(f"完成：共搬移 {moved} 張圖片")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(migrate(args.dsn, args.batch_size))
@@ -0,0 +1,466 @@
+"""
+改用 migration 之前 main.py 的 startup() 每次啟動都會執行的 DDL (users ~ jobs)，原封不動搬過來。
+全部都是 IF NOT EXISTS / 只處理還沒處理過的資料，所以已經有資料的資料庫也可以直接執行。
+
+所有 SQL 都寫死在這個檔案裡，不 import app 的模組：執行過的 migration 不能跟著程式碼改變
+(checksum 只涵蓋這個檔案)。之後要改這些物件請加新的 migration。
+"""
+
+# 新訊息 INSERT 後發 NOTIFY (channel 是 realtime.NOTIFY_CHANNEL)：payload 直接帶上前端通知需要的欄位
+# (含 sender_name)，超過 pg_notify 的 8000 bytes 上限時只送 id，由 MessageHub 自己回查。
+NOTIFY_TRIGGER_SQL = """
+    CREATE OR REPLACE FUNCTION notify_new_message() RETURNS trigger AS $$
+    DECLARE
+        payload TEXT;
+    BEGIN
+        payload := json_build_object(
+            'id', NEW.id,
+            'receiver_id', NEW.receiver_id,
+            'sender_id', NEW.sender_id,
+            'content', NEW.content,
+            'created_at', NEW.created_at,
+            'sender_name', (SELECT name FROM users WHERE user_id = NEW.sender_id)
+        )::text;
+        IF octet_length(payload) > 7900 THEN
+            payload := json_build_object('id', NEW.id, 'receiver_id', NEW.receiver_id)::text;
+        END IF;
+        PERFORM pg_notify('new_message', payload);
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_notify_new_message ON messages;
+    CREATE TRIGGER trg_notify_new_message
+        AFTER INSERT ON messages
+        FOR EACH ROW EXECUTE FUNCTION notify_new_message();
+"""
+
+# 縮圖 (derivatives) 對照表 (images.py)
+DERIVATIVES_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS picture_derivatives (
+        source_key   TEXT NOT NULL,
+        variant      TEXT NOT NULL,
+        format       TEXT NOT NULL,
+        blob_key     TEXT NOT NULL,
+        size_bytes   INTEGER NOT NULL,
+        content_type TEXT NOT NULL,
+        created_at   TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (source_key, variant, format)
+    );
+"""
+
+# 每個 user、每種資料的版本號 (versions.py)
+VERSIONS_TABLE_SQL = """
+    CREATE SEQUENCE IF NOT EXISTS resource_version_seq;
+    CREATE TABLE IF NOT EXISTS resource_versions (
+        user_id  INTEGER NOT NULL,
+        resource TEXT NOT NULL,
+        version  BIGINT NOT NULL,
+        PRIMARY KEY (user_id, resource)
+    );
+"""
+
+# 寫入 deadlines / pictures / focus_time / focus_daily / messages 時更新受影響 user 的版本號。
+# transition table (changed) 讓一個 statement 改很多列時，每個 user 也只更新一次；
+# 有 transition table 的 trigger 只能對應一種事件，所以每張表各三個。
+VERSION_TRIGGERS_SQL = """
+    CREATE OR REPLACE FUNCTION bump_deadlines_version() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO resource_versions (user_id, resource, version)
+        SELECT c.user_id, 'deadlines', nextval('resource_version_seq')
+        FROM (SELECT DISTINCT user_id FROM changed) c
+        ON CONFLICT (user_id, resource) DO UPDATE SET version = EXCLUDED.version;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_version_deadlines_insert ON deadlines;
+    CREATE TRIGGER trg_version_deadlines_insert
+        AFTER INSERT ON deadlines
+        REFERENCING NEW TABLE AS changed
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_deadlines_version();
+
+    DROP TRIGGER IF EXISTS trg_version_deadlines_update ON deadlines;
+    CREATE TRIGGER trg_version_deadlines_update
+        AFTER UPDATE ON deadlines
+        REFERENCING NEW TABLE AS changed
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_deadlines_version();
+
+    DROP TRIGGER IF EXISTS trg_version_deadlines_delete ON deadlines;
+    CREATE TRIGGER trg_version_deadlines_delete
+        AFTER DELETE ON deadlines
+        REFERENCING OLD TABLE AS changed
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_deadlines_version();
+
+    CREATE OR REPLACE FUNCTION bump_pictures_version() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO resource_versions (user_id, resource, version)
+        SELECT c.user_id, 'pictures', nextval('resource_version_seq')
+        FROM (SELECT DISTINCT user_id FROM changed) c
+        ON CONFLICT (user_id, resource) DO UPDATE SET version = EXCLUDED.version;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_version_pictures_insert ON pictures;
+    CREATE TRIGGER trg_version_pictures_insert
+        AFTER INSERT ON pictures
+        REFERENCING NEW TABLE AS changed
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_pictures_version();
+
+    DROP TRIGGER IF EXISTS trg_version_pictures_update ON pictures;
+    CREATE TRIGGER trg_version_pictures_update
+        AFTER UPDATE ON pictures
+        REFERENCING NEW TABLE AS changed
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_pictures_version();
+
+    DROP TRIGGER IF EXISTS trg_version_pictures_delete ON pictures;
+    CREATE TRIGGER trg_version_pictures_delete
+        AFTER DELETE ON pictures
+        REFERENCING OLD TABLE AS changed
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_pictures_version();
+
+    CREATE OR REPLACE FUNCTION bump_focus_time_version() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO resource_versions (user_id, resource, version)
+        SELECT c.user_id, 'focus', nextval('resource_version_seq')
+        FROM (SELECT DISTINCT user_id FROM changed) c
+        ON CONFLICT (user_id, resource) DO UPDATE SET version = EXCLUDED.version;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_version_focus_time_insert ON focus_time;
+    CREATE TRIGGER trg_version_focus_time_insert
+        AFTER INSERT ON focus_time
+        REFERENCING NEW TABLE AS changed
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_focus_time_version();
+
+    DROP TRIGGER IF EXISTS trg_version_focus_time_update ON focus_time;
+    CREATE TRIGGER trg_version_focus_time_update
+        AFTER UPDATE ON focus_time
+        REFERENCING NEW TABLE AS changed
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_focus_time_version();
+
+    DROP TRIGGER IF EXISTS trg_version_focus_time_delete ON focus_time;
+    CREATE TRIGGER trg_version_focus_time_delete
+        AFTER DELETE ON focus_time
+        REFERENCING OLD TABLE AS changed
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_focus_time_version();
+
+    CREATE OR REPLACE FUNCTION bump_focus_daily_version() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO resource_versions (user_id, resource, version)
+        SELECT c.user_id, 'focus', nextval('resource_version_seq')
+        FROM (SELECT DISTINCT user_id FROM changed) c
+        ON CONFLICT (user_id, resource) DO UPDATE SET version = EXCLUDED.version;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_version_focus_daily_insert ON focus_daily;
+    CREATE TRIGGER trg_version_focus_daily_insert
+        AFTER INSERT ON focus_daily
+        REFERENCING NEW TABLE AS changed
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_focus_daily_version();
+
+    DROP TRIGGER IF EXISTS trg_version_focus_daily_update ON focus_daily;
+    CREATE TRIGGER trg_version_focus_daily_update
+        AFTER UPDATE ON focus_daily
+        REFERENCING NEW TABLE AS changed
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_focus_daily_version();
+
+    DROP TRIGGER IF EXISTS trg_version_focus_daily_delete ON focus_daily;
+    CREATE TRIGGER trg_version_focus_daily_delete
+        AFTER DELETE ON focus_daily
+        REFERENCING OLD TABLE AS changed
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_focus_daily_version();
+
+    CREATE OR REPLACE FUNCTION bump_messages_version() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO resource_versions (user_id, resource, version)
+        SELECT c.user_id, 'messages', nextval('resource_version_seq')
+        FROM (SELECT DISTINCT receiver_id AS user_id FROM changed) c
+        ON CONFLICT (user_id, resource) DO UPDATE SET version = EXCLUDED.version;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_version_messages_insert ON messages;
+    CREATE TRIGGER trg_version_messages_insert
+        AFTER INSERT ON messages
+        REFERENCING NEW TABLE AS changed
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_messages_version();
+
+    DROP TRIGGER IF EXISTS trg_version_messages_update ON messages;
+    CREATE TRIGGER trg_version_messages_update
+        AFTER UPDATE ON messages
+        REFERENCING NEW TABLE AS changed
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_messages_version();
+
+    DROP TRIGGER IF EXISTS trg_version_messages_delete ON messages;
+    CREATE TRIGGER trg_version_messages_delete
+        AFTER DELETE ON messages
+        REFERENCING OLD TABLE AS changed
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_messages_version();
+"""
+
+# 背景工作佇列 (jobs.py)
+JOBS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id              BIGSERIAL PRIMARY KEY,
+        kind            TEXT NOT NULL,
+        payload         JSONB NOT NULL DEFAULT '{}',
+        idempotency_key TEXT,
+        status          TEXT NOT NULL DEFAULT 'queued',  -- queued / running / done / failed
+        attempts        INTEGER NOT NULL DEFAULT 0,
+        max_attempts    INTEGER NOT NULL DEFAULT 5,
+        run_at          TIMESTAMPTZ NOT NULL DEFAULT now(),
+        created_at      TIMESTAMPTZ NOT NULL DEFAULT now(),
+        started_at      TIMESTAMPTZ,
+        finished_at     TIMESTAMPTZ,
+        last_error      TEXT
+    );
+    -- worker 搶工作只看還沒完成的，完成的工作不佔 index
+    CREATE INDEX IF NOT EXISTS idx_jobs_pending ON jobs (run_at, id) WHERE status IN ('queued', 'running');
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_idempotency
+        ON jobs (idempotency_key) WHERE status = 'queued';
+"""
+
+# focus_daily 第一次建立時從既有的 focus_time 補算
+FOCUS_DAILY_BACKFILL_SQL = """
+    INSERT INTO focus_daily (user_id, record_date, focus_minutes)
+    SELECT user_id, record_date, SUM(focus_minutes)
+    FROM focus_time
+    GROUP BY user_id, record_date
+    ON CONFLICT (user_id, record_date) DO UPDATE SET focus_minutes = EXCLUDED.focus_minutes
+"""
+
+
+async def upgrade(conn):
+    # users
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id SERIAL PRIMARY KEY,
+            name TEXT not NULL,
+            is_studying BOOLEAN,
+            title TEXT,
+            badge INTEGER
+        );
+    """)
+
+    await conn.execute("""
+        ALTER TABLE users
+        ADD COLUMN IF NOT EXISTS is_breaking BOOLEAN;
+    """)
+    
+    # friends
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS friends (
+            user_id   INTEGER NOT NULL,
+            friend_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, friend_id),
+            FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+            FOREIGN KEY (friend_id) REFERENCES users(user_id) ON DELETE CASCADE
+        );
+    """)
+
+    # 反向查詢 (誰把我加為好友) 用
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_friends_friend_id ON friends (friend_id);
+    """)
+
+    # new friends (舊版的 JSON 好友列表，已改用 friends 表，只保留來搬資料)
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS new_friends (
+            user_id          INTEGER NOT NULL PRIMARY KEY,
+            friend_id_list   JSON,
+            FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        );
+    """)
+    await conn.execute("""
+        ALTER TABLE new_friends ADD COLUMN IF NOT EXISTS migrated BOOLEAN DEFAULT FALSE;
+    """)
+    # 把還沒搬過的 friend_id_list 搬進 friends 表 (每列只搬一次)
+    async with conn.transaction():
+        await conn.execute("""
+            INSERT INTO friends (user_id, friend_id)
+            SELECT nf.user_id, elem::int
+            FROM new_friends nf
+            CROSS JOIN LATERAL json_array_elements_text(nf.friend_id_list) AS elem
+            WHERE NOT nf.migrated
+              AND json_typeof(nf.friend_id_list) = 'array'
+              AND elem ~ '^[0-9]+$'
+              AND EXISTS (SELECT 1 FROM users u WHERE u.user_id = elem::int)
+            ON CONFLICT DO NOTHING;
+        """)
+        await conn.execute("UPDATE new_friends SET migrated = TRUE WHERE NOT migrated;")
+    # messages
+    # 修正重點 1: PostgreSQL 使用 SERIAL 來自動遞增，而不是 AUTOINCREMENT
+    # 修正重點 2: Boolean 預設值建議使用 FALSE，而不是 0
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS messages (
+            id           SERIAL PRIMARY KEY,
+            sender_id    INTEGER NOT NULL,
+            receiver_id  INTEGER NOT NULL,
+            content      TEXT NOT NULL,
+            is_read      BOOLEAN DEFAULT FALSE,
+            created_at   TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (sender_id) REFERENCES users(user_id) ON DELETE CASCADE,
+            FOREIGN KEY (receiver_id) REFERENCES users(user_id) ON DELETE CASCADE
+        );
+    """)
+
+    # 建立索引 (Index)
+    # 收件匣分頁用 (created_at, id)；未讀只建 partial index，已讀的訊息不佔空間
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_receiver_created
+        ON messages (receiver_id, created_at DESC, id DESC);
+    """)
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_receiver_unread
+        ON messages (receiver_id, created_at DESC, id DESC)
+        WHERE is_read = FALSE;
+    """)
+    # 上面兩個 index 已經涵蓋 (receiver_id, is_read) 的查詢
+    await conn.execute("DROP INDEX IF EXISTS idx_messages_receiver_read;")
+
+    # 新訊息 INSERT 後發 NOTIFY，給 /api/v1/messages/ws 推播用
+    await conn.execute(NOTIFY_TRIGGER_SQL)
+
+    # deadlines
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS deadlines (
+            id        SERIAL PRIMARY KEY,
+            user_id   INTEGER NOT NULL,
+            deadline_date   DATE,
+            task      TEXT,
+            is_done   BOOLEAN,
+            display_order INTEGER,
+            
+            FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        );
+    """)
+
+    await conn.execute("""
+        ALTER TABLE deadlines ADD COLUMN IF NOT EXISTS current_doing BOOLEAN DEFAULT false;
+    """)
+
+    await conn.execute("""
+        ALTER TABLE IF EXISTS public.deadlines
+        DROP CONSTRAINT IF EXISTS deadlines_user_id_display_order_key;
+    """)
+
+    # 排序改用字串 sort_key (見 ordering.py)，display_order 改成讀取時才算
+    await conn.execute("""
+        ALTER TABLE deadlines ADD COLUMN IF NOT EXISTS sort_key TEXT COLLATE "C";
+    """)
+    await conn.execute("""
+        UPDATE deadlines d
+        SET sort_key = 'a' || lpad(r.rank::text, 6, '0') || 'V'
+        FROM (
+            SELECT id, row_number() OVER (
+                PARTITION BY user_id ORDER BY is_done, display_order, id
+            ) AS rank
+            FROM deadlines
+        ) r
+        WHERE d.id = r.id AND d.sort_key IS NULL;
+    """)
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_deadlines_user_sort
+        ON deadlines (user_id, is_done, sort_key);
+    """)
+
+    # focus_time
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS focus_time (
+            user_id       INTEGER NOT NULL,
+            record_date   DATE NOT NULL,
+            record_hour   INT NOT NULL CHECK (record_hour BETWEEN 0 AND 23),
+            focus_minutes INT DEFAULT 0 CHECK (focus_minutes BETWEEN 0 AND 60),
+
+            FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+            PRIMARY KEY (user_id, record_date, record_hour)
+        );
+    """)
+    # 註: 我在這裡將 PRIMARY KEY 加入到 focus_time 表格，以便 ON CONFLICT 生效
+
+    await conn.execute("""
+        ALTER TABLE IF EXISTS public.focus_time
+        DROP CONSTRAINT IF EXISTS focus_time_user_id_record_date_record_hour_key;
+    """)
+
+    # focus_daily: 每人每天的總專注分鐘 (由 /focus/save 增量維護)，統計 API 用
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS focus_daily (
+            user_id       INTEGER NOT NULL,
+            record_date   DATE NOT NULL,
+            focus_minutes INT NOT NULL DEFAULT 0,
+
+            FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+            PRIMARY KEY (user_id, record_date)
+        );
+    """)
+    # 第一次建立時從既有的 focus_time 補算
+    if not await conn.fetchval("SELECT EXISTS (SELECT 1 FROM focus_daily)"):
+        await conn.execute(FOCUS_DAILY_BACKFILL_SQL)
+
+
+    # picture
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS pictures (
+            id      SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            img     BYTEA,
+            description TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        );
+    """)
+
+    # 圖片 metadata：列表 API 不用再讀 img 本體
+    await conn.execute("""
+        ALTER TABLE pictures
+        ADD COLUMN IF NOT EXISTS created_at   TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        ADD COLUMN IF NOT EXISTS size_bytes   INTEGER,
+        ADD COLUMN IF NOT EXISTS content_type TEXT,
+        ADD COLUMN IF NOT EXISTS blob_key     TEXT;
+    """)
+    # EXTERNAL = 不壓縮的 TOAST，substring() 只需讀取需要的 chunk，才能分段串流
+    await conn.execute("""
+        ALTER TABLE pictures ALTER COLUMN img SET STORAGE EXTERNAL;
+    """)
+    await conn.execute("""
+        UPDATE pictures SET size_bytes = octet_length(img)
+        WHERE size_bytes IS NULL AND img IS NOT NULL;
+    """)
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_pictures_user_id
+        ON pictures (user_id, id DESC);
+    """)
+
+    # 縮圖 (derivatives) 對照表
+    await conn.execute(DERIVATIVES_TABLE_SQL)
+
+    # /focus/sessions 的紀錄：client 產生的 session_id 讓重送的 request 不會重複計算
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS focus_sessions (
+            user_id          INTEGER NOT NULL,
+            session_id       TEXT NOT NULL,
+            duration_seconds INTEGER NOT NULL,
+            note             TEXT,
+            ended_at         TIMESTAMP NOT NULL,
+            badge_earned     BOOLEAN NOT NULL DEFAULT FALSE,
+            picture_id       INTEGER,
+            created_at       TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, session_id),
+            FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+            FOREIGN KEY (picture_id) REFERENCES pictures(id) ON DELETE SET NULL
+        );
+    """)
+
+    # 每個 user 每種資料的版本號 (ETag 用)，由 trigger 在寫入時更新
+    await conn.execute(VERSIONS_TABLE_SQL)
+    await conn.execute(VERSION_TRIGGERS_SQL)
+
+    # 背景工作佇列
+    await conn.execute(JOBS_TABLE_SQL)
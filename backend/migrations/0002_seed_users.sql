@@ -0,0 +1,8 @@
+-- 💡 確保 User 1 和 User 2 存在 (前端預設用這兩個帳號，避免 ForeignKeyViolationError)
+INSERT INTO users (user_id, name, is_studying, title, badge)
+VALUES (1, 'User 1', FALSE, 'Beginner', 0),
+       (2, 'User 2', FALSE, 'Beginner', 0)
+ON CONFLICT (user_id) DO NOTHING;
+
+-- 上面指定了 user_id，SERIAL 的 sequence 要跟上，不然下一個新 user 會撞到
+SELECT setval(pg_get_serial_sequence('users', 'user_id'), GREATEST((SELECT max(user_id) FROM users), 1));
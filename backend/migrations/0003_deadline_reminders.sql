@@ -0,0 +1,11 @@
+-- deadline 到期提醒 (reminders.py) 寄過的紀錄：同一個 deadline 在同一個日期、提前同樣天數只寄一次。
+-- deadline_date 也放進 key，改了日期之後會重新提醒。
+CREATE TABLE IF NOT EXISTS deadline_reminders (
+    deadline_id   INTEGER NOT NULL REFERENCES deadlines(id) ON DELETE CASCADE,
+    deadline_date DATE NOT NULL,
+    days_before   INTEGER NOT NULL,
+    sent_at       TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (deadline_id, deadline_date, days_before)
+);
+-- 每天清掉過期的紀錄
+CREATE INDEX IF NOT EXISTS idx_deadline_reminders_date ON deadline_reminders (deadline_date);
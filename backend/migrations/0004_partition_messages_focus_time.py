@@ -0,0 +1,258 @@
+"""
+messages / focus_time 改成每個月一個 partition (見 partitions.py)。
+
+舊的表改名後建立同名的 partitioned table，依舊資料的最早月份建好 partition，整份複製過去再刪掉舊表。
+資料搬完才建 index 和 trigger (NOTIFY、ETag 版本號)，複製的過程不會觸發推播或更新每個 user 的版本。
+超過保留期限的舊資料先照樣搬進 partition，之後由 partition 維護彙總後刪除。
+
+SQL 都寫死在這個檔案裡 (不 import partitions.py 等 app 模組)，執行過之後不會跟著程式碼改變。
+"""
+from datetime import date, datetime
+
+# partition 建到未來幾個月 (之後由 partitions.PartitionMaintenance 繼續往後建)
+MONTHS_AHEAD = 3
+
+MESSAGES_SQL = """
+    CREATE TABLE messages (
+        id           INTEGER NOT NULL DEFAULT nextval('messages_id_seq'),
+        sender_id    INTEGER NOT NULL,
+        receiver_id  INTEGER NOT NULL,
+        content      TEXT NOT NULL,
+        is_read      BOOLEAN DEFAULT FALSE,
+        created_at   TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, created_at),
+        FOREIGN KEY (sender_id) REFERENCES users(user_id) ON DELETE CASCADE,
+        FOREIGN KEY (receiver_id) REFERENCES users(user_id) ON DELETE CASCADE
+    ) PARTITION BY RANGE (created_at);
+"""
+
+# 建在 partitioned table 上，每個 partition 會自動建立自己的 index
+MESSAGES_INDEXES_SQL = """
+    CREATE INDEX IF NOT EXISTS idx_messages_receiver_created
+    ON messages (receiver_id, created_at DESC, id DESC);
+    CREATE INDEX IF NOT EXISTS idx_messages_receiver_unread
+    ON messages (receiver_id, created_at DESC, id DESC)
+    WHERE is_read = FALSE;
+"""
+
+FOCUS_TIME_SQL = """
+    CREATE TABLE focus_time (
+        user_id       INTEGER NOT NULL,
+        record_date   DATE NOT NULL,
+        record_hour   INT NOT NULL CHECK (record_hour BETWEEN 0 AND 23),
+        focus_minutes INT DEFAULT 0 CHECK (focus_minutes BETWEEN 0 AND 60),
+
+        FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+        PRIMARY KEY (user_id, record_date, record_hour)
+    ) PARTITION BY RANGE (record_date);
+"""
+
+ARCHIVE_SQL = """
+    CREATE TABLE IF NOT EXISTS messages_monthly (
+        receiver_id     INTEGER NOT NULL,
+        sender_id       INTEGER NOT NULL,
+        month           DATE NOT NULL,
+        message_count   INTEGER NOT NULL,
+        unread_count    INTEGER NOT NULL,  -- 超過保留期限還沒讀的
+        last_created_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (receiver_id, month, sender_id),
+        FOREIGN KEY (receiver_id) REFERENCES users(user_id) ON DELETE CASCADE,
+        FOREIGN KEY (sender_id) REFERENCES users(user_id) ON DELETE CASCADE
+    );
+
+    CREATE TABLE IF NOT EXISTS focus_hourly_monthly (
+        user_id       INTEGER NOT NULL,
+        month         DATE NOT NULL,
+        record_hour   INT NOT NULL,
+        focus_minutes INT NOT NULL,
+        PRIMARY KEY (user_id, month, record_hour),
+        FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+    );
+
+    -- 每個 messages partition 最小的 id (id 由 sequence 產生，大致跟 created_at 同方向增加)
+    CREATE TABLE IF NOT EXISTS messages_id_bounds (
+        partition_start TIMESTAMP PRIMARY KEY,
+        first_id        INTEGER NOT NULL
+    );
+
+    -- 前後各留一小時：跨月份的 transaction 拿到的 id 可能比下個月的第一個 id 還大
+    CREATE OR REPLACE FUNCTION messages_created_after(msg_id INTEGER) RETURNS TIMESTAMP
+    LANGUAGE sql STABLE AS $$
+        SELECT COALESCE(max(partition_start) - interval '1 hour', '-infinity')
+        FROM messages_id_bounds WHERE first_id <= msg_id
+    $$;
+
+    CREATE OR REPLACE FUNCTION messages_created_before(msg_id INTEGER) RETURNS TIMESTAMP
+    LANGUAGE sql STABLE AS $$
+        SELECT COALESCE(min(partition_start) + interval '1 hour', 'infinity')
+        FROM messages_id_bounds WHERE first_id > msg_id
+    $$;
+"""
+
+# 0001 的 trigger 跟著舊表改名了，新表要重建一次
+NOTIFY_TRIGGER_SQL = """
+    CREATE OR REPLACE FUNCTION notify_new_message() RETURNS trigger AS $$
+    DECLARE
+        payload TEXT;
+    BEGIN
+        payload := json_build_object(
+            'id', NEW.id,
+            'receiver_id', NEW.receiver_id,
+            'sender_id', NEW.sender_id,
+            'content', NEW.content,
+            'created_at', NEW.created_at,
+            'sender_name', (SELECT name FROM users WHERE user_id = NEW.sender_id)
+        )::text;
+        IF octet_length(payload) > 7900 THEN
+            payload := json_build_object('id', NEW.id, 'receiver_id', NEW.receiver_id)::text;
+        END IF;
+        PERFORM pg_notify('new_message', payload);
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_notify_new_message ON messages;
+    CREATE TRIGGER trg_notify_new_message
+        AFTER INSERT ON messages
+        FOR EACH ROW EXECUTE FUNCTION notify_new_message();
+"""
+
+VERSION_TRIGGERS_SQL = """
+    CREATE OR REPLACE FUNCTION bump_focus_time_version() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO resource_versions (user_id, resource, version)
+        SELECT c.user_id, 'focus', nextval('resource_version_seq')
+        FROM (SELECT DISTINCT user_id AS user_id FROM changed) c
+        ON CONFLICT (user_id, resource) DO UPDATE SET version = EXCLUDED.version;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_version_focus_time_insert ON focus_time;
+    CREATE TRIGGER trg_version_focus_time_insert
+        AFTER INSERT ON focus_time
+        REFERENCING NEW TABLE AS changed
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_focus_time_version();
+
+    DROP TRIGGER IF EXISTS trg_version_focus_time_update ON focus_time;
+    CREATE TRIGGER trg_version_focus_time_update
+        AFTER UPDATE ON focus_time
+        REFERENCING NEW TABLE AS changed
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_focus_time_version();
+
+    DROP TRIGGER IF EXISTS trg_version_focus_time_delete ON focus_time;
+    CREATE TRIGGER trg_version_focus_time_delete
+        AFTER DELETE ON focus_time
+        REFERENCING OLD TABLE AS changed
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_focus_time_version();
+
+    CREATE OR REPLACE FUNCTION bump_messages_version() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO resource_versions (user_id, resource, version)
+        SELECT c.user_id, 'messages', nextval('resource_version_seq')
+        FROM (SELECT DISTINCT receiver_id AS user_id FROM changed) c
+        ON CONFLICT (user_id, resource) DO UPDATE SET version = EXCLUDED.version;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_version_messages_insert ON messages;
+    CREATE TRIGGER trg_version_messages_insert
+        AFTER INSERT ON messages
+        REFERENCING NEW TABLE AS changed
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_messages_version();
+
+    DROP TRIGGER IF EXISTS trg_version_messages_update ON messages;
+    CREATE TRIGGER trg_version_messages_update
+        AFTER UPDATE ON messages
+        REFERENCING NEW TABLE AS changed
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_messages_version();
+
+    DROP TRIGGER IF EXISTS trg_version_messages_delete ON messages;
+    CREATE TRIGGER trg_version_messages_delete
+        AFTER DELETE ON messages
+        REFERENCING OLD TABLE AS changed
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_messages_version();
+"""
+
+# 每個 partition 最小的 id；沒有資料的月份等 partition 維護再記
+ID_BOUNDS_SQL = """
+    INSERT INTO messages_id_bounds (partition_start, first_id)
+    SELECT date_trunc('month', created_at), min(id) FROM messages GROUP BY 1
+    ON CONFLICT (partition_start) DO NOTHING
+"""
+
+
+def _add_months(d: date, months: int) -> date:
+    index = d.year * 12 + d.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+async def _create_partitions(conn, since: date):
+    """since 那個月到未來 MONTHS_AHEAD 個月，每個月一個 partition，另外各一個 default partition。"""
+    last = _add_months(date.today(), MONTHS_AHEAD)
+    for table, as_timestamp in (("messages", True), ("focus_time", False)):
+        await conn.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+        month = date(since.year, since.month, 1)
+        while month <= last:
+            lo, hi = month, _add_months(month, 1)
+            if as_timestamp:
+                lo, hi = datetime(lo.year, lo.month, 1), datetime(hi.year, hi.month, 1)
+            # partition bound 不能用參數
+            await conn.execute(f"""
+                CREATE TABLE {table}_p{month:%Y_%m} PARTITION OF {table}
+                FOR VALUES FROM ('{lo.isoformat()}') TO ('{hi.isoformat()}')
+            """)
+            month = _add_months(month, 1)
+
+
+async def _is_partitioned(conn, table: str) -> bool:
+    return await conn.fetchval("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass($1)", table)
+
+
+async def upgrade(conn):
+    await conn.execute(ARCHIVE_SQL)
+    if await _is_partitioned(conn, "messages") and await _is_partitioned(conn, "focus_time"):
+        return
+
+    # 舊表改名，index / constraint 也要改名，新表才能用原本的名字
+    await conn.execute("""
+        ALTER TABLE messages RENAME TO messages_unpartitioned;
+        ALTER TABLE messages_unpartitioned RENAME CONSTRAINT messages_pkey TO messages_unpartitioned_pkey;
+        ALTER INDEX IF EXISTS idx_messages_receiver_created RENAME TO idx_messages_unpartitioned_created;
+        ALTER INDEX IF EXISTS idx_messages_receiver_unread RENAME TO idx_messages_unpartitioned_unread;
+        ALTER SEQUENCE messages_id_seq OWNED BY NONE;
+
+        ALTER TABLE focus_time RENAME TO focus_time_unpartitioned;
+        ALTER TABLE focus_time_unpartitioned RENAME CONSTRAINT focus_time_pkey TO focus_time_unpartitioned_pkey;
+    """)
+    await conn.execute(MESSAGES_SQL)
+    await conn.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+    await conn.execute(FOCUS_TIME_SQL)
+
+    oldest = await conn.fetchval("""
+        SELECT least(
+            (SELECT min(created_at)::date FROM messages_unpartitioned),
+            (SELECT min(record_date) FROM focus_time_unpartitioned)
+        )
+    """)
+    await _create_partitions(conn, since=oldest or date.today())
+
+    await conn.execute("""
+        INSERT INTO messages (id, sender_id, receiver_id, content, is_read, created_at)
+        SELECT id, sender_id, receiver_id, content, is_read, COALESCE(created_at, CURRENT_TIMESTAMP)
+        FROM messages_unpartitioned;
+
+        INSERT INTO focus_time (user_id, record_date, record_hour, focus_minutes)
+        SELECT user_id, record_date, record_hour, focus_minutes
+        FROM focus_time_unpartitioned;
+
+        DROP TABLE messages_unpartitioned;
+        DROP TABLE focus_time_unpartitioned;
+    """)
+
+    await conn.execute(MESSAGES_INDEXES_SQL)
+    await conn.execute(NOTIFY_TRIGGER_SQL)
+    await conn.execute(VERSION_TRIGGERS_SQL)
+    await conn.execute(ID_BOUNDS_SQL)
+    await conn.execute("ANALYZE messages; ANALYZE focus_time;")
@@ -0,0 +1,60 @@
+-- deadline 的增量同步 (GET /deadlines/changes、POST /deadlines/sync，見 main.py)
+--
+-- row_version：最後一次寫入這列的 transaction id (xid8，只會變大)。
+-- 不用 sequence：sequence 的號碼順序跟 commit 順序不一樣，client 拿看過的最大號碼當下次的 since
+-- 會漏掉號碼比較小、但比較晚 commit 的寫入。用 xid 的話，server 回傳讀取當下 snapshot 的 xmin
+-- 當下次的 since，比 xmin 小的 transaction 一定都已經結束，不會漏。
+-- 既有的列是 0：since = 0 (第一次同步) 會整份拿到。
+ALTER TABLE deadlines ADD COLUMN IF NOT EXISTS row_version BIGINT NOT NULL DEFAULT 0;
+CREATE INDEX IF NOT EXISTS idx_deadlines_user_version ON deadlines (user_id, row_version);
+
+CREATE OR REPLACE FUNCTION deadlines_row_version() RETURNS trigger AS $$
+BEGIN
+    NEW.row_version := pg_current_xact_id()::text::bigint;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- /deadlines/sync 新增時 client 給的暫時 id：離線佇列重送同一筆 add 不會新增兩次
+ALTER TABLE deadlines ADD COLUMN IF NOT EXISTS client_id TEXT;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_deadlines_user_client_id ON deadlines (user_id, client_id)
+    WHERE client_id IS NOT NULL;
+
+DROP TRIGGER IF EXISTS trg_deadlines_row_version ON deadlines;
+CREATE TRIGGER trg_deadlines_row_version
+    BEFORE INSERT OR UPDATE ON deadlines
+    FOR EACH ROW EXECUTE FUNCTION deadlines_row_version();
+
+-- 刪掉的 deadline 留一筆 tombstone，client 才知道要從清單拿掉。
+-- 不加 users 的 foreign key：刪 user 時 cascade 刪 deadlines 也會寫 tombstone；
+-- 超過 DEADLINE_TOMBSTONE_DAYS 天的由 reminders.py 每天清掉。
+CREATE TABLE IF NOT EXISTS deadline_tombstones (
+    id          INTEGER PRIMARY KEY,
+    user_id     INTEGER NOT NULL,
+    row_version BIGINT NOT NULL,
+    deleted_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS idx_deadline_tombstones_user_version ON deadline_tombstones (user_id, row_version);
+CREATE INDEX IF NOT EXISTS idx_deadline_tombstones_deleted_at ON deadline_tombstones (deleted_at);
+
+CREATE OR REPLACE FUNCTION deadlines_tombstone() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO deadline_tombstones (id, user_id, row_version)
+    SELECT id, user_id, pg_current_xact_id()::text::bigint FROM removed
+    ON CONFLICT (id) DO UPDATE SET row_version = EXCLUDED.row_version, deleted_at = now();
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_deadlines_tombstone ON deadlines;
+CREATE TRIGGER trg_deadlines_tombstone
+    AFTER DELETE ON deadlines
+    REFERENCING OLD TABLE AS removed
+    FOR EACH STATEMENT EXECUTE FUNCTION deadlines_tombstone();
+
+-- 清掉的 tombstone 裡最大的 row_version + 1：since 比這個小的 client 可能漏掉刪除，要整份重拿
+CREATE TABLE IF NOT EXISTS deadline_sync_floor (
+    only_row    BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (only_row),
+    min_version BIGINT NOT NULL
+);
+INSERT INTO deadline_sync_floor (min_version) VALUES (0) ON CONFLICT DO NOTHING;
@@ -0,0 +1,29 @@
+-- 好友專注排行榜 (GET /api/v1/leaderboard/friends，見 leaderboard.py)
+--
+-- 每個 user 每天 / 每週 (週一開始，同 date_trunc('week')) 的專注分鐘數。
+-- main.FOCUS_UPSERT_SQL 寫 focus_time 時在同一個 statement 累加實際增加的分鐘數 (扣掉每小時 60 分鐘的上限)，
+-- focus.rollup job 再從 focus_time 重算一次；排行榜只要照好友的 user_id 查這張表，不用加總 focus_time。
+-- 超過 LEADERBOARD_RETENTION_WEEKS 週的由 leaderboard.py 清掉。
+CREATE TABLE IF NOT EXISTS focus_totals (
+    period        TEXT NOT NULL CHECK (period IN ('day', 'week')),
+    period_start  DATE NOT NULL,
+    user_id       INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    focus_minutes INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (period, period_start, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_focus_totals_user ON focus_totals (user_id);
+
+-- 既有資料：最近 8 週 (同 LEADERBOARD_RETENTION_WEEKS 的預設值)
+INSERT INTO focus_totals (period, period_start, user_id, focus_minutes)
+SELECT 'day', record_date, user_id, SUM(focus_minutes)
+FROM focus_time
+WHERE record_date >= date_trunc('week', current_date)::date - 56
+GROUP BY record_date, user_id
+ON CONFLICT (period, period_start, user_id) DO UPDATE SET focus_minutes = EXCLUDED.focus_minutes;
+
+INSERT INTO focus_totals (period, period_start, user_id, focus_minutes)
+SELECT 'week', date_trunc('week', record_date)::date, user_id, SUM(focus_minutes)
+FROM focus_time
+WHERE record_date >= date_trunc('week', current_date)::date - 56
+GROUP BY 2, user_id
+ON CONFLICT (period, period_start, user_id) DO UPDATE SET focus_minutes = EXCLUDED.focus_minutes;
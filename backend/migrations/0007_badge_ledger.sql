@@ -0,0 +1,47 @@
+-- 徽章改成帳本 (badge_ledger)：拿到 / 花掉徽章都是 INSERT 一筆，不再 UPDATE users.badge。
+-- users 那一列同時被 /user/status (presence 寫回)、結束專注、送訊息更新，同一個人的這些寫入會互相排隊；
+-- 改成 INSERT 之後只剩外鍵檢查的 FOR KEY SHARE，跟一般的 UPDATE users 不衝突。
+--
+-- 餘額 = badge_balances (壓縮過的快照) + badge_ledger 裡還沒壓縮的那幾筆，見 user_badges view。
+-- badges.py 定期把 badge_ledger 的紀錄加進快照再刪掉 (同一個 statement，讀到的餘額一定一致)。
+CREATE TABLE IF NOT EXISTS badge_ledger (
+    id         BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    user_id    INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    amount     INTEGER NOT NULL CHECK (amount <> 0),
+    reason     TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS idx_badge_ledger_user ON badge_ledger (user_id);
+
+CREATE TABLE IF NOT EXISTS badge_balances (
+    user_id      INTEGER PRIMARY KEY REFERENCES users(user_id) ON DELETE CASCADE,
+    balance      INTEGER NOT NULL,
+    compacted_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- 既有的徽章數當作第一份快照
+INSERT INTO badge_balances (user_id, balance)
+SELECT user_id, badge FROM users WHERE COALESCE(badge, 0) <> 0
+ON CONFLICT (user_id) DO NOTHING;
+
+ALTER TABLE users DROP COLUMN IF EXISTS badge;
+
+CREATE OR REPLACE VIEW user_badges AS
+SELECT u.user_id,
+       (COALESCE(s.balance, 0) + COALESCE(d.delta, 0))::int AS badge
+FROM users u
+LEFT JOIN badge_balances s ON s.user_id = u.user_id
+LEFT JOIN LATERAL (
+    SELECT SUM(l.amount) AS delta FROM badge_ledger l WHERE l.user_id = u.user_id
+) d ON TRUE;
+
+-- 扣徽章前呼叫：先拿這個 user 的 advisory lock (到 transaction 結束)，再讀餘額。
+-- 同一個人同時扣徽章會在這裡排隊，不會扣成負的；加徽章不用拿 lock。
+-- plpgsql 裡的查詢在拿到 lock 之後才取 snapshot，讀到的是前一個扣款 commit 之後的餘額。
+-- user 不存在時回傳 NULL。
+CREATE OR REPLACE FUNCTION badge_balance_for_update(p_user_id INTEGER) RETURNS INTEGER AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('badge_ledger'), p_user_id);
+    RETURN (SELECT badge FROM user_badges WHERE user_id = p_user_id);
+END;
+$$ LANGUAGE plpgsql VOLATILE;
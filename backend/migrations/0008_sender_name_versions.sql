@@ -0,0 +1,20 @@
+-- 收件匣 / 最新未讀的回應裡有寄件者的名字 (JOIN users)，但 resource_versions 的 trigger 只看 messages：
+-- 寄件者改名時 messages 的版本不會變，client 帶舊的 ETag 會拿到 304 和舊名字。
+-- 改名時把收過這個人訊息的 user 的 messages 版本都換掉。
+-- messages 沒有 sender_id 的 index，這裡會掃過每個 partition；改名很少發生，不為它在寫入很頻繁的表多加 index。
+CREATE OR REPLACE FUNCTION bump_sender_name_version() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO resource_versions (user_id, resource, version)
+    SELECT r.receiver_id, 'messages', nextval('resource_version_seq')
+    FROM (SELECT DISTINCT receiver_id FROM messages WHERE sender_id = NEW.user_id) r
+    ON CONFLICT (user_id, resource) DO UPDATE SET version = EXCLUDED.version;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_version_users_name ON users;
+CREATE TRIGGER trg_version_users_name
+    AFTER UPDATE OF name ON users
+    FOR EACH ROW
+    WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE FUNCTION bump_sender_name_version();
@@ -0,0 +1,11 @@
+-- 收件匣 / 未讀查詢的 created_at 下限：有了下限，比較舊的 partition 執行時就不用掃。
+-- cutoff 是 app 算的保留期限 (partitions.retention_cutoff)；超過保留期限還沒讀的訊息會留在 messages_default，
+-- 這個人還有這種訊息時下限往前推到最舊的那一則。
+-- 平常比 cutoff 舊的只剩 messages_default (加上還沒輪到維護的舊 partition)，走 idx_messages_receiver_unread 一次 index 查詢。
+CREATE OR REPLACE FUNCTION messages_floor(receiver INTEGER, cutoff TIMESTAMP) RETURNS TIMESTAMP
+LANGUAGE sql STABLE AS $$
+    SELECT LEAST(cutoff, (
+        SELECT min(created_at) FROM messages
+        WHERE receiver_id = receiver AND is_read = FALSE AND created_at < cutoff
+    ))
+$$;
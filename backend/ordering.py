@@ -0,0 +1,130 @@
+"""
+清單排序用的 fractional index (字典序排序鍵)
+
+每個項目存一個字串 sort_key，排序就是字串比較 (COLLATE "C")。
+要把項目移到 a、b 中間時，只要產生一個 a < key < b 的新字串，
+只改這一列，不用把後面所有項目的 display_order 都 +1。
+key 只用 0-9A-Za-z，且不會以 '0' 結尾 (保證前面永遠還插得進去)。
+"""
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Tuple
+
+DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+BASE = len(DIGITS)
+FIRST_KEY = "a00001"  # 空清單的第一個 key，前後都留了很多空間
+
+
+def key_between(a: Optional[str], b: Optional[str]) -> str:
+    """回傳 a < key < b 的排序鍵；a 為 None 表示最前面，b 為 None 表示最後面。"""
+    a = a or ""
+    if b is not None and not a < b:
+        raise ValueError(f"key_between: {a!r} 必須小於 {b!r}")
+    if b is None and not a:
+        return FIRST_KEY
+    # 加在最後/最前面是最常見的情況：當成整數 +1 / -1 (會進位、借位)，key 不會越加越長
+    if b is None:
+        bumped = _increment(a)
+        if bumped is not None:
+            return bumped
+    if not a:
+        lowered = _decrement(b)
+        if lowered is not None:
+            return lowered
+        # b 已經是這個長度最小的 ("0...01")：長度加倍，下一次開始又有 62^len 個 key 可以往前減
+        return "0" * len(b) + DIGITS[-1] * len(b)
+    return _midpoint(a, b)
+
+
+def _midpoint(a: str, b: Optional[str]) -> str:
+    if b is not None:
+        # 共同的前綴直接保留
+        n = 0
+        while n < len(b) and (a[n] if n < len(a) else "0") == b[n]:
+            n += 1
+        if n > 0:
+            return b[:n] + _midpoint(a[n:], b[n:])
+
+    digit_a = DIGITS.index(a[0]) if a else 0
+    digit_b = DIGITS.index(b[0]) if b is not None else BASE
+    if digit_b - digit_a > 1:
+        return DIGITS[(digit_a + digit_b) // 2]
+    # 兩個位數相鄰：b 還有後面的位數就直接取 b 的第一位，否則往下一位找空間
+    if b is not None and len(b) > 1:
+        return b[0]
+    return DIGITS[digit_a] + _midpoint(a[1:], None)
+
+
+def _increment(key: str) -> Optional[str]:
+    """同長度的下一個 key (base62 +1，進位)；全部都是 'z' 時回傳 None。"""
+    digits = [DIGITS.index(c) for c in key]
+    i = len(digits) - 1
+    while i >= 0 and digits[i] == BASE - 1:
+        digits[i] = 0
+        i -= 1
+    if i < 0:
+        return None
+    digits[i] += 1
+    if digits[-1] == 0:
+        digits[-1] = 1
+    return "".join(DIGITS[d] for d in digits)
+
+
+def _decrement(key: str) -> Optional[str]:
+    """同長度的前一個 key (base62 -1，借位，跳過以 '0' 結尾的)；已經是最小的時回傳 None。"""
+    digits = [DIGITS.index(c) for c in key]
+    while True:
+        i = len(digits) - 1
+        while i >= 0 and digits[i] == 0:
+            digits[i] = BASE - 1
+            i -= 1
+        if i < 0:
+            return None
+        digits[i] -= 1
+        if digits[-1] != 0:
+            return "".join(DIGITS[d] for d in digits)
+
+
+def plan_reorder(current: Dict[int, str], new_order: Sequence[int]) -> List[Tuple[int, str]]:
+    """
+    給目前的 {id: sort_key} 與新的 id 順序，回傳需要改的 (id, new_key)。
+    保留最長的「已經排好」子序列 (LIS) 不動，只幫其他項目產生新 key，
+    所以拖曳移動一個項目時只會改到一列。
+    """
+    ids = [i for i in new_order if i in current]
+    keys = [current[i] for i in ids]
+
+    keep = set(_longest_increasing_indices(keys))
+    changes = []
+    prev_key: Optional[str] = None
+    for pos, item_id in enumerate(ids):
+        if pos in keep:
+            prev_key = keys[pos]
+            continue
+        next_key = next((keys[j] for j in range(pos + 1, len(ids)) if j in keep), None)
+        new_key = key_between(prev_key, next_key)
+        changes.append((item_id, new_key))
+        prev_key = new_key
+    return changes
+
+
+def _longest_increasing_indices(keys: Sequence[str]) -> List[int]:
+    """嚴格遞增的最長子序列，回傳 index (O(n log n))。"""
+    tails: List[str] = []
+    tail_idx: List[int] = []
+    parent = [-1] * len(keys)
+    for i, key in enumerate(keys):
+        pos = bisect_left(tails, key)
+        if pos == len(tails):
+            tails.append(key)
+            tail_idx.append(i)
+        else:
+            tails[pos] = key
+            tail_idx[pos] = i
+        parent[i] = tail_idx[pos - 1] if pos > 0 else -1
+
+    result = []
+    i = tail_idx[-1] if tail_idx else -1
+    while i != -1:
+        result.append(i)
+        i = parent[i]
+    return result[::-1]
@@ -0,0 +1,327 @@
+"""
+messages / focus_time 依月份分割 (declarative range partitioning)
+
+兩張表都是一直長大的 (每則訊息一列、每人每小時一列)，改成每個月一個 partition：
+  - messages 依 created_at、focus_time 依 record_date 分割，partition 名稱是 <table>_pYYYY_MM，
+    另外各有一個 <table>_default 接住範圍外的資料 (例如 client 時間錯亂送來的很舊的日期)
+  - 每個 partition 有自己的 index，查詢帶有日期條件時只會碰到相關的月份 (partition pruning)
+  - 保留期限：
+      messages    MESSAGE_RETENTION_MONTHS 個月 (預設 6)。更舊的已讀訊息彙總成 messages_monthly
+                  (每個收件者 / 寄件者 / 月份一列) 之後整個 partition 刪掉；還沒讀的先搬進 messages_default，
+                  讀了之後下一次維護再彙總刪除。收件匣 / 未讀的查詢用 messages_floor() 當 created_at 的下限
+                  (保留期限，或這個人還留著的最舊未讀訊息)，比較舊的 partition 不用掃
+      focus_time  FOCUS_HOURLY_RETENTION_MONTHS 個月 (預設 24)。每天的總量本來就在 focus_daily，
+                  每小時的分佈彙總成 focus_hourly_monthly (每人每月每個小時一列) 之後刪掉
+    刪 partition 是 DROP TABLE，不會像 DELETE 一樣留下 dead tuple 讓 index 越來越肥
+  - 只知道 message id 的查詢 (標記已讀、推播回查) 用 messages_id_bounds 記錄每個 partition 的最小 id，
+    messages_created_after(id) / messages_created_before(id) 換算成 created_at 的範圍，執行時一樣能 pruning。
+    這個月的 partition 還沒有資料時先記 sequence 的下一個值 (之後拿到的 id 都是這個月的)，
+    換月之後的第一次維護就會記上，不用等到 partition 有資料
+  - 表、archive 表、上面兩個 function 在 migrations/0004_partition_messages_focus_time.py 建立，
+    messages_floor() 在 migrations/0009
+
+app 啟動後由 PartitionMaintenance 每 PARTITION_MAINTENANCE_HOURS 小時 (以及每個月一開始) 建立未來
+PARTITION_MONTHS_AHEAD 個月的 partition、記錄 id 範圍、執行保留期限 (多個 worker 用 advisory lock，只有一個會做)。
+也可以手動執行：
+    docker compose exec backend python partitions.py           # 執行一次維護
+    docker compose exec backend python partitions.py status    # 列出每個 partition 的列數與大小
+"""
+import argparse
+import asyncio
+import os
+import re
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+import asyncpg
+
+DATABASE_URL = os.environ.get("DATABASE_URL", "postgresql://postgres:password@db:5432/focusmate")
+PARTITION_MONTHS_AHEAD = int(os.environ.get("PARTITION_MONTHS_AHEAD", "3"))
+MESSAGE_RETENTION_MONTHS = int(os.environ.get("MESSAGE_RETENTION_MONTHS", "6"))
+FOCUS_HOURLY_RETENTION_MONTHS = int(os.environ.get("FOCUS_HOURLY_RETENTION_MONTHS", "24"))
+PARTITION_MAINTENANCE_HOURS = float(os.environ.get("PARTITION_MAINTENANCE_HOURS", "6"))
+# 刪 partition 要短暫鎖住整張表，拿不到 lock 就等下次再做，不要卡住線上的查詢
+PARTITION_LOCK_TIMEOUT = os.environ.get("PARTITION_LOCK_TIMEOUT", "5s")
+# pg_advisory_lock 的 key (migrate.py 用 7_310_001)
+PARTITION_LOCK_KEY = 7_310_002
+
+PARTITION_NAME_RE = re.compile(r"^(\w+)_p(\d{4})_(\d{2})$")
+
+
+@dataclass
+class PartitionedTable:
+    name: str
+    column: str
+    retention_months: int
+    keep: Optional[str] = None  # 超過保留期限也不能刪的列 (搬進 default partition 留著)
+
+
+MESSAGES = PartitionedTable("messages", "created_at", MESSAGE_RETENTION_MONTHS, keep="is_read = FALSE")
+FOCUS_TIME = PartitionedTable("focus_time", "record_date", FOCUS_HOURLY_RETENTION_MONTHS)
+TABLES = [MESSAGES, FOCUS_TIME]
+
+ARCHIVE_MESSAGES_SQL = """
+    INSERT INTO messages_monthly (receiver_id, sender_id, month, message_count, unread_count, last_created_at)
+    SELECT receiver_id, sender_id, date_trunc('month', created_at)::date,
+           count(*), count(*) FILTER (WHERE is_read IS NOT TRUE), max(created_at)
+    FROM {source}
+    {where}
+    GROUP BY 1, 2, 3
+    ON CONFLICT (receiver_id, month, sender_id) DO UPDATE SET
+        message_count   = messages_monthly.message_count + EXCLUDED.message_count,
+        unread_count    = messages_monthly.unread_count + EXCLUDED.unread_count,
+        last_created_at = GREATEST(messages_monthly.last_created_at, EXCLUDED.last_created_at)
+"""
+
+# focus_daily 平常由 /focus/save 增量維護，這裡只補沒有的 (例如直接寫進 DB 的舊資料)
+ARCHIVE_FOCUS_SQL = """
+    INSERT INTO focus_daily (user_id, record_date, focus_minutes)
+    SELECT user_id, record_date, SUM(focus_minutes)
+    FROM {source}
+    {where}
+    GROUP BY user_id, record_date
+    ON CONFLICT (user_id, record_date) DO NOTHING;
+
+    INSERT INTO focus_hourly_monthly (user_id, month, record_hour, focus_minutes)
+    SELECT user_id, date_trunc('month', record_date)::date, record_hour, SUM(focus_minutes)
+    FROM {source}
+    {where}
+    GROUP BY 1, 2, 3
+    ON CONFLICT (user_id, month, record_hour) DO UPDATE SET
+        focus_minutes = focus_hourly_monthly.focus_minutes + EXCLUDED.focus_minutes;
+"""
+
+ARCHIVE_SQL = {"messages": ARCHIVE_MESSAGES_SQL, "focus_time": ARCHIVE_FOCUS_SQL}
+
+# sequence 下一個會發出去的 id (還沒用過時是 start value)
+NEXT_MESSAGE_ID_SQL = "SELECT CASE WHEN is_called THEN last_value + 1 ELSE last_value END FROM messages_id_seq"
+
+
+def month_start(d: date) -> date:
+    return date(d.year, d.month, 1)
+
+
+def add_months(d: date, months: int) -> date:
+    index = d.year * 12 + d.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y_%m}"
+
+
+def _bound(table: PartitionedTable, d: date):
+    # messages 是 TIMESTAMP，asyncpg 需要 datetime
+    return datetime(d.year, d.month, d.day) if table.column == "created_at" else d
+
+
+def retention_cutoff(table: PartitionedTable, today: Optional[date] = None):
+    """比這個時間舊的資料會被彙總後刪掉 (table.keep 的列除外)。"""
+    return _bound(table, add_months(month_start(today or date.today()), -table.retention_months))
+
+
+async def list_partitions(conn: asyncpg.Connection, table: str) -> Dict[date, str]:
+    """{月份: partition 名稱}，不含 default partition。"""
+    rows = await conn.fetch("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass($1)
+    """, table)
+    partitions = {}
+    for row in rows:
+        match = PARTITION_NAME_RE.match(row["relname"])
+        if match and match.group(1) == table:
+            partitions[date(int(match.group(2)), int(match.group(3)), 1)] = row["relname"]
+    return partitions
+
+
+async def create_partition(conn: asyncpg.Connection, table: PartitionedTable, month: date) -> bool:
+    """建立一個月份的 partition；default partition 裡已經有這個月的資料時先搬出來再建。"""
+    name = partition_name(table.name, month)
+    if month in await list_partitions(conn, table.name):
+        return False
+    lo, hi = _bound(table, month), _bound(table, add_months(month, 1))
+    default = f"{table.name}_default"
+    async with conn.transaction():
+        moved = await conn.fetchval(
+            f"SELECT count(*) FROM {default} WHERE {table.column} >= $1 AND {table.column} < $2", lo, hi,
+        )
+        if moved:
+            await conn.execute(f"CREATE TEMP TABLE _partition_moved (LIKE {table.name}) ON COMMIT DROP")
+            await conn.execute(f"""
+                WITH moved AS (
+                    DELETE FROM {default} WHERE {table.column} >= $1 AND {table.column} < $2 RETURNING *
+                )
+                INSERT INTO _partition_moved SELECT * FROM moved
+            """, lo, hi)
+        # partition bound 不能用參數
+        await conn.execute(f"""
+            CREATE TABLE {name} PARTITION OF {table.name}
+            FOR VALUES FROM ('{lo.isoformat()}') TO ('{hi.isoformat()}')
+        """)
+        if moved:
+            await conn.execute(f"INSERT INTO {table.name} SELECT * FROM _partition_moved")
+    return True
+
+
+async def ensure_partitions(conn: asyncpg.Connection, since: Optional[date] = None,
+                            ahead: int = PARTITION_MONTHS_AHEAD) -> List[str]:
+    """建立 since (預設這個月) 到未來 ahead 個月的 partition，回傳新建的名稱。"""
+    first = month_start(since or date.today())
+    last = add_months(month_start(date.today()), ahead)
+    created = []
+    for table in TABLES:
+        await conn.execute(f"CREATE TABLE IF NOT EXISTS {table.name}_default PARTITION OF {table.name} DEFAULT")
+        month = first
+        while month <= last:
+            if await create_partition(conn, table, month):
+                created.append(partition_name(table.name, month))
+            month = add_months(month, 1)
+    return created
+
+
+async def record_id_bounds(conn: asyncpg.Connection, today: Optional[date] = None):
+    """
+    記錄還沒記過的 messages partition 的最小 id (用 PK index，每個 partition 一次 index 查詢)。
+    這個月的 partition 還是空的就記 sequence 的下一個值；未來月份的空 partition 不知道第一個 id，先不記
+    (記太小的話，這個月後面的訊息會被當成下個月的，標記已讀時找不到)。
+    """
+    current = month_start(today or date.today())
+    known = {row["partition_start"].date() for row in await conn.fetch("SELECT partition_start FROM messages_id_bounds")}
+    for month, name in sorted((await list_partitions(conn, "messages")).items()):
+        if month in known:
+            continue
+        first_id = await conn.fetchval(f"SELECT min(id) FROM {name}")
+        if first_id is None and month == current:
+            first_id = await conn.fetchval(NEXT_MESSAGE_ID_SQL)
+        if first_id is not None:
+            await conn.execute("""
+                INSERT INTO messages_id_bounds (partition_start, first_id) VALUES ($1, $2)
+                ON CONFLICT (partition_start) DO NOTHING
+            """, datetime(month.year, month.month, 1), first_id)
+
+
+async def apply_retention(conn: asyncpg.Connection, today: Optional[date] = None) -> List[str]:
+    """
+    超過保留期限的 partition 彙總進 archive 表後刪除，回傳刪掉的 partition。
+    table.keep 的列 (還沒讀的訊息) 不彙總：partition DETACH 之後搬進 default partition 再 DROP。
+    """
+    today = today or date.today()
+    dropped = []
+    for table in TABLES:
+        cutoff = add_months(month_start(today), -table.retention_months)
+        archive_sql = ARCHIVE_SQL[table.name]
+        default = f"{table.name}_default"
+        # keep 是 NULL 的列也要彙總刪除
+        archived = f"({table.keep}) IS NOT TRUE" if table.keep else "TRUE"
+        for month, name in sorted((await list_partitions(conn, table.name)).items()):
+            if month >= cutoff:
+                break
+            async with conn.transaction():
+                await conn.execute(f"SET LOCAL lock_timeout = '{PARTITION_LOCK_TIMEOUT}'")
+                await conn.execute(archive_sql.format(source=name, where=f"WHERE {archived}"))
+                if table.keep:
+                    # 還掛在 partitioned table 上時 default partition 不能放這個月份的列。
+                    # is_read 只會從 FALSE 變 TRUE，彙總之後才讀的訊息只是沒算進 archive，不會把沒讀的丟掉
+                    await conn.execute(f"ALTER TABLE {table.name} DETACH PARTITION {name}")
+                    # 搬家不是新訊息：不要觸發推播的 trigger (只在這個 transaction 裡關掉)
+                    await conn.execute(f"ALTER TABLE {default} DISABLE TRIGGER USER")
+                    await conn.execute(f"INSERT INTO {default} SELECT * FROM {name} WHERE {table.keep}")
+                    await conn.execute(f"ALTER TABLE {default} ENABLE TRIGGER USER")
+                await conn.execute(f"DROP TABLE {name}")
+                if table.name == "messages":
+                    await conn.execute("DELETE FROM messages_id_bounds WHERE partition_start = $1",
+                                       datetime(month.year, month.month, 1))
+            dropped.append(name)
+
+        # default partition 裡比保留期限還舊的資料也一起彙總、刪除 (keep 的列留著)
+        where = f"WHERE {table.column} < '{_bound(table, cutoff).isoformat()}' AND {archived}"
+        async with conn.transaction():
+            await conn.execute(archive_sql.format(source=default, where=where))
+            await conn.execute(f"DELETE FROM {default} {where}")
+    return dropped
+
+
+async def maintain(conn: asyncpg.Connection) -> Optional[dict]:
+    """建立未來的 partition、記錄 id 範圍、執行保留期限。別的 process 正在做時回傳 None。"""
+    if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", PARTITION_LOCK_KEY):
+        return None
+    try:
+        created = await ensure_partitions(conn)
+        await record_id_bounds(conn)
+        dropped = await apply_retention(conn)
+        return {"created": created, "dropped": dropped}
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", PARTITION_LOCK_KEY)
+
+
+class PartitionMaintenance:
+    def __init__(self, pool: asyncpg.Pool, interval_hours: float = PARTITION_MAINTENANCE_HOURS):
+        self.pool = pool
+        self.interval = interval_hours * 3600
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _loop(self):
+        while True:
+            try:
+                async with self.pool.acquire() as conn:
+                    result = await maintain(conn)
+                if result and (result["created"] or result["dropped"]):
+                    print(f"partition 維護: 新增 {result['created']}，刪除 {result['dropped']}")
+            except Exception as e:
+                print(f"partition 維護失敗: {e}")
+            await asyncio.sleep(min(self.interval, _seconds_until_next_month()))
+
+
+def _seconds_until_next_month() -> float:
+    # 換月後一分鐘：新的月份要盡快記 id 範圍、執行保留期限
+    now = datetime.now()
+    next_month = add_months(month_start(now.date()), 1)
+    return (datetime(next_month.year, next_month.month, 1) + timedelta(minutes=1) - now).total_seconds()
+
+
+async def status(conn: asyncpg.Connection):
+    for table in TABLES:
+        rows = await conn.fetch("""
+            SELECT c.relname, c.reltuples::bigint AS estimated_rows,
+                   pg_size_pretty(pg_total_relation_size(c.oid)) AS size
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass($1)
+            ORDER BY c.relname
+        """, table.name)
+        print(f"{table.name} (保留 {table.retention_months} 個月):")
+        for row in rows:
+            print(f"  {row['relname']}: ~{max(row['estimated_rows'], 0)} rows, {row['size']}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", nargs="?", choices=["maintain", "status"], default="maintain")
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(args.dsn)
+    try:
+        if args.command == "status":
+            await status(conn)
+        else:
+            result = await maintain(conn)
+            print(result if result is not None else "其他 process 正在執行維護")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
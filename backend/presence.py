@@ -0,0 +1,282 @@
+"""
+好友在線狀態 (presence) 快取
+
+is_studying / is_breaking 變動很頻繁、資料很小，而且每次看好友列表都要讀。
+這裡把它放在記憶體裡：
+  - 讀取 (好友狀態、我的紀錄) 直接從記憶體拿，不查 DB
+  - 寫入先改記憶體，再由背景 task 每隔一段時間合併成一個 UPDATE 寫回 users (write-behind)
+  - 每筆狀態有 TTL，client 要定期 heartbeat；app 當掉沒送結束的人會自動變成離線
+  - 多個 uvicorn worker 時，狀態變更用 NOTIFY 廣播，各 worker 的快取保持一致：
+    變更先排進 outbox，由寫回 DB 的同一個背景 task 合併成幾個 NOTIFY 送出 (request 不用等 DB)，
+    其他 worker 最多晚 PRESENCE_FLUSH_SECONDS 秒看到。heartbeat 沒有改變狀態就不廣播，
+    改成每 TTL/3 秒把這個 worker 負責的人整批重送一次，其他 worker 的快取才不會過期；
+    負責的 worker 判定過期時廣播離線。
+  - 啟動時從 DB 載入的人不屬於任何 worker (重啟前的 worker 已經不在了)，有 heartbeat 才由收到的 worker 接手；
+    沒有人負責的紀錄過期時 (沒人接手、或負責的 worker 當掉)，每個 worker 都會用 EXPIRE_SQL 寫回離線，
+    這個 UPDATE 只在 DB 還是過期前的狀態時才改，重複執行沒關係
+name / title / badge 也一起快取 (profile)，改到 badge 的地方要呼叫 invalidate_profile()。
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import asyncpg
+
+from db import named_query
+
+PRESENCE_CHANNEL = "presence"
+PRESENCE_TTL = float(os.environ.get("PRESENCE_TTL_SECONDS", "90"))
+PRESENCE_FLUSH_INTERVAL = float(os.environ.get("PRESENCE_FLUSH_SECONDS", "1.0"))
+PROFILE_TTL = float(os.environ.get("PROFILE_CACHE_TTL_SECONDS", "60"))
+
+OFFLINE = (False, False)
+
+PROFILES_SQL = named_query("presence.profiles", """
+    SELECT u.user_id, u.name, u.title, b.badge
+    FROM users u JOIN user_badges b ON b.user_id = u.user_id
+    WHERE u.user_id = ANY($1::int[])
+""")
+
+FLUSH_SQL = named_query("presence.flush", """
+    UPDATE users u
+    SET is_studying = t.is_studying, is_breaking = t.is_breaking
+    FROM unnest($1::int[], $2::bool[], $3::bool[]) AS t(user_id, is_studying, is_breaking)
+    WHERE u.user_id = t.user_id
+      AND (u.is_studying IS DISTINCT FROM t.is_studying
+           OR u.is_breaking IS DISTINCT FROM t.is_breaking)
+""")
+
+# 沒有人負責的紀錄過期：DB 還是當時看到的狀態才改成離線 (這段期間有新的狀態寫進來就不動)
+EXPIRE_SQL = named_query("presence.expire", """
+    UPDATE users u
+    SET is_studying = FALSE, is_breaking = FALSE
+    FROM unnest($1::int[], $2::bool[], $3::bool[]) AS t(user_id, is_studying, is_breaking)
+    WHERE u.user_id = t.user_id
+      AND COALESCE(u.is_studying, FALSE) = t.is_studying
+      AND COALESCE(u.is_breaking, FALSE) = t.is_breaking
+""")
+
+BROADCAST_SQL = named_query("presence.broadcast", "SELECT pg_notify($1, $2)")
+
+# 一個 NOTIFY 最多放幾筆 (payload 上限 8000 bytes)
+BROADCAST_BATCH = 300
+
+
+@dataclass
+class PresenceState:
+    is_studying: bool
+    is_breaking: bool
+    expires_at: float
+    owned: bool  # 是不是這個 worker 收到的 (過期時由它負責寫回 DB 並廣播)
+
+
+class PresenceCache:
+    def __init__(self, pool: asyncpg.Pool, ttl: float = PRESENCE_TTL, flush_interval: float = PRESENCE_FLUSH_INTERVAL):
+        self.pool = pool
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.node_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._states: Dict[int, PresenceState] = {}
+        self._dirty: Dict[int, Tuple[bool, bool]] = {}
+        # 沒有人負責、已經過期的紀錄 -> 過期前的狀態 (用 EXPIRE_SQL 寫回)
+        self._expired: Dict[int, Tuple[bool, bool]] = {}
+        self._profiles: Dict[int, Tuple[float, dict]] = {}
+        # 還沒廣播的狀態變更 (同一個人只留最新的) 和 profile invalidation
+        self._outbox: Dict[int, Tuple[bool, bool]] = {}
+        self._invalidated: Set[int] = set()
+        self._next_renewal = 0.0
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def start(self, hub):
+        # 啟動時把 DB 裡還在線上的人載入，給他們一個 TTL 的時間 heartbeat。
+        # 每個 worker 都會載入同一批人，所以先不算誰的 (owned=False)：收到 heartbeat 的 worker 才接手，
+        # 沒人接手的過期時由 _expire 寫回離線
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT user_id, COALESCE(is_studying, FALSE) AS is_studying,
+                       COALESCE(is_breaking, FALSE) AS is_breaking
+                FROM users
+                WHERE is_studying OR is_breaking
+            """)
+        expires_at = time.monotonic() + self.ttl
+        for row in rows:
+            self._states[row["user_id"]] = PresenceState(row["is_studying"], row["is_breaking"], expires_at, False)
+
+        await hub.add_channel_listener(PRESENCE_CHANNEL, self._on_notify)
+        self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flusher:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        await self.publish()
+
+    # --- presence ---
+
+    def get(self, user_id: int) -> Tuple[bool, bool]:
+        """回傳 (is_studying, is_breaking)，沒有紀錄或已過期就是離線。"""
+        state = self._states.get(user_id)
+        if state is None or state.expires_at <= time.monotonic():
+            return OFFLINE
+        return state.is_studying, state.is_breaking
+
+    async def set(self, user_id: int, is_studying: bool, is_breaking: bool):
+        self._apply(user_id, is_studying, is_breaking, owned=True)
+        self._dirty[user_id] = (is_studying, is_breaking)
+        self._outbox[user_id] = (is_studying, is_breaking)
+
+    async def heartbeat(self, user_id: int) -> bool:
+        """延長 TTL；已經過期 (或 server 重啟過) 時回傳 False，client 要重送一次狀態。"""
+        state = self._states.get(user_id)
+        if state is None or state.expires_at <= time.monotonic():
+            return False
+        if not state.owned:
+            # 接手別的 worker 負責的人：要讓原本的 worker 知道，不然它 TTL 到了會把人設成離線
+            self._outbox[user_id] = (state.is_studying, state.is_breaking)
+        self._apply(user_id, state.is_studying, state.is_breaking, owned=True)
+        return True
+
+    # --- profile (name / title / badge) ---
+
+    async def get_profiles(self, user_ids: Iterable[int]) -> Dict[int, dict]:
+        """批次取得 profile，快取沒有的才一次查 DB；不存在的 user 不會出現在結果裡。"""
+        now = time.monotonic()
+        result = {}
+        misses = []
+        for user_id in user_ids:
+            cached = self._profiles.get(user_id)
+            if cached and cached[0] > now:
+                result[user_id] = cached[1]
+            else:
+                misses.append(user_id)
+
+        if misses:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(PROFILES_SQL, misses)
+            for row in rows:
+                profile = dict(row)
+                self._profiles[row["user_id"]] = (now + PROFILE_TTL, profile)
+                result[row["user_id"]] = profile
+        return result
+
+    async def invalidate_profile(self, user_id: int):
+        self._profiles.pop(user_id, None)
+        self._invalidated.add(user_id)
+
+    # --- write-behind ---
+
+    async def flush(self):
+        if not self._dirty and not self._expired:
+            return
+        dirty, self._dirty = self._dirty, {}
+        expired, self._expired = self._expired, {}
+        try:
+            async with self.pool.acquire() as conn:
+                for sql, states in ((EXPIRE_SQL, expired), (FLUSH_SQL, dirty)):
+                    if states:
+                        user_ids = list(states.keys())
+                        await conn.execute(sql, user_ids, [states[u][0] for u in user_ids], [states[u][1] for u in user_ids])
+        except Exception:
+            # 寫失敗就放回去下次再試 (期間的新狀態優先)
+            for user_id, value in dirty.items():
+                self._dirty.setdefault(user_id, value)
+            for user_id, value in expired.items():
+                self._expired.setdefault(user_id, value)
+            raise
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self._expire()
+            self._purge_profiles()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"presence 寫回 DB 失敗: {e}")
+            try:
+                await self.publish()
+            except Exception as e:
+                print(f"presence 廣播失敗: {e}")
+
+    def _expire(self):
+        now = time.monotonic()
+        for user_id, state in list(self._states.items()):
+            if state.expires_at <= now:
+                del self._states[user_id]
+                last = (state.is_studying, state.is_breaking)
+                if last == OFFLINE:
+                    continue
+                if state.owned:
+                    self._dirty[user_id] = OFFLINE
+                    self._outbox[user_id] = OFFLINE
+                elif user_id not in self._dirty:
+                    self._expired[user_id] = last
+
+    def _purge_profiles(self):
+        now = time.monotonic()
+        for user_id, (expires_at, _) in list(self._profiles.items()):
+            if expires_at <= now:
+                del self._profiles[user_id]
+
+    # --- 跨 worker 同步 ---
+
+    def _apply(self, user_id: int, is_studying: bool, is_breaking: bool, owned: bool):
+        self._expired.pop(user_id, None)
+        self._states[user_id] = PresenceState(is_studying, is_breaking, time.monotonic() + self.ttl, owned)
+
+    async def publish(self):
+        """把 outbox 合併成幾個 NOTIFY 送出；每 TTL/3 秒順便重送這個 worker 負責的人 (其他 worker 的快取續期)。"""
+        now = time.monotonic()
+        states, self._outbox = self._outbox, {}
+        invalidated, self._invalidated = self._invalidated, set()
+        if now >= self._next_renewal:
+            self._next_renewal = now + self.ttl / 3
+            for user_id, state in self._states.items():
+                if state.owned and state.expires_at > now:
+                    states.setdefault(user_id, (state.is_studying, state.is_breaking))
+        if not states and not invalidated:
+            return
+
+        try:
+            async with self.pool.acquire() as conn:
+                for payload in self._payloads(states, invalidated):
+                    await conn.execute(BROADCAST_SQL, PRESENCE_CHANNEL, payload)
+        except Exception:
+            # 送失敗就放回去下次再送 (期間的新狀態優先)
+            for user_id, value in states.items():
+                self._outbox.setdefault(user_id, value)
+            self._invalidated |= invalidated
+            raise
+
+    def _payloads(self, states: Dict[int, Tuple[bool, bool]], invalidated: Set[int]) -> List[str]:
+        entries = [[user_id, int(s), int(b)] for user_id, (s, b) in states.items()]
+        invalidated = list(invalidated)
+        payloads = []
+        for i in range(0, max(len(entries), len(invalidated)), BROADCAST_BATCH):
+            payloads.append(json.dumps({
+                "n": self.node_id,
+                "s": entries[i:i + BROADCAST_BATCH],
+                "inv": invalidated[i:i + BROADCAST_BATCH],
+            }))
+        return payloads
+
+    def _on_notify(self, conn, pid, channel, payload):
+        try:
+            event = json.loads(payload)
+        except json.JSONDecodeError:
+            return
+        if event.get("n") == self.node_id:
+            return
+        for user_id in event.get("inv", ()):
+            self._profiles.pop(user_id, None)
+        # 別的 worker 收到的更新：它負責寫回 DB，這裡只更新快取
+        for user_id, is_studying, is_breaking in event.get("s", ()):
+            self._apply(user_id, bool(is_studying), bool(is_breaking), owned=False)
@@ -0,0 +1,243 @@
+"""
+request 層級的效能紀錄 (ProfilingMiddleware) 與慢查詢 / sampling profiler
+
+每個 HTTP request 會記錄：
+  - 總時間、DB 查詢時間 (asyncpg query logger 回報)、等待連線的時間，剩下的算 Python 時間
+  - 回應的 bytes 數
+結果寫進 metrics.py 的 histogram (GET /metrics)，每個 route 也留最近的樣本給 /debug/profile/routes，
+回應 header 帶 Server-Timing，瀏覽器 / app 的 devtools 看得到。
+
+超過 SLOW_QUERY_MS 的查詢會連同參數留在記憶體 (最近 SLOW_QUERY_KEEP 筆)，
+之後可以用 /debug/slow-queries/{id}/explain 拿 EXPLAIN 的結果，不用重新部署。
+/debug/* 需要 DEBUG_TOKEN 環境變數，沒設就關閉。
+"""
+import contextvars
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter as TallyCounter, deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional
+
+from metrics import Histogram
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_KEEP = int(os.environ.get("SLOW_QUERY_KEEP", "100"))
+ROUTE_SAMPLES = 1000  # 每個 route 保留幾筆算 percentile
+DEBUG_TOKEN = os.environ.get("DEBUG_TOKEN", "")
+
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+REQUEST_DURATION = Histogram("http_request_duration_seconds", "Request latency", ["method", "route", "status"])
+REQUEST_DB_TIME = Histogram("http_request_db_seconds", "Time spent in DB queries and pool waits per request", ["route"])
+RESPONSE_SIZE = Histogram("http_response_size_bytes", "Response body size", ["route"], buckets=SIZE_BUCKETS)
+
+
+@dataclass
+class RequestStats:
+    scope: dict
+    db_seconds: float = 0.0
+    pool_wait_seconds: float = 0.0
+    queries: int = 0
+
+    @property
+    def route(self) -> str:
+        # router 比對到 route 之後才會寫進 scope，用 route 的樣板 (例如 /pictures/{picture_id}) 當 label
+        return getattr(self.scope.get("route"), "path", "unmatched")
+
+
+@dataclass
+class RouteSample:
+    total: float
+    db: float
+    size: int
+
+
+@dataclass
+class SlowQuery:
+    id: int
+    name: str
+    route: str
+    sql: str
+    args: tuple
+    elapsed_ms: float
+    at: float
+    error: Optional[str] = None
+    plan: Optional[list] = field(default=None)
+
+
+_current: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_stats", default=None)
+_route_samples: Dict[str, Deque[RouteSample]] = {}
+_slow_queries: Deque[SlowQuery] = deque(maxlen=SLOW_QUERY_KEEP)
+_slow_ids = itertools.count(1)
+
+
+# --- 給 db.py 呼叫 ---
+
+def record_query(name: str, sql: str, args: tuple, elapsed: float, error: Optional[BaseException]):
+    # query logger 用 call_soon 執行，會帶著發出查詢那個 task 的 context
+    stats = _current.get()
+    if stats is not None:
+        stats.db_seconds += elapsed
+        stats.queries += 1
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        _slow_queries.append(SlowQuery(
+            id=next(_slow_ids), name=name, route=stats.route if stats else "-", sql=sql, args=args,
+            elapsed_ms=elapsed * 1000, at=time.time(), error=repr(error) if error else None,
+        ))
+
+
+def record_pool_wait(seconds: float):
+    stats = _current.get()
+    if stats is not None:
+        stats.pool_wait_seconds += seconds
+
+
+def slow_queries() -> List[SlowQuery]:
+    return list(reversed(_slow_queries))
+
+
+def find_slow_query(query_id: int) -> Optional[SlowQuery]:
+    return next((q for q in _slow_queries if q.id == query_id), None)
+
+
+# --- middleware ---
+
+class ProfilingMiddleware:
+    """pure ASGI middleware (不用 BaseHTTPMiddleware，串流回應不會被整個讀進記憶體)。"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = _current.set(stats)
+        started = time.perf_counter()
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                # 串流回應在這之後還會查 DB，header 只算得到目前為止的時間
+                elapsed = time.perf_counter() - started
+                db = stats.db_seconds + stats.pool_wait_seconds
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(
+                    b"server-timing",
+                    f"db;dur={db * 1000:.1f}, app;dur={max(0.0, elapsed - db) * 1000:.1f}".encode(),
+                )]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            elapsed = time.perf_counter() - started
+            db = stats.db_seconds + stats.pool_wait_seconds
+            REQUEST_DURATION.observe(elapsed, scope["method"], stats.route, str(status))
+            REQUEST_DB_TIME.observe(db, stats.route)
+            RESPONSE_SIZE.observe(size, stats.route)
+            samples = _route_samples.get(stats.route)
+            if samples is None:
+                samples = _route_samples[stats.route] = deque(maxlen=ROUTE_SAMPLES)
+            samples.append(RouteSample(elapsed, db, size))
+
+
+def route_summary() -> List[dict]:
+    """每個 route 最近的樣本：依總耗時排序，最花時間的在最前面。"""
+    result = []
+    for route, samples in _route_samples.items():
+        totals = sorted(s.total for s in samples)
+        n = len(totals)
+        db = sum(s.db for s in samples) / n
+        mean = sum(totals) / n
+        result.append({
+            "route": route,
+            "samples": n,
+            "p50_ms": totals[n // 2] * 1000,
+            "p95_ms": totals[min(n - 1, int(n * 0.95))] * 1000,
+            "mean_ms": mean * 1000,
+            "mean_db_ms": db * 1000,
+            "mean_python_ms": (mean - db) * 1000,
+            "mean_bytes": sum(s.size for s in samples) / n,
+            "total_ms": sum(totals) * 1000,
+        })
+    return sorted(result, key=lambda r: r["total_ms"], reverse=True)
+
+
+# --- sampling profiler ---
+
+class SamplingProfiler:
+    """
+    每 interval 秒看一次 event loop 那條 thread 正在執行哪裡 (sys._current_frames)，
+    累計成 collapsed stack (可以直接丟給 flamegraph.pl / speedscope)。
+    只在開啟期間有額外開銷，時間到自動停止。
+    """
+
+    def __init__(self):
+        self.stacks: TallyCounter = TallyCounter()
+        self.samples = 0
+        self.running = False
+        self.started_at: Optional[float] = None
+        self.interval = 0.005
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self, target_thread_id: int, seconds: float, interval: float):
+        if self.running:
+            raise RuntimeError("profiler 已經在執行")
+        self.stacks.clear()
+        self.samples = 0
+        self.interval = interval
+        self.started_at = time.time()
+        self.running = True
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(target_thread_id, seconds), name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, target_thread_id: int, seconds: float):
+        deadline = time.monotonic() + seconds
+        try:
+            while not self._stop.is_set() and time.monotonic() < deadline:
+                frame = sys._current_frames().get(target_thread_id)
+                if frame is not None:
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    self.stacks[";".join(reversed(stack))] += 1
+                    self.samples += 1
+                self._stop.wait(self.interval)
+        finally:
+            self.running = False
+
+    def report(self, top: int = 50) -> dict:
+        return {
+            "running": self.running,
+            "started_at": self.started_at,
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "stacks": [{"stack": stack, "count": count} for stack, count in self.stacks.most_common(top)],
+        }
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+profiler = SamplingProfiler()
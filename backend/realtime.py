@@ -0,0 +1,140 @@
+"""
+即時訊息推播 (LISTEN/NOTIFY -> WebSocket)
+
+messages 表上的 trigger (migrations/0001_baseline.py、0004) 在每次 INSERT 後發出 `NOTIFY new_message`，
+payload 直接帶上前端通知需要的欄位 (含 sender_name)，太大時只帶 id 由 hub 回查；
+MessageHub 只用「一條」從 pool 借出的連線 LISTEN，
+再把通知分送給目前有連線的接收者，閒置的 client 不會產生任何 DB 查詢。
+其他需要跨 process 通知的功能 (例如 presence) 也可以掛在同一條 LISTEN 連線上。
+"""
+import asyncio
+import json
+from typing import Callable, Dict, Set
+
+import asyncpg
+
+NOTIFY_CHANNEL = "new_message"  # 要跟 migration 裡 trigger 的 pg_notify channel 一樣
+
+FETCH_MESSAGE_SQL = """
+    SELECT
+        m.id,
+        m.content,
+        m.created_at,
+        m.sender_id,
+        u.name as sender_name
+    FROM messages m
+    JOIN users u ON m.sender_id = u.user_id
+    WHERE m.id = $1
+      -- messages 依 created_at 分割 (partitions.py)，id 換算成時間範圍才能只查相關的 partition
+      AND m.created_at >= messages_created_after($1) AND m.created_at < messages_created_before($1)
+"""
+
+
+class MessageHub:
+    """把 LISTEN 收到的新訊息分送給各個 user 的訂閱 queue。"""
+
+    def __init__(self, pool: asyncpg.Pool, channel: str = NOTIFY_CHANNEL):
+        self.pool = pool
+        self.channel = channel
+        self._conn = None
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}
+        self._channel_listeners: Dict[str, Callable] = {self.channel: self._on_notify}
+        self._closing = False
+
+    async def start(self):
+        self._closing = False
+        self._conn = await self.pool.acquire()
+        self._conn.add_termination_listener(self._on_terminated)
+        for channel, callback in self._channel_listeners.items():
+            await self._conn.add_listener(channel, callback)
+
+    async def stop(self):
+        self._closing = True
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            try:
+                for channel, callback in self._channel_listeners.items():
+                    await conn.remove_listener(channel, callback)
+            finally:
+                await self.pool.release(conn)
+
+    async def add_channel_listener(self, channel: str, callback: Callable):
+        """在同一條 LISTEN 連線上多聽一個 channel，callback 簽名同 asyncpg 的 add_listener。"""
+        self._channel_listeners[channel] = callback
+        if self._conn is not None:
+            await self._conn.add_listener(channel, callback)
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=100)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if not queues:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[user_id]
+
+    @property
+    def connection_count(self) -> int:
+        return sum(len(qs) for qs in self._subscribers.values())
+
+    def _on_notify(self, conn, pid, channel, payload):
+        try:
+            data = json.loads(payload)
+        except json.JSONDecodeError:
+            print(f"NOTIFY payload 解析錯誤: {payload}")
+            return
+
+        receiver_id = data.pop("receiver_id", None)
+        # 沒有人在線上等這個 receiver，就直接丟掉，不查 DB
+        if receiver_id not in self._subscribers:
+            return
+
+        if "content" not in data:
+            asyncio.get_running_loop().create_task(self._fetch_and_publish(receiver_id, data["id"]))
+            return
+
+        self._publish(receiver_id, data)
+
+    async def _fetch_and_publish(self, receiver_id: int, message_id: int):
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(FETCH_MESSAGE_SQL, message_id)
+        if row:
+            data = dict(row)
+            data["created_at"] = data["created_at"].isoformat()
+            self._publish(receiver_id, data)
+
+    def _publish(self, receiver_id: int, data: dict):
+        for queue in self._subscribers.get(receiver_id, ()):
+            try:
+                queue.put_nowait(data)
+            except asyncio.QueueFull:
+                # client 太慢，丟掉最舊的一則，保留最新通知
+                queue.get_nowait()
+                queue.put_nowait(data)
+
+    def _on_terminated(self, conn):
+        if self._closing:
+            return
+        # LISTEN 連線斷掉 (DB 重啟等)：重新借一條連線再 LISTEN
+        self._conn = None
+        asyncio.get_running_loop().create_task(self._reconnect(conn))
+
+    async def _reconnect(self, dead_conn):
+        try:
+            await self.pool.release(dead_conn)
+        except Exception:
+            pass
+        delay = 1
+        while not self._closing:
+            try:
+                await self.start()
+                print("MessageHub 重新連線成功")
+                return
+            except Exception as e:
+                print(f"MessageHub 重新連線失敗: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
@@ -0,0 +1,358 @@
+"""
+deadline 到期提醒 (server 端排程)
+
+以前是 app 在休息畫面每次都抓整份 /deadlines 自己找最近的一筆；現在由 server 在
+到期前 N 天 (DEADLINE_REMINDER_DAYS) 的 REMINDER_HOUR 點寄一則訊息到收件匣，
+走原本的 messages → NOTIFY → WebSocket 推播，app 不用再輪詢。
+
+  - 記憶體裡的索引：未完成的 deadline (id -> Entry) + 依提醒時間分桶的 priority queue
+    (每 REMINDER_BUCKET_SECONDS 秒一個桶，heap 裡放桶的編號)
+  - 啟動時從 deadlines 整份載入一次；之後 add / edit / done / remove 的 route 呼叫
+    track() / forget() 更新，改過的 id 排進 outbox，由背景 task 每 REMINDER_PUBLISH_SECONDS 秒
+    合併成幾個 NOTIFY 通知其他 worker 重新讀取那幾筆 (request 不用多等一次 DB)
+  - 每個 tick 只把到期的桶 pop 出來，合併成一個 INSERT 寄出 (不管多少 user 都是一次 sweep)；
+    桶裡的項目不會因為修改而刪除，寄出時再比對目前的日期 (lazy delete)，
+    SQL 也會 JOIN deadlines 確認還沒完成、日期沒變
+  - deadline_reminders 記錄寄過的 (deadline, 日期, 第幾天)：每個 worker 都會 sweep，
+    但同一則提醒只會有一個寄出去；server 重啟後補寄停機期間錯過的也不會重複
+"""
+import asyncio
+import heapq
+import json
+import os
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+
+import asyncpg
+
+from db import named_query
+from metrics import Counter, Gauge
+from presence import BROADCAST_BATCH, BROADCAST_SQL
+
+REMINDER_CHANNEL = "deadline_reminders"
+REMINDER_DAYS = sorted({int(d) for d in os.environ.get("DEADLINE_REMINDER_DAYS", "3,1,0").split(",")}, reverse=True)
+REMINDER_HOUR = int(os.environ.get("REMINDER_HOUR", "9"))
+REMINDER_TZ = ZoneInfo(os.environ.get("REMINDER_TZ", "Asia/Taipei"))
+REMINDER_TICK_SECONDS = float(os.environ.get("REMINDER_TICK_SECONDS", "30"))
+# 改過的 deadline 多久通知其他 worker 一次 (其他 worker 的 upcoming() 最多晚這麼久)
+REMINDER_PUBLISH_SECONDS = float(os.environ.get("REMINDER_PUBLISH_SECONDS", "1.0"))
+# 刪掉的 deadline 留給 /deadlines/changes 的 tombstone 保留幾天；更久沒同步的 client 會整份重拿
+DEADLINE_TOMBSTONE_DAYS = int(os.environ.get("DEADLINE_TOMBSTONE_DAYS", "30"))
+REMINDER_BUCKET_SECONDS = 60
+REMINDER_BATCH_SIZE = 5000
+
+LOAD_SQL = """
+    SELECT id, user_id, deadline_date, task FROM deadlines
+    WHERE is_done IS NOT TRUE AND deadline_date >= $1
+"""
+
+REFRESH_SQL = named_query("reminders.refresh", """
+    SELECT id, user_id, deadline_date, task, is_done FROM deadlines WHERE id = ANY($1::int[])
+""")
+
+# 寄出前再確認一次 deadline 還沒完成、日期沒變；deadline_reminders 擋掉別的 worker 已經寄過的
+SEND_SQL = named_query("reminders.send", """
+    WITH due AS (
+        SELECT d.id, d.user_id, d.task, t.deadline_date, t.days_before
+        FROM unnest($1::int[], $2::date[], $3::int[]) AS t(deadline_id, deadline_date, days_before)
+        JOIN deadlines d
+          ON d.id = t.deadline_id AND d.deadline_date = t.deadline_date AND d.is_done IS NOT TRUE
+    ), claimed AS (
+        INSERT INTO deadline_reminders (deadline_id, deadline_date, days_before)
+        SELECT id, deadline_date, days_before FROM due
+        ON CONFLICT DO NOTHING
+        RETURNING deadline_id, days_before
+    )
+    INSERT INTO messages (sender_id, receiver_id, content)
+    SELECT due.user_id, due.user_id,
+           CASE WHEN due.days_before = 0 THEN '⏰ 今天到期：' || due.task
+                ELSE format('⏰ 還有 %s 天到期 (%s)：%s', due.days_before, to_char(due.deadline_date, 'MM/DD'), due.task)
+           END
+    FROM claimed
+    JOIN due ON due.id = claimed.deadline_id AND due.days_before = claimed.days_before
+    RETURNING id
+""")
+
+PURGE_SQL = named_query("reminders.purge", """
+    DELETE FROM deadline_reminders WHERE deadline_date < $1
+""")
+
+PURGE_TOMBSTONES_SQL = named_query("deadlines.purge_tombstones", """
+    WITH purged AS (
+        DELETE FROM deadline_tombstones WHERE deleted_at < now() - make_interval(days => $1)
+        RETURNING row_version
+    )
+    UPDATE deadline_sync_floor
+    SET min_version = GREATEST(min_version, (SELECT max(row_version) + 1 FROM purged))
+""")
+
+REMINDERS_SENT = Counter("deadline_reminders_sent_total", "Reminder messages inserted by this process")
+REMINDER_SWEEP = Counter("deadline_reminder_sweeps_total", "Reminder sweeps that found due items")
+
+_schedulers: List["ReminderScheduler"] = []
+
+
+def _index_size():
+    values = {}
+    for scheduler in _schedulers:
+        values[("deadlines",)] = values.get(("deadlines",), 0) + len(scheduler._entries)
+        values[("scheduled",)] = values.get(("scheduled",), 0) + scheduler.pending()
+    return values
+
+
+Gauge("deadline_reminder_index", "Deadlines and reminders held in memory", ["kind"], callback=_index_size)
+
+
+@dataclass(slots=True)
+class Entry:
+    user_id: int
+    deadline_date: date
+    task: str
+
+
+Item = Tuple[int, date, int]  # (deadline_id, deadline_date, days_before)
+
+
+def today() -> date:
+    return datetime.now(REMINDER_TZ).date()
+
+
+def fire_time(deadline_date: date, days_before: int) -> float:
+    day = deadline_date - timedelta(days=days_before)
+    return datetime(day.year, day.month, day.day, REMINDER_HOUR, tzinfo=REMINDER_TZ).timestamp()
+
+
+class ReminderScheduler:
+    def __init__(self, pool: asyncpg.Pool, days: Iterable[int] = REMINDER_DAYS,
+                 tick: float = REMINDER_TICK_SECONDS, publish_interval: float = REMINDER_PUBLISH_SECONDS):
+        self.pool = pool
+        self.days = sorted(set(days), reverse=True)
+        self.tick = tick
+        self.publish_interval = min(publish_interval, tick)
+        self.node_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._entries: Dict[int, Entry] = {}
+        self._by_user: Dict[int, Set[int]] = defaultdict(set)
+        self._buckets: Dict[int, Set[Item]] = {}
+        self._heap: List[int] = []
+        self._today: Optional[date] = None
+        # 還沒通知其他 worker 的 deadline id
+        self._outbox: Set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, hub):
+        await self.load()
+        await hub.add_channel_listener(REMINDER_CHANNEL, self._on_notify)
+        self._task = asyncio.get_running_loop().create_task(self._loop())
+        _schedulers.append(self)
+
+    async def stop(self):
+        if self in _schedulers:
+            _schedulers.remove(self)
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.publish()
+
+    async def load(self):
+        """從 deadlines 重建整個索引 (用 cursor 分批讀，不會一次把全部 row 放進記憶體)。"""
+        self._entries.clear()
+        self._by_user.clear()
+        self._buckets.clear()
+        self._heap.clear()
+        self._today = today()
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                async for row in conn.cursor(LOAD_SQL, self._today, prefetch=10_000):
+                    self._add(row["id"], row["user_id"], row["deadline_date"], row["task"])
+
+    # --- route 呼叫 ---
+
+    async def track(self, rows: Iterable):
+        """新增 / 修改後傳入 deadline 的 row (id, user_id, deadline_date, task, is_done)，在 commit 之後呼叫。"""
+        rows = list(rows)
+        self._apply(rows)
+        self._outbox.update(row["id"] for row in rows)
+
+    async def forget(self, deadline_ids: Iterable[int]):
+        for deadline_id in deadline_ids:
+            self._remove(deadline_id)
+            self._outbox.add(deadline_id)
+
+    def upcoming(self, user_id: int, limit: int = 5) -> List[dict]:
+        """這個 user 最近要到期的未完成 deadline (只看記憶體)。"""
+        entries = sorted(
+            (self._entries[i].deadline_date, i) for i in self._by_user.get(user_id, ())
+        )[:limit]
+        return [
+            {"id": i, "deadline_date": d, "thing": self._entries[i].task}
+            for d, i in entries
+        ]
+
+    def pending(self) -> int:
+        return sum(len(items) for items in self._buckets.values())
+
+    # --- 索引 ---
+
+    def _apply(self, rows):
+        for row in rows:
+            if row["is_done"] or row["deadline_date"] is None:
+                self._remove(row["id"])
+            else:
+                self._add(row["id"], row["user_id"], row["deadline_date"], row["task"])
+
+    def _add(self, deadline_id: int, user_id: int, deadline_date: date, task: Optional[str]):
+        if deadline_date < (self._today or today()):
+            self._remove(deadline_id)
+            return
+        old = self._entries.get(deadline_id)
+        if old is not None and old.user_id != user_id:
+            self._remove(deadline_id)
+            old = None
+        self._entries[deadline_id] = Entry(user_id, deadline_date, task or "")
+        self._by_user[user_id].add(deadline_id)
+        if old is not None and old.deadline_date == deadline_date:
+            return  # 只改了名稱：已經排好的提醒不變
+
+        now = time.time()
+        passed = [d for d in self.days if fire_time(deadline_date, d) <= now]
+        for days_before in self.days:
+            when = fire_time(deadline_date, days_before)
+            if when <= now:
+                # 已經過了的時間點只補寄最接近的一個 (例如明天到期的新 deadline 不會收到「還有 3 天」)
+                if days_before != passed[-1]:
+                    continue
+                when = now
+            self._schedule(when, (deadline_id, deadline_date, days_before))
+
+    def _remove(self, deadline_id: int):
+        # 桶裡排好的提醒不用刪，寄出前會發現 entry 不在了
+        entry = self._entries.pop(deadline_id, None)
+        if entry is not None:
+            ids = self._by_user.get(entry.user_id)
+            if ids is not None:
+                ids.discard(deadline_id)
+                if not ids:
+                    del self._by_user[entry.user_id]
+
+    def _schedule(self, when: float, item: Item):
+        bucket = int(when // REMINDER_BUCKET_SECONDS)
+        items = self._buckets.get(bucket)
+        if items is None:
+            items = self._buckets[bucket] = set()
+            heapq.heappush(self._heap, bucket)
+        items.add(item)
+
+    def _pop_due(self, now: float) -> List[Item]:
+        current = int(now // REMINDER_BUCKET_SECONDS)
+        due = []
+        while self._heap and self._heap[0] <= current:
+            for item in self._buckets.pop(heapq.heappop(self._heap), ()):
+                entry = self._entries.get(item[0])
+                if entry is not None and entry.deadline_date == item[1]:
+                    due.append(item)
+        return due
+
+    def _roll_day(self):
+        # 換日：過期的 deadline 移出索引，deadline_reminders 的舊紀錄也一起清
+        self._today = today()
+        for deadline_id, entry in list(self._entries.items()):
+            if entry.deadline_date < self._today:
+                self._remove(deadline_id)
+
+    # --- sweep ---
+
+    async def sweep(self, now: Optional[float] = None) -> int:
+        """寄出到期的提醒，回傳這個 process 實際寫入的訊息數。"""
+        due = self._pop_due(time.time() if now is None else now)
+        if not due:
+            return 0
+        REMINDER_SWEEP.inc()
+        sent = 0
+        try:
+            async with self.pool.acquire() as conn:
+                for start in range(0, len(due), REMINDER_BATCH_SIZE):
+                    batch = due[start:start + REMINDER_BATCH_SIZE]
+                    rows = await conn.fetch(
+                        SEND_SQL,
+                        [item[0] for item in batch],
+                        [item[1] for item in batch],
+                        [item[2] for item in batch],
+                    )
+                    sent += len(rows)
+        except Exception:
+            # 沒寄成的放回去下一個 tick 再試 (已經寄出的會被 deadline_reminders 擋掉)
+            retry_at = time.time() + self.tick
+            for item in due:
+                self._schedule(retry_at, item)
+            raise
+        REMINDERS_SENT.inc(amount=sent)
+        return sent
+
+    async def _loop(self):
+        next_sweep = time.monotonic() + self.tick
+        while True:
+            await asyncio.sleep(self.publish_interval)
+            try:
+                await self.publish()
+            except Exception as e:
+                print(f"deadline 變更廣播失敗: {e}")
+            if time.monotonic() < next_sweep:
+                continue
+            next_sweep = time.monotonic() + self.tick
+            try:
+                if today() != self._today:
+                    self._roll_day()
+                    async with self.pool.acquire() as conn:
+                        await conn.execute(PURGE_SQL, self._today - timedelta(days=1))
+                        await conn.execute(PURGE_TOMBSTONES_SQL, DEADLINE_TOMBSTONE_DAYS)
+                await self.sweep()
+            except Exception as e:
+                print(f"deadline 提醒寄送失敗: {e}")
+
+    # --- 跨 worker 同步 ---
+
+    async def publish(self):
+        """把 outbox 裡的 deadline id 合併成幾個 NOTIFY 送出。"""
+        if not self._outbox:
+            return
+        deadline_ids, self._outbox = list(self._outbox), set()
+        try:
+            async with self.pool.acquire() as conn:
+                for start in range(0, len(deadline_ids), BROADCAST_BATCH):
+                    payload = json.dumps({"n": self.node_id, "ids": deadline_ids[start:start + BROADCAST_BATCH]})
+                    await conn.execute(BROADCAST_SQL, REMINDER_CHANNEL, payload)
+        except Exception:
+            # 送失敗就放回去下次再送 (重送已經送過的只是讓別的 worker 多讀一次)
+            self._outbox.update(deadline_ids)
+            raise
+
+    def _on_notify(self, conn, pid, channel, payload):
+        try:
+            event = json.loads(payload)
+        except json.JSONDecodeError:
+            return
+        if event.get("n") == self.node_id:
+            return
+        asyncio.get_running_loop().create_task(self._refresh(event["ids"]))
+
+    async def _refresh(self, deadline_ids: List[int]):
+        # 別的 worker 改過的 deadline：重新讀那幾筆，查不到的就是被刪掉了
+        try:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(REFRESH_SQL, deadline_ids)
+        except Exception as e:
+            print(f"deadline 提醒索引更新失敗: {e}")
+            return
+        found = {row["id"] for row in rows}
+        for deadline_id in deadline_ids:
+            if deadline_id not in found:
+                self._remove(deadline_id)
+        self._apply(rows)
@@ -0,0 +1,211 @@
+"""
+讀寫分離：唯讀的查詢送到 streaming replication 的 replica，其他的留在 primary
+
+  DATABASE_REPLICA_URL       replica 的連線字串；沒設就全部走 primary
+  DB_REPLICA_POOL_MAX_SIZE   replica 連線池上限，預設同 DB_POOL_MAX_SIZE
+  REPLICA_MAX_LAG_SECONDS    replica 落後超過這個秒數就改讀 primary，預設 2
+  REPLICA_LAG_CHECK_SECONDS  多久檢查一次落後程度，預設 1
+  READ_STICKY_SECONDS        user 寫入後這段時間內的讀取都走 primary (read-your-writes)，預設 5
+
+怎麼選：
+  - 寫入、寫完馬上要讀回來的流程 (例如 transaction 裡的 SELECT) 一律用 app.state.db_pool
+  - 只讀的 route 用 app.state.read_pool.acquire(user_id)；user 剛寫過 (mark_write) 時會拿到 primary
+  - replica 落後太多、連不上或檢查失敗時整個退回 primary，恢復後自動切回來
+落後程度：primary 目前的 WAL 位置 replica 已經 replay 到了就是 0，否則是 replica 最後 replay 的 transaction 到現在的時間
+(primary 閒置時 pg_last_xact_replay_timestamp 不會更新，所以不能只看時間)。
+mark_write 會用 NOTIFY 通知其他 worker，同一個 user 的下一個 request 打到別的 worker 也會讀 primary。
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Dict, Optional
+
+import asyncpg
+
+from db import DB_ACQUIRE_TIMEOUT, DB_POOL_MAX_SIZE, InstrumentedPool, _Acquire, create_pool, named_query
+from metrics import Counter, Gauge
+from presence import BROADCAST_SQL
+
+DATABASE_REPLICA_URL = os.environ.get("DATABASE_REPLICA_URL", "")
+DB_REPLICA_POOL_MAX_SIZE = int(os.environ.get("DB_REPLICA_POOL_MAX_SIZE", str(DB_POOL_MAX_SIZE)))
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get("REPLICA_MAX_LAG_SECONDS", "2"))
+REPLICA_LAG_CHECK_SECONDS = float(os.environ.get("REPLICA_LAG_CHECK_SECONDS", "1"))
+READ_STICKY_SECONDS = float(os.environ.get("READ_STICKY_SECONDS", "5"))
+WRITES_CHANNEL = "db_writes"
+WRITES_FLUSH_SECONDS = 0.05
+
+PRIMARY_LSN_SQL = named_query("replica.primary_lsn", "SELECT pg_current_wal_lsn()::text")
+
+REPLICA_LAG_SQL = named_query("replica.lag", """
+    SELECT pg_is_in_recovery() AS in_recovery,
+           CASE WHEN pg_last_wal_replay_lsn() >= $1::pg_lsn THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 'Infinity')
+           END::float8 AS lag_seconds
+""")
+
+READS_ROUTED = Counter("db_reads_routed_total", "Read connections handed out by ReadRouter", ["pool", "reason"])
+
+_routers = []
+
+
+def _replica_lag():
+    return {(): r.lag for r in _routers if r.replica is not None and r.lag is not None}
+
+
+Gauge("db_replica_lag_seconds", "Replica replay lag measured against the primary WAL position", callback=_replica_lag)
+
+
+class _ReplicaAcquire(_Acquire):
+    """replica 連不上的時候 (掛了、重開中) 這次改拿 primary 的連線，並停用 replica 直到下一次檢查成功。"""
+
+    def __init__(self, router: "ReadRouter", timeout: float):
+        super().__init__(router.replica, timeout)
+        self.router = router
+
+    async def _acquire(self) -> asyncpg.Connection:
+        try:
+            return await super()._acquire()
+        except (OSError, asyncpg.PostgresConnectionError, asyncpg.CannotConnectNowError) as e:
+            self.router.mark_unhealthy(e)
+            READS_ROUTED.inc("primary", "replica_error")
+            self.pool = self.router.primary
+            return await super()._acquire()
+
+
+class ReadRouter:
+    def __init__(self, primary: InstrumentedPool, replica: Optional[InstrumentedPool] = None,
+                 max_lag: float = REPLICA_MAX_LAG_SECONDS, sticky_seconds: float = READ_STICKY_SECONDS):
+        self.primary = primary
+        self.replica = replica
+        self.max_lag = max_lag
+        self.sticky_seconds = sticky_seconds
+        self.node_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.lag: Optional[float] = None
+        self.healthy = False
+        self._sticky: Dict[int, float] = {}
+        self._pending_writes = set()
+        self._tasks = []
+
+    @classmethod
+    async def from_env(cls, primary: InstrumentedPool) -> "ReadRouter":
+        replica = None
+        if DATABASE_REPLICA_URL:
+            # min_size=0：建立時不連線，replica 還沒起來 (或在 pg_basebackup) 也不會讓後端啟動失敗
+            replica = await create_pool(DATABASE_REPLICA_URL, name="replica", min_size=0,
+                                        max_size=DB_REPLICA_POOL_MAX_SIZE)
+        return cls(primary, replica)
+
+    async def start(self, hub):
+        if self.replica is None:
+            return
+        await self.check_lag()
+        await hub.add_channel_listener(WRITES_CHANNEL, self._on_notify)
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._lag_loop()), loop.create_task(self._flush_loop())]
+        _routers.append(self)
+
+    async def stop(self):
+        if self in _routers:
+            _routers.remove(self)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.replica is not None:
+            await self.replica.close()
+
+    # --- routing ---
+
+    def acquire(self, *user_ids: int, timeout: float = DB_ACQUIRE_TIMEOUT) -> _Acquire:
+        """唯讀查詢用：user_ids 是這次要讀的資料屬於誰 (有人剛寫過就讀 primary)。"""
+        if self.replica is None:
+            return self.primary.acquire(timeout=timeout)
+        reason = self._primary_reason(user_ids)
+        if reason:
+            READS_ROUTED.inc("primary", reason)
+            return self.primary.acquire(timeout=timeout)
+        READS_ROUTED.inc("replica", "ok")
+        return _ReplicaAcquire(self, timeout)
+
+    def _primary_reason(self, user_ids) -> Optional[str]:
+        if not self.healthy:
+            return "replica_unhealthy"
+        if self.lag is None or self.lag > self.max_lag:
+            return "replica_lag"
+        if self._sticky:
+            now = time.monotonic()
+            for user_id in user_ids:
+                if self._sticky.get(user_id, 0) > now:
+                    return "sticky"
+        return None
+
+    def mark_write(self, *user_ids: Optional[int]):
+        """寫入之後呼叫：這些 user 接下來 READ_STICKY_SECONDS 秒的讀取都走 primary。"""
+        if self.replica is None:
+            return
+        until = time.monotonic() + self.sticky_seconds
+        for user_id in user_ids:
+            if user_id is not None:
+                self._sticky[user_id] = until
+                self._pending_writes.add(user_id)
+
+    # --- replica 狀態 ---
+
+    async def check_lag(self):
+        try:
+            async with self.primary.acquire() as conn:
+                lsn = await conn.fetchval(PRIMARY_LSN_SQL)
+            async with self.replica.acquire(timeout=1) as conn:
+                row = await conn.fetchrow(REPLICA_LAG_SQL, lsn)
+        except Exception as e:
+            # 503 (acquire timeout) 也會走到這裡
+            self.mark_unhealthy(e)
+            return
+        if not row["in_recovery"]:
+            # 連到的不是 standby (設定錯誤或 failover 之後)，不能當 replica 用
+            self.healthy = False
+            return
+        self.lag = row["lag_seconds"]
+        self.healthy = True
+
+    def mark_unhealthy(self, error: Exception):
+        if self.healthy:
+            print(f"replica 無法使用，改讀 primary: {error}")
+        self.healthy = False
+
+    async def _lag_loop(self):
+        while True:
+            await asyncio.sleep(REPLICA_LAG_CHECK_SECONDS)
+            await self.check_lag()
+            now = time.monotonic()
+            for user_id, until in list(self._sticky.items()):
+                if until <= now:
+                    del self._sticky[user_id]
+
+    # --- 跨 worker 同步 sticky ---
+
+    async def _flush_loop(self):
+        # 寫入很多的時候也只是每 50ms 一個 NOTIFY
+        while True:
+            await asyncio.sleep(WRITES_FLUSH_SECONDS)
+            if not self._pending_writes:
+                continue
+            user_ids, self._pending_writes = list(self._pending_writes), set()
+            try:
+                async with self.primary.acquire() as conn:
+                    await conn.execute(BROADCAST_SQL, WRITES_CHANNEL, json.dumps({"n": self.node_id, "u": user_ids}))
+            except Exception as e:
+                print(f"db_writes 通知失敗: {e}")
+
+    def _on_notify(self, conn, pid, channel, payload):
+        try:
+            event = json.loads(payload)
+        except json.JSONDecodeError:
+            return
+        if event.get("n") == self.node_id:
+            return
+        until = time.monotonic() + self.sticky_seconds
+        for user_id in event.get("u", ()):
+            self._sticky[user_id] = max(self._sticky.get(user_id, 0), until)
@@ -0,0 +1,44 @@
+"""
+用 orjson 序列化的 JSON 回應
+
+FastAPI 預設會先用 jsonable_encoder 把回傳值整個走過一遍 (每個 dict / list / date 都轉一次)，
+再交給 json.dumps；列表很長的 API 大部分的 CPU 都花在這裡。
+orjson 直接認得 date / datetime / dict / list，asyncpg 的 Record 也只要在 default 裡轉成 dict，
+所以 route 可以直接回傳 conn.fetch() 的結果，不用先 [dict(row) for row in rows]。
+
+route 回傳 FastJSONResponse (或 main.json_response) 就會跳過 jsonable_encoder；
+回傳一般的 dict 時，FastAPI 仍會先做 jsonable_encoder，只有最後一步換成 orjson。
+"""
+from decimal import Decimal
+
+import asyncpg
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+
+def _default(obj):
+    if isinstance(obj, asyncpg.Record):
+        return dict(obj)
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    if isinstance(obj, Decimal):
+        # 和 jsonable_encoder 一樣轉成數字 (SUM() 之類的結果)
+        return float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"{type(obj).__name__} 無法轉成 JSON")
+
+
+def dumps(content, sort_keys: bool = False) -> bytes:
+    option = orjson.OPT_NON_STR_KEYS
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    return orjson.dumps(content, default=_default, option=option)
+
+
+class FastJSONResponse(JSONResponse):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -0,0 +1,93 @@
+"""
+正式環境的啟動方式 (開發時 docker compose 用的是 uvicorn --reload)
+
+  - 開多個 uvicorn worker process (預設 = CPU 核心數)，用 uvloop + httptools
+  - 依 Postgres 的 max_connections 分配每個 worker 的連線池大小，全部加起來不會超過上限
+  - 收到 SIGTERM 時先停止接新連線，等進行中的 request (例如上傳照片) 做完再結束，
+    最多等 GRACEFUL_TIMEOUT 秒；WebSocket 會收到 1012 (service restart)，client 會自己重連
+
+    python migrate.py && python serve.py --workers 4
+
+環境變數：
+  WEB_CONCURRENCY          worker 數，--workers 沒給時使用
+  GRACEFUL_TIMEOUT         SIGTERM 後等待進行中 request 的秒數，預設 30
+  DB_RESERVED_CONNECTIONS  保留給 migrate / 管理工具 / benchmark 的連線數，預設 10
+  PG_MAX_CONNECTIONS       連不到資料庫查 max_connections 時使用，預設 100
+  DB_POOL_MAX_SIZE         有設的話當作每個 worker 的上限 (超過預算會自動調小)
+"""
+import argparse
+import asyncio
+import os
+
+import asyncpg
+import uvicorn
+
+from db import DATABASE_URL
+
+GRACEFUL_TIMEOUT = int(os.environ.get("GRACEFUL_TIMEOUT", "30"))
+DB_RESERVED_CONNECTIONS = int(os.environ.get("DB_RESERVED_CONNECTIONS", "10"))
+PG_MAX_CONNECTIONS = int(os.environ.get("PG_MAX_CONNECTIONS", "100"))
+DEFAULT_POOL_MAX_SIZE = 20
+
+
+async def connection_budget(dsn: str) -> int:
+    """Postgres 可以給一般使用者的連線數 (max_connections 扣掉 superuser 保留的)。"""
+    try:
+        conn = await asyncpg.connect(dsn, timeout=10)
+    except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+        print(f"查不到 max_connections ({e})，使用 PG_MAX_CONNECTIONS={PG_MAX_CONNECTIONS}")
+        return PG_MAX_CONNECTIONS
+    try:
+        max_connections = int(await conn.fetchval("SHOW max_connections"))
+        reserved = int(await conn.fetchval("SHOW superuser_reserved_connections"))
+        return max_connections - reserved
+    finally:
+        await conn.close()
+
+
+def pool_size_per_worker(budget: int, workers: int) -> int:
+    available = budget - DB_RESERVED_CONNECTIONS
+    per_worker = available // workers
+    # 每個 worker 至少要有 LISTEN 一條 + job worker + request 用的
+    if per_worker < 4:
+        raise SystemExit(
+            f"資料庫連線不夠：{workers} 個 worker 只分得到 {per_worker} 條 "
+            f"(可用 {available} 條)，請減少 worker 或調高 Postgres 的 max_connections"
+        )
+    wanted = int(os.environ.get("DB_POOL_MAX_SIZE", DEFAULT_POOL_MAX_SIZE))
+    return min(wanted, per_worker)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", "0")) or os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    budget = asyncio.run(connection_budget(DATABASE_URL))
+    pool_size = pool_size_per_worker(budget, args.workers)
+    # worker process 是 spawn 出來的，會繼承這些環境變數 (db.py / images.py 在 import 時讀取)
+    os.environ["DB_POOL_MAX_SIZE"] = str(pool_size)
+    os.environ["DB_POOL_MIN_SIZE"] = str(min(int(os.environ.get("DB_POOL_MIN_SIZE", "2")), pool_size))
+    # 縮圖的 process pool 也是每個 worker 一份，總數不要超過 CPU 核心數
+    os.environ.setdefault("IMAGE_WORKERS", str(max(1, (os.cpu_count() or 1) // args.workers)))
+
+    print(f"{args.workers} workers，每個 worker 的 DB pool 上限 {pool_size} 條 "
+          f"(共 {pool_size * args.workers} / 可用 {budget} 條)，SIGTERM 後最多等 {GRACEFUL_TIMEOUT}s")
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop="uvloop",
+        http="httptools",
+        lifespan="on",
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        proxy_headers=True,
+        access_log=False,  # 每個 request 的耗時在 /metrics (profiling.py)
+    )
+
+
+if __name__ == "__main__":
+    main()
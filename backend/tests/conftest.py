@@ -0,0 +1,111 @@
+"""
+pytest 共用設定：在 backend/ 底下執行 `python -m pytest tests`。
+
+需要資料庫的測試用 TEST_DATABASE_URL 指定一個可以 CREATE DATABASE 的連線 (沒設就 skip)，
+每個測試建一個空的資料庫、結束後刪掉，不會動到 DATABASE_URL 那個：
+    docker compose exec -e TEST_DATABASE_URL=postgresql://postgres:password@db:5432/postgres backend python -m pytest tests
+"""
+import asyncio
+import functools
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+
+@pytest.fixture
+def empty_database():
+    """回傳一個剛建立的空資料庫的 DSN。"""
+    if not TEST_DATABASE_URL:
+        pytest.skip("沒有設定 TEST_DATABASE_URL")
+    asyncpg = pytest.importorskip("asyncpg")
+    name = f"focusmate_test_{uuid.uuid4().hex[:8]}"
+
+    async def admin(sql: str):
+        conn = await asyncpg.connect(TEST_DATABASE_URL)
+        try:
+            await conn.execute(sql)
+        finally:
+            await conn.close()
+
+    asyncio.run(admin(f"CREATE DATABASE {name}"))
+    try:
+        yield TEST_DATABASE_URL.rsplit("/", 1)[0] + "/" + name
+    finally:
+        asyncio.run(admin(f"DROP DATABASE IF EXISTS {name} WITH (FORCE)"))
+
+
+@pytest.fixture
+def migrated_database(empty_database):
+    """執行過全部 migration 的空資料庫。"""
+    import asyncpg
+    from migrate import migrate
+
+    async def run():
+        conn = await asyncpg.connect(empty_database)
+        try:
+            await migrate(conn, log=lambda *args: None)
+        finally:
+            await conn.close()
+
+    asyncio.run(run())
+    return empty_database
+
+
+@pytest.fixture
+def run_with_pool(migrated_database):
+    """run_with_pool(test)：在 migrated_database 上開一個 asyncpg pool 執行 `await test(pool)`。"""
+    import asyncpg
+
+    def run(test, max_size: int = 4):
+        async def main():
+            pool = await asyncpg.create_pool(migrated_database, min_size=1, max_size=max_size)
+            try:
+                return await test(pool)
+            finally:
+                await pool.close()
+
+        return asyncio.run(main())
+
+    return run
+
+
+@pytest.fixture
+def query(migrated_database):
+    """query(sql, *args)：在 migrated_database 上執行一個查詢，回傳 fetchval 的結果。"""
+    import asyncpg
+
+    def run(sql: str, *args):
+        async def main():
+            conn = await asyncpg.connect(migrated_database)
+            try:
+                return await conn.fetchval(sql, *args)
+            finally:
+                await conn.close()
+
+        return asyncio.run(main())
+
+    return run
+
+
+@pytest.fixture
+def client(migrated_database, tmp_path, monkeypatch):
+    """連到 migrated_database 的 TestClient (會跑 lifespan)，圖片存在 tmp_path。"""
+    pytest.importorskip("fastapi")
+    pytest.importorskip("PIL")
+    from fastapi.testclient import TestClient
+
+    import db
+    import main
+    from blob_store import LocalBlobStore
+
+    monkeypatch.setattr(main, "create_pool", functools.partial(db.create_pool, migrated_database))
+    monkeypatch.setattr(main, "get_blob_store", lambda: LocalBlobStore(str(tmp_path)))
+    with TestClient(main.app) as client:
+        yield client
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+asyncpg = pytest.importorskip("asyncpg")
+
+from badges import BADGE_BALANCE_SQL, BADGE_COMPACT_LOCK_KEY, compact
+
+EARNED = 5
+TASKS = 20
+
+
+async def create_user(pool, earned: int = 0) -> int:
+    async with pool.acquire() as conn:
+        user_id = await conn.fetchval("INSERT INTO users (name) VALUES ('badges-test') RETURNING user_id")
+        for _ in range(earned):
+            await conn.execute("INSERT INTO badge_ledger (user_id, amount, reason) VALUES ($1, 1, 'focus')", user_id)
+    return user_id
+
+
+async def spend(pool, user_id) -> bool:
+    """跟送訊息一樣：先 badge_balance_for_update 再扣一個。"""
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            if await conn.fetchval("SELECT badge_balance_for_update($1)", user_id) < 1:
+                return False
+            await conn.execute("INSERT INTO badge_ledger (user_id, amount, reason) VALUES ($1, -1, 'message')", user_id)
+            return True
+
+
+async def balance(pool, user_id) -> int:
+    async with pool.acquire() as conn:
+        return await conn.fetchval(BADGE_BALANCE_SQL, user_id)
+
+
+async def ledger_rows(pool) -> int:
+    async with pool.acquire() as conn:
+        return await conn.fetchval("SELECT count(*) FROM badge_ledger")
+
+
+def test_balance_is_snapshot_plus_ledger(run_with_pool):
+    async def test(pool):
+        user_id = await create_user(pool, EARNED)
+        assert await spend(pool, user_id)
+        assert await balance(pool, user_id) == EARNED - 1
+
+        async with pool.acquire() as conn:
+            assert await compact(conn) == EARNED + 1
+        assert await ledger_rows(pool) == 0
+        assert await balance(pool, user_id) == EARNED - 1
+
+        # 壓縮後的新紀錄接在快照後面
+        assert await spend(pool, user_id)
+        assert await balance(pool, user_id) == EARNED - 2
+
+    run_with_pool(test)
+
+
+def test_compact_in_small_batches(run_with_pool):
+    async def test(pool):
+        users = [await create_user(pool, EARNED) for _ in range(3)]
+        async with pool.acquire() as conn:
+            assert await compact(conn, batch=4) == EARNED * len(users)
+        assert await ledger_rows(pool) == 0
+        assert [await balance(pool, u) for u in users] == [EARNED] * len(users)
+
+    run_with_pool(test)
+
+
+def test_compact_skips_when_another_process_holds_the_lock(run_with_pool):
+    async def test(pool):
+        await create_user(pool, EARNED)
+        async with pool.acquire() as holder, pool.acquire() as conn:
+            await holder.execute("SELECT pg_advisory_lock($1)", BADGE_COMPACT_LOCK_KEY)
+            try:
+                assert await compact(conn) is None
+            finally:
+                await holder.execute("SELECT pg_advisory_unlock($1)", BADGE_COMPACT_LOCK_KEY)
+        assert await ledger_rows(pool) == EARNED
+
+    run_with_pool(test)
+
+
+def test_concurrent_spends_and_compaction_never_overdraw(run_with_pool):
+    async def test(pool):
+        user_id = await create_user(pool, EARNED)
+
+        async def compactor():
+            for _ in range(TASKS):
+                async with pool.acquire() as conn:
+                    await compact(conn, batch=2)
+                await asyncio.sleep(0)
+
+        results = await asyncio.gather(*(spend(pool, user_id) for _ in range(TASKS)), compactor())
+        assert sum(results[:TASKS]) == EARNED
+        assert await balance(pool, user_id) == 0
+
+        async with pool.acquire() as conn:
+            await compact(conn)
+        assert await balance(pool, user_id) == 0
+
+    run_with_pool(test, max_size=10)
@@ -0,0 +1,65 @@
+import asyncio
+import contextlib
+import json
+from datetime import timedelta
+
+import pytest
+
+pytest.importorskip("asyncpg")
+
+from leaderboard import Leaderboard
+from presence import BROADCAST_BATCH
+from reminders import ReminderScheduler, today
+
+
+class RecordingPool:
+    """記下每個 NOTIFY 的 pool：acquire 了幾次、送了哪些 payload。"""
+
+    def __init__(self):
+        self.acquired = 0
+        self.notified = []
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        self.acquired += 1
+        yield self
+
+    async def execute(self, sql, channel, payload):
+        self.notified.append(json.loads(payload))
+
+
+def test_reminder_changes_are_published_from_the_loop():
+    async def run():
+        pool = RecordingPool()
+        scheduler = ReminderScheduler(pool)
+        deadline_date = today() + timedelta(days=5)
+        rows = [{"id": i, "user_id": 1, "deadline_date": deadline_date, "task": "t", "is_done": False}
+                for i in range(BROADCAST_BATCH + 1)]
+        await scheduler.track(rows)
+        await scheduler.forget([0])
+        # route 只改記憶體，不碰 DB
+        assert pool.acquired == 0
+
+        await scheduler.publish()
+        assert pool.acquired == 1
+        assert sorted(i for event in pool.notified for i in event["ids"]) == list(range(BROADCAST_BATCH + 1))
+        await scheduler.publish()
+        assert pool.acquired == 1
+
+    asyncio.run(run())
+
+
+def test_leaderboard_invalidations_are_published_from_the_loop():
+    async def run():
+        pool = RecordingPool()
+        board = Leaderboard(pool)
+        await board.invalidate(user_ids=[1, 2])
+        await board.invalidate(user_ids=[2], friends_of=[3])
+        assert pool.acquired == 0
+
+        await board.publish()
+        assert [(sorted(e["u"]), e["f"]) for e in pool.notified] == [([1, 2], [3])]
+        await board.publish()
+        assert len(pool.notified) == 1
+
+    asyncio.run(run())
@@ -0,0 +1,99 @@
+import pytest
+
+pytest.importorskip("asyncpg")
+pytest.importorskip("fastapi")
+pytest.importorskip("PIL")
+
+from reminders import PURGE_TOMBSTONES_SQL
+
+
+@pytest.fixture
+def user_id(query):
+    return query("INSERT INTO users (name) VALUES ('sync-test') RETURNING user_id")
+
+
+def sync(client, user_id, since=0, *mutations):
+    response = client.post("/deadlines/sync", json={"user_id": user_id, "since": since, "mutations": list(mutations)})
+    assert response.status_code == 200
+    return response.json()
+
+
+def changes(client, user_id, since):
+    response = client.get("/deadlines/changes", params={"user_id": user_id, "since": since})
+    assert response.status_code == 200
+    return response.json()
+
+
+def add(client, user_id, *tasks):
+    body = sync(client, user_id, 0, *({"op": "add", "client_id": task, "task": task, "deadline_date": "2030-01-01"}
+                                      for task in tasks))
+    return [result["id"] for result in body["results"]], body
+
+
+def test_changes_only_returns_rows_written_since_version(client, user_id):
+    (first, second), body = add(client, user_id, "a", "b")
+    assert body["reset"] is True
+    assert sorted(row["id"] for row in body["upserts"]) == [first, second]
+
+    version = changes(client, user_id, 0)["version"]
+    sync(client, user_id, 0, {"op": "edit", "id": second, "task": "b2"})
+    delta = changes(client, user_id, version)
+    assert delta["reset"] is False
+    assert [(row["id"], row["thing"]) for row in delta["upserts"]] == [(second, "b2")]
+    assert delta["deleted"] == []
+
+
+def test_stale_base_version_is_a_conflict(client, user_id):
+    (deadline_id,), body = add(client, user_id, "a")
+    seen = body["upserts"][0]["row_version"]
+    # 另一台裝置先改了
+    sync(client, user_id, 0, {"op": "edit", "id": deadline_id, "base_version": seen, "task": "other device"})
+
+    result = sync(client, user_id, 0, {"op": "edit", "id": deadline_id, "base_version": seen, "task": "offline"})
+    assert result["results"][0]["status"] == "conflict"
+    assert result["results"][0]["current"]["thing"] == "other device"
+    assert [row["thing"] for row in result["upserts"]] == ["other device"]
+
+
+def test_same_row_twice_in_one_batch_is_not_a_conflict(client, user_id):
+    (deadline_id,), body = add(client, user_id, "a")
+    seen = body["upserts"][0]["row_version"]
+    result = sync(client, user_id, 0,
+                  {"op": "edit", "id": deadline_id, "base_version": seen, "task": "a2"},
+                  {"op": "done", "id": deadline_id, "base_version": seen, "is_done": True})
+    assert [r["status"] for r in result["results"]] == ["applied", "applied"]
+    assert [(row["thing"], row["is_done"]) for row in result["upserts"]] == [("a2", True)]
+
+
+def test_replayed_add_is_not_duplicated(client, user_id):
+    (first,), _ = add(client, user_id, "a")
+    result = sync(client, user_id, 0, {"op": "add", "client_id": "a", "task": "a", "deadline_date": "2030-01-01"})
+    assert result["results"][0] == {"op": "add", "id": first, "client_id": "a", "status": "replayed"}
+    assert [row["id"] for row in result["upserts"]] == [first]
+
+
+def test_removed_rows_come_back_as_tombstones(client, user_id):
+    (kept, removed), _ = add(client, user_id, "a", "b")
+    version = changes(client, user_id, 0)["version"]
+    result = sync(client, user_id, version, {"op": "remove", "id": removed})
+    assert result["results"][0]["status"] == "applied"
+    assert result["deleted"] == [removed]
+    assert result["upserts"] == []
+
+    # 已經刪掉的再刪一次
+    again = sync(client, user_id, 0, {"op": "remove", "id": removed})
+    assert again["results"][0]["status"] == "not_found"
+    assert [row["id"] for row in again["upserts"]] == [kept]
+
+
+def test_since_older_than_purged_tombstones_resets(client, query, user_id):
+    (kept, removed), body = add(client, user_id, "a", "b")
+    sync(client, user_id, 0, {"op": "remove", "id": removed})
+    query("UPDATE deadline_tombstones SET deleted_at = now() - interval '60 days' WHERE id = $1", removed)
+    query(PURGE_TOMBSTONES_SQL, 30)
+
+    # 刪除的紀錄已經清掉：整份重拿，client 才不會留著 removed
+    delta = changes(client, user_id, body["version"])
+    assert delta["reset"] is True
+    assert delta["deleted"] == []
+    assert [row["id"] for row in delta["upserts"]] == [kept]
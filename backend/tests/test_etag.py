@@ -0,0 +1,92 @@
+import pytest
+
+pytest.importorskip("asyncpg")
+pytest.importorskip("fastapi")
+pytest.importorskip("PIL")
+
+INBOX = "/api/v1/messages/inbox"
+LATEST = "/api/v1/messages/unread/latest"
+
+
+@pytest.fixture
+def users(query):
+    sender = query("INSERT INTO users (name) VALUES ('etag-sender') RETURNING user_id")
+    receiver = query("INSERT INTO users (name) VALUES ('etag-receiver') RETURNING user_id")
+    return sender, receiver
+
+
+def send(query, sender, receiver, content="hi"):
+    query("INSERT INTO messages (sender_id, receiver_id, content) VALUES ($1, $2, $3)", sender, receiver, content)
+
+
+def get(client, path, user_id, etag=None):
+    headers = {"If-None-Match": etag} if etag else {}
+    return client.get(path, params={"user_id": user_id}, headers=headers)
+
+
+@pytest.mark.parametrize("path", [INBOX, LATEST])
+def test_unchanged_messages_return_304(client, query, users, path):
+    sender, receiver = users
+    send(query, sender, receiver)
+
+    first = get(client, path, receiver)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+
+    again = get(client, path, receiver, etag)
+    assert again.status_code == 304
+    assert again.headers["ETag"] == etag
+    assert again.content == b""
+
+
+@pytest.mark.parametrize("path", [INBOX, LATEST])
+def test_new_message_invalidates_etag(client, query, users, path):
+    sender, receiver = users
+    send(query, sender, receiver, "first")
+    etag = get(client, path, receiver).headers["ETag"]
+
+    send(query, sender, receiver, "second")
+    response = get(client, path, receiver, etag)
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_sender_rename_invalidates_inbox_and_latest(client, query, users):
+    sender, receiver = users
+    send(query, sender, receiver)
+    etags = {path: get(client, path, receiver).headers["ETag"] for path in (INBOX, LATEST)}
+
+    query("UPDATE users SET name = 'renamed' WHERE user_id = $1", sender)
+
+    inbox = get(client, INBOX, receiver, etags[INBOX])
+    assert inbox.status_code == 200
+    assert inbox.json()["items"][0]["sender_name"] == "renamed"
+    latest = get(client, LATEST, receiver, etags[LATEST])
+    assert latest.status_code == 200
+    assert latest.json()["data"]["sender_name"] == "renamed"
+
+
+def test_other_users_writes_keep_etag(client, query, users):
+    sender, receiver = users
+    send(query, sender, receiver)
+    etag = get(client, INBOX, receiver).headers["ETag"]
+
+    # 寄件者收到訊息不會影響收件者的收件匣
+    send(query, receiver, sender)
+    assert get(client, INBOX, receiver, etag).status_code == 304
+
+
+def test_record_status_etag(client, query, users):
+    _, user_id = users
+    path = "/api/v1/user/record_status"
+    first = get(client, path, user_id)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert get(client, path, user_id, etag).status_code == 304
+
+    query("UPDATE users SET title = 'changed' WHERE user_id = $1", user_id)
+    # profile 快取要先失效才看得到新的 title (改 title 的 API 會呼叫 invalidate_profile)
+    client.app.state.presence._profiles.clear()
+    response = get(client, path, user_id, etag)
+    assert response.status_code == 200
+    assert response.json()["title_name"] == "changed"
@@ -0,0 +1,85 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+pytest.importorskip("asyncpg")
+pytest.importorskip("fastapi")
+Image = pytest.importorskip("PIL.Image")
+
+from blob_store import LocalBlobStore
+
+SESSION_ID = "session-0001"
+
+
+@pytest.fixture
+def user_id(query):
+    return query("INSERT INTO users (name) VALUES ('sessions-test') RETURNING user_id")
+
+
+def png() -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", (64, 64), "blue").save(out, "PNG")
+    return out.getvalue()
+
+
+def end_session(client, user_id, photo: bytes = None, **form):
+    data = {"session_id": SESSION_ID, "user_id": user_id, "duration_seconds": 25 * 60,
+            "ended_at": "2024-05-01T10:30:00", **form}
+    files = {"file": ("photo.png", photo, "image/png")} if photo is not None else None
+    return client.post("/focus/sessions", data=data, files=files)
+
+
+def totals(query, user_id):
+    return (
+        query("SELECT COALESCE(SUM(focus_minutes), 0) FROM focus_time WHERE user_id = $1", user_id),
+        query("SELECT badge FROM user_badges WHERE user_id = $1", user_id),
+        query("SELECT count(*) FROM pictures WHERE user_id = $1", user_id),
+    )
+
+
+def test_replay_returns_first_result_without_counting_twice(client, query, user_id):
+    first = end_session(client, user_id, png())
+    assert first.status_code == 200
+    assert first.json()["replayed"] is False
+    assert totals(query, user_id) == (25, 1, 1)
+
+    again = end_session(client, user_id, png())
+    assert again.status_code == 200
+    body = again.json()
+    assert body["replayed"] is True
+    assert (body["minutes"], body["badge_earned"], body["picture_id"]) == (25, True, first.json()["picture_id"])
+    assert totals(query, user_id) == (25, 1, 1)
+
+
+def test_replay_still_applies_status(client, user_id):
+    presence = client.app.state.presence
+    # 第一次 commit 了但回應沒送到：client 這邊狀態還是「專注中」
+    assert end_session(client, user_id).status_code == 200
+    client.post("/user/status", json={"user_id": user_id, "is_studying": True})
+    assert presence.get(user_id) == (True, False)
+
+    response = end_session(client, user_id, is_studying="false", is_breaking="true")
+    assert response.json()["replayed"] is True
+    assert presence.get(user_id) == (False, True)
+
+
+def test_unknown_user_leaves_no_blob(client, query, tmp_path):
+    photo = png()
+    missing = query("SELECT COALESCE(MAX(user_id), 0) + 1000 FROM users")
+
+    response = end_session(client, missing, photo)
+    assert response.status_code == 404
+    key = hashlib.sha256(photo).hexdigest()
+    assert not os.path.exists(LocalBlobStore(str(tmp_path)).path_for(key))
+
+
+def test_failed_request_keeps_blob_used_by_another_picture(client, query, user_id, tmp_path):
+    photo = png()
+    assert end_session(client, user_id, photo).status_code == 200
+    missing = query("SELECT COALESCE(MAX(user_id), 0) + 1000 FROM users")
+
+    assert end_session(client, missing, photo, session_id="session-0002").status_code == 404
+    key = hashlib.sha256(photo).hexdigest()
+    assert os.path.exists(LocalBlobStore(str(tmp_path)).path_for(key))
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+asyncpg = pytest.importorskip("asyncpg")
+
+from jobs import CLAIM_SQL, JobQueue, enqueue
+
+KEY = "focus-rollup:1:2024-01-01"
+
+
+async def claim_failing_job(pool):
+    """排一筆有 idempotency key 的工作並拿出來 (running)，回傳 claim 到的 record。"""
+    async with pool.acquire() as conn:
+        await enqueue(conn, "test.fail", {}, KEY)
+        return await conn.fetchrow(CLAIM_SQL, 60.0)
+
+
+async def statuses(pool):
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("SELECT id, status FROM jobs WHERE idempotency_key = $1 ORDER BY id", KEY)
+    return [(row["id"], row["status"]) for row in rows]
+
+
+def run_with_pool(dsn, test):
+    async def run():
+        pool = await asyncpg.create_pool(dsn, min_size=1, max_size=4)
+        try:
+            await test(pool)
+        finally:
+            await pool.close()
+
+    asyncio.run(run())
+
+
+def test_failed_job_is_requeued(migrated_database):
+    async def test(pool):
+        job = await claim_failing_job(pool)
+        await JobQueue(pool)._fail(job, RuntimeError("boom"))
+        assert await statuses(pool) == [(job["id"], "queued")]
+
+    run_with_pool(migrated_database, test)
+
+
+def test_retry_merges_into_pending_job_with_same_key(migrated_database):
+    async def test(pool):
+        job = await claim_failing_job(pool)
+        async with pool.acquire() as conn:
+            pending = await enqueue(conn, "test.fail", {}, KEY)
+        await JobQueue(pool)._fail(job, RuntimeError("boom"))
+        assert await statuses(pool) == [(job["id"], "done"), (pending, "queued")]
+
+    run_with_pool(migrated_database, test)
+
+
+def test_retry_survives_same_key_enqueued_concurrently(migrated_database):
+    async def test(pool):
+        job = await claim_failing_job(pool)
+        # 新工作在 _fail 檢查之後才 commit：放回佇列時撞到 unique index
+        async with pool.acquire() as other:
+            tx = other.transaction()
+            await tx.start()
+            pending = await enqueue(other, "test.fail", {}, KEY)
+            failing = asyncio.create_task(JobQueue(pool)._fail(job, RuntimeError("boom")))
+            await asyncio.sleep(0.5)
+            await tx.commit()
+            await failing
+        assert await statuses(pool) == [(job["id"], "done"), (pending, "queued")]
+
+    run_with_pool(migrated_database, test)
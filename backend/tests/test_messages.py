@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+asyncpg = pytest.importorskip("asyncpg")
+pytest.importorskip("fastapi")
+pytest.importorskip("PIL")
+
+from main import MessageCreate, send_nudges, spend_badge_and_send
+
+BADGES = 5
+TASKS = 30
+
+
+async def create_users(pool, count: int, badge: int = 0):
+    async with pool.acquire() as conn:
+        user_ids = await conn.fetchval("""
+            WITH created AS (
+                INSERT INTO users (name) SELECT 'messages-test-' || i FROM generate_series(1, $1) AS i
+                RETURNING user_id
+            )
+            SELECT array_agg(user_id ORDER BY user_id) FROM created
+        """, count)
+        await conn.execute("""
+            INSERT INTO badge_balances (user_id, balance) SELECT unnest($1::int[]), $2
+        """, user_ids, badge)
+    return user_ids
+
+
+async def badge_and_sent(pool, sender_id):
+    async with pool.acquire() as conn:
+        return await conn.fetchrow("""
+            SELECT (SELECT badge FROM user_badges WHERE user_id = $1) AS badge,
+                   (SELECT count(*) FROM messages WHERE sender_id = $1) AS sent
+        """, sender_id)
+
+
+async def send(pool, sender_id, receiver_id):
+    async with pool.acquire() as conn:
+        return await spend_badge_and_send(conn, MessageCreate(sender_id=sender_id, receiver_id=receiver_id, content="hi"))
+
+
+async def nudge(pool, sender_id, receiver_ids):
+    async with pool.acquire() as conn:
+        results = await send_nudges(conn, sender_id, receiver_ids, "起來讀書")
+    return sum(1 for r in results if r["status"] == "sent")
+
+
+def test_concurrent_sends_never_overdraw(run_with_pool):
+    async def test(pool):
+        sender, receiver = await create_users(pool, 2, badge=BADGES)
+        sent = await asyncio.gather(*(send(pool, sender, receiver) for _ in range(TASKS)))
+
+        assert sum(1 for message_id in sent if message_id is not None) == BADGES
+        assert dict(await badge_and_sent(pool, sender)) == {"badge": 0, "sent": BADGES}
+
+    run_with_pool(test, max_size=10)
+
+
+def test_concurrent_nudges_never_overdraw(run_with_pool):
+    async def test(pool):
+        sender, *receivers = await create_users(pool, 4, badge=BADGES)
+        sent = await asyncio.gather(*(nudge(pool, sender, receivers) for _ in range(TASKS)))
+
+        assert sum(sent) == BADGES
+        assert dict(await badge_and_sent(pool, sender)) == {"badge": 0, "sent": BADGES}
+
+    run_with_pool(test, max_size=10)
+
+
+def test_sends_and_nudges_share_one_balance(run_with_pool):
+    async def test(pool):
+        sender, *receivers = await create_users(pool, 4, badge=BADGES)
+        results = await asyncio.gather(
+            *(send(pool, sender, receivers[0]) for _ in range(TASKS)),
+            *(nudge(pool, sender, receivers) for _ in range(TASKS)),
+        )
+
+        singles, nudges = results[:TASKS], results[TASKS:]
+        assert sum(1 for message_id in singles if message_id is not None) + sum(nudges) == BADGES
+        assert dict(await badge_and_sent(pool, sender)) == {"badge": 0, "sent": BADGES}
+
+    run_with_pool(test, max_size=10)
@@ -0,0 +1,65 @@
+import asyncio
+import hashlib
+
+import pytest
+
+asyncpg = pytest.importorskip("asyncpg")
+pytest.importorskip("starlette")
+
+import migrate_pictures
+from blob_store import LocalBlobStore
+
+IMG = b"\x89PNG\r\n\x1a\n" + b"picture" * 100
+
+
+def migrate_with_derivatives(dsn, store, monkeypatch, copies: int):
+    """copies 張內容一樣、還存在 img 的圖片，每張都有一個 'pic-<id>' 的縮圖；搬完回傳縮圖表。"""
+    monkeypatch.setattr(migrate_pictures, "get_blob_store", lambda: store)
+
+    async def run():
+        conn = await asyncpg.connect(dsn)
+        try:
+            user_id = await conn.fetchval("INSERT INTO users (name) VALUES ('migrate-test') RETURNING user_id")
+            thumbs = {}
+            for i in range(copies):
+                picture_id = await conn.fetchval(
+                    "INSERT INTO pictures (user_id, img) VALUES ($1, $2) RETURNING id", user_id, IMG)
+                thumb_key, size = await store.put_bytes(b"thumb of copy %d" % i)
+                await conn.execute("""
+                    INSERT INTO picture_derivatives (source_key, variant, format, blob_key, size_bytes, content_type)
+                    VALUES ($1, 'thumb', 'jpeg', $2, $3, 'image/jpeg')
+                """, f"pic-{picture_id}", thumb_key, size)
+                thumbs[picture_id] = thumb_key
+        finally:
+            await conn.close()
+
+        await migrate_pictures.migrate(dsn, batch_size=10)
+
+        conn = await asyncpg.connect(dsn)
+        try:
+            rows = await conn.fetch("SELECT source_key, blob_key FROM picture_derivatives ORDER BY source_key")
+        finally:
+            await conn.close()
+        return thumbs, [(row["source_key"], row["blob_key"]) for row in rows]
+
+    return asyncio.run(run())
+
+
+def test_derivatives_follow_the_new_blob_key(migrated_database, tmp_path, monkeypatch):
+    store = LocalBlobStore(str(tmp_path))
+    thumbs, rows = migrate_with_derivatives(migrated_database, store, monkeypatch, copies=1)
+
+    thumb_key, = thumbs.values()
+    assert rows == [(hashlib.sha256(IMG).hexdigest(), thumb_key)]
+    assert asyncio.run(store.exists(thumb_key))
+
+
+def test_duplicate_derivatives_are_deleted(migrated_database, tmp_path, monkeypatch):
+    store = LocalBlobStore(str(tmp_path))
+    thumbs, rows = migrate_with_derivatives(migrated_database, store, monkeypatch, copies=2)
+
+    # 兩張圖內容一樣：留第一張的縮圖，第二張的那份 (列和檔案) 都刪掉
+    first, second = (thumbs[picture_id] for picture_id in sorted(thumbs))
+    assert rows == [(hashlib.sha256(IMG).hexdigest(), first)]
+    assert asyncio.run(store.exists(first))
+    assert not asyncio.run(store.exists(second))
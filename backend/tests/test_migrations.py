@@ -0,0 +1,38 @@
+import ast
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+MIGRATIONS_DIR = Path(__file__).resolve().parents[1] / "migrations"
+
+
+def test_all_migrations_run_on_empty_database(empty_database):
+    asyncpg = pytest.importorskip("asyncpg")
+    from migrate import discover, migrate, verify_schema
+
+    async def run():
+        conn = await asyncpg.connect(empty_database)
+        try:
+            ran = await migrate(conn, log=lambda *args: None)
+            assert [m.version for m in ran] == [m.version for m in discover()]
+            await verify_schema(conn)
+            # 再執行一次什麼都不用做
+            assert await migrate(conn, log=lambda *args: None) == []
+        finally:
+            await conn.close()
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("path", sorted(MIGRATIONS_DIR.glob("*.py")), ids=lambda p: p.name)
+def test_migrations_only_import_stdlib(path):
+    # checksum 只涵蓋 migration 檔案本身：import app 模組的 SQL 常數的話，常數一改就跟執行過的不一樣
+    modules = set()
+    for node in ast.walk(ast.parse(path.read_text(encoding="utf-8"))):
+        if isinstance(node, ast.Import):
+            modules |= {alias.name.split(".")[0] for alias in node.names}
+        elif isinstance(node, ast.ImportFrom):
+            modules.add((node.module or "").split(".")[0])
+    assert modules <= set(sys.stdlib_module_names)
@@ -0,0 +1,58 @@
+import random
+
+import pytest
+
+from ordering import FIRST_KEY, key_between, plan_reorder
+
+
+def test_front_inserts_keep_key_length_bounded():
+    keys = [FIRST_KEY]
+    for _ in range(5000):
+        keys.insert(0, key_between(None, keys[0]))
+    assert keys == sorted(keys)
+    assert len(set(keys)) == len(keys)
+    assert max(len(k) for k in keys) == len(FIRST_KEY)
+
+
+def test_back_inserts_keep_key_length_bounded():
+    keys = [FIRST_KEY]
+    for _ in range(5000):
+        keys.append(key_between(keys[-1], None))
+    assert keys == sorted(keys)
+    assert max(len(k) for k in keys) == len(FIRST_KEY)
+
+
+def test_toggling_items_to_the_front_keeps_keys_short():
+    # 取消完成的項目一律放到最前面 (/deadlines/click-done、/deadlines/sync 的 done)
+    keys = [FIRST_KEY]
+    for _ in range(200):
+        keys.append(key_between(keys[-1], None))
+    rng = random.Random(1)
+    for _ in range(5000):
+        keys.remove(rng.choice(keys))
+        keys.insert(0, key_between(None, keys[0]))
+    assert keys == sorted(keys)
+    assert max(len(k) for k in keys) == len(FIRST_KEY)
+
+
+def test_front_inserts_below_the_smallest_key_grow_logarithmically():
+    key = "1"
+    for _ in range(5000):
+        lower = key_between(None, key)
+        assert lower < key and not lower.endswith("0")
+        key = lower
+    assert len(key) <= 8  # "1" → "0z" → "00zz" → "0000zzzz"
+
+
+@pytest.mark.parametrize("a,b", [("a00001", "a00002"), ("a0000V", "a0000W"), ("1", "2"), ("a", "a1")])
+def test_key_between_neighbours(a, b):
+    key = key_between(a, b)
+    assert a < key < b
+    assert not key.endswith("0")
+
+
+def test_plan_reorder_moves_only_the_dragged_item():
+    current = {i: k for i, k in zip(range(5), ["a00001", "a00002", "a00003", "a00004", "a00005"])}
+    changes = plan_reorder(current, [0, 3, 1, 2, 4])
+    assert [item_id for item_id, _ in changes] == [3]
+    assert current[0] < changes[0][1] < current[1]
@@ -0,0 +1,122 @@
+from datetime import date, datetime
+
+import pytest
+
+pytest.importorskip("asyncpg")
+
+from partitions import (
+    MESSAGES,
+    add_months,
+    apply_retention,
+    ensure_partitions,
+    month_start,
+    partition_name,
+    record_id_bounds,
+    retention_cutoff,
+)
+
+UNREAD_SQL = """
+    SELECT array_agg(id ORDER BY id) FROM messages
+    WHERE receiver_id = $1 AND is_read = FALSE AND created_at >= messages_floor($1, $2)
+"""
+
+
+def expired_month() -> date:
+    return add_months(month_start(date.today()), -(MESSAGES.retention_months + 2))
+
+
+async def seed(conn, month: date):
+    """month 的 partition 裡一則已讀、一則未讀，回傳 (收件者, 已讀 id, 未讀 id)。"""
+    await ensure_partitions(conn, since=month)
+    sender, receiver = await conn.fetchval("""
+        WITH created AS (INSERT INTO users (name) VALUES ('retention-sender'), ('retention-receiver') RETURNING user_id)
+        SELECT array_agg(user_id ORDER BY user_id) FROM created
+    """)
+    created_at = datetime(month.year, month.month, 10)
+    read_id, unread_id = await conn.fetchval("""
+        WITH created AS (
+            INSERT INTO messages (sender_id, receiver_id, content, is_read, created_at)
+            VALUES ($1, $2, 'read', TRUE, $3), ($1, $2, 'unread', FALSE, $3)
+            RETURNING id
+        )
+        SELECT array_agg(id ORDER BY id) FROM created
+    """, sender, receiver, created_at)
+    return receiver, read_id, unread_id
+
+
+def test_retention_keeps_unread_messages(run_with_pool):
+    async def test(pool):
+        month = expired_month()
+        async with pool.acquire() as conn:
+            receiver, read_id, unread_id = await seed(conn, month)
+
+            assert partition_name("messages", month) in await apply_retention(conn)
+            remaining = await conn.fetch("SELECT id, tableoid::regclass::text AS part FROM messages WHERE receiver_id = $1",
+                                         receiver)
+            assert [(r["id"], r["part"]) for r in remaining] == [(unread_id, "messages_default")]
+            # 搬家時關掉的 trigger 要開回來
+            assert await conn.fetchval("""
+                SELECT bool_and(tgenabled = 'O') FROM pg_trigger
+                WHERE tgrelid = 'messages_default'::regclass AND NOT tgisinternal
+            """)
+            # 比保留期限舊也查得到
+            assert await conn.fetchval(UNREAD_SQL, receiver, retention_cutoff(MESSAGES)) == [unread_id]
+            archived = await conn.fetchrow("SELECT message_count, unread_count FROM messages_monthly WHERE receiver_id = $1",
+                                           receiver)
+            assert dict(archived) == {"message_count": 1, "unread_count": 0}
+
+    run_with_pool(test)
+
+
+def test_unread_message_is_archived_after_it_is_read(run_with_pool):
+    async def test(pool):
+        async with pool.acquire() as conn:
+            receiver, _, unread_id = await seed(conn, expired_month())
+            await apply_retention(conn)
+
+            await conn.execute("UPDATE messages SET is_read = TRUE WHERE id = $1", unread_id)
+            await apply_retention(conn)
+            assert await conn.fetchval("SELECT count(*) FROM messages WHERE receiver_id = $1", receiver) == 0
+            assert await conn.fetchval("SELECT message_count FROM messages_monthly WHERE receiver_id = $1", receiver) == 2
+
+    run_with_pool(test)
+
+
+def test_floor_skips_expired_months_without_unread(run_with_pool):
+    async def test(pool):
+        async with pool.acquire() as conn:
+            receiver, _, _ = await seed(conn, expired_month())
+            cutoff = retention_cutoff(MESSAGES)
+            await apply_retention(conn)
+            await conn.execute("UPDATE messages SET is_read = TRUE WHERE receiver_id = $1", receiver)
+            assert await conn.fetchval("SELECT messages_floor($1, $2)", receiver, cutoff) == cutoff
+            assert await conn.fetchval(UNREAD_SQL, receiver, cutoff) is None
+
+    run_with_pool(test)
+
+
+def test_empty_current_partition_gets_an_id_bound(run_with_pool):
+    async def test(pool):
+        today = date.today()
+        current = month_start(today)
+        async with pool.acquire() as conn:
+            await ensure_partitions(conn)
+            await conn.execute("DELETE FROM messages_id_bounds")
+            await record_id_bounds(conn, today)
+            bounds = {row["partition_start"].date(): row["first_id"]
+                      for row in await conn.fetch("SELECT partition_start, first_id FROM messages_id_bounds")}
+            # 未來月份的第一個 id 還不知道
+            assert list(bounds) == [current]
+
+            user_id = await conn.fetchval("INSERT INTO users (name) VALUES ('bounds') RETURNING user_id")
+            message_id = await conn.fetchval("""
+                INSERT INTO messages (sender_id, receiver_id, content) VALUES ($1, $1, 'hi') RETURNING id
+            """, user_id)
+            assert message_id >= bounds[current]
+            # 只知道 id 的查詢 (標記已讀) 要找得到
+            assert await conn.fetchval("""
+                SELECT count(*) FROM messages
+                WHERE id = $1 AND created_at >= messages_created_after($1) AND created_at < messages_created_before($1)
+            """, message_id) == 1
+
+    run_with_pool(test)
@@ -0,0 +1,44 @@
+import io
+
+import pytest
+
+pytest.importorskip("asyncpg")
+pytest.importorskip("fastapi")
+Image = pytest.importorskip("PIL.Image")
+
+
+@pytest.fixture
+def user_id(query):
+    return query("INSERT INTO users (name) VALUES ('pictures-test') RETURNING user_id")
+
+
+def upload(client, user_id, data: bytes) -> int:
+    response = client.post("/camera/upload-file", data={"user_id": user_id},
+                           files={"file": ("upload.bin", data, "application/octet-stream")})
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def test_thumbnail_of_non_image_upload_is_415(client, user_id):
+    data = b"this is not an image" * 100
+    picture_id = upload(client, user_id, data)
+
+    response = client.get(f"/pictures/{picture_id}", params={"size": "thumb"})
+    assert response.status_code == 415
+
+    # 原檔還是拿得到
+    response = client.get(f"/pictures/{picture_id}")
+    assert response.status_code == 200
+    assert response.content == data
+
+
+def test_thumbnail_of_image_upload(client, user_id):
+    out = io.BytesIO()
+    Image.new("RGB", (800, 600), "red").save(out, "PNG")
+    picture_id = upload(client, user_id, out.getvalue())
+
+    response = client.get(f"/pictures/{picture_id}", params={"size": "thumb"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/jpeg"
+    with Image.open(io.BytesIO(response.content)) as thumb:
+        assert max(thumb.size) == 256
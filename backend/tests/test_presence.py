@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+import pytest
+
+asyncpg = pytest.importorskip("asyncpg")
+
+from presence import PresenceCache
+
+TTL = 0.3
+
+
+class ListenHub:
+    """只有 add_channel_listener 的 MessageHub：每個 worker 一條自己的 LISTEN 連線。"""
+
+    def __init__(self, dsn):
+        self.dsn = dsn
+        self.conn = None
+
+    async def add_channel_listener(self, channel, callback):
+        self.conn = await asyncpg.connect(self.dsn)
+        await self.conn.add_listener(channel, callback)
+
+    async def close(self):
+        await self.conn.close()
+
+
+def run_workers(dsn, test, workers: int = 2):
+    """workers 個 PresenceCache (模擬多個 uvicorn worker)，背景 flush 關掉，由測試自己呼叫。"""
+    async def run():
+        pool = await asyncpg.create_pool(dsn, min_size=1, max_size=4)
+        hubs = [ListenHub(dsn) for _ in range(workers)]
+        try:
+            async with pool.acquire() as conn:
+                user_id = await conn.fetchval("""
+                    INSERT INTO users (name, is_studying, is_breaking) VALUES ('presence-test', TRUE, FALSE)
+                    RETURNING user_id
+                """)
+            caches = [PresenceCache(pool, ttl=TTL, flush_interval=3600) for _ in range(workers)]
+            for cache, hub in zip(caches, hubs):
+                await cache.start(hub)
+            await test(pool, caches, user_id)
+            for cache in caches:
+                await cache.stop()
+        finally:
+            for hub in hubs:
+                if hub.conn is not None:
+                    await hub.close()
+            await pool.close()
+
+    asyncio.run(run())
+
+
+async def tick(caches):
+    """每個 worker 跑一次 _flush_loop 的內容，再等 NOTIFY 送到。"""
+    for cache in caches:
+        cache._expire()
+        await cache.flush()
+        await cache.publish()
+    await asyncio.sleep(0.05)
+
+
+async def is_studying(pool, user_id):
+    async with pool.acquire() as conn:
+        return await conn.fetchval("SELECT is_studying FROM users WHERE user_id = $1", user_id)
+
+
+def test_user_loaded_at_startup_without_heartbeat_goes_offline(migrated_database):
+    async def test(pool, caches, user_id):
+        await tick(caches)
+        assert all(cache.get(user_id) == (True, False) for cache in caches)
+
+        await asyncio.sleep(TTL)
+        await tick(caches)
+        assert all(cache.get(user_id) == (False, False) for cache in caches)
+        assert await is_studying(pool, user_id) is False
+
+    run_workers(migrated_database, test)
+
+
+def test_heartbeat_after_restart_keeps_user_online(migrated_database):
+    async def test(pool, caches, user_id):
+        first, second = caches
+        for _ in range(4):
+            assert await first.heartbeat(user_id)
+            await tick(caches)
+            await asyncio.sleep(TTL / 3)
+        assert second.get(user_id) == (True, False)
+        assert await is_studying(pool, user_id) is True
+
+        # app 關掉不再 heartbeat：負責的 worker 寫回離線
+        await asyncio.sleep(TTL)
+        await tick(caches)
+        assert second.get(user_id) == (False, False)
+        assert await is_studying(pool, user_id) is False
+
+    run_workers(migrated_database, test)
+
+
+def test_expired_profiles_are_purged():
+    cache = PresenceCache(pool=None)
+    now = time.monotonic()
+    cache._profiles = {1: (now - 1, {"user_id": 1}), 2: (now + 60, {"user_id": 2})}
+    cache._purge_profiles()
+    assert list(cache._profiles) == [2]
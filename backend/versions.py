@@ -0,0 +1,35 @@
+"""
+每個 user、每種資料 (resource) 的版本號，給 GET 的 ETag / If-None-Match 用
+
+寫入 deadlines / pictures / focus_time / focus_daily / messages 時，statement-level trigger
+(migrations/0001_baseline.py) 會把受影響 user 的版本號換成 resource_version_seq 的下一個值，
+所以不管是哪個 API (或 migrate script) 寫的都會更新，也不會漏掉。
+focus_time / focus_daily 算同一種 resource (focus)，messages 算在收件者 (receiver_id) 身上。
+messages 的回應裡有寄件者的名字，寄件者改名時收件者的 messages 版本也會換 (migrations/0008)。
+GET 先查一次版本號 (PK 查詢)，跟 client 帶來的 ETag 一樣就直接回 304。
+版本號來自全域 sequence，只會變大，刪掉重建也不會跟舊的 ETag 撞在一起。
+"""
+from typing import Optional
+
+import asyncpg
+
+from db import named_query
+
+# API 回應格式改變時改這個，讓 client 手上的舊 ETag 全部失效
+ETAG_EPOCH = "v1"
+
+GET_VERSION_SQL = named_query("versions.get", """
+    SELECT version FROM resource_versions WHERE user_id = $1 AND resource = $2
+""")
+
+
+async def get_version(conn: asyncpg.Connection, user_id: int, resource: str) -> int:
+    """還沒寫過任何資料的 user 是 0。"""
+    version: Optional[int] = await conn.fetchval(GET_VERSION_SQL, user_id, resource)
+    return version or 0
+
+
+def make_etag(resource: str, version: int, *variant) -> str:
+    """variant: 會影響回應內容的參數 (例如 size、日期範圍)。"""
+    parts = [ETAG_EPOCH, resource, str(version), *(str(v) for v in variant)]
+    return 'W/"' + "-".join(parts) + '"'
@@ -5,4 +5,35 @@ const api = axios.create({
   baseURL: API_URL,  // 要改成你自己的電腦 IP！！！
 });
 
+// === 條件式 GET ===
+// 記住每個 GET 網址最後一次的 ETag 和資料，下次帶 If-None-Match；
+// server 回 304 (資料沒變) 時直接用上次的資料，畫面程式不用改。
+const etagCache = new Map();
+
+const isGet = (config) => (config.method || "get").toLowerCase() === "get";
+
+api.interceptors.request.use((config) => {
+  if (!isGet(config)) return config;
+  const cached = etagCache.get(api.getUri(config));
+  if (cached) {
+    config.headers.set("If-None-Match", cached.etag);
+  }
+  config.validateStatus = (status) => (status >= 200 && status < 300) || status === 304;
+  return config;
+});
+
+api.interceptors.response.use((response) => {
+  if (!isGet(response.config)) return response;
+  const key = api.getUri(response.config);
+  if (response.status === 304) {
+    const cached = etagCache.get(key);
+    if (cached) return { ...response, status: 200, data: cached.data };
+  }
+  const etag = response.headers?.etag;
+  if (etag) {
+    etagCache.set(key, { etag, data: response.data });
+  }
+  return response;
+});
+
 export default api;
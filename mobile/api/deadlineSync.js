@@ -0,0 +1,100 @@
+import api from "./api";
+
+// === deadline 清單的增量同步 ===
+// 本地保留一份清單和 server 回傳的 version：
+//   - 畫面打開時 GET /deadlines/changes?since=version，只拿變動的項目
+//   - 每次修改排進佇列，POST /deadlines/sync 一次送出，回應裡就有 server 最新的變動，不用再抓整份清單
+//   - 沒有網路時佇列留著，下次修改或重新整理時一起送 (只存在記憶體，App 關掉就沒了)
+const stores = new Map();
+
+const storeFor = (userId) => {
+  if (!stores.has(userId)) {
+    stores.set(userId, { version: 0, items: new Map(), queue: [], flushing: null });
+  }
+  return stores.get(userId);
+};
+
+let nextClientId = 1;
+export const newClientId = () => `c${Date.now().toString(36)}-${nextClientId++}`;
+
+// 未完成在前，再依 sort_key、id；display_order 的算法同 /deadlines/get-deadlines (已完成的是 -1)
+const toList = (store) => {
+  const items = [...store.items.values()].sort((a, b) =>
+    (a.is_done - b.is_done) ||
+    (a.sort_key < b.sort_key ? -1 : a.sort_key > b.sort_key ? 1 : 0) ||
+    (a.id - b.id)
+  );
+  let order = 0;
+  return items.map((item) => ({ ...item, display_order: item.is_done ? -1 : ++order }));
+};
+
+const applyChanges = (store, changes) => {
+  if (changes.reset) store.items.clear();
+  for (const row of changes.upserts) store.items.set(row.id, row);
+  for (const id of changes.deleted) store.items.delete(id);
+  store.version = changes.version;
+};
+
+export async function loadDeadlines(userId) {
+  const store = storeFor(userId);
+  if (store.queue.length) return flush(userId);
+  const response = await api.get("/deadlines/changes", { params: { user_id: userId, since: store.version } });
+  applyChanges(store, response.data);
+  return toList(store);
+}
+
+// mutation 格式見後端的 DeadlineMutation (op: add / edit / done / doing / move / remove)
+export async function pushMutation(userId, mutation) {
+  const store = storeFor(userId);
+  // 只有修改內容 (edit) 要檢查衝突；打勾、排序之類的直接套用最新的
+  const current = mutation.op === "edit" ? store.items.get(mutation.id) : null;
+  store.queue.push({ base_version: current ? current.row_version : undefined, ...mutation });
+  return flush(userId);
+}
+
+async function flush(userId) {
+  const store = storeFor(userId);
+  // 上一批還在送的話等它送完再送下一批，佇列的順序不會亂
+  while (store.flushing) await store.flushing.catch(() => {});
+  if (!store.queue.length) return toList(store);
+
+  const mutations = store.queue.slice();
+  store.flushing = (async () => {
+    try {
+      const response = await api.post("/deadlines/sync", { user_id: userId, since: store.version, mutations });
+      store.queue.splice(0, mutations.length);
+      applyChanges(store, response.data);
+      for (const result of response.data.results) {
+        if (result.status === "conflict") {
+          // 別的裝置先改過：以 server 上的為準
+          store.items.set(result.current.id, result.current);
+          console.warn("deadline 修改衝突，已改用 server 上的內容:", result.current);
+        }
+      }
+    } catch (error) {
+      if (error.response) {
+        // server 拒絕整批 (格式錯誤之類的)：丟掉這批，下次整份重新同步
+        store.queue.splice(0, mutations.length);
+        store.version = 0;
+      }
+      throw error;
+    } finally {
+      store.flushing = null;
+    }
+  })();
+  await store.flushing;
+  return toList(store);
+}
+
+// 拖曳一個項目之後，從新舊順序找出被移動的項目和它的前後項目 (只看同一組：未完成 / 已完成)
+export function findMove(oldList, newList) {
+  let first = 0;
+  while (first < newList.length && newList[first].id === oldList[first].id) first++;
+  if (first === newList.length) return null;
+  let last = newList.length - 1;
+  while (newList[last].id === oldList[last].id) last--;
+  const index = newList[first].id === oldList[last].id ? first : last;
+  const moved = newList[index];
+  const sameGroup = (item) => item && item.is_done === moved.is_done ? item.id : null;
+  return { op: "move", id: moved.id, prev_id: sameGroup(newList[index - 1]), next_id: sameGroup(newList[index + 1]) };
+}
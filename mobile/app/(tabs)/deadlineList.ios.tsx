@@ -1,6 +1,6 @@
 import React, { isValidElement, useEffect, useState, useRef } from "react";
 import { View, Text, TouchableOpacity, StyleSheet, Modal, TextInput, Dimensions, Pressable } from "react-native";
-import api from '../../api/api';
+import { loadDeadlines, pushMutation, findMove, newClientId } from '../../api/deadlineSync';
 import PageTemplate from '@/components/page-template';
 import DeadlineItem from "@/components/deadline-item";
 import { useFocusEffect } from '@react-navigation/native';
@@ -77,9 +77,8 @@ export default function DeadlineListScreen() {
   const fetchDeadlines = async () => {
     if (userId === null) return;
     try {
-        // 💡 傳遞 user_id 作為查詢參數
-        const response = await api.get('/deadlines/get-deadlines', { params: { user_id: userId } });
-        setDeadlines(response.data);
+        // 只拿上次同步之後的變動 (api/deadlineSync.js)
+        setDeadlines(await loadDeadlines(userId));
     } catch (error) {
       console.error("fetchDeadlines() in deadlineList.tsx: 抓不到清單: ", error);
     }
@@ -93,21 +92,12 @@ export default function DeadlineListScreen() {
 
   // === reorder ===
   const updateOrder = async (newData: TodoItem[]) => {
+    if (userId === null) return;
     try {
+      // 只送被拖曳的那一項和它的前後項目
+      const move = findMove(deadlines, newData);
       setDeadlines(newData);
-
-      const body = newData.map((item, index) => ({
-        id: item.id,
-        user_id: userId,
-        display_order: index + 1,
-      }));
-
-      // console.log(body);
-
-      await api.post("/deadlines/reorder", body);
-
-      fetchDeadlines();
-
+      if (move) setDeadlines(await pushMutation(userId, move));
     } catch (error) {
       console.error("updateOrder() in deadlineList.tsx: ", error);
     }
@@ -128,14 +118,7 @@ export default function DeadlineListScreen() {
       );
       setDeadlines(newData);
 
-      const body = {
-        id: item.id,
-        is_done: !item.is_done,
-        user_id: userId
-      }
-      // console.log(body);
-      await api.post("/deadlines/click-done", body);
-      fetchDeadlines();
+      setDeadlines(await pushMutation(userId, { op: "done", id: item.id, is_done: !item.is_done }));
     } catch (error){
       console.error("onClickCheckBox() in deadlineList.tsx: ", error);
     }
@@ -163,20 +146,18 @@ export default function DeadlineListScreen() {
         return;
       }
 
-      const body = {
-        user_id: userId,
+      const list = await pushMutation(userId, {
+        op: "add",
+        client_id: newClientId(),
         task: newTask,
         deadline_date: newDate,
         is_done: false,
-      };
-
-      await api.post("/deadlines/add-item", body);
+      });
 
       setShowAddModal(false);
       setNewTask("");
       setNewDate("");
-
-      fetchDeadlines();
+      setDeadlines(list);
     } catch (error) {
       console.error("submitNewDeadline() in deadlineList.tsx: ", error);
     }
@@ -208,21 +189,13 @@ export default function DeadlineListScreen() {
         return;
       }
 
-      const body = {
-        user_id: userId,
-        id: editItemid,
-        task: newTask,
-        deadline_date: newDate,
-      };
-
-      await api.post("/deadlines/edit-item", body);
+      const list = await pushMutation(userId, { op: "edit", id: editItemid, task: newTask, deadline_date: newDate });
 
       setEditItemid(-1);
       setNewTask("");
       setNewDate("");
       setShowEditModal(false);
-
-      fetchDeadlines();
+      setDeadlines(list);
     } catch (error) {
       console.error("submitEditDeadline() in deadlineList.tsx: ", error);
     }
@@ -230,8 +203,12 @@ export default function DeadlineListScreen() {
 
   // remove
   const onClickRemoveBox = async (item: TodoItem) => {
-    await api.post("/deadlines/remove-item", {id: item.id, user_id: userId});
-    fetchDeadlines();
+    if (userId === null) return;
+    try {
+      setDeadlines(await pushMutation(userId, { op: "remove", id: item.id }));
+    } catch (error) {
+      console.error("onClickRemoveBox() in deadlineList.tsx: ", error);
+    }
   }
 
   // set current_doing
@@ -243,13 +220,7 @@ export default function DeadlineListScreen() {
       );
       setDeadlines(newData);
 
-      const body = {
-        id: item.id,
-        current_doing: !item.current_doing,
-        user_id: userId
-      }
-      await api.post("/deadlines/doing-item", body);
-      fetchDeadlines();
+      setDeadlines(await pushMutation(userId, { op: "doing", id: item.id, current_doing: !item.current_doing }));
     } catch (error){
       console.error("onClickDoing() in deadlineList.tsx: ", error);
     }
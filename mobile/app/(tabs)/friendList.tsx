@@ -99,53 +99,33 @@ interface FriendStatusAPIResponse {
 }
 
 /**
- * 步驟 1: 取得好友 ID 列表
+ * 取得好友列表與狀態 (一個 API，好友很多時分頁抓完)
  */
-const fetchFriendIds = async (userId: number | null): Promise<number[]> => {
+const fetchFriendFeed = async (userId: number | null): Promise<FriendStatusAPIResponse[]> => {
   if (userId === null) return [];
-  try {
-    const response = await api.get(`/api/v1/new-friends/${userId}`);
-    const data = response.data;
-    if (data && Array.isArray(data.friend_ids)) {
-      return data.friend_ids;
-    }
-    return [];
-  } catch (error) {
-    console.error("[API Error] fetchFriendIds 失敗:", error);
-    return [];
-  }
-}
+  const friends: FriendStatusAPIResponse[] = [];
+  let cursor: number | null = null;
 
-/**
- * 步驟 2: 取得好友詳細狀態
- */
-const fetchFriendStatuses = async (friendIds: number[]): Promise<FriendStatusAPIResponse[]> => {
-  if (friendIds.length === 0) return [];
-
-  const idsString = friendIds.join(',');
-  
   try {
-    const response = await api.get("/api/v1/friends/status", {
-      params: { ids: idsString }
-    });
-    const data = response.data;
-    
-    if (!Array.isArray(data)) {
-       return [];
-    }
-    
-    const validatedData = data.map((item: any) => ({
-      friend_id: item.friend_id,
-      name: item.name || 'Unknown Friend', 
-      is_studying: item.is_studying,
-      current_timer: item.current_timer,
-    })) as FriendStatusAPIResponse[];
-
-    return validatedData;
+    do {
+      const response: { data: { items: any[]; next_cursor: number | null } } = await api.get("/api/v1/friends", {
+        params: { user_id: userId, ...(cursor !== null ? { cursor } : {}) }
+      });
+      for (const item of response.data.items) {
+        friends.push({
+          friend_id: item.friend_id,
+          name: item.name || 'Unknown Friend',
+          is_studying: item.is_studying,
+          current_timer: item.current_timer,
+        });
+      }
+      cursor = response.data.next_cursor;
+    } while (cursor !== null);
 
+    return friends;
   } catch (error) {
-    console.error("[API Error] fetchFriendStatuses 失敗:", error);
-    return []; 
+    console.error("[API Error] fetchFriendFeed 失敗:", error);
+    return [];
   }
 };
 
@@ -193,13 +173,8 @@ export default function FriendListScreen() {
 
       try {
         // 1. 抓好友狀態
-        const friendIds = await fetchFriendIds(userId);
-        if (friendIds.length > 0) {
-           const apiData = await fetchFriendStatuses(friendIds);
-           if (isMounted) setFriendsList(apiData);
-        } else {
-           if (isMounted) setFriendsList([]);
-        }
+        const apiData = await fetchFriendFeed(userId);
+        if (isMounted) setFriendsList(apiData);
       } catch (error) {
         console.error("載入流程錯誤:", error);
       } finally {
@@ -19,6 +19,7 @@ interface UserRecordStatus {
 interface PhotoItem {
   id: number;
   uri: string;
+  thumbnailUri?: string;
   description?: string;
 }
 // ----------------------------------------------------
@@ -88,6 +89,9 @@ export default function MyRecordScreen() {
     datasets: [{ data: currentUserData.weeklyData }],
   });
   
+  // 各時段 (每 3 小時) 的專注時數
+  const [focusTimeSeries, setFocusTimeSeries] = useState<number[]>(currentUserData.focusTimeData);
+
   // [新增] 照片相關狀態
   const [photos, setPhotos] = useState<PhotoItem[]>([]);
   const [selectedPhoto, setSelectedPhoto] = useState<PhotoItem | null>(null);
@@ -122,16 +126,22 @@ export default function MyRecordScreen() {
 
     try {
         // [新增] 2. 嘗試抓取真實照片牆
-        const picturesResponse = await api.get(`/pictures?user_id=${currentUserId}`);
+        // 只拿 metadata，圖片本體由 <Image> 直接向 /pictures/{id} 載入 (可被快取)
+        const picturesResponse = await api.get(`/pictures/list?user_id=${currentUserId}&limit=100`);
         if (picturesResponse.data) {
-            setPhotos(picturesResponse.data);
+            setPhotos(picturesResponse.data.items.map((item: { id: number; url: string; thumbnail_url: string; description?: string }) => ({
+                id: item.id,
+                uri: `${api.defaults.baseURL}${item.url}`,
+                thumbnailUri: `${api.defaults.baseURL}${item.thumbnail_url}`,
+                description: item.description,
+            })));
         }
     } catch (error) {
         console.error("抓取照片失敗 (可能是後端未開啟):", error);
         // 如果抓失敗，可以保持 photos 為空，或者塞入 mock data
     }
 
-    // 3. 圖表資料 (保持 Mock Data 邏輯，因為你後端好像還沒接圖表 API)
+    // 3. 圖表資料 (從專注統計 API 取得)
     const chartColors = [
         (opacity = 1) => `rgba(0, 150, 136, ${opacity})`, 
         (opacity = 1) => `rgba(255, 87, 34, ${opacity})`, 
@@ -142,11 +152,31 @@ export default function MyRecordScreen() {
         (opacity = 1) => `rgba(244, 67, 54, ${opacity})`, 
     ];
 
+    let weeklyLabels = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'];
+    let weeklyData = currentUserData.weeklyData;
+    try {
+        // 最近 7 天每天的專注時數 + 各時段分佈 (失敗就用 Mock Data)
+        const [dailyResponse, hourlyResponse] = await Promise.all([
+            api.get('/api/v1/focus/stats/daily', { params: { user_id: currentUserId } }),
+            api.get('/api/v1/focus/stats/best-hour', { params: { user_id: currentUserId } }),
+        ]);
+        const days: { record_date: string; focus_minutes: number }[] = dailyResponse.data.days;
+        weeklyLabels = days.map(d => ['Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat'][new Date(d.record_date).getDay()]);
+        weeklyData = days.map(d => Math.round(d.focus_minutes / 6) / 10);
+
+        const byHour: number[] = hourlyResponse.data.by_hour;
+        setFocusTimeSeries([0, 1, 2, 3, 4, 5, 6, 7].map(i =>
+            Math.round((byHour[i * 3] + byHour[i * 3 + 1] + byHour[i * 3 + 2]) / 6) / 10
+        ));
+    } catch (error) {
+        setFocusTimeSeries(currentUserData.focusTimeData);
+    }
+
     setWeeklyReadingData({
-        labels: ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'],
+        labels: weeklyLabels,
         datasets: [{ 
-            data: currentUserData.weeklyData,
-            colors: chartColors.slice(0, currentUserData.weeklyData.length),
+            data: weeklyData,
+            colors: chartColors.slice(0, weeklyData.length),
         }],
     });
 
@@ -177,11 +207,11 @@ export default function MyRecordScreen() {
     setSelectedPhoto(null);
   };
 
-  // 圖表設定 (Mock)
+  // 圖表設定
   const focusTimeData = { 
     labels: ['00:00', '03:00', '06:00', '09:00', '12:00', '15:00', '18:00', '21:00'],
     datasets: [{
-      data: currentUserData.focusTimeData,
+      data: focusTimeSeries,
       color: (opacity = 1) => `rgba(0, 122, 255, ${opacity})`, 
       strokeWidth: 1.5,
     }],
@@ -295,7 +325,7 @@ export default function MyRecordScreen() {
                       style={{ marginBottom: 10 }}
                   >
                       <Image
-                        source={{ uri: photo.uri }}
+                        source={{ uri: photo.thumbnailUri || photo.uri }}
                         style={{ 
                           width: imageSize, 
                           height: imageSize, 
@@ -115,53 +115,109 @@ export const FocusProvider = ({ children }: { children: React.ReactNode }) => {
     return () => subscription.remove();
   }, []);
 
-  // === 3. Polling 檢查新訊息 ===
+  // === 3. 新訊息通知：優先用 WebSocket 推播，斷線時退回 polling ===
   useEffect(() => {
     if (!userId) return;
 
+    let ws: WebSocket | null = null;
+    let pollingId: ReturnType<typeof setInterval> | null = null;
+    let reconnectId: ReturnType<typeof setTimeout> | null = null;
+    let closed = false;
+
+    const notifyNewMessage = async (payload: { has_unread: boolean; data: any }) => {
+      const { has_unread, data } = payload;
+
+      if (has_unread && data) {
+         if (data.id !== lastNotificationIdRef.current) {
+            console.log("🚀 觸發通知 function...");
+            // 這可更換圖片
+            const alertImage = "https://media1.giphy.com/media/v1.Y2lkPTc5MGI3NjExMmUxdXNxMm1kaW1uOWdxbmRkZHZ6bHVseTRvaG9tNzUyanh6M25iOSZlcD12MV9pbnRlcm5hbF9naWZfYnlfaWQmY3Q9Zw/s35s4lFBxpndm/giphy.gif"; 
+
+            await Notifications.scheduleNotificationAsync({
+              content: {
+                title: `來自 ${data.sender_name} 的訊息 🔔`,
+                body: data.content,
+                sound: true, 
+                priority: Notifications.AndroidNotificationPriority.HIGH,
+                // 這裡記得要傳 messageId，上面的監聽器才抓得到
+                data: { 
+                  messageId: data.id,
+                  imageUrl: alertImage,
+                  senderName: data.sender_name 
+                },
+              },
+              trigger: null, 
+            });
+
+            lastNotificationIdRef.current = data.id;
+         }
+      }
+    };
+
     const checkNewMessages = async () => {
       try {
         const response = await api.get('/api/v1/messages/unread/latest', {
            params: { user_id: userId }
         });
-        
-        const { has_unread, data } = response.data;
-
-        if (has_unread && data) {
-           if (data.id !== lastNotificationIdRef.current) {
-              console.log("🚀 觸發通知 function...");
-              // 這可更換圖片
-              const alertImage = "https://media1.giphy.com/media/v1.Y2lkPTc5MGI3NjExMmUxdXNxMm1kaW1uOWdxbmRkZHZ6bHVseTRvaG9tNzUyanh6M25iOSZlcD12MV9pbnRlcm5hbF9naWZfYnlfaWQmY3Q9Zw/s35s4lFBxpndm/giphy.gif"; 
-
-              await Notifications.scheduleNotificationAsync({
-                content: {
-                  title: `來自 ${data.sender_name} 的訊息 🔔`,
-                  body: data.content,
-                  sound: true, 
-                  priority: Notifications.AndroidNotificationPriority.HIGH,
-                  // 這裡記得要傳 messageId，上面的監聽器才抓得到
-                  data: { 
-                    messageId: data.id,
-                    imageUrl: alertImage,
-                    senderName: data.sender_name 
-                  },
-                },
-                trigger: null, 
-              });
-
-              lastNotificationIdRef.current = data.id;
-           }
-        }
+        await notifyNewMessage(response.data);
       } catch (error) {
          // console.error("Polling Error:", error);
       }
     };
-    
-    const intervalId = setInterval(checkNewMessages, 3000); 
-    return () => clearInterval(intervalId);
+
+    const startPolling = () => {
+      if (pollingId === null) pollingId = setInterval(checkNewMessages, 3000);
+    };
+
+    const stopPolling = () => {
+      if (pollingId !== null) {
+        clearInterval(pollingId);
+        pollingId = null;
+      }
+    };
+
+    const connect = () => {
+      const wsUrl = `${api.defaults.baseURL?.replace(/^http/, 'ws')}/api/v1/messages/ws?user_id=${userId}`;
+      ws = new WebSocket(wsUrl);
+      ws.onopen = () => stopPolling();
+      ws.onmessage = (event) => {
+        try { notifyNewMessage(JSON.parse(event.data)); } catch (e) {}
+      };
+      ws.onclose = () => {
+        if (closed) return;
+        // 推播斷線：先用 polling 頂著，10 秒後再試著連回來
+        startPolling();
+        reconnectId = setTimeout(connect, 10000);
+      };
+    };
+
+    connect();
+    return () => {
+      closed = true;
+      stopPolling();
+      if (reconnectId !== null) clearTimeout(reconnectId);
+      ws?.close();
+    };
   }, [userId]);
 
 
+  // === 在線狀態 heartbeat：專注或休息中每 30 秒回報一次，server 過期時重送狀態 ===
+  useEffect(() => {
+    if (!userId || (!isFocusing && !isResting)) return;
+
+    const sendHeartbeat = async () => {
+      try {
+        const res = await api.post('/user/heartbeat', { user_id: userId });
+        if (!res.data.known) {
+          await api.post('/user/status', { is_studying: isFocusing, user_id: userId });
+        }
+      } catch (e) {}
+    };
+
+    const heartbeatId = setInterval(sendHeartbeat, 30000);
+    return () => clearInterval(heartbeatId);
+  }, [userId, isFocusing, isResting]);
+
   // === 專注計時器 (維持不動) ===
   useEffect(() => {
     let interval: NodeJS.Timeout | null = null;
@@ -231,19 +287,10 @@ export const FocusProvider = ({ children }: { children: React.ReactNode }) => {
 
     try {
           console.log("正在抓取最近的 Deadline...");
-          const res = await api.get('/deadlines', { params: { user_id: userId } });
-          const allDeadlines: DeadlineItem[] = res.data;
-
-          // 過濾出未完成且有日期的事項
-          const activeDeadlines = allDeadlines.filter(item => !item.is_done && item.deadline_date);
-
-          // 排序：找出離今天最近的日期 (日期字串可以直接比較大小)
-          // 這裡簡單用字串排序，如果日期格式是 YYYY-MM-DD 這是準的
-          activeDeadlines.sort((a, b) => {
-              if (a.deadline_date! < b.deadline_date!) return -1;
-              if (a.deadline_date! > b.deadline_date!) return 1;
-              return 0;
-          });
+          // server 已經排好未完成的 deadline (依日期)，只拿最近的一筆；
+          // 到期前的提醒則由 server 直接寄到收件匣 (backend/reminders.py)
+          const res = await api.get('/deadlines/upcoming', { params: { user_id: userId, limit: 1 } });
+          const activeDeadlines: DeadlineItem[] = res.data.items;
 
           if (activeDeadlines.length > 0) {
               const nearest = activeDeadlines[0]; // 拿第一筆
@@ -280,25 +327,38 @@ export const FocusProvider = ({ children }: { children: React.ReactNode }) => {
     } else {
       setIsResting(false);
       restStartTimeRef.current = null;
-      try { await api.post('/user/status', { is_studying: false, user_id: userId }); } catch (e) {}
     }
 
     try {
-      const response = await api.post('/focus/save', {
-        duration_seconds: finalDuration,
-        note: mode === 'pause' ? "暫停休息" : "結束專注",
-        user_id: userId 
-      });
-
+      // 狀態、專注時間、照片一次送到 /focus/sessions (同一個 transaction)；
+      // 網路斷掉重送時帶同一個 session_id，server 不會重複計算
+      const sessionId = `${userId}-${Date.now()}-${Math.random().toString(36).slice(2, 10)}`;
+      const form = new FormData();
+      form.append('session_id', sessionId);
+      form.append('user_id', String(userId));
+      form.append('duration_seconds', String(finalDuration));
+      form.append('note', mode === 'pause' ? "暫停休息" : "結束專注");
+      form.append('ended_at', new Date().toISOString());
+      if (mode === 'end') form.append('is_studying', 'false');
       if (photoBase64) {
-        console.log("正在上傳照片...");
-        await api.post('/camera/upload', {
-          user_id: userId ,
-          image_base64: photoBase64,
-          description: description || ""
-        });
-        console.log("照片上傳成功！");
+        form.append('image_base64', photoBase64);
+        form.append('description', description || "");
+      }
+
+      let response;
+      for (let attempt = 1; ; attempt++) {
+        try {
+          response = await api.post('/focus/sessions', form, {
+            headers: { 'Content-Type': 'multipart/form-data' },
+          });
+          break;
+        } catch (err: any) {
+          // server 有回應 (4xx/5xx) 就不重送，只有連不到 server 才重送
+          if (err.response || attempt >= 3) throw err;
+          await new Promise((resolve) => setTimeout(resolve, 1000 * attempt));
+        }
       }
+      if (photoBase64) console.log("照片上傳成功！");
 
       const data = response.data;
       let msg = `此次專注：${data.minutes} 分鐘`;